@@ -32,6 +32,7 @@ from .const import (
     MODEL_REGISTRY,
 )
 from .coordinator import HA_FelicityCoordinator
+from . import worker
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -217,6 +218,13 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         "flexible_load_1_default_current": 16,
         "ev_charge_strategy": "smart",
         "scheduler_engine": "greedy",
+        "auto_engine_budget_s": 5.0,
+        "pv_scenario_samples": 0,
+        "pv_scenario_shortfall_pct": 10.0,
+        "extended_horizon": "off",
+        "variable_power": "off",
+        "scheduler_worker": "thread",
+        "profile_next_replan": "off",
         "flexible_load_2_enabled": "off",
         "flexible_load_2_name": "",
         "flexible_load_2_switch_entity": "",
@@ -426,6 +434,8 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         return False
 
     if coordinator:
+        # Write the coalesced consumption-store changes before the entry goes.
+        await coordinator.async_flush_store()
         hub_key = coordinator.hub_key
         # Close hub only if no other entries use it
         remaining_entries = [
@@ -441,6 +451,13 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
             if hub:
                 await hub.close()
 
+        # Last entry gone → stop the schedule worker process (if started).
+        if not any(
+            isinstance(value, HA_FelicityCoordinator)
+            for value in hass.data[DOMAIN].values()
+        ):
+            await hass.async_add_executor_job(worker.shutdown)
+
     return True
 
 
@@ -1,11 +1,15 @@
 """Data update coordinator for Felicity with proper async handling."""
 
 import asyncio
+import base64
 import dataclasses
 import json
 import logging
 import math
+import sys
 import time
+from array import array
+from collections import deque
 from datetime import timedelta, datetime
 from typing import Dict, Any
 from homeassistant.core import HomeAssistant
@@ -20,6 +24,7 @@ from .const import (
 )
 from .type_specific import TypeSpecificHandler
 from . import ems as ems_module
+from . import worker
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,6 +33,157 @@ _LOGGER = logging.getLogger(__name__)
 logging.getLogger("pymodbus").setLevel(logging.CRITICAL)
 logging.getLogger("pymodbus.logging").setLevel(logging.CRITICAL)
 
+# How long a tick waits for its schedule solve before moving on with the
+# last committed plan.  Greedy and warm-started MILP land well inside this;
+# a slow solve finishes in the background and is committed when done.
+_SCHEDULE_INLINE_WAIT_S = 2.0
+
+# Plan repair (ems.repair_schedule) instead of a full replan when only the
+# SOC has moved: bounded by plan age and by how far the actual SOC has
+# drifted from the committed trajectory.
+_REPAIR_MAX_AGE_S = 3600.0
+_REPAIR_MAX_SOC_DRIFT_PCT = 3.0
+
+# Forecast error model for the scenario check: days of per-hour history
+# kept, samples needed before an hour's error is trusted, and the smallest
+# spread used (a few sunny days in a row must not read as certainty).
+_PV_ERROR_DAYS = 14
+_ERROR_MIN_SAMPLES = 3
+_ERROR_MIN_SIGMA = 0.05
+
+# Extended horizon: days of price curves kept for the weekday/slot medians.
+_PRICE_HISTORY_DAYS = 28
+
+# PV actuals: daily totals kept for a year (plus the seasonal window), and
+# hourly production for the intraday shape.  The baseline (PV forecast
+# fallback and tomorrow's PV estimate) is the median of the last week's
+# days; short of _PV_BASELINE_MIN_DAYS it falls back to the same weeks a
+# year earlier (+/- _PV_SEASON_DAYS).
+_PV_DAILY_RING_DAYS = 380
+_PV_HISTORY_DAYS = 14
+_PV_BASELINE_DAYS = 7
+_PV_BASELINE_MIN_DAYS = 3
+_PV_SEASON_DAYS = 7
+
+# Phase profiler diagnostics: full replans behind the rolling statistics.
+_PHASE_HISTORY_REPLANS = 20
+
+# Consumption store writes are coalesced: runtime changes mark the store
+# dirty and at most one write happens per this many seconds (HA flushes a
+# pending write on shutdown; entry unload flushes it explicitly).
+_STORE_SAVE_DELAY_S = 300.0
+
+# Live hourly consumption: a day x hour float32 ring (row = date ordinal
+# mod days) fed by the load-energy counter each tick.  A gap between
+# counter samples longer than this marks the hour incomplete (it is then
+# not recorded).
+_LOAD_SAMPLE_MAX_GAP_S = 120.0
+# Counter growth above what the inverter can deliver between two samples
+# (times this slack, plus one counter resolution step) is a glitch or a
+# counter swap, not load; so is a drop that does not land near zero.
+_LOAD_DELTA_SLACK = 1.5
+_LOAD_DELTA_RESOLUTION_KWH = 0.1
+
+# Hour-of-week consumption model: weeks kept in the ring, same-weekday
+# samples before the median takes over, and days behind the plain hourly
+# average used until then (and by the consumption error model).
+_CONSUMPTION_WEEKS = 10
+_HOURLY_RING_DAYS = 7 * _CONSUMPTION_WEEKS
+_HOW_MIN_SAMPLES = 2
+_PROFILE_RECENT_DAYS = 7
+
+# Load-energy day counters, most specific first.
+_LOAD_ENERGY_KEYS = (
+    "daily_energy_consumed", "daily_load_energy", "total_load_energy_today",
+    "daily_consumption", "daily_energy_used",
+    "total_load_consumption_energy_day",
+    "load_consumption_energy_day",
+    "homeload_day_cost_energy",
+    "load_day_cost_energy",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class _ScheduleRequest:
+    """Inputs of one schedule solve, snapshotted when it was requested."""
+
+    config: Any
+    state: Any
+    battery_soc: float | None
+    now: datetime
+    effective_capacity: float
+    generation: int = 0
+    # Hash of everything except the SOC / PV actuals; a change forces a
+    # full replan instead of a repair.
+    replan_key: int | None = None
+
+
+class _DayRing:
+    """Fixed-size float32 history of per-day rows, ``width`` values a day.
+
+    Row = date ordinal mod ``days``.  Each row is tagged with its ordinal,
+    so a row still holding an older day reads as empty and is cleared when
+    reused; NaN marks a value never recorded.  Lookups are O(1) and the
+    whole ring packs to two base64 strings for the JSON store.
+    """
+
+    def __init__(self, days: int, width: int) -> None:
+        self.days = days
+        self.width = width
+        self.values = array("f", [math.nan]) * (days * width)
+        self.ordinals = array("i", [0]) * days
+
+    def __bool__(self) -> bool:
+        return any(self.ordinals)
+
+    def _row(self, ordinal: int) -> int:
+        """Row for day ``ordinal``, cleared first if it holds another day."""
+        row = ordinal % self.days
+        if self.ordinals[row] != ordinal:
+            self.ordinals[row] = ordinal
+            self.values[row * self.width:(row + 1) * self.width] = (
+                array("f", [math.nan]) * self.width)
+        return row
+
+    def set(self, ordinal: int, col: int, value: float) -> None:
+        self.values[self._row(ordinal) * self.width + col] = value
+
+    def get(self, ordinal: int, col: int = 0) -> float | None:
+        """Recorded value, None when that day/column was never recorded."""
+        row = ordinal % self.days
+        if self.ordinals[row] != ordinal:
+            return None
+        value = self.values[row * self.width + col]
+        return None if math.isnan(value) else value
+
+    def pack(self) -> dict:
+        """Little-endian int32 day ordinals and float32 values, base64-encoded."""
+        ordinals, values = array("i", self.ordinals), array("f", self.values)
+        if sys.byteorder == "big":
+            ordinals.byteswap()
+            values.byteswap()
+        return {
+            "days": base64.b64encode(ordinals.tobytes()).decode("ascii"),
+            "values": base64.b64encode(values.tobytes()).decode("ascii"),
+        }
+
+    def load(self, packed: dict) -> None:
+        """Restore a packed ring; rows are re-placed by ordinal, so ``days`` may differ."""
+        ordinals, values = array("i"), array("f")
+        ordinals.frombytes(base64.b64decode(packed["days"]))
+        values.frombytes(base64.b64decode(packed["values"]))
+        if sys.byteorder == "big":
+            ordinals.byteswap()
+            values.byteswap()
+        if len(values) != len(ordinals) * self.width:
+            raise ValueError(f"{len(values)} values for {len(ordinals)} days x {self.width}")
+        w = self.width
+        for i in sorted(range(len(ordinals)), key=ordinals.__getitem__):  # newest wins
+            if ordinals[i] > 0:
+                row = self._row(ordinals[i])
+                self.values[row * w:(row + 1) * w] = values[i * w:(i + 1) * w]
+
+
 class HA_FelicityCoordinator(DataUpdateCoordinator):
     """Felicity Solar Inverter Data Update Coordinator."""
 
@@ -97,6 +253,10 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self.avg_price: float | None = None
         self.price_threshold: float | None = None
         self.safe_max_power = 0 # used in setting rule 1 power checks toward max amperage
+        # Last rule-1 power (W) this coordinator wrote while active; lets the
+        # variable-power executor skip redundant writes and the safe-power
+        # check tell its own reduced slot level from an external change.
+        self._rule_power_written_w: int | None = None
         self._last_known_max_amperage: float | None = None
         self.battery_soc: float | None = None  # resolved SOC (type-specific)
         # SOC history: {slot_index: soc_pct} for past slots today
@@ -113,12 +273,41 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self.pv_hourly_kwh: dict[int, float] = {}  # {hour: kwh} from forecast entity
         self.pv_hourly_kwh_tomorrow: dict[int, float] = {}  # tomorrow's hourly PV
         self.scheduled_slots: dict[int, str] = {}  # {slot_idx: "charge" | "discharge"}
+        self.slot_power_kw: dict[int, float] = {}  # variable power: {slot_idx: kW} below safe power
         self.slot_overrides: dict = config_entry.options.get("slot_overrides", {})  # manual overrides from card, persisted in entry.options
         self.cheap_slots_remaining: int = 0
         self.grid_energy_planned: float = 0.0
         self.schedule_status: str = "unknown"
         self.schedule_reason: str = ""
         self.scheduler_active: str = "greedy"
+        self.solver_stats: dict = {}  # last milp/dp solve: backend, solve_ms, iterations, warm_start
+        # Phase profiler: the last full replan's per-phase ms / entry counts,
+        # and a rolling window of past replans (see schedule_phase_stats).
+        self.schedule_phase_ms: dict[str, float] = {}
+        self.schedule_phase_calls: dict[str, int] = {}
+        self._schedule_phase_history: deque = deque(maxlen=_PHASE_HISTORY_REPLANS)
+
+        # Background schedule solve.  The control path always executes the
+        # last COMMITTED plan; a solve runs as a background task and swaps its
+        # plan in when it finishes.  Generations order requests: a result is
+        # only committed when it is newer than the committed plan, so a
+        # cancelled or overtaken solve can never overwrite a fresher one.
+        self._schedule_task: asyncio.Task | None = None
+        self._pending_schedule: _ScheduleRequest | None = None
+        self._schedule_generation: int = 0
+        self._committed_generation: int = 0
+        self.schedule_committed_ts: float | None = None
+        self.schedule_solves_superseded: int = 0
+
+        # Rolling-horizon repair.  Between input changes the committed plan
+        # is shifted and locally repaired from the actual SOC (sub-ms, on the
+        # event loop) rather than re-solved; see _full_replan_reason.
+        self._committed_result = None
+        self._committed_replan_key: int | None = None
+        self._last_full_replan_ts: float | None = None
+        self.schedule_repairs: int = 0
+        self.schedule_replans: int = 0
+        self.schedule_replan_reason: str | None = None
 
         # Consumption tracking & persistent storage
         self.consumption_override_entity = consumption_override_entity
@@ -126,11 +315,32 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self._consumption_store = None
         self._consumption_store_loaded = False
         self._consumption_store_lock = asyncio.Lock()
+        self._store_save_pending = False
         self.weekly_avg_consumption: float | None = None
         self._yesterday_deficit: float = 0.0
-        # Hourly consumption profiles: {hour: avg_kwh} from 7-day history
+        # Hourly consumption profile: {hour: kwh} for each hour's next
+        # occurrence, from the hour-of-week model
         self._hourly_consumption_profile: dict[int, float] = {}
-        self._hourly_consumption_history: list = []  # [{date, hours: {0: kwh, 1: kwh, ...}}]
+        # Hourly kWh per day for the hour-of-week model (~7 KB for ten weeks)
+        self._hourly_ring = _DayRing(_HOURLY_RING_DAYS, 24)
+        self._hourly_backfill_done = False
+        # Counter sample behind the live accumulation, and the hour being filled.
+        self._load_counter_kwh: float | None = None
+        self._load_counter_ts: float | None = None
+        self._load_hour_marker: tuple[str, int] | None = None
+        self._load_hour_kwh: float = 0.0
+        self._load_hour_complete = False
+        # Extended horizon (EMSConfig.extended_horizon): past days' price curves
+        # and daily PV actuals, persisted with the consumption history.
+        self._price_history: list = []  # [{date, weekday, prices: [...]}]
+        self._pv_daily_ring = _DayRing(_PV_DAILY_RING_DAYS, 1)
+        self._pv_hourly_ring = _DayRing(_PV_HISTORY_DAYS, 24)
+        # Cached from the rings at each day's close: baseline kWh, and the
+        # share of a day's PV still to come from each hour on (25 entries).
+        self._pv_baseline_kwh: float | None = None
+        self._pv_remaining_share: list[float] | None = None
+        self._pv_today_peak_kwh: float = 0.0
+        self._tomorrow_estimate: tuple | None = None  # (date, num_slots, prices)
         self.self_consumption_reserve: float = 0.0
         self._reserve_target_pct: float = 0.0  # computed reserve target as battery %
         self._last_net_pv: float = 0.0
@@ -138,8 +348,11 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self.tomorrow_precharge: float = 0.0
         self.tomorrow_planned_slots: int = 0
         self.tomorrow_planned_kwh: float = 0.0
+        self.tomorrow_provisional: bool = False
+        self.tomorrow_estimated_prices: list[float] | None = None
         self._backend_soc_trajectory: list[float] = []
         self._tomorrow_scheduled_slots: dict[int, str] = {}
+        self._tomorrow_slot_power_kw: dict[int, float] = {}
         self._backend_soc_trajectory_tomorrow: list[float] = []
 
         # Economic Rule 1 window warning.  The integration writes rule 1's
@@ -184,6 +397,13 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self._pv_integrated_today_kwh: float = 0.0
         self._last_pv_integrate_ts: float | None = None
 
+        # PV forecast error history for the scenario check: per hour, the
+        # last _PV_ERROR_DAYS actual/forecast ratios (str keys for JSON).
+        # Persisted with the consumption history.
+        self._pv_forecast_ratios: dict[str, list[float]] = {}
+        self._pv_error_hour: tuple[int, int] | None = None  # (day, hour) being measured
+        self._pv_error_hour_start_kwh: float | None = None
+
         # Grid-mode change tracking (#10).  Detect transitions to reset
         # transient state that shouldn't survive a mode change.
         self._last_grid_mode: str | None = None
@@ -310,6 +530,145 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         total_kw = pv_kw + gen_kw
         if total_kw > 0:
             self._pv_integrated_today_kwh += total_kw * dt_hours
+            self._mark_store_dirty()
+
+    def _record_pv_forecast_error(self) -> None:
+        """At each hour boundary, log the finished hour's actual/forecast PV ratio.
+
+        The hour's production is the growth of pv_actual_today_kwh across
+        it; hours forecast below 0.1 kWh (night, dawn) are skipped because
+        their ratio is noise.  Feeds _pv_error_model; every measured hour
+        also goes into the PV hourly ring behind the fallback's day shape.
+        """
+        now = datetime.now()
+        marker = (now.day, now.hour)
+        if marker == self._pv_error_hour:
+            return
+        actual = self.pv_actual_today_kwh
+        previous, start = self._pv_error_hour, self._pv_error_hour_start_kwh
+        self._pv_error_hour, self._pv_error_hour_start_kwh = marker, actual
+        # Only a directly preceding hour of the same day was measured in
+        # full (restarts and the midnight register reset would mis-attribute
+        # the energy).
+        if previous != (now.day, now.hour - 1) or actual is None or start is None:
+            return
+        produced = actual - start
+        if produced < 0:
+            return
+        self._pv_hourly_ring.set(now.toordinal(), previous[1], round(produced, 3))
+        self._mark_store_dirty()
+        forecast = (self.pv_hourly_kwh or {}).get(previous[1], 0.0)
+        if forecast < 0.1:
+            return
+        ratios = self._pv_forecast_ratios.setdefault(str(previous[1]), [])
+        ratios.append(round(produced / forecast, 3))
+        del ratios[:-_PV_ERROR_DAYS]
+
+    def _record_day_history(self, day: datetime) -> None:
+        """Store the finished day's price curve and PV total (extended horizon).
+
+        Runs in the midnight bookkeeping before today's prices are fetched,
+        so slot_prices_today still holds ``day``'s prices.  The PV total is
+        the day's peak reading — the register may already have reset.
+        """
+        date_str = day.strftime("%Y-%m-%d")
+        if self.slot_prices_today:
+            self._price_history = [
+                e for e in self._price_history if e["date"] != date_str
+            ]
+            self._price_history.append({
+                "date": date_str,
+                "weekday": day.weekday(),
+                "prices": list(self.slot_prices_today),
+            })
+            self._price_history = self._price_history[-_PRICE_HISTORY_DAYS:]
+        if self._pv_today_peak_kwh > 0:
+            self._pv_daily_ring.set(day.toordinal(), 0, round(self._pv_today_peak_kwh, 2))
+        self._update_pv_baseline(day.toordinal() + 1)
+        self._tomorrow_estimate = None
+        self.tomorrow_estimated_prices = None
+        self._mark_store_dirty()
+
+    def _estimate_tomorrow_prices(self, now: datetime) -> list[float] | None:
+        """Tomorrow's estimated price curve (weekday/slot medians), cached per day."""
+        if not self.slot_prices_today:
+            return None
+        tomorrow = now + timedelta(days=1)
+        key = (tomorrow.strftime("%Y-%m-%d"), len(self.slot_prices_today))
+        if self._tomorrow_estimate is None or self._tomorrow_estimate[:2] != key:
+            prices = ems_module.estimate_day_prices(
+                self._price_history, tomorrow.weekday(), len(self.slot_prices_today),
+            )
+            self._tomorrow_estimate = (*key, prices)
+        self.tomorrow_estimated_prices = self._tomorrow_estimate[2]
+        return self.tomorrow_estimated_prices
+
+    def _estimate_daily_pv(self) -> float | None:
+        """Daily PV baseline from stored actuals (see _update_pv_baseline), None without history."""
+        return self._pv_baseline_kwh
+
+    def _update_pv_baseline(self, today: int) -> None:
+        """Recompute the cached PV baseline and intraday shape for day ``today``.
+
+        Runs when a day closes (and after loading), so the lookups in
+        _compute_pv_fallback and _estimate_daily_pv stay O(1).
+        """
+        recent = [v for v in (self._pv_daily_ring.get(today - k)
+                              for k in range(1, _PV_BASELINE_DAYS + 1)) if v is not None]
+        if len(recent) < _PV_BASELINE_MIN_DAYS:
+            # Seasonal stand-in: the same weeks a year earlier
+            recent = [v for v in (self._pv_daily_ring.get(today - 365 + k)
+                                  for k in range(-_PV_SEASON_DAYS, _PV_SEASON_DAYS + 1))
+                      if v is not None]
+        if len(recent) < _PV_BASELINE_MIN_DAYS:
+            self._pv_baseline_kwh = None
+        else:
+            recent.sort()
+            mid = len(recent) // 2
+            median = recent[mid] if len(recent) % 2 else (recent[mid - 1] + recent[mid]) / 2
+            self._pv_baseline_kwh = round(median, 2)
+
+        hourly = [0.0] * 24
+        days = 0
+        for k in range(1, _PV_HISTORY_DAYS + 1):
+            row = [self._pv_hourly_ring.get(today - k, h) for h in range(24)]
+            if any(v is not None for v in row):
+                days += 1
+                hourly = [acc + (v or 0.0) for acc, v in zip(hourly, row, strict=True)]
+        total = sum(hourly)
+        if days and total > 0:
+            share = [0.0] * 25
+            for h in range(23, -1, -1):
+                share[h] = share[h + 1] + hourly[h] / total
+            self._pv_remaining_share = share
+        else:
+            self._pv_remaining_share = None
+
+    def _pv_error_model(self) -> dict[int, tuple[float, float]]:
+        """{hour: (mean, std)} of the actual/forecast PV ratio, for hours with history."""
+        model: dict[int, tuple[float, float]] = {}
+        for hour, ratios in self._pv_forecast_ratios.items():
+            if len(ratios) < _ERROR_MIN_SAMPLES:
+                continue
+            mean = sum(ratios) / len(ratios)
+            std = math.sqrt(sum((r - mean) ** 2 for r in ratios) / len(ratios))
+            model[int(hour)] = (round(mean, 3), round(max(std, _ERROR_MIN_SIGMA), 3))
+        return model
+
+    def _consumption_error_model(self) -> dict[int, float]:
+        """{hour: relative std} of consumption around the last 7 days' hourly average."""
+        today = datetime.now().toordinal()
+        model: dict[int, float] = {}
+        for hour in range(24):
+            kwhs = self._recent_hour_values(hour, today)
+            if len(kwhs) < _ERROR_MIN_SAMPLES:
+                continue
+            mean = sum(kwhs) / len(kwhs)
+            if mean <= 0:
+                continue
+            std = math.sqrt(sum((k - mean) ** 2 for k in kwhs) / len(kwhs))
+            model[hour] = round(max(std / mean, _ERROR_MIN_SIGMA), 3)
+        return model
 
     def _apply_scaling(self, raw: int, index: int, size: int = 1) -> int | float:
         """Apply scaling based on index and size."""
@@ -695,6 +1054,8 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         opts = self.config_entry.options
         grid_mode = opts.get("grid_mode", "off")
         prices = self.slot_prices_today
+        self.slot_power_kw = {}
+        self._tomorrow_slot_power_kw = {}
         if grid_mode == "off" or not prices or self.price_threshold is None:
             self.scheduled_slots = {}
             self._tomorrow_scheduled_slots = {}
@@ -793,8 +1154,13 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         Delegates entirely to ems.calculate_schedule() — the single source of
         truth for scheduling logic — and unpacks the result into coordinator
         attributes.  The pure calculation runs in an executor thread because
-        the MILP solver performs blocking file I/O (writes .mps model to /tmp
-        and runs the CBC subprocess).
+        the solvers are CPU-bound and the pulp fallback performs blocking file
+        I/O (writes .mps model to /tmp and runs the CBC subprocess).
+
+        The solve is a background task (see _submit_schedule_solve): this
+        method waits at most _SCHEDULE_INLINE_WAIT_S for it, so tick latency
+        does not depend on solver speed.  Until a new plan is committed the
+        previous one keeps executing.
         """
         opts = self.config_entry.options
         now = datetime.now()
@@ -812,6 +1178,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             )
             self._yesterday_deficit = 0.0
             self._last_schedule_input_hash = None  # force recompute
+            self._cancel_schedule_solve("grid mode changed")
         self._last_grid_mode = grid_mode
 
         # Stale-data guard (#6).  If we haven't had a successful Modbus read
@@ -838,7 +1205,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         nominal_capacity = opts.get("battery_capacity_kwh", 10) or 10
         effective_capacity = nominal_capacity * self._battery_soh_factor
 
-        # Fallback PV (#4): coordinator computes a 7-day actual avg for
+        # Fallback PV (#4): today's total from the stored PV actuals, for
         # use when forecast.solar is unavailable.
         pv_fallback = self._compute_pv_fallback()
 
@@ -868,6 +1235,18 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             flexible_loads=self._build_flex_load_configs(),
             ev_charge_strategy=str(opts.get("ev_charge_strategy", "smart")),
             scheduler_engine=str(opts.get("scheduler_engine", "greedy")),
+            auto_engine_budget_s=float(opts.get("auto_engine_budget_s", 5.0)),
+            pv_scenario_samples=int(opts.get("pv_scenario_samples", 0)),
+            pv_scenario_shortfall_pct=float(opts.get("pv_scenario_shortfall_pct", 10.0)),
+            extended_horizon=str(opts.get("extended_horizon", "off")).lower()
+                in ("on", "true", "1"),
+            variable_power=str(opts.get("variable_power", "off")).lower()
+                in ("on", "true", "1"),
+            # TREX-25/50 take the rule-1 power in whole kW, TREX-5/10 in W.
+            power_step_kw=1.0 if self.inverter_model in (
+                INVERTER_MODEL_TREX_TWENTY_FIVE, INVERTER_MODEL_TREX_FIFTY
+            ) else 0.1,
+            plan_id=self.config_entry.entry_id,
         )
 
         # What did the previous schedule predict the SOC would be at this slot?
@@ -902,10 +1281,12 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             if deviation_kwh > significant_kwh:
                 if self._deviation_since_ts is None:
                     self._deviation_since_ts = time.time()
-            else:
+                    self._mark_store_dirty()
+            elif self._deviation_since_ts is not None:
                 # Consumption back on trend → stop tracking → withhold the
                 # prediction → extra charge stops next recalc.
                 self._deviation_since_ts = None
+                self._mark_store_dirty()
 
             sustained = (
                 self._deviation_since_ts is not None
@@ -937,6 +1318,13 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             previous_pv_confidence=self._last_pv_confidence,
             last_modbus_read_ts=self._last_modbus_success_ts,
             pv_fallback_today_kwh=pv_fallback,
+            pv_error_hourly=self._pv_error_model() or None,
+            consumption_error_hourly=self._consumption_error_model() or None,
+            slot_prices_tomorrow_estimate=(
+                self._estimate_tomorrow_prices(now) if config.extended_horizon
+                and not self.slot_prices_tomorrow else None
+            ),
+            pv_tomorrow_estimate_kwh=self._estimate_daily_pv(),
             current_hour=now.hour,
             current_minute=now.minute,
             predicted_soc_pct=predicted_soc,
@@ -958,6 +1346,11 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             safe_power_kw,
             opts.get("ev_charge_strategy", "smart"),
             opts.get("scheduler_engine", "greedy"),
+            opts.get("auto_engine_budget_s", 5.0),
+            opts.get("pv_scenario_samples", 0),
+            opts.get("pv_scenario_shortfall_pct", 10.0),
+            opts.get("extended_horizon", "off"),
+            opts.get("profile_next_replan", "off"),
         ))
         if (input_hash == self._last_schedule_input_hash
                 and current_slot_idx == self._last_schedule_slot_idx):
@@ -969,22 +1362,249 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self._last_schedule_input_hash = input_hash
         self._last_schedule_slot_idx = current_slot_idx
 
-        result = await self.hass.async_add_executor_job(
-            ems_module.calculate_schedule, config, state
+        # Same inputs minus SOC and PV actuals: while this is unchanged the
+        # committed plan is still the right plan, just shifted in time.
+        replan_key = hash((
+            grid_mode,
+            tuple(self.slot_prices_today) if self.slot_prices_today else None,
+            tuple(self.slot_prices_tomorrow) if self.slot_prices_tomorrow else None,
+            round(self.pv_forecast_today, 2) if self.pv_forecast_today else None,
+            self._yesterday_deficit,
+            json.dumps(self.slot_overrides, sort_keys=True) if self.slot_overrides else "",
+            safe_power_kw,
+            json.dumps({k: v for k, v in opts.items() if k != "profile_next_replan"},
+                       sort_keys=True, default=str),
+        ))
+        request = _ScheduleRequest(
+            config=config,
+            state=state,
+            battery_soc=battery_soc,
+            now=now,
+            effective_capacity=effective_capacity,
+            replan_key=replan_key,
         )
+        reason = self._full_replan_reason(request)
+        if reason is None:
+            repaired = ems_module.repair_schedule(self._committed_result, config, state)
+            if repaired is not None:
+                self._commit_schedule_result(repaired, request)
+                self.schedule_repairs += 1
+                _LOGGER.debug("Schedule repaired in place (slot %d)", current_slot_idx)
+                return
+            reason = "plan not repairable"
+        _LOGGER.debug("Full schedule replan: %s", reason)
+        self.schedule_replans += 1
+        self.schedule_replan_reason = reason
+        self._last_full_replan_ts = time.time()
+        self._submit_schedule_solve(request)
+        # Give a fast solve the chance to land within this tick (greedy and
+        # warm-started MILP finish in milliseconds).  A slow one keeps running
+        # in the background; until it commits, the control path below keeps
+        # executing the last committed plan.
+        task = self._schedule_task
+        if task is not None and not task.done():
+            await asyncio.wait({task}, timeout=_SCHEDULE_INLINE_WAIT_S)
+
+    def _submit_schedule_solve(self, request: _ScheduleRequest) -> None:
+        """Start a background solve for ``request``, or queue it behind the running one.
+
+        At most one solve runs at a time (an executor thread cannot be
+        interrupted, so starting another would only pile threads up).  A
+        request arriving while one is in flight takes the single queue slot;
+        an older queued request it displaces is superseded and never solved.
+        """
+        self._schedule_generation += 1
+        request = dataclasses.replace(request, generation=self._schedule_generation)
+        if self._schedule_task is not None and not self._schedule_task.done():
+            if self._pending_schedule is not None:
+                self.schedule_solves_superseded += 1
+            self._pending_schedule = request
+            return
+        self._schedule_task = self.config_entry.async_create_background_task(
+            self.hass, self._run_schedule_solve(request),
+            f"{DOMAIN} schedule solve",
+        )
+
+    async def _run_schedule_solve(self, request: _ScheduleRequest) -> None:
+        """Solve in the executor, commit the plan, then start any queued request."""
+        try:
+            result = await self._execute_calculate_schedule(
+                request.config, request.state
+            )
+        except Exception:  # a failed solve keeps the last committed plan
+            _LOGGER.exception("Schedule solve failed — keeping the last committed plan")
+            result = None
+        if result is not None:
+            self._record_schedule_phases(result)
+        # A cancel (grid-mode change, new day, unload) bumps the committed
+        # generation past this request, so a late result is dropped here.
+        if result is not None and request.generation > self._committed_generation:
+            self._commit_schedule_result(result, request)
+            self.async_update_listeners()
+        pending, self._pending_schedule = self._pending_schedule, None
+        if pending is not None and pending.generation > self._committed_generation:
+            self._schedule_task = self.config_entry.async_create_background_task(
+                self.hass, self._run_schedule_solve(pending),
+                f"{DOMAIN} schedule solve",
+            )
+
+    async def _execute_calculate_schedule(self, config, state):
+        """Run ems.calculate_schedule in the worker process or an executor thread.
+
+        The process path (option ``scheduler_worker: process``) keeps the
+        solve off HA's interpreter entirely; see worker.py.  A worker that
+        fails to start, crashes, cannot pickle the call or raises is
+        disabled for the session and this solve is retried in a thread.
+        With ``profile_next_replan`` on, the solve runs under cProfile
+        (ems.profile_schedule) in either place.
+        """
+        fn, args = ems_module.calculate_schedule, (config, state)
+        profile_path = self._take_profile_request()
+        if profile_path is not None:
+            fn, args = ems_module.profile_schedule, (config, state, profile_path)
+        result = None
+        if (self.config_entry.options.get("scheduler_worker", "thread") == "process"
+                and worker.available()):
+            try:
+                future = await self.hass.async_add_executor_job(worker.submit, fn, *args)
+                result = await asyncio.wrap_future(future)
+            except Exception as err:  # noqa: BLE001
+                # Start failures and crashes (OSError, BrokenProcessPool) as
+                # well as pickling errors and exceptions raised in the child:
+                # the worker is not trusted again and the solve reruns here.
+                worker.disable(repr(err))
+        if result is None:
+            result = await self.hass.async_add_executor_job(fn, *args)
+        if profile_path is not None:
+            _LOGGER.info(
+                "Replan profile written to %s (open with python -m pstats)", profile_path
+            )
+        return result
+
+    def _take_profile_request(self) -> str | None:
+        """Dump path for a one-shot cProfile of this solve, or None.
+
+        Switches ``profile_next_replan`` back off, so exactly one replan is
+        profiled per request.
+        """
+        entry = self.config_entry
+        if str(entry.options.get("profile_next_replan", "off")).lower() != "on":
+            return None
+        self.hass.config_entries.async_update_entry(
+            entry, options={**entry.options, "profile_next_replan": "off"}
+        )
+        return self.hass.config.path(f"{DOMAIN}_replan_{datetime.now():%Y%m%d_%H%M%S}.prof")
+
+    def _record_schedule_phases(self, result) -> None:
+        """Keep a finished solve's phase timings (last + rolling window)."""
+        self.schedule_phase_ms = result.phase_ms
+        self.schedule_phase_calls = result.phase_calls
+        if result.phase_ms:
+            self._schedule_phase_history.append(result.phase_ms)
+
+    @property
+    def schedule_phase_stats(self) -> dict[str, dict[str, float]]:
+        """Per-phase mean / max ms over the last _PHASE_HISTORY_REPLANS replans."""
+        samples: dict[str, list[float]] = {}
+        for phases in self._schedule_phase_history:
+            for name, ms in phases.items():
+                samples.setdefault(name, []).append(ms)
+        return {
+            name: {
+                "mean_ms": round(sum(values) / len(values), 3),
+                "max_ms": round(max(values), 3),
+                "replans": len(values),
+            }
+            for name, values in samples.items()
+        }
+
+    def _commit_schedule_result(self, result, request: _ScheduleRequest) -> None:
+        """Make ``result`` the executing plan and remember it for repairs."""
+        if request.generation == 0:  # inline repair: never went through the queue
+            self._schedule_generation += 1
+            request = dataclasses.replace(request, generation=self._schedule_generation)
+        self._committed_result = result
+        self._committed_replan_key = request.replan_key
+        self._apply_schedule_result(result, request)
+        self._committed_generation = request.generation
+        self.schedule_committed_ts = time.time()
+
+    def _full_replan_reason(self, request: _ScheduleRequest) -> str | None:
+        """Why ``request`` needs a full solve, or None when a repair will do."""
+        if self._committed_result is None:
+            return "no committed plan"
+        task = self._schedule_task
+        if (task is not None and not task.done()) or self._pending_schedule is not None:
+            return "solve in progress"
+        if request.replan_key != self._committed_replan_key:
+            return "inputs changed"
+        if str(self.config_entry.options.get("profile_next_replan", "off")).lower() == "on":
+            return "profile requested"
+        if (self._last_full_replan_ts is None
+                or time.time() - self._last_full_replan_ts > _REPAIR_MAX_AGE_S):
+            return "plan expired"
+        if request.state.predicted_soc_pct is not None:
+            return "consumption deviation"
+        trajectory = self._committed_result.soc_trajectory
+        prices = request.state.slot_prices_today
+        if request.battery_soc is None or not prices or not trajectory:
+            return "no trajectory"
+        slot = min(
+            int((request.now.hour * 60 + request.now.minute) / ((24 * 60) / len(prices))),
+            len(trajectory) - 1,
+        )
+        drift = abs(request.battery_soc - trajectory[slot])
+        if drift > _REPAIR_MAX_SOC_DRIFT_PCT:
+            return f"SOC drifted {drift:.1f}% from plan"
+        return None
+
+    def _cancel_schedule_solve(self, reason: str) -> None:
+        """Discard the in-flight and queued solves; their inputs no longer apply."""
+        task = self._schedule_task
+        if (task is None or task.done()) and self._pending_schedule is None:
+            return
+        _LOGGER.debug("Cancelling schedule solve (%s)", reason)
+        self._pending_schedule = None
+        self._committed_generation = self._schedule_generation
+        self._schedule_task = None
+        if task is not None and not task.done():
+            task.cancel()
+
+    @property
+    def schedule_plan_age_s(self) -> float | None:
+        """Seconds since the executing plan was committed (None before the first)."""
+        if self.schedule_committed_ts is None:
+            return None
+        return round(time.time() - self.schedule_committed_ts, 1)
+
+    def _apply_schedule_result(self, result, request: _ScheduleRequest) -> None:
+        """Commit a finished solve: unpack ``result`` into coordinator attributes.
+
+        Everything is read from the request snapshot the solve was built
+        from, so a plan that lands a few ticks late stays self-consistent.
+        """
+        config = request.config
+        state = request.state
+        battery_soc = request.battery_soc
+        now = request.now
+        effective_capacity = request.effective_capacity
+        grid_mode = config.grid_mode
 
         # Smoothed PV confidence for this tick — same EMA blend the
         # schedule used internally (previous_confidence keeps the chain
         # intact; storing the raw value would degrade the EMA to a weak
         # 2-tap blend).
         smoothed_pv_confidence = ems_module._calculate_pv_confidence(
-            self.pv_hourly_kwh, self.pv_actual_today_kwh,
+            state.pv_hourly_kwh, state.pv_actual_today_kwh,
             now.hour, now.minute,
-            previous_confidence=self._last_pv_confidence,
+            previous_confidence=state.previous_pv_confidence,
         )
 
-        # Unpack ScheduleResult into coordinator attributes
-        self.scheduled_slots = result.scheduled_slots
+        # Unpack ScheduleResult into coordinator attributes.  Copied: the
+        # override merge below must not leak into the committed result,
+        # which the next plan repair starts from.
+        self.scheduled_slots = dict(result.scheduled_slots)
+        self.slot_power_kw = dict(result.slot_power_kw)
 
         # Merge manual slot overrides from the card, then re-validate (#9).
         # Without validation, a manual override could push SOC above
@@ -999,20 +1619,21 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                 if grid_mode == "to_grid" and action != "discharge":
                     continue
                 self.scheduled_slots[idx] = action
+                self.slot_power_kw.pop(idx, None)  # overrides run at full power
 
             # Re-run SOC validation on the merged schedule.  Drops any
             # manually-added slot that would violate battery bounds.
-            if self.slot_prices_today and battery_soc is not None:
-                num_slots_t = len(self.slot_prices_today)
+            if state.slot_prices_today and battery_soc is not None:
+                num_slots_t = len(state.slot_prices_today)
                 minutes_per_slot_t = (24 * 60) / num_slots_t
                 current_slot_t = int(
                     (now.hour * 60 + now.minute) / minutes_per_slot_t
                 )
                 current_slot_t = min(current_slot_t, num_slots_t - 1)
                 remaining_t = [
-                    (i, self.slot_prices_today[i])
+                    (i, state.slot_prices_today[i])
                     for i in range(current_slot_t, num_slots_t)
-                    if self.slot_prices_today[i] is not None
+                    if state.slot_prices_today[i] is not None
                 ]
                 charge_set = {
                     i for i, a in self.scheduled_slots.items() if a == "charge"
@@ -1036,14 +1657,15 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                 validated_charge, validated_discharge = ems_module._validate_schedule_soc(
                     remaining_t, charge_set, discharge_set,
                     current_kwh_t, consumption_per_slot_t,
-                    self.pv_hourly_kwh or {}, minutes_per_slot_t,
+                    state.pv_hourly_kwh, minutes_per_slot_t,
                     smoothed_pv_confidence,
                     effective_capacity, floor_t,
                     energy_per_slot_t, config.efficiency,
-                    consumption_hourly_kwh=self._hourly_consumption_profile or None,
+                    consumption_hourly_kwh=state.consumption_hourly_kwh,
                     inverter_max_power_kw=config.inverter_max_power_kw,
                     safe_power_kw=config.safe_power_kw,
                     keep_all_negative_charges=config.charge_to_full_on_negative_price,
+                    slot_power_kw=self.slot_power_kw,
                 )
                 # Drop any slot rejected by validation, including overrides
                 dropped: list[tuple[int, str]] = []
@@ -1055,6 +1677,8 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                     elif action == "discharge" and idx not in validated_discharge:
                         del self.scheduled_slots[idx]
                         dropped.append((idx, action))
+                for idx, _ in dropped:
+                    self.slot_power_kw.pop(idx, None)
                 if dropped:
                     _LOGGER.warning(
                         "Override SOC validation: dropped %d slot(s) that would "
@@ -1071,6 +1695,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self.tomorrow_precharge = result.tomorrow_precharge
         self.tomorrow_planned_slots = result.tomorrow_planned_slots
         self.tomorrow_planned_kwh = result.tomorrow_planned_kwh
+        self.tomorrow_provisional = result.tomorrow_provisional
         self.schedule_status = result.status
         self.schedule_reason = result.schedule_reason
         # Reflect manual overrides in the status/reason.  result.status was
@@ -1087,13 +1712,14 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                 f"Manual override: {action_now} this slot"
             )
         self.scheduler_active = result.scheduler_active
+        self.solver_stats = result.solver_stats
         # Recompute SOC trajectory with the finalized schedule (including
         # any merged manual overrides).  Without this, the trajectory shows
         # the pre-override plan — so manually-added charge slots don't
         # appear in the SOC line, and the graph flatlines while the inverter
         # is actively charging.
-        if today_overrides and self.slot_prices_today and battery_soc is not None:
-            num_slots_r = len(self.slot_prices_today)
+        if today_overrides and state.slot_prices_today and battery_soc is not None:
+            num_slots_r = len(state.slot_prices_today)
             minutes_per_slot_r = (24 * 60) / num_slots_r
             current_slot_r = int(
                 (now.hour * 60 + now.minute) / minutes_per_slot_r
@@ -1110,20 +1736,21 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             # remaining, yet the SOC line barely rose).
             traj_state = state
             if not state.pv_hourly_kwh:
-                forecast_total = self.pv_forecast_today or pv_fallback
+                forecast_total = state.pv_forecast_today or state.pv_fallback_today_kwh
                 if forecast_total and forecast_total > 0:
                     traj_state = dataclasses.replace(
                         state,
                         pv_hourly_kwh=ems_module._synthesize_pv_hourly(forecast_total),
                     )
             self._backend_soc_trajectory = ems_module._compute_scheduled_soc_trajectory(
-                self.slot_prices_today, num_slots_r, minutes_per_slot_r,
+                state.slot_prices_today, num_slots_r, minutes_per_slot_r,
                 current_kwh_r, current_slot_r,
-                self.scheduled_slots, config, traj_state,
+                self.scheduled_slots, config, traj_state, self.slot_power_kw,
             )
         else:
             self._backend_soc_trajectory = result.soc_trajectory
         self._tomorrow_scheduled_slots = result.tomorrow_scheduled_slots
+        self._tomorrow_slot_power_kw = result.tomorrow_slot_power_kw
         self._backend_soc_trajectory_tomorrow = result.tomorrow_soc_trajectory
         self._flex_load_scheduled = result.load_slots
         self._flex_load_scheduled_tomorrow = result.tomorrow_load_slots
@@ -1132,8 +1759,8 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             self.price_threshold = result.price_threshold
 
         # Expose net_pv and pv_confidence for card simulation
-        if self.slot_prices_today:
-            prices = self.slot_prices_today
+        if state.slot_prices_today:
+            prices = state.slot_prices_today
             num_slots = len(prices)
             minutes_per_slot = (24 * 60) / num_slots
             current_slot = int((now.hour * 60 + now.minute) / minutes_per_slot)
@@ -1635,26 +2262,134 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             if self._consumption_store_loaded:
                 return
             from homeassistant.helpers.storage import Store
+            # Minor 2 adds the "runtime" snapshot; older files load as-is.
             self._consumption_store = Store(
                 self.hass,
                 version=1,
+                minor_version=2,
                 key=f"{DOMAIN}_{self.config_entry.entry_id}_consumption",
             )
             data = await self._consumption_store.async_load()
             if data and "daily_history" in data:
                 self._daily_consumption_history = data["daily_history"][-7:]
                 self._calculate_weekly_avg()
-            if data and "hourly_history" in data:
-                self._hourly_consumption_history = data["hourly_history"][-7:]
+            if data and "hourly_ring" in data:
+                try:
+                    self._hourly_ring.load(data["hourly_ring"])
+                except (ValueError, KeyError, TypeError) as err:
+                    _LOGGER.warning("Stored hourly consumption unreadable, starting over: %s", err)
                 self._calculate_hourly_profile()
+            elif data and "hourly_history" in data:
+                # Pre-ring stores: [{date, hours: {"h": kwh}}]
+                for entry in data["hourly_history"][-_HOURLY_RING_DAYS:]:
+                    self._store_hourly_day(entry["date"], entry.get("hours", {}))
+                self._calculate_hourly_profile()
+            if data and "pv_forecast_ratios" in data:
+                self._pv_forecast_ratios = data["pv_forecast_ratios"]
+            if data and "price_history" in data:
+                self._price_history = data["price_history"][-_PRICE_HISTORY_DAYS:]
+            if data and "pv_ring" in data:
+                try:
+                    self._pv_daily_ring.load(data["pv_ring"]["daily"])
+                    self._pv_hourly_ring.load(data["pv_ring"]["hourly"])
+                except (ValueError, KeyError, TypeError) as err:
+                    _LOGGER.warning("Stored PV history unreadable, starting over: %s", err)
+            elif data and "pv_daily_history" in data:
+                # Pre-ring stores: [{date, kwh}]
+                for entry in data["pv_daily_history"]:
+                    self._pv_daily_ring.set(
+                        datetime.strptime(entry["date"], "%Y-%m-%d").toordinal(), 0, entry["kwh"])
+            if data and ("pv_ring" in data or "pv_daily_history" in data):
+                self._update_pv_baseline(datetime.now().toordinal())
             # Cycle counting + SOH (#13).  Persisted across restarts so we
             # can estimate battery wear from cumulative throughput.
             if data and "cycle_charged_kwh" in data:
                 self._cycle_charged_kwh = float(data.get("cycle_charged_kwh", 0))
                 self._cycle_discharged_kwh = float(data.get("cycle_discharged_kwh", 0))
                 self._battery_soh_factor = float(data.get("battery_soh_factor", 1.0))
+            if data and "runtime" in data:
+                self._restore_runtime_state(data["runtime"])
             self._consumption_store_loaded = True
 
+    def _mark_store_dirty(self) -> None:
+        """Schedule one coalesced write of the consumption store.
+
+        The first change since the last write arms HA's delayed save;
+        later ones only ride along (re-arming would push the write back on
+        every tick).  The snapshot is taken at write time by _store_data.
+        """
+        if self._consumption_store is None or self._store_save_pending:
+            return
+        self._store_save_pending = True
+        self._consumption_store.async_delay_save(self._store_data, _STORE_SAVE_DELAY_S)
+
+    def _store_data(self) -> dict:
+        """Everything the consumption store persists, snapshotted now."""
+        self._store_save_pending = False
+        return {
+            "daily_history": self._daily_consumption_history,
+            "hourly_ring": self._hourly_ring.pack(),
+            "pv_forecast_ratios": self._pv_forecast_ratios,
+            "price_history": self._price_history,
+            "pv_ring": {
+                "daily": self._pv_daily_ring.pack(),
+                "hourly": self._pv_hourly_ring.pack(),
+            },
+            "cycle_charged_kwh": round(self._cycle_charged_kwh, 3),
+            "cycle_discharged_kwh": round(self._cycle_discharged_kwh, 3),
+            "battery_soh_factor": round(self._battery_soh_factor, 4),
+            "runtime": self._runtime_state(),
+        }
+
+    def _runtime_state(self) -> dict:
+        """Today's in-flight state, so a restart picks the day up where it was.
+
+        Stamped with the day the state belongs to: between midnight and the
+        rollover tick it still holds yesterday's figures, which must not be
+        restored as today's.
+        """
+        day = datetime.now()
+        if self._current_day is not None and self._current_day != day.day:
+            day -= timedelta(days=1)
+        return {
+            "date": day.strftime("%Y-%m-%d"),
+            "soc_history": {str(k): v for k, v in self._soc_history.items()},
+            "pv_integrated_today_kwh": round(self._pv_integrated_today_kwh, 3),
+            "pv_today_peak_kwh": round(self._pv_today_peak_kwh, 3),
+            "deviation_since_ts": self._deviation_since_ts,
+            "load_counter": [self._load_counter_kwh, self._load_counter_ts],
+            "load_hour": [*(self._load_hour_marker or (None, None)),
+                          round(self._load_hour_kwh, 4), self._load_hour_complete],
+        }
+
+    def _restore_runtime_state(self, runtime: dict) -> None:
+        """Adopt a stored runtime snapshot when it is from today.
+
+        The load counter sample only bridges a restart shorter than
+        _LOAD_SAMPLE_MAX_GAP_S (checked on the next tick), so a quick
+        restart keeps the hour being filled.
+        """
+        if runtime.get("date") != datetime.now().strftime("%Y-%m-%d"):
+            return
+        try:
+            self._soc_history = {int(k): float(v) for k, v in runtime.get("soc_history", {}).items()}
+            self._pv_integrated_today_kwh = float(runtime.get("pv_integrated_today_kwh", 0.0))
+            self._pv_today_peak_kwh = float(runtime.get("pv_today_peak_kwh", 0.0))
+            self._deviation_since_ts = runtime.get("deviation_since_ts")
+            self._load_counter_kwh, self._load_counter_ts = runtime.get("load_counter", (None, None))
+            date_str, hour, kwh, complete = runtime.get("load_hour", (None, None, 0.0, False))
+            if date_str is not None:
+                self._load_hour_marker = (date_str, int(hour))
+                self._load_hour_kwh, self._load_hour_complete = float(kwh), bool(complete)
+        except (ValueError, TypeError) as err:
+            _LOGGER.warning("Stored runtime state unreadable, ignoring: %s", err)
+
+    async def async_flush_store(self) -> None:
+        """Write a pending store change now (entry unload / reload)."""
+        if self._consumption_store is None or not self._store_save_pending:
+            return
+        await self._consumption_store.async_save(self._store_data())
+
     async def _record_daily_consumption(self) -> None:
         """Record today's consumption and update 7-day rolling average.
 
@@ -1707,18 +2442,12 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         # Keep last 7 days
         self._daily_consumption_history = self._daily_consumption_history[-7:]
 
-        # Record hourly breakdown from HA history
-        await self._record_hourly_consumption(today_str)
-
-        # Persist
-        if self._consumption_store:
-            await self._consumption_store.async_save({
-                "daily_history": self._daily_consumption_history,
-                "hourly_history": self._hourly_consumption_history,
-                "cycle_charged_kwh": round(self._cycle_charged_kwh, 3),
-                "cycle_discharged_kwh": round(self._cycle_discharged_kwh, 3),
-                "battery_soh_factor": round(self._battery_soh_factor, 4),
-            })
+        # The hourly ring fills live; the last hour of the day closes here
+        # because bookkeeping runs before this tick's counter sample.
+        self._close_consumption_hour()
+
+        # Persist (coalesced with the runtime state; see _mark_store_dirty)
+        self._mark_store_dirty()
 
         self._calculate_weekly_avg()
         _LOGGER.info("Recorded daily consumption: %.2f kWh (7-day avg: %.2f kWh)",
@@ -1733,29 +2462,28 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         self.weekly_avg_consumption = round(total / len(self._daily_consumption_history), 2)
 
     def _compute_pv_fallback(self) -> float | None:
-        """7-day rolling average of actual daily PV (#4).
+        """Today's PV total from stored actuals, for forecast outages (#4).
 
         Used when forecast.solar is unavailable so the algorithm doesn't
         treat PV as zero — that would over-aggressively grid-charge on
         every clear day after a forecast service outage.
 
-        Returns None when no actual PV history is available.
+        PV produced so far plus the baseline's share still to come from
+        this point of the day (from the recent hourly shape); the plain
+        baseline before sunrise or without hourly history.  Only cached
+        values are read.  Returns None when no PV history is available.
         """
-        # We piggy-back on the daily consumption store: there is no separate
-        # PV history yet, so return None for now and rely on yesterday's
-        # actual when available via pv_actual_today_kwh on the previous tick.
-        # Future: track _daily_pv_history alongside daily consumption.
-        if self.pv_actual_today_kwh is None or self.pv_actual_today_kwh <= 0:
+        baseline = self._pv_baseline_kwh
+        if baseline is None:
             return None
-        # Rough fallback: assume today will produce similarly to today-so-far
-        # extrapolated by remaining daylight.  This is a crude estimate but
-        # better than zero.
+        actual = self.pv_actual_today_kwh or 0.0
+        share = self._pv_remaining_share
+        if share is None:
+            return round(max(baseline, actual), 2)
         now = datetime.now()
-        if now.hour < 6 or now.hour >= 20:
-            return None  # outside daylight, can't extrapolate
-        elapsed_daylight = max(1, now.hour - 6)
-        total_daylight = 14
-        return self.pv_actual_today_kwh * (total_daylight / elapsed_daylight)
+        h = now.hour
+        to_come = share[h + 1] + (share[h] - share[h + 1]) * (1 - now.minute / 60.0)
+        return round(actual + baseline * to_come, 2)
 
     def _track_cycle_throughput(self, current_soc: float | None) -> None:
         """Accumulate charged/discharged kWh from SOC changes (#13).
@@ -1781,6 +2509,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             self._cycle_discharged_kwh += abs(delta_kwh)
         self._last_soc_for_cycles = current_soc
         self._update_soh_estimate()
+        self._mark_store_dirty()
 
     def _update_soh_estimate(self) -> None:
         """Estimate SOH from equivalent full cycles (#13).
@@ -1808,38 +2537,140 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                 self._cycle_charged_kwh, self._cycle_discharged_kwh,
             )
 
-    async def _record_hourly_consumption(self, date_str: str) -> None:
-        """Record hourly consumption breakdown using HA recorder history.
+    def _load_energy_counter_kwh(self) -> float | None:
+        """Current reading of the load-energy counter in kWh, or None.
 
-        Queries the consumption entity's history for the given date and bins
-        energy usage into 24 hourly buckets.  Falls back to flat distribution
-        from the daily total when history is unavailable.
+        The override entity wins (its unit_of_measurement decides Wh/kWh);
+        otherwise the first load-energy register present in this tick's
+        data, scaled by its register-map unit.  Only the growth of the
+        counter is used, so a daily counter and a lifetime meter both work.
         """
-        hourly: dict[str, float] = {}  # str keys for JSON serialisation
+        if self.consumption_override_entity:
+            state = self.hass.states.get(self.consumption_override_entity)
+            if state is None or state.state in ("unknown", "unavailable"):
+                return None
+            try:
+                value = float(state.state)
+            except (ValueError, TypeError):
+                return None
+            unit = state.attributes.get("unit_of_measurement")
+            return value / 1000.0 if unit == "Wh" else value
+        for key in _LOAD_ENERGY_KEYS:
+            value = self.data.get(key) if self.data else None
+            if value is None:
+                continue
+            unit = self.register_map.get(key, {}).get("unit")
+            return value / 1000.0 if unit == "Wh" else float(value)
+        return None
 
+    def _accumulate_hourly_consumption(self) -> None:
+        """Add the load counter's growth since the last tick to the current hour.
+
+        Called every coordinator tick.  An hour is recorded into the ring
+        by the first tick of the next one, and only if it was followed from
+        its start to its end without a gap; a missed stretch (restart,
+        Modbus outage) leaves that hour unknown rather than too low.  A
+        counter that drops to near zero is a day counter's midnight reset:
+        the new reading is the energy since the reset.  Growth beyond the
+        inverter's rating over the interval, or any other drop, counts as a
+        gap.
+        """
+        now = datetime.now()
+        now_ts = time.time()
+        marker = (now.strftime("%Y-%m-%d"), now.hour)
+        counter = self._load_energy_counter_kwh()
+        previous, previous_ts = self._load_counter_kwh, self._load_counter_ts
+        self._load_counter_kwh, self._load_counter_ts = counter, now_ts
+
+        delta = None
+        if (counter is not None and previous is not None
+                and now_ts - previous_ts <= _LOAD_SAMPLE_MAX_GAP_S):
+            max_delta = (self._inverter_max_power_kw * (now_ts - previous_ts) / 3600.0
+                         * _LOAD_DELTA_SLACK + _LOAD_DELTA_RESOLUTION_KWH)
+            delta = counter - previous if counter >= previous else counter
+            if delta > max_delta:
+                delta = None  # implausible jump or a drop that is not a reset
+
+        if delta is None:
+            self._load_hour_complete = False
+        else:
+            self._load_hour_kwh += delta
+        if marker != self._load_hour_marker:
+            # The sample that crosses the boundary closes the old hour; the
+            # new one is complete only if it starts from a fresh sample.
+            self._close_consumption_hour()
+            self._load_hour_complete = self._load_hour_marker is not None and delta is not None
+            self._load_hour_marker, self._load_hour_kwh = marker, 0.0
+
+    def _close_consumption_hour(self) -> None:
+        """Record the hour being filled (if fully observed) and refresh its profile."""
+        if self._load_hour_marker is None or not self._load_hour_complete:
+            return
+        date_str, hour = self._load_hour_marker
+        self._load_hour_complete = False  # recorded; closing again is a no-op
+        ordinal = datetime.strptime(date_str, "%Y-%m-%d").toordinal()
+        self._hourly_ring.set(ordinal, hour, self._load_hour_kwh)
+        self._mark_store_dirty()
+        # The profile entry for this hour now looks ahead to tomorrow's.
+        self._update_hourly_profile(hour, ordinal + 1)
+
+    def _store_hourly_day(self, date_str: str, hours: dict) -> None:
+        """Write a {hour: kWh} day (legacy stored history or recorder backfill) into the ring."""
+        ordinal = datetime.strptime(date_str, "%Y-%m-%d").toordinal()
+        for h_str, kwh in hours.items():
+            h = int(h_str)
+            if 0 <= h <= 23 and kwh is not None and kwh >= 0:
+                self._hourly_ring.set(ordinal, h, kwh)
+
+    def _recent_hour_values(self, hour: int, last_ordinal: int) -> list[float]:
+        """Recorded kWh of ``hour`` over the _PROFILE_RECENT_DAYS days up to ``last_ordinal``."""
+        values = (self._hourly_ring.get(last_ordinal - k, hour) for k in range(_PROFILE_RECENT_DAYS))
+        return [v for v in values if v is not None]
+
+    def _hour_of_week_estimate(self, hour: int, ordinal: int) -> float | None:
+        """Expected kWh in ``hour`` of day ``ordinal``.
+
+        The median of the same hour on the same weekday over the stored
+        weeks, so weekday and weekend patterns stay apart and a one-off
+        (guests, a holiday) does not drag the estimate.  Until a weekday
+        has _HOW_MIN_SAMPLES weeks behind it, the hour's average over the
+        last days stands in.
+        """
+        same = sorted(
+            v for v in (self._hourly_ring.get(ordinal - 7 * k, hour)
+                        for k in range(1, _CONSUMPTION_WEEKS + 1))
+            if v is not None
+        )
+        if len(same) >= _HOW_MIN_SAMPLES:
+            mid = len(same) // 2
+            return same[mid] if len(same) % 2 else (same[mid - 1] + same[mid]) / 2
+        recent = self._recent_hour_values(hour, ordinal - 1)
+        return sum(recent) / len(recent) if recent else None
+
+    async def _backfill_hourly_consumption(self) -> None:
+        """One-time fill of an empty ring from the recorder's hourly statistics.
+
+        Runs once after the store is loaded, and only when neither stored
+        history nor live ticks have put anything in the ring yet (a fresh
+        install or an upgrade from the recorder-based profile).  Two weeks
+        give every weekday a second sample for the hour-of-week median.
+        """
+        self._hourly_backfill_done = True
+        if self._hourly_ring:
+            return
         entity_id = self._resolve_consumption_entity()
-        if entity_id:
-            hourly = await self._query_hourly_from_history(entity_id, date_str)
-
-        if not hourly:
-            # Fallback: distribute daily total evenly across 24 hours
-            today_entry = next(
-                (e for e in self._daily_consumption_history if e["date"] == date_str), None
-            )
-            if today_entry:
-                per_hour = round(today_entry["kwh"] / 24.0, 3)
-                hourly = {str(h): per_hour for h in range(24)}
-
-        if not hourly:
+        if not entity_id:
             return
-
-        # Remove existing entry for this date
-        self._hourly_consumption_history = [
-            e for e in self._hourly_consumption_history if e["date"] != date_str
-        ]
-        self._hourly_consumption_history.append({"date": date_str, "hours": hourly})
-        self._hourly_consumption_history = self._hourly_consumption_history[-7:]
-        self._calculate_hourly_profile()
+        today = datetime.now()
+        for days_ago in range(_HOW_MIN_SAMPLES * 7, 0, -1):
+            date_str = (today - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+            hourly = await self._query_hourly_from_history(entity_id, date_str)
+            if hourly:
+                self._store_hourly_day(date_str, hourly)
+        if self._hourly_ring:
+            self._calculate_hourly_profile()
+            self._mark_store_dirty()
+            _LOGGER.info("Hourly consumption profile backfilled from the recorder")
 
     def _resolve_consumption_entity(self) -> str | None:
         """Return the best entity_id to query for hourly consumption history.
@@ -1928,30 +2759,35 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             return {}
 
     def _calculate_hourly_profile(self) -> None:
-        """Build per-hour average consumption from 7-day hourly history."""
-        if not self._hourly_consumption_history:
-            self._hourly_consumption_profile = {}
-            return
-
-        hour_totals: dict[int, list[float]] = {h: [] for h in range(24)}
-        for entry in self._hourly_consumption_history:
-            hours = entry.get("hours", {})
-            for h_str, kwh in hours.items():
-                h = int(h_str)
-                if 0 <= h <= 23 and kwh >= 0:
-                    hour_totals[h].append(kwh)
-
+        """Rebuild the 24-hour consumption profile from the hour-of-week ring.
+
+        Each entry is the estimate for that hour's next occurrence: later
+        hours of today, and tomorrow for the hours already past, so the
+        overnight reserve sees tomorrow morning's weekday.  Used after
+        loading or backfilling; a recorded hour refreshes its own entry
+        through _update_hourly_profile.  Hours never measured stay out of
+        the profile, so the scheduler uses its flat estimate there.
+        """
+        now = datetime.now()
+        today = now.toordinal()
         profile: dict[int, float] = {}
         for h in range(24):
-            values = hour_totals[h]
-            if values:
-                profile[h] = round(sum(values) / len(values), 3)
-            else:
-                profile[h] = 0.0
-
+            estimate = self._hour_of_week_estimate(h, today if h >= now.hour else today + 1)
+            if estimate is not None:
+                profile[h] = round(estimate, 3)
         self._hourly_consumption_profile = profile
         _LOGGER.debug("Hourly consumption profile: %s", profile)
 
+    def _update_hourly_profile(self, hour: int, ordinal: int) -> None:
+        """Refresh one hour of the profile to its estimate for day ``ordinal``."""
+        estimate = self._hour_of_week_estimate(hour, ordinal)
+        profile = dict(self._hourly_consumption_profile)
+        if estimate is None:
+            profile.pop(hour, None)
+        else:
+            profile[hour] = round(estimate, 3)
+        self._hourly_consumption_profile = profile
+
     def _record_soc_snapshot(self, battery_soc: float | None) -> None:
         """Record battery SOC at the current slot boundary (every 15 min)."""
         if battery_soc is None:
@@ -1969,6 +2805,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
         if current_slot != self._last_recorded_slot:
             self._soc_history[current_slot] = round(battery_soc, 1)
             self._last_recorded_slot = current_slot
+            self._mark_store_dirty()
 
     def _calculate_yesterday_deficit(self, battery_soc: float | None) -> None:
         """At midnight, calculate how much energy target was missed yesterday."""
@@ -2062,6 +2899,12 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             new_data["highest_grid_current_now"] = max_current
         # This is the key: use the freshly read register value from new_data!
         applied_kwatts = self.TypeSpecificHandler.determine_rule_power(new_data) # works in kW
+        reduced_w = self._rule_power_written_w
+        if (applied_kwatts is not None and reduced_w is not None
+                and reduced_w < base_level * 1000
+                and applied_kwatts == round(reduced_w / 1000)):
+            # Our own reduced per-slot level (variable power), not an app change.
+            applied_kwatts = None
         if applied_kwatts is not None:
             detected_level = max(1, min(user_level, applied_kwatts))
             if abs(detected_level - base_level) >= 1:
@@ -2113,6 +2956,8 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
             try:
                 await self.TypeSpecificHandler.write_type_specific_register("econ_rule_1_power", target_watts)
                 self.safe_max_power = safe_level
+                if self._rule_power_written_w is not None:
+                    self._rule_power_written_w = target_watts
             except Exception as err:
                 _LOGGER.error("Failed to write power limit: %s", err)
                 # Don't update internal state on failure → retry next cycle
@@ -2188,19 +3033,64 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                 enable_value, new_state,
             )
             return False
+        self._rule_power_written_w = None
         if new_state != "idle":
+            power_w = self._slot_rule_power_w(new_state)
             for reg, val in [
                 ("econ_rule_1_soc", soc_limit),
                 ("econ_rule_1_start_day", date_16bit),
                 ("econ_rule_1_stop_day", date_16bit),
                 ("econ_rule_1_voltage", voltage_level),
-                ("econ_rule_1_power", int(round(self.safe_max_power * 1000))),
+                ("econ_rule_1_power", power_w),
             ]:
                 ok = await self.TypeSpecificHandler.write_type_specific_register(reg, val)
                 if not ok:
                     _LOGGER.warning("Failed to write %s=%s during %s transition", reg, val, new_state)
+                elif reg == "econ_rule_1_power":
+                    self._rule_power_written_w = power_w
         return True
 
+    def _slot_rule_power_w(self, state: str) -> int:
+        """Rule-1 power (W) for running ``state`` in the current slot.
+
+        Full safe power, unless the plan runs this slot at a reduced level
+        (variable power) — then that level, still capped at safe power.
+        """
+        power_kw = self.safe_max_power
+        slot_idx = self._current_slot_index()
+        action = {"charging": "charge", "discharging": "discharge"}.get(state)
+        if (slot_idx is not None and action is not None
+                and self.scheduled_slots.get(slot_idx) == action
+                and slot_idx in self.slot_power_kw):
+            power_kw = min(power_kw, self.slot_power_kw[slot_idx])
+        return int(round(power_kw * 1000))
+
+    async def _sync_slot_rule_power(self) -> None:
+        """Variable power: follow the plan's per-slot level while active.
+
+        _transition_to_state writes the rule-1 power only on a state change,
+        but consecutive slots of one charge/discharge block can run at
+        different levels.  Re-write it when the current slot's level differs
+        from the one last written.
+        """
+        if self._current_energy_state not in ("charging", "discharging"):
+            return
+        if str(self.config_entry.options.get("variable_power", "off")).lower() not in (
+                "on", "true", "1"):
+            return
+        target_w = self._slot_rule_power_w(self._current_energy_state)
+        if target_w == self._rule_power_written_w:
+            return
+        ok = await self.TypeSpecificHandler.write_type_specific_register(
+            "econ_rule_1_power", target_w)
+        if ok:
+            _LOGGER.info(
+                "Variable power: rule-1 power %s → %dW for this slot",
+                f"{self._rule_power_written_w}W" if self._rule_power_written_w is not None else "?",
+                target_w,
+            )
+            self._rule_power_written_w = target_w
+
     async def _apply_rule1_auto_settings(self) -> None:
         """If rule 1 auto settings are enabled, ensure the inverter's
         time-window and weekday-mask match the auto defaults.
@@ -2520,6 +3410,8 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
 
                             # Initialize consumption store on first run
                             await self._init_consumption_store()
+                            if not self._hourly_backfill_done:
+                                await self._backfill_hourly_consumption()
 
                             # Midnight bookkeeping (once per day change)
                             now = datetime.now()
@@ -2539,13 +3431,23 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                                 if not first_boot:
                                     # Record deficit before rolling over (for next-day compensation)
                                     self._calculate_yesterday_deficit(battery_soc)
+                                    # Yesterday's prices / PV for the extended
+                                    # horizon (saved with the consumption below)
+                                    self._record_day_history(now - timedelta(days=1))
                                     # Record daily consumption for rolling average
                                     await self._record_daily_consumption()
-                                self._soc_history = {}
+                                    # (On first boot these hold today's
+                                    # restored runtime state.)
+                                    self._soc_history = {}
+                                    self._pv_integrated_today_kwh = 0.0
+                                    self._pv_today_peak_kwh = 0.0
                                 self._last_recorded_slot = -1
-                                self._pv_integrated_today_kwh = 0.0
                                 self._current_day = now.day
 
+                                # A solve started before midnight planned
+                                # against yesterday's price arrays.
+                                self._cancel_schedule_solve("new day")
+
                                 # Propagate tomorrow's slot overrides → today
                                 await self._rotate_slot_overrides()
                                 # Do NOT force-idle the inverter here.  A discharge
@@ -2573,6 +3475,10 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                             self._track_cycle_throughput(battery_soc)
                             # PV power integration (generator-port solar fix)
                             self._integrate_pv_power()
+                            self._accumulate_hourly_consumption()
+                            self._record_pv_forecast_error()
+                            self._pv_today_peak_kwh = max(
+                                self._pv_today_peak_kwh, self.pv_actual_today_kwh or 0.0)
 
                             # In auto mode, run the schedule optimizer
                             if price_mode == "auto":
@@ -2741,6 +3647,7 @@ class HA_FelicityCoordinator(DataUpdateCoordinator):
                                 # inverter hasn't silently dropped out of
                                 # Economic mode while we believe we're active.
                                 await self._ensure_economic_mode_when_active()
+                                await self._sync_slot_rule_power()
                         else:
                             _LOGGER.debug(
                                 "Cannot calculate price threshold: missing data (min=%s, avg=%s, max=%s)",
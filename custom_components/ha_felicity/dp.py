@@ -0,0 +1,538 @@
+"""Dynamic-programming (DP) scheduler for the EMS.
+
+A third ``scheduler_engine`` next to the greedy heuristic in ``ems.py`` and
+the LP in ``milp.py``.  It solves the same remaining-today (+ tomorrow, when
+prices are known) horizon *exactly* over a discretised SOC grid, in-process,
+with no solver binary, subprocess or temp files.
+
+Why DP
+------
+The executor only knows three per-slot actions — charge at safe power,
+discharge at safe power, or idle.  The MILP relaxes that to continuous
+energy and then has to collapse its plan back onto full-power slots; the
+greedy engine needs many repair passes to stay feasible.  A backward DP over
+SOC levels optimises directly over the executable action set, so the plan it
+returns is exactly the plan the inverter will run (up to SOC-grid
+resolution), and every cross-slot / cross-day trade-off is priced jointly.
+
+Design
+------
+* Pure module: reads ``EMSConfig`` / ``EMSState`` by attribute and takes the
+  precomputed reserve target / PV confidence as arguments, like ``milp.py``.
+  The horizon comes from :func:`milp.build_horizon` so both exact engines
+  see an identical energy model (``milp`` only imports pulp lazily, so this
+  costs nothing when pulp is absent).
+* Cost model mirrors ``milp._solve``: buy cost, sell revenue × efficiency,
+  per-kWh cycle wear, soft reserve at midnight and at the horizon end,
+  leftover-SOC value capped at the reserve, a heavy penalty for dropping
+  below the discharge floor, and a tiny earliness tie-break (applied to
+  selling as well, so equal-price peaks today and tomorrow resolve to
+  today instead of deferring the sale).
+  One addition: PV that overflows a full battery is exported at the slot
+  price instead of vanishing.  An exact optimiser exploits every gap in
+  its model, and without this it sells cheap slots merely to make room
+  for PV that would have been exported at the same price anyway.
+* Value function lives on ``levels`` evenly spaced SOC points and is
+  linearly interpolated between them; the forward pass then replays the
+  policy on the *continuous* SOC from ``current_kwh``.  Work is
+  O(slots × levels × 3).  numpy vectorises the per-slot sweep over levels
+  when available; the pure-Python path gives the same decisions.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import time
+from typing import Any
+
+try:
+    import numpy as _np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    _np = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# SOC grid resolution.  0.05 kWh is well below one slot's charge energy on
+# any real inverter; large batteries are capped at _MAX_SOC_LEVELS so the
+# sweep stays in the low milliseconds.
+_SOC_STEP_KWH = 0.05
+_MAX_SOC_LEVELS = 201
+
+# Same activation threshold as the MILP extraction: a "charge" that only
+# tops off a nearly-full battery by <15% of a slot is not worth a slot.
+_MIN_FRAC = 0.15
+
+# Decision ties (e.g. charge vs idle on a full battery) resolve to the
+# earlier action in _ACTIONS, so idle wins unless an action is strictly
+# better by more than this.
+_TIE_EPS = 1e-9
+_ACTIONS = ("idle", "charge", "discharge")
+
+
+def solve_schedule(
+    config: Any,
+    state: Any,
+    *,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    reserve_target: float,
+    pv_confidence: float,
+    stats: dict[str, Any] | None = None,
+    slot_power: dict[str, dict[int, float]] | None = None,
+) -> tuple[dict[int, str], dict[int, str]] | None:
+    """Solve the EMS schedule by dynamic programming over SOC.
+
+    Returns ``(today_slots, tomorrow_slots)`` where each is
+    ``{slot_index: "charge"|"discharge"}``, or ``None`` when there is nothing
+    to plan or the solve fails (caller falls back to greedy).  ``stats``
+    receives the same diagnostics keys as the MILP's; a DP sweep has no
+    iteration count or warm start, so those stay None / "cold".
+    ``slot_power`` is filled like the MILP's under ``config.variable_power``.
+    """
+    try:
+        return _solve(
+            config, state,
+            remaining=remaining,
+            current_kwh=current_kwh,
+            num_slots=num_slots,
+            current_slot=current_slot,
+            minutes_per_slot=minutes_per_slot,
+            reserve_target=reserve_target,
+            pv_confidence=pv_confidence,
+            stats=stats,
+            slot_power=slot_power,
+        )
+    except Exception:  # pragma: no cover - defensive guard
+        _LOGGER.warning("DP solve failed — falling back to greedy", exc_info=True)
+        return None
+
+
+def plan_cost(
+    config: Any,
+    state: Any,
+    *,
+    today_slots: dict[int, str],
+    tomorrow_slots: dict[int, str],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    reserve_target: float,
+    pv_confidence: float,
+    slot_power: dict[str, dict[int, float]] | None = None,
+) -> float | None:
+    """Price a fixed plan with the DP's slot model; None if nothing to price.
+
+    Lets plans from different engines be compared on one yardstick (the
+    ``auto`` engine in ems.py).  Slots missing from the plan are idle;
+    slots listed in ``slot_power`` (kW per day/slot) run at that level.
+    """
+    model = _build_model(
+        config, state,
+        current_kwh=current_kwh,
+        num_slots=num_slots,
+        current_slot=current_slot,
+        minutes_per_slot=minutes_per_slot,
+        reserve_target=reserve_target,
+        pv_confidence=pv_confidence,
+    )
+    if model is None:
+        return None
+    actions = [
+        (today_slots if h["day"] == "today" else tomorrow_slots).get(h["slot"], "idle")
+        for h in model.horizon
+    ]
+    scales = None
+    if slot_power:
+        slot_hours = minutes_per_slot / 60.0
+        scales = []
+        for h, action in zip(model.horizon, actions):
+            kw = slot_power.get(h["day"], {}).get(h["slot"])
+            cap = h["charge_cap"] if action == "charge" else h["discharge_cap"]
+            scales.append(1.0 if kw is None or cap <= 0
+                          else min(1.0, kw * slot_hours / cap))
+    return model.plan_cost(current_kwh, actions, scales)
+
+
+def _import_milp():
+    try:
+        from . import milp  # type: ignore
+    except ImportError:
+        import milp  # type: ignore
+    return milp
+
+
+def _build_horizon(config, state, **kwargs) -> list[dict[str, Any]]:
+    return _import_milp().build_horizon(config, state, **kwargs)
+
+
+def _solve(
+    config: Any,
+    state: Any,
+    *,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    reserve_target: float,
+    pv_confidence: float,
+    backend: str = "auto",
+    stats: dict[str, Any] | None = None,
+    slot_power: dict[str, dict[int, float]] | None = None,
+) -> tuple[dict[int, str], dict[int, str]] | None:
+    if not remaining:
+        return None
+    model = _build_model(
+        config, state,
+        current_kwh=current_kwh,
+        num_slots=num_slots,
+        current_slot=current_slot,
+        minutes_per_slot=minutes_per_slot,
+        reserve_target=reserve_target,
+        pv_confidence=pv_confidence,
+    )
+    if model is None:
+        return None
+
+    use_numpy = _np is not None and backend in ("auto", "numpy")
+    started = time.perf_counter()
+    values = model.backward_numpy() if use_numpy else model.backward_python()
+    actions = model.forward(current_kwh, values)
+    solve_ms = round((time.perf_counter() - started) * 1000.0, 3)
+    if stats is not None:
+        stats.update(backend="numpy" if use_numpy else "python",
+                     solve_ms=solve_ms, iterations=None,
+                     warm_start="cold")
+
+    horizon = model.horizon
+    if getattr(config, "variable_power", False):
+        # The last slot of a fill or drain carries only what fits; run it at
+        # that level instead of dropping it below _MIN_FRAC or rounding it up.
+        milp = _import_milp()
+        if slot_power is None:
+            slot_power = {}
+        today_scheduled, tomorrow_scheduled = milp.variable_power_slots(
+            horizon,
+            [energy if action == "charge" else 0.0 for action, energy in actions],
+            [energy if action == "discharge" else 0.0 for action, energy in actions],
+            safe_power_kw=config.safe_power_kw,
+            power_step_kw=getattr(config, "power_step_kw", 0.0),
+            minutes_per_slot=minutes_per_slot,
+            slot_power=slot_power,
+        )
+        milp._force_negative_charges(config, horizon, today_scheduled,
+                                     tomorrow_scheduled, slot_power)
+        return today_scheduled, tomorrow_scheduled
+
+    today_scheduled: dict[int, str] = {}
+    tomorrow_scheduled: dict[int, str] = {}
+    for h, (action, energy) in zip(horizon, actions):
+        sched = today_scheduled if h["day"] == "today" else tomorrow_scheduled
+        if action == "charge" and energy > h["charge_cap"] * _MIN_FRAC:
+            sched[h["slot"]] = "charge"
+        elif action == "discharge" and energy > h["discharge_cap"] * _MIN_FRAC:
+            sched[h["slot"]] = "discharge"
+
+    # Same explicit opt-in as the MILP: grab every negative-price slot even
+    # when the battery would already be full.
+    if getattr(config, "charge_to_full_on_negative_price", False):
+        for h in horizon:
+            if h["price"] < 0:
+                sched = (today_scheduled if h["day"] == "today"
+                         else tomorrow_scheduled)
+                if sched.get(h["slot"]) != "discharge":
+                    sched[h["slot"]] = "charge"
+
+    _LOGGER.debug(
+        "DP solved (%.1f ms): today %d slots (%d charge, %d discharge), "
+        "tomorrow %d slots (%d charge, %d discharge), horizon=%d, levels=%d",
+        solve_ms,
+        len(today_scheduled),
+        sum(1 for v in today_scheduled.values() if v == "charge"),
+        sum(1 for v in today_scheduled.values() if v == "discharge"),
+        len(tomorrow_scheduled),
+        sum(1 for v in tomorrow_scheduled.values() if v == "charge"),
+        sum(1 for v in tomorrow_scheduled.values() if v == "discharge"),
+        len(horizon),
+        model.levels,
+    )
+    return today_scheduled, tomorrow_scheduled
+
+
+def _build_model(
+    config: Any,
+    state: Any,
+    *,
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    reserve_target: float,
+    pv_confidence: float,
+) -> _Model | None:
+    """Build the slot cost model over the shared horizon (None = nothing to plan)."""
+    slot_hours = minutes_per_slot / 60.0
+    cap = config.battery_capacity_kwh
+    eff = config.efficiency
+    soc_max = (config.battery_charge_max_pct / 100.0) * cap
+    soc_min = (config.battery_discharge_min_pct / 100.0) * cap
+    safe_kwh = config.safe_power_kw * slot_hours
+
+    if cap <= 0 or safe_kwh <= 0 or eff <= 0:
+        return None
+
+    horizon = _build_horizon(
+        config, state,
+        num_slots=num_slots,
+        current_slot=current_slot,
+        minutes_per_slot=minutes_per_slot,
+        pv_confidence=pv_confidence,
+    )
+    if not horizon:
+        return None
+
+    grid_mode = config.grid_mode
+    allow_charge = grid_mode in ("from_grid", "both")
+    allow_discharge = grid_mode in ("to_grid", "both")
+
+    cycle_cost = config.battery_cycle_cost_eur_kwh
+    if config.optimization_priority == "longevity":
+        cycle_cost = max(cycle_cost, 0.05)
+
+    # Per-slot action caps, gated exactly like the MILP variable bounds.
+    delta = config.arbitrage_price_delta if grid_mode == "both" else 0.0
+    prices_h = [h["price"] for h in horizon]
+    cheapest = min(prices_h)
+    most_exp = max(prices_h)
+    charge_cap: list[float] = []
+    discharge_cap: list[float] = []
+    for h in horizon:
+        price = h["price"]
+        c_ub = h["charge_cap"] if allow_charge else 0.0
+        if delta > 0 and price > most_exp - delta:
+            c_ub = 0.0
+        d_ub = h["discharge_cap"] if allow_discharge else 0.0
+        if config.block_export_on_negative_price and price < 0:
+            d_ub = 0.0
+        if delta > 0 and price < cheapest + delta:
+            d_ub = 0.0
+        charge_cap.append(c_ub)
+        discharge_cap.append(d_ub)
+
+    reserve_clamped = min(reserve_target, soc_max)
+    reserve_penalty = max(1.0, most_exp) * 5.0
+    avg_price = max(0.0, sum(prices_h) / len(prices_h))
+    terminal_value = avg_price * eff
+    early = (avg_price + 0.01) * 1e-4
+    midnight_k = next(
+        (k for k, h in enumerate(horizon) if h["day"] == "tomorrow"), None)
+
+    # SOC grid.  A battery already below the floor (or above the charge
+    # ceiling) must still be representable, so the grid spans current_kwh.
+    lo = min(soc_min, current_kwh)
+    hi = max(soc_max, current_kwh)
+    span = hi - lo
+    levels = min(_MAX_SOC_LEVELS, max(2, math.ceil(span / _SOC_STEP_KWH) + 1))
+    step = span / (levels - 1) if span > 0 else 0.0
+
+    return _Model(
+        horizon=horizon, charge_cap=charge_cap, discharge_cap=discharge_cap,
+        eff=eff, soc_min=soc_min, soc_max=soc_max, cycle_cost=cycle_cost,
+        reserve_clamped=reserve_clamped, reserve_penalty=reserve_penalty,
+        terminal_value=terminal_value, early=early, midnight_k=midnight_k,
+        lo=lo, step=step, levels=levels,
+        block_negative_export=config.block_export_on_negative_price,
+    )
+
+
+class _Model:
+    """Slot transition + cost model and the backward / forward passes.
+
+    ``_step`` is the single source of truth for one slot: both backward
+    passes and the forward replay evaluate the same arithmetic, the numpy
+    path just does it for every SOC level at once.
+    """
+
+    def __init__(self, *, horizon, charge_cap, discharge_cap, eff, soc_min,
+                 soc_max, cycle_cost, reserve_clamped, reserve_penalty,
+                 terminal_value, early, midnight_k, lo, step, levels,
+                 block_negative_export) -> None:
+        self.horizon = horizon
+        self.export_price = [
+            0.0 if price < 0 and block_negative_export else price
+            for price in (h["price"] for h in horizon)
+        ]
+        self.charge_cap = charge_cap
+        self.discharge_cap = discharge_cap
+        self.eff = eff
+        self.soc_min = soc_min
+        self.soc_max = soc_max
+        self.cycle_cost = cycle_cost
+        self.reserve_clamped = reserve_clamped
+        self.reserve_penalty = reserve_penalty
+        self.terminal_value = terminal_value
+        self.early = early
+        self.midnight_k = midnight_k
+        self.lo = lo
+        self.step = step
+        self.levels = levels
+
+    # -- shared arithmetic (works on floats and numpy arrays alike) --------
+
+    def _step(self, k: int, soc, action: str, xp, scale: float = 1.0):
+        """Return ``(next_soc, stage_cost, energy)`` for one slot.
+
+        ``energy`` is grid-side kWh for charge, battery-side kWh for
+        discharge.  Charging stops at the charge ceiling, discharging at the
+        floor.  PV beyond the ceiling is exported at the slot price (or
+        curtailed when export is blocked on a negative price), so the DP
+        only empties the battery ahead of a PV window when that export would
+        actually cost money.  Load that would pull the battery below the
+        floor is served from the grid (passthrough) and penalised like the
+        MILP's feasibility slack.  ``scale`` caps the action below full
+        power (variable-power plans).
+        """
+        price = self.horizon[k]["price"]
+        raw = soc + self.horizon[k]["net"]
+        cost = 0.0 * raw
+        energy = 0.0 * raw
+        if action == "charge":
+            energy = xp.minimum(self.charge_cap[k] * scale,
+                                xp.maximum(0.0, self.soc_max - raw) / self.eff)
+            raw = raw + self.eff * energy
+            cost = (price + self.early * k) * energy
+        elif action == "discharge":
+            energy = xp.minimum(self.discharge_cap[k] * scale,
+                                xp.maximum(0.0, raw - self.soc_min))
+            raw = raw - energy
+            cost = (self.cycle_cost - price * self.eff + self.early * k) * energy
+        shortfall = xp.maximum(0.0, self.soc_min - raw)
+        cost = cost + self.reserve_penalty * shortfall
+        export_price = self.export_price[k]
+        if export_price:
+            cost = cost - export_price * xp.maximum(0.0, raw - self.soc_max)
+        nxt = xp.minimum(self.soc_max, raw)
+        nxt = xp.maximum(nxt, xp.minimum(soc, self.soc_min))
+        return nxt, cost, energy
+
+    def _boundary(self, k: int, soc, xp):
+        """State cost on entering slot ``k`` (``k == K`` is the horizon end)."""
+        if k == len(self.horizon):
+            cost = self.reserve_penalty * xp.maximum(0.0, self.reserve_clamped - soc)
+            return cost - self.terminal_value * xp.minimum(soc, self.reserve_clamped)
+        if k == self.midnight_k and k > 0:
+            return self.reserve_penalty * xp.maximum(0.0, self.reserve_clamped - soc)
+        return None
+
+    def _interp(self, values: list[float], soc: float) -> float:
+        if self.step <= 0:
+            return values[0]
+        pos = (soc - self.lo) / self.step
+        if pos <= 0:
+            return values[0]
+        last = self.levels - 1
+        if pos >= last:
+            return values[last]
+        i = int(pos)
+        frac = pos - i
+        return values[i] + (values[i + 1] - values[i]) * frac
+
+    # -- backward passes ---------------------------------------------------
+
+    def backward_numpy(self) -> list:
+        np = _np
+        K = len(self.horizon)
+        grid = self.lo + self.step * np.arange(self.levels, dtype=float)
+        hi = self.lo + self.step * (self.levels - 1)
+        v_next = self._boundary(K, grid, np)
+        values = [None] * (K + 1)
+        values[K] = v_next
+        for k in range(K - 1, -1, -1):
+            best = None
+            for action in _ACTIONS:
+                if action == "charge" and self.charge_cap[k] <= 0:
+                    continue
+                if action == "discharge" and self.discharge_cap[k] <= 0:
+                    continue
+                nxt, cost, _ = self._step(k, grid, action, np)
+                if self.step > 0:
+                    total = cost + np.interp(np.clip(nxt, self.lo, hi), grid, v_next)
+                else:
+                    total = cost + v_next[0]
+                best = total if best is None else np.minimum(best, total)
+            boundary = self._boundary(k, grid, np)
+            if boundary is not None:
+                best = best + boundary
+            values[k] = best
+            v_next = best
+        return [v.tolist() for v in values]
+
+    def backward_python(self) -> list:
+        K = len(self.horizon)
+        grid = [self.lo + self.step * i for i in range(self.levels)]
+        values: list = [None] * (K + 1)
+        values[K] = [self._boundary(K, s, _ScalarOps) for s in grid]
+        for k in range(K - 1, -1, -1):
+            v_next = values[k + 1]
+            row = []
+            for s in grid:
+                best = math.inf
+                for action in _ACTIONS:
+                    if action == "charge" and self.charge_cap[k] <= 0:
+                        continue
+                    if action == "discharge" and self.discharge_cap[k] <= 0:
+                        continue
+                    nxt, cost, _ = self._step(k, s, action, _ScalarOps)
+                    best = min(best, cost + self._interp(v_next, nxt))
+                boundary = self._boundary(k, s, _ScalarOps)
+                row.append(best + boundary if boundary is not None else best)
+            values[k] = row
+        return values
+
+    def plan_cost(self, current_kwh: float, actions: list[str],
+                  scales: list[float] | None = None) -> float:
+        """Exact model cost of a fixed action sequence from ``current_kwh``."""
+        soc = current_kwh
+        total = 0.0
+        for k, action in enumerate(actions):
+            boundary = self._boundary(k, soc, _ScalarOps)
+            if boundary is not None:
+                total += boundary
+            scale = scales[k] if scales is not None else 1.0
+            soc, cost, _ = self._step(k, soc, action, _ScalarOps, scale)
+            total += cost
+        return total + self._boundary(len(self.horizon), soc, _ScalarOps)
+
+    # -- forward replay ----------------------------------------------------
+
+    def forward(self, current_kwh: float, values: list) -> list[tuple[str, float]]:
+        """Replay the optimal policy on the continuous SOC."""
+        soc = current_kwh
+        out: list[tuple[str, float]] = []
+        for k in range(len(self.horizon)):
+            v_next = values[k + 1]
+            best = None
+            for action in _ACTIONS:
+                if action == "charge" and self.charge_cap[k] <= 0:
+                    continue
+                if action == "discharge" and self.discharge_cap[k] <= 0:
+                    continue
+                nxt, cost, energy = self._step(k, soc, action, _ScalarOps)
+                total = cost + self._interp(v_next, nxt)
+                if best is None or total < best[0] - _TIE_EPS:
+                    best = (total, action, nxt, energy)
+            _, action, soc, energy = best
+            out.append((action, energy))
+        return out
+
+
+class _ScalarOps:
+    """``min`` / ``max`` with the numpy spelling, for scalar SOC values."""
+
+    minimum = staticmethod(min)
+    maximum = staticmethod(max)
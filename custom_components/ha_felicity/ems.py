@@ -1,17 +1,52 @@
-"""EMS scheduling algorithm — pure functions for energy management.
+"""EMS scheduling algorithm for energy management.
 
 This module contains the scheduling logic extracted from coordinator.py.
-All functions are pure (no HA state, no self.* access) for testability.
+It never touches HA state or the coordinator: the planning functions take
+plain EMSConfig / EMSState inputs, which keeps them testable.  A few pieces
+of state are process-wide:
+- ``_auto_pool``: the thread pool behind the "auto" engine's MILP leg.
+- ``_PHASE_STATS``: the ContextVar phase recorder of the running replan.
+- ``profile_schedule``: writes a cProfile dump to the given path.
+The solver modules keep their own caches (MILP templates and warm starts).
 """
 
 from __future__ import annotations
 
+import bisect
+import cProfile
 import logging
 import math
-from dataclasses import dataclass, field, replace
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields, replace
+
+try:
+    # Optional: vectorised SOC trajectories for batches of candidate
+    # schedules.  Home Assistant core ships numpy, but the scheduler must
+    # stay importable without it (simulator / bare test environments), so
+    # every caller goes through `_soc_walk_batch`, which falls back to a
+    # pure-Python walk with identical results.
+    import numpy as _np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    _np = None
 
 _LOGGER = logging.getLogger(__name__)
 
+# Below this many rows a Python loop beats numpy's per-slot dispatch cost.
+_VECTOR_MIN_ROWS = 16
+
+# Phase profiler: calculate_schedule installs a {phase: [seconds, calls]}
+# collector here for the duration of one replan; _phase / _record_phase
+# add to it and are no-ops outside a replan.  A ContextVar rather than a
+# parameter keeps the mode functions' signatures unchanged; threads do not
+# inherit it, so the "auto" race legs only show up as the "engine" phase.
+_PHASE_STATS: ContextVar[dict[str, list] | None] = ContextVar(
+    "ems_phase_stats", default=None)
+
 
 @dataclass
 class FlexibleLoadConfig:
@@ -124,11 +159,41 @@ class EMSConfig:
     #   always_on  — always allowed on; the EMS only throttles the charge
     #                current when grid current gets too high
     ev_charge_strategy: str = "smart"
-    # Scheduler engine: "greedy" (default, the heuristic in this module) or
-    # "milp" (the solver in milp.py).  When "milp", calculate_schedule tries
-    # the MILP first and silently falls back to greedy on any failure
-    # (pulp missing, infeasible, timeout).
+    # Scheduler engine: "greedy" (default, the heuristic in this module),
+    # "milp" (the solver in milp.py), "dp" (the exact SOC dynamic program
+    # in dp.py) or "auto" (greedy and MILP raced, cheaper plan kept).  For
+    # "milp" / "dp", calculate_schedule tries that engine first and silently
+    # falls back to greedy on any failure (pulp missing, infeasible, timeout).
     scheduler_engine: str = "greedy"
+    # Wall-clock budget (s) of the "auto" race; MILP is dropped if it has
+    # not finished by then.
+    auto_engine_budget_s: float = 5.0
+    # Probabilistic scenario check (from_grid / both): >0 samples that many
+    # PV + consumption trajectories around the forecast and re-picks today's
+    # charge set by expected cost, subject to the chance of missing the
+    # planned reserve staying <= pv_scenario_shortfall_pct.  0 disables.
+    # Needs numpy; without it the engine's plan is kept unchanged.
+    pv_scenario_samples: int = 0
+    pv_scenario_shortfall_pct: float = 10.0
+    # Extended horizon: before tomorrow's prices are published, plan across
+    # tomorrow anyway using the coordinator's estimate (state.
+    # slot_prices_tomorrow_estimate) so today's plan does not drain or fill
+    # the battery blindly at midnight.  The estimated part of the plan is
+    # flagged provisional (ScheduleResult.tomorrow_provisional).
+    extended_horizon: bool = False
+    # Variable per-slot power (solver engines): keep the per-slot energy the
+    # engine optimised instead of rounding every active slot up to a full
+    # safe_power_kw slot.  Partial slots are listed in
+    # ScheduleResult.slot_power_kw, the SOC validation and trajectories model
+    # them, and the coordinator writes the level to the rule-1 power
+    # register.  power_step_kw is that register's resolution; levels are
+    # rounded to it.  Greedy plans stay full-power.
+    variable_power: bool = False
+    power_step_kw: float = 0.1
+    # Who the plan is for (the coordinator passes its config entry id).
+    # Keys per-inverter solver caches such as the MILP warm start, so two
+    # inverters with the same mode and capacity do not share a basis.
+    plan_id: str = ""
     # NOTE: battery State of Health (SOH) is applied by the coordinator
     # before constructing this config — it scales battery_capacity_kwh
     # by the SOH factor.  ems.py treats the capacity as already-effective.
@@ -167,6 +232,18 @@ class EMSState:
     # Coordinator sets this from the 7-day rolling average of actual daily
     # PV.  Used only when pv_forecast_today is None or 0.
     pv_fallback_today_kwh: float | None = None
+    # Forecast error model for the scenario check, learned by the
+    # coordinator from history.  pv_error_hourly: {hour: (mean, std)} of
+    # the actual / forecast PV ratio.  consumption_error_hourly: {hour:
+    # relative std} of consumption around the hourly profile.  Missing
+    # hours use _MC_PV_SIGMA / _MC_LOAD_SIGMA around the forecast.
+    pv_error_hourly: dict[int, tuple[float, float]] | None = None
+    consumption_error_hourly: dict[int, float] | None = None
+    # Extended-horizon estimates for tomorrow, used only while
+    # slot_prices_tomorrow is unknown: a price curve from stored history
+    # (estimate_day_prices) and a PV total from stored daily actuals.
+    slot_prices_tomorrow_estimate: list[float] | None = None
+    pv_tomorrow_estimate_kwh: float | None = None
     current_hour: int = 12
     current_minute: int = 0
 
@@ -184,15 +261,53 @@ class ScheduleResult:
     tomorrow_planned_slots: int = 0
     tomorrow_planned_kwh: float = 0.0
     tomorrow_precharge: float = 0.0
+    # True when tomorrow's plan was made on estimated prices (extended
+    # horizon): it shapes today's plan but is replaced once real prices land.
+    tomorrow_provisional: bool = False
     status: str = "off"
     schedule_reason: str = ""
-    scheduler_active: str = "greedy"  # "greedy" | "milp" | "greedy_fallback"
+    scheduler_active: str = "greedy"  # "greedy" | "milp" | "dp" | "greedy_fallback"
+    # Solver diagnostics for milp/dp: backend, solve_ms, iterations, warm_start
+    # (MILP also build_ms / extract_ms)
+    solver_stats: dict[str, object] = field(default_factory=dict)
     soc_trajectory: list[float] = field(default_factory=list)
     tomorrow_scheduled_slots: dict[int, str] = field(default_factory=dict)
     tomorrow_soc_trajectory: list[float] = field(default_factory=list)
+    # Variable power: {slot: kW} for the scheduled slots planned below
+    # safe_power_kw (a slot missing here runs at full safe power).
+    slot_power_kw: dict[int, float] = field(default_factory=dict)
+    tomorrow_slot_power_kw: dict[int, float] = field(default_factory=dict)
     # Flexible load schedules: {load_index: {slot_idx: True}}
     load_slots: dict[int, dict[int, bool]] = field(default_factory=dict)
     tomorrow_load_slots: dict[int, dict[int, bool]] = field(default_factory=dict)
+    # Phase profiler: wall-clock ms and entry count per phase of the replan
+    # that built this result.  Dotted phases ("greedy.validation",
+    # "milp.solve") run inside "engine"; "total" is the whole call.
+    phase_ms: dict[str, float] = field(default_factory=dict)
+    phase_calls: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class ScheduleBatch:
+    """Output of calculate_schedule_batch, stored column-wise.
+
+    ``columns`` maps every ScheduleResult field name to a list with one
+    entry per scenario, in input order, so a sweep can be compared field by
+    field (``batch["grid_energy_planned"]``) without walking result objects.
+    """
+
+    columns: dict[str, list] = field(default_factory=dict)
+    solved: int = 0  # distinct scenarios solved; duplicates share one solve
+
+    def __len__(self) -> int:
+        return len(self.columns.get("status", []))
+
+    def __getitem__(self, name: str) -> list:
+        return self.columns[name]
+
+    def result(self, index: int) -> ScheduleResult:
+        """Row ``index`` as a ScheduleResult (shares the column objects)."""
+        return ScheduleResult(**{name: col[index] for name, col in self.columns.items()})
 
 
 @dataclass
@@ -205,6 +320,42 @@ class AvailableInfo:
     charge_likelihood: str = "no_data"
 
 
+def estimate_day_prices(
+    history: list[dict],
+    weekday: int,
+    num_slots: int,
+    min_days: int = 2,
+) -> list[float] | None:
+    """Per-slot median price curve for a day whose prices are not known yet.
+
+    ``history`` holds past days as ``{"weekday": 0-6 (Mon=0), "prices":
+    [...]}``.  Days with the same weekday are used when there are at least
+    ``min_days`` of them (weekend and weekday curves differ), otherwise all
+    days.  Days recorded at another granularity are resampled by time
+    (averaged when finer, repeated when coarser).  Returns None without
+    enough history or when a slot has no price on any day.
+    """
+    same = [day for day in history if day.get("weekday") == weekday]
+    days = same if len(same) >= min_days else history
+    if len(days) < min_days or num_slots <= 0:
+        return None
+    columns: list[list[float]] = [[] for _ in range(num_slots)]
+    for day in days:
+        prices = day.get("prices") or []
+        n = len(prices)
+        if not n:
+            continue
+        for k in range(num_slots):
+            first = (k * n) // num_slots
+            last = max(first + 1, ((k + 1) * n) // num_slots)
+            values = [p for p in prices[first:last] if p is not None]
+            if values:
+                columns[k].append(sum(values) / len(values))
+    if any(not column for column in columns):
+        return None
+    return [round(statistics.median(column), 5) for column in columns]
+
+
 def _synthesize_pv_hourly(
     pv_forecast_today: float,
     sunrise: int = 6,
@@ -625,6 +776,138 @@ def _calculate_pv_confidence(
     return max(0.1, min(1.0, smoothed))
 
 
+def _soc_walk_batch(
+    start_kwh: float,
+    net: list[float],
+    charge_gain: list[float],
+    charge: list[list[bool]] | None,
+    discharge: list[list[bool]] | None,
+    discharge_kwh: float,
+    lower: float,
+    upper: float,
+    discharge_floor: float | None = None,
+    backend: str = "auto",
+) -> tuple[list[list[float]], list[float]]:
+    """Clamped SOC walk for one or many candidate schedules at once.
+
+    Every row b shares the per-slot energy arrays (``net`` = PV − consumption,
+    ``charge_gain`` = SOC a charge action adds) and differs only in its action
+    masks ``charge[b]`` / ``discharge[b]`` (None = no such actions; with both
+    None a single idle row is walked).  A mask entry is a bool or, for
+    variable-power plans, the share of the full action run in that slot
+    (0.0–1.0; ``True`` == 1.0).  Per slot:
+
+        delta = net[k] (+ share · charge_gain[k]) (− discharge energy)
+        soc   = clamp(soc + delta, lower, upper)
+
+    A discharge removes ``share · discharge_kwh``, or with
+    ``discharge_floor`` set only what lies above the floor (and nothing once
+    at/below it) — the executor model used by the SOC trajectories.
+
+    Returns ``(entering, raw_min)``: ``entering[b][k]`` is the SOC entering
+    slot k (``entering[b][n]`` the SOC after the last slot) and ``raw_min[b]``
+    the lowest *unclamped* SOC seen, starting from ``start_kwh``.
+
+    With numpy available and at least `_VECTOR_MIN_ROWS` rows, the walk runs
+    over all rows at once (a batch × slots matrix, numpy arrays returned);
+    otherwise row by row in Python (lists).  Both perform the same IEEE
+    operations in the same order, so results are identical.
+    """
+    num = len(net)
+    rows = len(charge) if charge is not None else (
+        len(discharge) if discharge is not None else 1)
+    use_numpy = backend == "numpy" or (
+        backend == "auto" and _np is not None and rows >= _VECTOR_MIN_ROWS)
+
+    if use_numpy:
+        # Slot-major (slots × rows) so each step reads contiguous memory.
+        net_col = _np.asarray(net, dtype=float).reshape(num, 1)
+        added = None
+        if charge is not None:
+            added = (_np.asarray(charge, dtype=float).reshape(rows, num).T
+                     * _np.asarray(charge_gain, dtype=float).reshape(num, 1))
+        discharge_mask = None
+        taken = None
+        if discharge is not None:
+            discharge_mask = _np.asarray(discharge, dtype=float).reshape(rows, num).T
+            taken = discharge_mask * discharge_kwh
+        base = _np.broadcast_to(net_col, (num, rows))
+        delta_all = base + added if added is not None else base
+        if taken is not None and discharge_floor is None:
+            delta_all = delta_all - taken
+        soc = _np.full(rows, float(start_kwh))
+        raw_min = soc.copy()
+        entering = _np.empty((num + 1, rows))
+        raw = _np.empty(rows)
+        for k in range(num):
+            entering[k] = soc
+            if discharge_floor is not None and discharge_mask is not None:
+                # Floor-limited discharge depends on the SOC reached so far.
+                limited = _np.where(
+                    (discharge_mask[k] > 0) & (soc > discharge_floor),
+                    _np.minimum(taken[k], soc - discharge_floor), 0.0)
+                _np.add(soc, delta_all[k] - limited, out=raw)
+            else:
+                _np.add(soc, delta_all[k], out=raw)
+            _np.minimum(raw_min, raw, out=raw_min)
+            soc = _np.maximum(lower, _np.minimum(upper, raw))
+        entering[num] = soc
+        return entering.T, raw_min
+
+    entering_rows: list[list[float]] = []
+    raw_mins: list[float] = []
+    for b in range(rows):
+        charge_row = charge[b] if charge is not None else None
+        discharge_row = discharge[b] if discharge is not None else None
+        soc = start_kwh
+        low = soc
+        path: list[float] = []
+        for k in range(num):
+            path.append(soc)
+            delta = net[k]
+            if charge_row is not None and charge_row[k]:
+                delta += charge_gain[k] * charge_row[k]
+            if discharge_row is not None and discharge_row[k]:
+                taken = discharge_kwh * discharge_row[k]
+                if discharge_floor is None:
+                    delta -= taken
+                elif soc > discharge_floor:
+                    delta -= min(taken, soc - discharge_floor)
+            raw = soc + delta
+            low = min(low, raw)
+            soc = max(lower, min(upper, raw))
+        path.append(soc)
+        entering_rows.append(path)
+        raw_mins.append(low)
+    return entering_rows, raw_mins
+
+
+def _action_mask(
+    schedule: dict[int, str],
+    slot_power_kw: dict[int, float] | None,
+    slots,
+    action: str,
+    full_kw: list[float] | float,
+) -> list:
+    """`_soc_walk_batch` mask for ``action`` over ``slots``.
+
+    Plain bools for full-power plans.  With ``slot_power_kw`` each scheduled
+    slot gets its planned share of the full action power ``full_kw`` (per
+    slot, or one value for all slots).
+    """
+    if not slot_power_kw:
+        return [schedule.get(i) == action for i in slots]
+    mask: list[float] = []
+    for k, i in enumerate(slots):
+        if schedule.get(i) != action:
+            mask.append(0.0)
+            continue
+        full = full_kw[k] if isinstance(full_kw, list) else full_kw
+        kw = slot_power_kw.get(i)
+        mask.append(1.0 if kw is None or full <= 0 else min(1.0, kw / full))
+    return mask
+
+
 def _project_soc_trajectory(
     remaining: list[tuple[int, float]],
     current_kwh: float,
@@ -644,11 +927,7 @@ def _project_soc_trajectory(
     Returns:
         (per_slot_projection, min_kwh, max_kwh)
     """
-    projection: dict[int, float] = {}
-    projected = current_kwh
-    min_soc = current_kwh
-    max_soc = current_kwh
-
+    net: list[float] = []
     for slot_idx, _ in remaining:
         hour = int((slot_idx * minutes_per_slot) / 60)
         pv_kwh = (pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
@@ -658,31 +937,34 @@ def _project_soc_trajectory(
             cons_per_slot = consumption_hourly_kwh[hour] * (minutes_per_slot / 60.0)
         else:
             cons_per_slot = consumption_per_slot
+        net.append(pv_per_slot - cons_per_slot)
 
-        projected = max(0.0, min(battery_capacity, projected + pv_per_slot - cons_per_slot))
-        projection[slot_idx] = projected
-        min_soc = min(min_soc, projected)
-        max_soc = max(max_soc, projected)
-
-    return projection, min_soc, max_soc
+    entering, _ = _soc_walk_batch(
+        current_kwh, net, [], None, None, 0.0, 0.0, battery_capacity,
+    )
+    path = [float(v) for v in entering[0]]
+    projection = {slot_idx: path[k + 1] for k, (slot_idx, _) in enumerate(remaining)}
+    return projection, min(path), max(path)
 
 
-def _compute_scheduled_soc_trajectory(
+def _compute_scheduled_soc_trajectories(
     prices: list[float | None],
     num_slots: int,
     minutes_per_slot: float,
     current_kwh: float,
     current_slot: int,
-    scheduled_slots: dict[int, str],
+    schedules: list[dict[int, str]],
     config: EMSConfig,
     state: EMSState,
-) -> list[float]:
-    """Compute SOC% trajectory for all slots using the finalized schedule.
-
-    Returns a list of SOC% values (one per slot, from slot 0 to num_slots-1).
-    Past slots use current_kwh as placeholder (frontend uses soc_history
-    for past slots instead). Future slots simulate forward with PV,
-    consumption, and scheduled actions.
+    slot_powers: list[dict[int, float] | None] | None = None,
+) -> list[list[float]]:
+    """SOC% trajectories for several candidate schedules of the same day.
+
+    The per-slot PV/consumption arrays are built once and every schedule is
+    walked in one `_soc_walk_batch` call (a schedules × slots matrix when
+    numpy is available).  ``slot_powers[b]`` is schedule b's variable-power
+    map (see ScheduleResult.slot_power_kw).  See
+    `_compute_scheduled_soc_trajectory`.
     """
     pv_confidence = _calculate_pv_confidence(
         state.pv_hourly_kwh, state.pv_actual_today_kwh,
@@ -694,20 +976,11 @@ def _compute_scheduled_soc_trajectory(
     cap = config.battery_capacity_kwh
     current_pct = max(0.0, min(100.0, (current_kwh / cap) * 100.0)) if cap > 0 else 0.0
 
-    trajectory: list[float] = []
-    soc = current_kwh
-
-    for i in range(num_slots):
-        if i < current_slot:
-            trajectory.append(round(current_pct, 1))
-            continue
-
-        if i == current_slot:
-            soc = current_kwh
-
-        pct = max(0.0, min(100.0, (soc / cap) * 100.0)) if cap > 0 else 0.0
-        trajectory.append(round(pct, 1))
-
+    first = max(0, current_slot)
+    net: list[float] = []
+    gain: list[float] = []
+    grid_kws: list[float] = []
+    for i in range(first, num_slots):
         hour = int((i * minutes_per_slot) / 60)
         pv_kwh = (state.pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
         pv_per_slot = pv_kwh * (minutes_per_slot / 60.0)
@@ -717,19 +990,59 @@ def _compute_scheduled_soc_trajectory(
         else:
             cons = (config.consumption_est_kwh / num_slots)
 
-        delta = pv_per_slot - cons
-        action = scheduled_slots.get(i)
-        if action == "charge":
-            # pv_kwh is already confidence-scaled (see above).
-            grid_kw = min(config.safe_power_kw,
-                          max(0.0, config.inverter_max_power_kw - pv_kwh))
-            delta += grid_kw * (minutes_per_slot / 60.0) * config.efficiency
-        elif action == "discharge" and soc > min_kwh:
-            delta -= min(energy_per_slot, soc - min_kwh)
+        net.append(pv_per_slot - cons)
+        # pv_kwh is already confidence-scaled (see above).
+        grid_kw = min(config.safe_power_kw,
+                      max(0.0, config.inverter_max_power_kw - pv_kwh))
+        grid_kws.append(grid_kw)
+        gain.append(grid_kw * (minutes_per_slot / 60.0) * config.efficiency)
+
+    slots = range(first, num_slots)
+    powers = slot_powers or [None] * len(schedules)
+    entering, _ = _soc_walk_batch(
+        current_kwh, net, gain,
+        [_action_mask(sched, power, slots, "charge", grid_kws)
+         for sched, power in zip(schedules, powers)],
+        [_action_mask(sched, power, slots, "discharge", config.safe_power_kw)
+         for sched, power in zip(schedules, powers)],
+        energy_per_slot, min_kwh, cap, discharge_floor=min_kwh,
+    )
 
-        soc = max(min_kwh, min(cap, soc + delta))
+    past = [round(current_pct, 1)] * min(first, num_slots)
+    trajectories: list[list[float]] = []
+    for row in entering:
+        trajectory = list(past)
+        for soc in row[:-1]:
+            soc = float(soc)
+            pct = max(0.0, min(100.0, (soc / cap) * 100.0)) if cap > 0 else 0.0
+            trajectory.append(round(pct, 1))
+        trajectories.append(trajectory)
+    return trajectories
 
-    return trajectory
+
+def _compute_scheduled_soc_trajectory(
+    prices: list[float | None],
+    num_slots: int,
+    minutes_per_slot: float,
+    current_kwh: float,
+    current_slot: int,
+    scheduled_slots: dict[int, str],
+    config: EMSConfig,
+    state: EMSState,
+    slot_power_kw: dict[int, float] | None = None,
+) -> list[float]:
+    """Compute SOC% trajectory for all slots using the finalized schedule.
+
+    Returns a list of SOC% values (one per slot, from slot 0 to num_slots-1).
+    Past slots use current_kwh as placeholder (frontend uses soc_history
+    for past slots instead). Future slots simulate forward with PV,
+    consumption, and scheduled actions (at their planned power when
+    ``slot_power_kw`` lists them).
+    """
+    return _compute_scheduled_soc_trajectories(
+        prices, num_slots, minutes_per_slot, current_kwh, current_slot,
+        [scheduled_slots], config, state, [slot_power_kw],
+    )[0]
 
 
 def _validate_schedule_soc(
@@ -750,6 +1063,7 @@ def _validate_schedule_soc(
     consumption_hourly_kwh: dict[int, float] | None = None,
     keep_all_negative_charges: bool = False,
     keep_partial_charges: bool = False,
+    slot_power_kw: dict[int, float] | None = None,
 ) -> tuple[set[int], set[int]]:
     """Validate schedule by simulating SOC at every slot, pruning violations.
 
@@ -765,6 +1079,10 @@ def _validate_schedule_soc(
     strategy: user has opted to charge during all negative slots, accepting
     that some PV may be curtailed.
 
+    ``slot_power_kw`` (variable-power plans) lists slots that run below
+    safe power; their charge gain and discharge energy are scaled to the
+    planned kW.
+
     Returns pruned (charge_slots, discharge_slots).
     """
     charge_slots = set(charge_slots)
@@ -773,19 +1091,56 @@ def _validate_schedule_soc(
     # Build price lookup from remaining
     price_of: dict[int, float] = {idx: price for idx, price in remaining}
 
-    # Check if PV alone would fill the battery (net surplus > available space).
-    # When true, overflow is PV-caused — pruning negative-price charge slots
-    # won't prevent it, and the negative-price income is pure profit.
-    pv_surplus_total = 0.0
+    # Per-slot constants, computed once.  The pruning loop below re-walks
+    # the horizon after every drop; recomputing PV/consumption per walk made
+    # each call O(n²) on 96/192-slot days.  `net_of[k]` is the PV surplus
+    # (pv - consumption) of remaining[k], `gain_of[k]` the SOC a charge
+    # action at that slot adds.  Both use the exact expressions of the
+    # original per-walk code so the walk stays bit-identical.
+    slot_hours = minutes_per_slot / 60.0
+    pv_by_hour = pv_hourly_kwh or {}
+    slot_power = slot_power_kw or {}
+    full_kw = safe_power_kw or energy_per_slot / slot_hours
+    slot_ids: list[int] = []
+    net_of: list[float] = []
+    gain_of: list[float] = []
+    take_of: list[float] = []
     for slot_idx, _ in remaining:
         hour = int((slot_idx * minutes_per_slot) / 60)
-        pv_kwh = (pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
-        pv_per_slot = pv_kwh * (minutes_per_slot / 60.0)
+        pv_kwh = pv_by_hour.get(hour, 0.0) * pv_confidence
+        pv_per_slot = pv_kwh * slot_hours
         if consumption_hourly_kwh and hour in consumption_hourly_kwh:
-            cons = consumption_hourly_kwh[hour] * (minutes_per_slot / 60.0)
+            cons = consumption_hourly_kwh[hour] * slot_hours
         else:
             cons = consumption_per_slot
-        surplus = pv_per_slot - cons
+        planned_kw = slot_power.get(slot_idx)
+        gain = 0.0
+        if slot_idx in charge_slots:
+            # Only charge slots ever read their gain (the set only shrinks).
+            if inverter_max_power_kw > 0:
+                # pv_kwh is already confidence-scaled (see above).
+                grid_kw = min(safe_power_kw or energy_per_slot / slot_hours,
+                              max(0.0, inverter_max_power_kw - pv_kwh))
+                if planned_kw is not None:
+                    grid_kw = min(grid_kw, planned_kw)
+                gain = grid_kw * slot_hours * efficiency
+            elif planned_kw is not None:
+                gain = min(full_kw, planned_kw) * slot_hours * efficiency
+            else:
+                gain = energy_per_slot * efficiency
+        take = energy_per_slot
+        if planned_kw is not None and slot_idx in discharge_slots:
+            take = min(full_kw, planned_kw) * slot_hours
+        slot_ids.append(slot_idx)
+        net_of.append(pv_per_slot - cons)
+        gain_of.append(gain)
+        take_of.append(take)
+
+    # Check if PV alone would fill the battery (net surplus > available space).
+    # When true, overflow is PV-caused — pruning negative-price charge slots
+    # won't prevent it, and the negative-price income is pure profit.
+    pv_surplus_total = 0.0
+    for surplus in net_of:
         if surplus > 0:
             pv_surplus_total += surplus
     # pv_surplus_total is logged when a negative-price slot is kept due
@@ -802,41 +1157,42 @@ def _validate_schedule_soc(
         and pv_surplus_total >= (battery_capacity - current_kwh) * 0.9
     )
 
+    # Prefix state of the last walk: SOC and discharge-seen flag *entering*
+    # each position of `remaining`.  Dropping a slot cannot change anything
+    # before it, so each re-walk resumes from the earliest affected position
+    # (the dropped slot, or the violation itself when the drop lies later)
+    # instead of restarting from current_kwh.
+    num_remaining = len(slot_ids)
+    position_of = {slot_idx: k for k, slot_idx in enumerate(slot_ids)}
+    soc_entering: list[float] = [current_kwh] * (num_remaining + 1)
+    seen_entering: list[bool] = [False] * (num_remaining + 1)
+    resume_at = 0
+
     max_iterations = len(charge_slots) + len(discharge_slots) + 1
 
     for _ in range(max_iterations):
         violation_slot: int | None = None
+        violation_pos = num_remaining
         violation_type: str | None = None  # "low" or "high"
         # Whether the charge action at the violation slot is wasted: when
         # the battery is already at capacity entering a charge slot, the
         # inverter can't physically store any of the grid energy.  Such
         # phantom slots must be dropped regardless of price.
         violation_charge_wasted = False
-        discharge_seen = False
-
-        soc = current_kwh
-        for slot_idx, _ in remaining:
-            hour = int((slot_idx * minutes_per_slot) / 60)
-            pv_kwh = (pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
-            pv_per_slot = pv_kwh * (minutes_per_slot / 60.0)
-
-            if consumption_hourly_kwh and hour in consumption_hourly_kwh:
-                cons = consumption_hourly_kwh[hour] * (minutes_per_slot / 60.0)
-            else:
-                cons = consumption_per_slot
-            delta = pv_per_slot - cons
+        discharge_seen = seen_entering[resume_at]
+
+        soc = soc_entering[resume_at]
+        for k in range(resume_at, num_remaining):
+            soc_entering[k] = soc
+            seen_entering[k] = discharge_seen
+            slot_idx = slot_ids[k]
+            delta = net_of[k]
             charge_contribution = 0.0
             if slot_idx in charge_slots:
-                if inverter_max_power_kw > 0:
-                    # pv_kwh is already confidence-scaled (see above).
-                    grid_kw = min(safe_power_kw or energy_per_slot / (minutes_per_slot / 60.0),
-                                  max(0.0, inverter_max_power_kw - pv_kwh))
-                    charge_contribution = grid_kw * (minutes_per_slot / 60.0) * efficiency
-                else:
-                    charge_contribution = energy_per_slot * efficiency
+                charge_contribution = gain_of[k]
                 delta += charge_contribution
             if slot_idx in discharge_slots:
-                delta -= energy_per_slot
+                delta -= take_of[k]
                 discharge_seen = True
 
             soc_before = soc
@@ -848,6 +1204,7 @@ def _validate_schedule_soc(
                     soc = max(0.0, min(battery_capacity, soc_ideal))
                     continue
                 violation_slot = slot_idx
+                violation_pos = k
                 violation_type = "low"
                 break
             if soc_ideal > battery_capacity + 0.01:
@@ -902,6 +1259,7 @@ def _validate_schedule_soc(
                             and soc_before >= battery_capacity - 0.01):
                         violation_charge_wasted = True
                         violation_slot = slot_idx
+                        violation_pos = k
                         violation_type = "high"
                         break
                     # PV-only spill: clamp and continue simulating.
@@ -912,6 +1270,7 @@ def _validate_schedule_soc(
                         and soc_before >= battery_capacity - 0.01):
                     violation_charge_wasted = True
                 violation_slot = slot_idx
+                violation_pos = k
                 violation_type = "high"
                 break
 
@@ -995,6 +1354,8 @@ def _validate_schedule_soc(
                 drop, price_of.get(drop, 0.0), violation_slot,
             )
 
+        resume_at = min(position_of.get(drop, num_remaining), violation_pos)
+
     return charge_slots, discharge_slots
 
 
@@ -1026,6 +1387,256 @@ def _slot_grid_charge_kwh(
     return energy_per_slot * efficiency
 
 
+class _ChargeFeasibility:
+    """Charge-only SOC feasibility oracle for `_fill_charge_to_deficit`.
+
+    Answers "can charge slot i join the kept set without the strict
+    `_validate_schedule_soc` pass (no discharges, no keep flags) dropping
+    anything, and how much does it store?" without re-walking the horizon.
+
+    Adding a charge at slot i lifts every later SOC by some shift ``d`` until
+    a clamp absorbs it.  Only two kinds of slot can change anything: those
+    where the lifted SOC would reach capacity (headroom below ``d``) and those
+    where the current walk is clamped at zero.  A min-segment-tree over
+    headroom (with lazy range-add) finds the next such slot in O(log n), a
+    Fenwick tree holds the SOC offsets, and a sorted list the zero clamps.
+    A capacity clamp ends the shift, so `query` and `add` touch O(log n)
+    per clamp instead of the whole day.
+
+    `query` returns None when a lifted SOC lands within float noise of a
+    decision threshold — the caller then asks the exact validator, so the
+    refill result never differs from per-candidate re-validation.
+    """
+
+    _EPS = 1e-9
+
+    def __init__(
+        self,
+        remaining: list[tuple[int, float]],
+        current_kwh: float,
+        consumption_per_slot: float,
+        pv_hourly_kwh: dict[int, float] | None,
+        minutes_per_slot: float,
+        pv_confidence: float,
+        battery_capacity: float,
+        min_kwh: float,
+        energy_per_slot: float,
+        efficiency: float,
+        inverter_max_power_kw: float,
+        safe_power_kw: float,
+        consumption_hourly_kwh: dict[int, float] | None,
+    ) -> None:
+        self.cap = battery_capacity
+        self.min_kwh = min_kwh
+        self.current_kwh = current_kwh
+        self.position_of: dict[int, int] = {}
+        self.price: list[float] = []
+        self.net: list[float] = []
+        self.gain: list[float] = []
+        # Same expressions as `_validate_schedule_soc` / `_slot_grid_charge_kwh`.
+        for k, (slot_idx, price) in enumerate(remaining):
+            hour = int((slot_idx * minutes_per_slot) / 60)
+            pv_kwh = (pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
+            pv_per_slot = pv_kwh * (minutes_per_slot / 60.0)
+            if consumption_hourly_kwh and hour in consumption_hourly_kwh:
+                cons = consumption_hourly_kwh[hour] * (minutes_per_slot / 60.0)
+            else:
+                cons = consumption_per_slot
+            self.position_of[slot_idx] = k
+            self.price.append(price if price is not None else 0.0)
+            self.net.append(pv_per_slot - cons)
+            self.gain.append(_slot_grid_charge_kwh(
+                slot_idx, pv_hourly_kwh, minutes_per_slot, pv_confidence,
+                energy_per_slot, efficiency, inverter_max_power_kw,
+                safe_power_kw,
+            ))
+        self.size = 1
+        while self.size < max(1, len(self.net)):
+            self.size *= 2
+        self.valid = False
+
+    # ── construction ────────────────────────────────────────────────────
+
+    def rebuild(self, charge_slots: set[int]) -> bool:
+        """Walk ``charge_slots`` exactly; False when the set itself is not
+        strictly valid (e.g. a partial charge kept by the selector's
+        validation), in which case every query must go to the validator."""
+        cap = self.cap
+        n = len(self.net)
+        self.member = [False] * n
+        for slot_idx in charge_slots:
+            k = self.position_of.get(slot_idx)
+            if k is not None:
+                self.member[k] = True
+        self.min_member_gain = math.inf
+        self.any_non_negative = False
+        self.base_soc = [0.0] * (n + 1)
+        ideal = [0.0] * n
+        soc = self.current_kwh
+        for k in range(n):
+            self.base_soc[k] = soc
+            cc = self.gain[k] if self.member[k] else 0.0
+            if self.member[k]:
+                self.min_member_gain = min(self.min_member_gain, cc)
+                self.any_non_negative = (self.any_non_negative
+                                         or self.price[k] >= 0)
+            delta = self.net[k]
+            if cc:
+                delta += cc
+            soc_ideal = soc + delta
+            if soc_ideal > cap + 0.01 and not soc_ideal < self.min_kwh - 0.01:
+                soc_no_charge = soc + (delta - cc)
+                if (not soc_no_charge > cap + 0.01
+                        or (cc > 0 and soc >= cap - 0.01)):
+                    self.valid = False
+                    return False
+            ideal[k] = soc_ideal
+            soc = max(0.0, min(cap, soc_ideal))
+        self.base_soc[n] = soc
+        self.offsets = [0.0] * (n + 2)
+        self.zero_clamps = [k for k in range(n) if ideal[k] < 0.0]
+        self.headroom = [math.inf] * (2 * self.size)
+        self.pending = [0.0] * (2 * self.size)
+        for k in range(n):
+            self.headroom[self.size + k] = cap - ideal[k]
+        for node in range(self.size - 1, 0, -1):
+            self.headroom[node] = min(self.headroom[2 * node],
+                                      self.headroom[2 * node + 1])
+        self.valid = True
+        return True
+
+    # ── storage primitives ──────────────────────────────────────────────
+
+    def _soc(self, k: int) -> float:
+        """SOC entering position k (base walk + accumulated shifts)."""
+        total = 0.0
+        i = k + 1
+        while i > 0:
+            total += self.offsets[i]
+            i -= i & -i
+        return self.base_soc[k] + total
+
+    def _offset_add(self, k: int, value: float) -> None:
+        i = k + 1
+        while i < len(self.offsets):
+            self.offsets[i] += value
+            i += i & -i
+
+    def _headroom_add(self, node: int, lo: int, hi: int,
+                      a: int, b: int, value: float) -> None:
+        if b <= lo or hi <= a:
+            return
+        if a <= lo and hi <= b:
+            self.headroom[node] += value
+            self.pending[node] += value
+            return
+        mid = (lo + hi) // 2
+        self._headroom_add(2 * node, lo, mid, a, b, value)
+        self._headroom_add(2 * node + 1, mid, hi, a, b, value)
+        self.headroom[node] = (min(self.headroom[2 * node],
+                                   self.headroom[2 * node + 1])
+                               + self.pending[node])
+
+    def _shift(self, a: int, b: int, value: float) -> None:
+        """Lift SOC entering positions [a, b) by ``value``."""
+        self._offset_add(a, value)
+        self._offset_add(b, -value)
+        self._headroom_add(1, 0, self.size, a, min(b, len(self.net)), -value)
+
+    def _first_below(self, start: int, limit: float) -> int:
+        """First position >= start whose headroom is below ``limit``."""
+        tree, pending, size = self.headroom, self.pending, self.size
+
+        def descend(node: int, lo: int, hi: int, lifted: float) -> int:
+            if hi <= start or tree[node] + lifted >= limit:
+                return -1
+            if node >= size:
+                return lo
+            mid = (lo + hi) // 2
+            lifted += pending[node]
+            found = descend(2 * node, lo, mid, lifted)
+            return found if found >= 0 else descend(2 * node + 1, mid, hi, lifted)
+
+        found = descend(1, 0, size, 0.0)
+        return found if 0 <= found < len(self.net) else len(self.net)
+
+    def _next_event(self, start: int, shift: float) -> int:
+        zi = bisect.bisect_left(self.zero_clamps, start)
+        next_zero = self.zero_clamps[zi] if zi < len(self.zero_clamps) else len(self.net)
+        return min(self._first_below(start, shift), next_zero)
+
+    # ── decisions ───────────────────────────────────────────────────────
+
+    def _violates(self, soc: float, k: int, cc: float) -> bool | None:
+        """Overflow verdict of the strict validation at slot k (None = tie)."""
+        if cc <= 0:
+            return False
+        cap, eps = self.cap, self._EPS
+        soc_ideal = soc + self.net[k] + cc
+        if abs(soc_ideal - (cap + 0.01)) < eps:
+            return None
+        if soc_ideal <= cap + 0.01:
+            return False
+        soc_no_charge = soc + self.net[k]
+        if (abs(soc_no_charge - (cap + 0.01)) < eps
+                or abs(soc - (cap - 0.01)) < eps):
+            return None
+        return soc_no_charge <= cap + 0.01 or soc >= cap - 0.01
+
+    def query(self, slot_idx: int) -> bool | None:
+        """True/False when adding ``slot_idx`` is certainly valid/invalid,
+        None when too close to a threshold to decide without the validator."""
+        cap = self.cap
+        n = len(self.net)
+        p = self.position_of[slot_idx]
+        soc = self._soc(p)
+        verdict = self._violates(soc, p, self.gain[p])
+        if verdict is not False:
+            return None if verdict is None else False
+        shift = max(0.0, min(cap, soc + self.net[p] + self.gain[p])) - self._soc(p + 1)
+        k = p + 1
+        while shift > 0.0 and k < n:
+            k = self._next_event(k, shift)
+            if k >= n:
+                break
+            soc = self._soc(k) + shift
+            cc = self.gain[k] if self.member[k] else 0.0
+            verdict = self._violates(soc, k, cc)
+            if verdict is not False:
+                return None if verdict is None else False
+            shift = max(0.0, min(cap, soc + self.net[k] + cc)) - self._soc(k + 1)
+            k += 1
+        return True
+
+    def add(self, slot_idx: int) -> None:
+        """Commit a slot `query` accepted, updating the stored walk."""
+        cap = self.cap
+        n = len(self.net)
+        p = self.position_of[slot_idx]
+        gain = self.gain[p]
+        self.member[p] = True
+        self.min_member_gain = min(self.min_member_gain, gain)
+        self.any_non_negative = self.any_non_negative or self.price[p] >= 0
+        soc = self._soc(p)
+        self._headroom_add(1, 0, self.size, p, p + 1, -gain)
+        shift = max(0.0, min(cap, soc + self.net[p] + gain)) - self._soc(p + 1)
+        k = p + 1
+        while shift > 0.0 and k <= n:
+            event = self._next_event(k, shift) if k < n else n
+            self._shift(k, event + 1, shift)
+            if event >= n:
+                break
+            soc = self._soc(event)
+            cc = self.gain[event] if self.member[event] else 0.0
+            soc_ideal = soc + self.net[event] + cc
+            zi = bisect.bisect_left(self.zero_clamps, event)
+            if (zi < len(self.zero_clamps) and self.zero_clamps[zi] == event
+                    and soc_ideal >= 0.0):
+                self.zero_clamps.pop(zi)
+            shift = max(0.0, min(cap, soc_ideal)) - self._soc(event + 1)
+            k = event + 1
+
+
 def _fill_charge_to_deficit(
     remaining: list[tuple[int, float]],
     validated_charge: set[int],
@@ -1075,6 +1686,11 @@ def _fill_charge_to_deficit(
     beyond what overnight survival needs.  In the common case where validation
     dropped nothing, the delivered energy already meets the deficit and this
     returns immediately — a no-op for healthy schedules.
+
+    Candidates are screened by `_ChargeFeasibility` (O(log n) per query)
+    rather than a full re-validation each; the validator only runs when the
+    oracle cannot rule out a beneficial swap or sits on a float tie, so the
+    result is identical to re-validating every candidate.
     """
 
     def delivered(slots: set[int]) -> float:
@@ -1101,23 +1717,52 @@ def _fill_charge_to_deficit(
         ),
         key=lambda ip: ip[1],
     )
+    if not pool:
+        return validated
+    feasibility = _ChargeFeasibility(
+        remaining, current_kwh, consumption_per_slot, pv_hourly_kwh,
+        minutes_per_slot, pv_confidence, battery_capacity, min_kwh,
+        energy_per_slot, efficiency, inverter_max_power_kw, safe_power_kw,
+        consumption_hourly_kwh,
+    )
+    feasibility.rebuild(validated)
     for idx, _price in pool:
         if got >= energy_deficit - 0.01:
             break
         attempted.add(idx)
-        trial, _ = _validate_schedule_soc(
-            remaining, validated | {idx}, set(),
-            current_kwh, consumption_per_slot, pv_hourly_kwh,
-            minutes_per_slot, pv_confidence, battery_capacity, min_kwh,
-            energy_per_slot, efficiency,
-            inverter_max_power_kw=inverter_max_power_kw,
-            safe_power_kw=safe_power_kw,
-            consumption_hourly_kwh=consumption_hourly_kwh,
-        )
+        fits = feasibility.query(idx) if feasibility.valid else None
+        if fits is False:
+            # The strict validation would drop something (unless every
+            # charge is negative-priced, where it may keep the overflow).
+            # A pruned trial only beats `got` by swapping out kept slots
+            # that deliver less than this one (PV-throttled hours); when no
+            # kept slot does, the validator's answer is a guaranteed reject.
+            if ((_price >= 0 or feasibility.any_non_negative)
+                    and feasibility.min_member_gain
+                    >= feasibility.gain[feasibility.position_of[idx]] - 0.01):
+                continue
+            fits = None
+        if fits:
+            # Nothing to prune: the validator would return the set as-is.
+            trial = set(validated | {idx})
+        else:
+            trial, _ = _validate_schedule_soc(
+                remaining, validated | {idx}, set(),
+                current_kwh, consumption_per_slot, pv_hourly_kwh,
+                minutes_per_slot, pv_confidence, battery_capacity, min_kwh,
+                energy_per_slot, efficiency,
+                inverter_max_power_kw=inverter_max_power_kw,
+                safe_power_kw=safe_power_kw,
+                consumption_hourly_kwh=consumption_hourly_kwh,
+            )
         new_got = delivered(trial)
         if new_got > got + 0.01:
             validated = trial
             got = new_got
+            if fits:
+                feasibility.add(idx)
+            else:
+                feasibility.rebuild(validated)
     return validated
 
 
@@ -1167,36 +1812,46 @@ def _select_discharges_for_pv_headroom(
     def _slot_pv(hour: int) -> float:
         return (state.pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence * (minutes_per_slot / 60.0)
 
-    def _project_soc(extra_discharge: set[int]) -> tuple[dict[int, float], float, float]:
-        """Project SOC entering each slot given current schedule + extra discharges.
+    # Per-slot energy arrays shared by every projection below.
+    slot_net: list[float] = []
+    slot_gain: list[float] = []
+    for idx, _ in remaining:
+        hour = int((idx * minutes_per_slot) / 60)
+        slot_net.append(_slot_pv(hour) - _slot_cons(hour))
+        pv_kw_rate = (state.pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
+        grid_kw = min(config.safe_power_kw,
+                      max(0.0, config.inverter_max_power_kw - pv_kw_rate))
+        slot_gain.append(grid_kw * (minutes_per_slot / 60.0) * config.efficiency)
+    charge_row = [idx in scheduled_charge for idx, _ in remaining]
 
-        Returns (per_slot_entering, soc_at_end, min_soc_observed).
+    def _project_socs(extra: list[int | None]) -> tuple[list, list]:
+        """Walk the current schedule plus, per row, one extra discharge slot
+        (None = none) — all rows in one `_soc_walk_batch` call.
+
+        Returns (entering rows, unclamped minimum per row); the minimum is
+        taken before clamping so it captures the true dip.
         """
-        soc = current_kwh
-        per_slot: dict[int, float] = {}
-        min_soc = soc
-        for idx, _ in remaining:
-            per_slot[idx] = soc
-            hour = int((idx * minutes_per_slot) / 60)
-            pv = _slot_pv(hour)
-            cons = _slot_cons(hour)
-            delta = pv - cons
-            if idx in scheduled_charge:
-                pv_kw_rate = (state.pv_hourly_kwh or {}).get(hour, 0.0) * pv_confidence
-                grid_kw = min(config.safe_power_kw,
-                              max(0.0, config.inverter_max_power_kw - pv_kw_rate))
-                delta += grid_kw * (minutes_per_slot / 60.0) * config.efficiency
-            if idx in discharge or idx in extra_discharge or idx in existing_discharge:
-                delta -= energy_per_slot
-            soc_raw = soc + delta  # before clamp — captures true dip
-            min_soc = min(min_soc, soc_raw)
-            soc = max(0.0, min(max_battery_kwh, soc_raw))
-        return per_slot, soc, min_soc
+        base_row = [idx in discharge or idx in existing_discharge
+                    for idx, _ in remaining]
+        discharge_rows = [
+            [flag or idx == cand for flag, (idx, _) in zip(base_row, remaining)]
+            for cand in extra
+        ]
+        return _soc_walk_batch(
+            current_kwh, slot_net, slot_gain,
+            [charge_row] * len(extra), discharge_rows,
+            energy_per_slot, 0.0, max_battery_kwh,
+        )
+
+    def _project_soc() -> dict[int, float]:
+        """SOC entering each slot under the current schedule."""
+        entering, _ = _project_socs([None])
+        return {idx: entering[0][k] for k, (idx, _) in enumerate(remaining)}
 
     # Iterate (bounded) until no more overflow at negative+PV slots is reducible.
     max_passes = len(remaining)
     for _ in range(max_passes):
-        soc_in, _, _ = _project_soc(set())
+        soc_in = _project_soc()
         # Find the FIRST negative-price slot with PV surplus that would overflow.
         target_idx: int | None = None
         for idx, price in remaining:
@@ -1235,23 +1890,43 @@ def _select_discharges_for_pv_headroom(
         candidates.sort(key=lambda x: -x[1])  # most expensive first
 
         added_this_pass = False
-        for cand_idx, _ in candidates:
-            # A discharge is acceptable when:
-            #  - SOC never drops below the absolute min_kwh floor at any
-            #    point in the simulation (hardware safety);
-            #  - end-of-day SOC remains >= reserve_target (overnight
-            #    self-consumption protection).
-            # Temporary dips below reserve_target during the day are OK
-            # because the negative-window PV refills the battery.
-            _, soc_end_day, soc_min_observed = _project_soc({cand_idx})
-            if soc_min_observed < min_kwh_floor - 0.01:
-                continue
-            if soc_end_day < reserve_target - 0.01:
-                continue
+        # Candidates are tried most-expensive first and each one is judged
+        # against the discharges accepted so far.  They are projected in
+        # doubling batches (1, 2, 4, … rows per `_soc_walk_batch` call):
+        # usually the first one fits, and when many don't, the wide batches
+        # run vectorised.  After an acceptance the rest are re-projected
+        # against the grown set — same outcome as trying them one by one.
+        untried = [cand_idx for cand_idx, _ in candidates]
+        while untried:
+            accepted_at: int | None = None
+            start, width = 0, 1
+            while start < len(untried) and accepted_at is None:
+                entering, raw_min = _project_socs(untried[start:start + width])
+                for pos, (row, soc_min_observed) in enumerate(zip(entering, raw_min)):
+                    soc_end_day = row[-1]
+                    # A discharge is acceptable when:
+                    #  - SOC never drops below the absolute min_kwh floor at
+                    #    any point in the simulation (hardware safety);
+                    #  - end-of-day SOC remains >= reserve_target (overnight
+                    #    self-consumption protection).
+                    # Temporary dips below reserve_target during the day are
+                    # OK because the negative-window PV refills the battery.
+                    if soc_min_observed < min_kwh_floor - 0.01:
+                        continue
+                    if soc_end_day < reserve_target - 0.01:
+                        continue
+                    accepted_at = start + pos
+                    break
+                start += width
+                width *= 2
+            if accepted_at is None:
+                break
+            cand_idx = untried[accepted_at]
+            untried = untried[accepted_at + 1:]
             discharge.add(cand_idx)
             added_this_pass = True
             # Did this resolve the overflow at target_idx?
-            new_soc, _, _ = _project_soc(set())
+            new_soc = _project_soc()
             hour = int((target_idx * minutes_per_slot) / 60)
             pv = _slot_pv(hour)
             cons = _slot_cons(hour)
@@ -1833,19 +2508,18 @@ def _compute_tomorrow_soc_trajectory(
     num_slots: int,
     minutes_per_slot: float,
     pv_hourly_tomorrow: dict[int, float],
+    slot_power_kw: dict[int, float] | None = None,
 ) -> list[float]:
     """Simulate SOC trajectory for tomorrow given a schedule."""
     slot_duration_hours = minutes_per_slot / 60.0
     energy_per_slot = config.safe_power_kw * slot_duration_hours
     min_kwh = (config.battery_discharge_min_pct / 100.0) * config.battery_capacity_kwh
     cap = config.battery_capacity_kwh
-    trajectory: list[float] = []
-    soc = midnight_kwh
 
+    net: list[float] = []
+    gain: list[float] = []
+    grid_kws: list[float] = []
     for i in range(num_slots):
-        pct = max(0.0, min(100.0, (soc / cap) * 100.0)) if cap > 0 else 0.0
-        trajectory.append(round(pct, 1))
-
         hour = int((i * minutes_per_slot) / 60)
         pv_kwh_rate = pv_hourly_tomorrow.get(hour, 0.0)
         pv_per_slot = pv_kwh_rate * slot_duration_hours
@@ -1855,46 +2529,57 @@ def _compute_tomorrow_soc_trajectory(
         else:
             cons = config.consumption_est_kwh / num_slots
 
-        delta = pv_per_slot - cons
-        action = scheduled.get(i)
-        if action == "charge":
-            grid_kw = min(config.safe_power_kw,
-                          max(0.0, config.inverter_max_power_kw - pv_kwh_rate))
-            delta += grid_kw * slot_duration_hours * config.efficiency
-        elif action == "discharge" and soc > min_kwh:
-            delta -= min(energy_per_slot, soc - min_kwh)
-
-        soc = max(min_kwh, min(cap, soc + delta))
-
+        net.append(pv_per_slot - cons)
+        grid_kw = min(config.safe_power_kw,
+                      max(0.0, config.inverter_max_power_kw - pv_kwh_rate))
+        grid_kws.append(grid_kw)
+        gain.append(grid_kw * slot_duration_hours * config.efficiency)
+
+    slots = range(num_slots)
+    entering, _ = _soc_walk_batch(
+        midnight_kwh, net, gain,
+        [_action_mask(scheduled, slot_power_kw, slots, "charge", grid_kws)],
+        [_action_mask(scheduled, slot_power_kw, slots, "discharge",
+                      config.safe_power_kw)],
+        energy_per_slot, min_kwh, cap, discharge_floor=min_kwh,
+    )
+    trajectory: list[float] = []
+    for soc in entering[0][:-1]:
+        soc = float(soc)
+        pct = max(0.0, min(100.0, (soc / cap) * 100.0)) if cap > 0 else 0.0
+        trajectory.append(round(pct, 1))
     return trajectory
 
 
-def _run_milp_or_none(
-    config: EMSConfig,
-    state: EMSState,
-    remaining: list[tuple[int, float]],
-    current_kwh: float,
-    num_slots: int,
-    current_slot: int,
-    minutes_per_slot: float,
-) -> ScheduleResult | None:
-    """Run the MILP scheduler; return None to signal greedy fallback.
+# Solver engines selectable via EMSConfig.scheduler_engine, mapped to the
+# label used in the schedule reason.  Each module exposes the same
+# solve_schedule() signature and returns None to request greedy fallback.
+_SOLVER_ENGINES = {"milp": "MILP", "dp": "DP"}
 
-    Builds the ScheduleResult skeleton (scheduled_slots + reserve fields).
-    The downstream machinery in calculate_schedule fills in the SOC
-    trajectory, tomorrow schedule, and flexible-load overlays exactly as
-    it does for the greedy path, so only the per-slot charge/discharge
-    decision differs.
-    """
-    try:
+
+def _import_solver(engine: str):
+    """Import a solver engine module, package-relative or flat (tools/tests)."""
+    if engine == "dp":
         try:
-            from . import milp  # type: ignore  # noqa: PLC0415
+            from . import dp as solver  # type: ignore  # noqa: PLC0415
         except ImportError:
-            import milp  # type: ignore  # noqa: PLC0415
-    except Exception as err:  # pragma: no cover - import guard
-        _LOGGER.warning("MILP module unavailable — falling back to greedy: %s", err)
-        return None
+            import dp as solver  # type: ignore  # noqa: PLC0415
+    else:
+        try:
+            from . import milp as solver  # type: ignore  # noqa: PLC0415
+        except ImportError:
+            import milp as solver  # type: ignore  # noqa: PLC0415
+    return solver
+
 
+def _solver_inputs(
+    config: EMSConfig, state: EMSState, current_kwh: float,
+) -> tuple[float, float, float, float]:
+    """Return ``(reserve_kwh, reserve_target, pv_confidence, start_kwh)`` for the solvers.
+
+    Shared by the solver engines and the ``auto`` engine's plan costing so
+    every plan is judged against the same reserve and starting SOC.
+    """
     # Time-aware + night-boost-drop reserve, scoped to from_grid — SAME as the
     # greedy path, so the two engines compute the SAME reserve for the same
     # inputs (predictable, no cross-engine divergence on the displayed reserve).
@@ -1906,42 +2591,86 @@ def _run_milp_or_none(
         config.consumption_est_kwh, state.pv_hourly_kwh,
         state.current_hour if from_grid else None, state.current_minute,
         consumption_hourly_kwh=state.consumption_hourly_kwh)
-    milp_night = from_grid and _is_night(
+    solver_night = from_grid and _is_night(
         state.pv_hourly_kwh, state.current_hour, state.current_minute)
     reserve_target = _compute_reserve_target(
-        config, reserve_kwh, apply_boost=not milp_night)
+        config, reserve_kwh, apply_boost=not solver_night)
     pv_confidence = _calculate_pv_confidence(
         state.pv_hourly_kwh, state.pv_actual_today_kwh,
         state.current_hour, state.current_minute,
         previous_confidence=state.previous_pv_confidence,
     )
 
-    # Consumption-deviation correction for MILP: lower the starting SOC
-    # by the deviation so the solver "sees" a less-full battery and plans
-    # extra charging to compensate for the unexpected load.
+    # Consumption-deviation correction for the solver engines: lower the
+    # starting SOC by the deviation so the solver "sees" a less-full battery
+    # and plans extra charging to compensate for the unexpected load.
     deviation = _consumption_deviation_kwh(
         state, current_kwh, reserve_target, config.battery_capacity_kwh)
-    milp_current_kwh = max(0.0, current_kwh - deviation)
+    return reserve_kwh, reserve_target, pv_confidence, max(0.0, current_kwh - deviation)
+
 
-    milp_result = milp.solve_schedule(
+def _run_solver_or_none(
+    engine: str,
+    config: EMSConfig,
+    state: EMSState,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    time_limit: float | None = None,
+) -> ScheduleResult | None:
+    """Run a solver engine ("milp" or "dp"); return None to signal greedy fallback.
+
+    Builds the ScheduleResult skeleton (scheduled_slots + reserve fields).
+    The downstream machinery in calculate_schedule fills in the SOC
+    trajectory, tomorrow schedule, and flexible-load overlays exactly as
+    it does for the greedy path, so only the per-slot charge/discharge
+    decision differs.  ``time_limit`` caps the MILP solve (the auto race
+    passes its budget); DP has no limit to pass.
+    """
+    label = _SOLVER_ENGINES[engine]
+    try:
+        solver = _import_solver(engine)
+    except Exception as err:  # pragma: no cover - import guard
+        _LOGGER.warning("%s module unavailable — falling back to greedy: %s", label, err)
+        return None
+
+    reserve_kwh, reserve_target, pv_confidence, solver_current_kwh = (
+        _solver_inputs(config, state, current_kwh))
+
+    solver_stats: dict[str, object] = {}
+    slot_power: dict[str, dict[int, float]] = {}
+    solver_result = solver.solve_schedule(
         config, state,
         remaining=remaining,
-        current_kwh=milp_current_kwh,
+        current_kwh=solver_current_kwh,
         num_slots=num_slots,
         current_slot=current_slot,
         minutes_per_slot=minutes_per_slot,
         reserve_target=reserve_target,
         pv_confidence=pv_confidence,
+        stats=solver_stats,
+        slot_power=slot_power,
+        **({"time_limit": time_limit} if time_limit is not None else {}),
     )
-    if milp_result is None:
+    # The engines time their own model build / solve / extraction.
+    for part in ("build", "solve", "extract"):
+        part_ms = solver_stats.get(f"{part}_ms")
+        if part_ms is not None:
+            _record_phase(f"{engine}.{part}", part_ms / 1000.0)
+    if solver_result is None:
         return None
 
-    scheduled, tomorrow_scheduled = milp_result
+    scheduled, tomorrow_scheduled = solver_result
 
     result = ScheduleResult()
-    result.scheduler_active = "milp"
+    result.scheduler_active = engine
+    result.solver_stats = solver_stats
     result.scheduled_slots = scheduled
     result.tomorrow_scheduled_slots = tomorrow_scheduled
+    result.slot_power_kw = slot_power.get("today", {})
+    result.tomorrow_slot_power_kw = slot_power.get("tomorrow", {})
     result.self_consumption_reserve = round(reserve_kwh, 2)
     result.reserve_target_pct = round(
         (reserve_target / config.battery_capacity_kwh) * 100.0, 1,
@@ -1951,8 +2680,8 @@ def _run_milp_or_none(
     charge_prices = [p for i, p in remaining if scheduled.get(i) == "charge"]
     if charge_prices:
         result.price_threshold = max(charge_prices)
-    effective_per_slot = config.safe_power_kw * (minutes_per_slot / 60.0) * config.efficiency
-    result.grid_energy_planned = round(len(charge_prices) * effective_per_slot, 2)
+    result.grid_energy_planned = round(_planned_charge_kwh(
+        config, scheduled, result.slot_power_kw, minutes_per_slot), 2)
 
     n_charge = sum(1 for v in scheduled.values() if v == "charge")
     n_sell = sum(1 for v in scheduled.values() if v == "discharge")
@@ -1964,17 +2693,546 @@ def _run_milp_or_none(
     if n_sell or tmr_sell:
         parts.append(f"selling {n_sell}+{tmr_sell} slot(s)")
     if parts:
-        result.schedule_reason = f"MILP plan: {', '.join(parts)}"
+        result.schedule_reason = f"{label} plan: {', '.join(parts)}"
     else:
-        result.schedule_reason = "MILP plan: no grid action needed"
+        result.schedule_reason = f"{label} plan: no grid action needed"
+    partial = len(result.slot_power_kw) + len(result.tomorrow_slot_power_kw)
+    if partial:
+        result.schedule_reason += f" ({partial} at reduced power)"
     return result
 
 
+def _planned_charge_kwh(
+    config: EMSConfig,
+    scheduled: dict[int, str],
+    slot_power_kw: dict[int, float],
+    minutes_per_slot: float,
+) -> float:
+    """Effective kWh the plan's charge slots store, at their planned power."""
+    slot_hours = minutes_per_slot / 60.0
+    charges = [i for i, action in scheduled.items() if action == "charge"]
+    partial = [min(config.safe_power_kw, slot_power_kw[i])
+               for i in charges if i in slot_power_kw]
+    full = len(charges) - len(partial)
+    return (full * (config.safe_power_kw * slot_hours * config.efficiency)
+            + sum(kw * slot_hours * config.efficiency for kw in partial))
+
+
+def _refresh_plan_counters(
+    result: ScheduleResult,
+    config: EMSConfig,
+    scheduled: dict[int, str],
+    remaining: list[tuple[int, float]],
+) -> tuple[int, int]:
+    """Re-derive price_threshold and cheap_slots_remaining after a plan edit.
+
+    The threshold is the dearest remaining charge, else the cheapest
+    remaining sell; the slot count is the charges (sells in to_grid).
+    Returns (charge count, sell count) over ``remaining``.
+    """
+    charge_prices = [p for i, p in remaining if scheduled.get(i) == "charge"]
+    sell_prices = [p for i, p in remaining if scheduled.get(i) == "discharge"]
+    if charge_prices:
+        result.price_threshold = max(charge_prices)
+    elif sell_prices:
+        result.price_threshold = min(sell_prices)
+    n_charge, n_sell = len(charge_prices), len(sell_prices)
+    result.cheap_slots_remaining = n_charge if config.grid_mode != "to_grid" else n_sell
+    return n_charge, n_sell
+
+
+def _charge_price_ceiling(
+    scheduled: dict[int, str],
+    remaining: list[tuple[int, float]],
+) -> float:
+    """Highest price a local fix-up may add a grid charge at.
+
+    The plan's dearest remaining charge when it has one (greedy never buys
+    above it), else the average remaining price — and never at or above a
+    planned discharge, which would buy back what the plan sells.
+    """
+    charge_prices = [p for i, p in remaining if scheduled.get(i) == "charge"]
+    if charge_prices:
+        ceiling = max(charge_prices)
+    else:
+        ceiling = sum(p for _, p in remaining) / len(remaining)
+    sell_prices = [p for i, p in remaining if scheduled.get(i) == "discharge"]
+    if sell_prices:
+        ceiling = min(ceiling, min(sell_prices))
+    return ceiling
+
+
+# Worker thread for the "auto" engine's MILP leg.  Two workers so a solve
+# that overran the previous budget cannot block the next race.
+_AUTO_POOL: ThreadPoolExecutor | None = None
+
+
+def _auto_pool() -> ThreadPoolExecutor:
+    global _AUTO_POOL
+    if _AUTO_POOL is None:
+        _AUTO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ems_auto")
+    return _AUTO_POOL
+
+
+def _race_engines(
+    config: EMSConfig,
+    state: EMSState,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    run_greedy,
+) -> ScheduleResult:
+    """Run greedy and MILP side by side and keep the cheaper plan ("auto").
+
+    MILP solves on a worker thread (HiGHS releases the GIL) while greedy runs
+    here, with ``auto_engine_budget_s`` as its solver time limit; a MILP
+    that has not finished within the budget is dropped.  Both plans — today
+    and tomorrow — are priced by dp.plan_cost, the slot model the solver
+    engines share: grid buy cost, export revenue, cycle wear, leftover-SOC
+    value and reserve shortfall.  Greedy wins ties and whenever the plans
+    cannot be priced.
+    """
+    started = time.perf_counter()
+    budget = max(0.0, config.auto_engine_budget_s)
+    # A running future cannot be cancelled, so the budget doubles as the
+    # solver's own time limit: an overrunning solve stops by itself instead
+    # of lingering on the pool (and in the warm-start / template caches).
+    future = _auto_pool().submit(
+        _run_solver_or_none, "milp", config, state, remaining, current_kwh,
+        num_slots, current_slot, minutes_per_slot, budget,
+    )
+    greedy = run_greedy()
+    try:
+        solved = future.result(timeout=max(0.0, budget - (time.perf_counter() - started)))
+    except FuturesTimeoutError:
+        if not future.cancel():
+            _LOGGER.info(
+                "Auto engine: MILP missed the %.1f s budget — keeping greedy "
+                "(its thread is still running until the solver time limit)", budget,
+            )
+        else:
+            _LOGGER.info("Auto engine: MILP missed the %.1f s budget — keeping greedy", budget)
+        solved = None
+
+    candidates = {"greedy": greedy}
+    if solved is not None:
+        candidates["milp"] = solved
+    costs = {
+        engine: _plan_cost(config, state, result, remaining, current_kwh,
+                           num_slots, current_slot, minutes_per_slot)
+        for engine, result in candidates.items()
+    }
+    winner = "greedy"
+    if (costs.get("milp") is not None and costs["greedy"] is not None
+            and costs["milp"] < costs["greedy"] - 1e-6):
+        winner = "milp"
+    result = candidates[winner]
+    margin = None
+    if len(costs) == 2 and None not in costs.values():
+        margin = round(abs(costs["greedy"] - costs["milp"]), 4)
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000.0, 1)
+    result.solver_stats.update(
+        auto_winner=winner,
+        auto_costs={k: None if v is None else round(v, 4) for k, v in costs.items()},
+        auto_margin_eur=margin,
+        auto_ms=elapsed_ms,
+    )
+    _LOGGER.debug(
+        "Auto engine: %s won (costs %s, margin %s EUR, %.1f ms)",
+        winner, result.solver_stats["auto_costs"], margin, elapsed_ms,
+    )
+    if margin is not None:
+        loser = "MILP" if winner == "greedy" else "greedy"
+        result.schedule_reason = (
+            f"Auto ({'MILP' if winner == 'milp' else 'greedy'} beat {loser} "
+            f"by €{margin:.2f}) — {result.schedule_reason}"
+        )
+    return result
+
+
+def _plan_cost(
+    config: EMSConfig,
+    state: EMSState,
+    result: ScheduleResult,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+) -> float | None:
+    """Price ``result``'s today + tomorrow plan with the shared slot model."""
+    try:
+        dp = _import_solver("dp")
+    except ImportError:  # pragma: no cover - import guard
+        return None
+    _, reserve_target, pv_confidence, start_kwh = _solver_inputs(config, state, current_kwh)
+    tomorrow = result.tomorrow_scheduled_slots
+    if state.slot_prices_tomorrow and not tomorrow:
+        # Greedy plans tomorrow after the fact from its SOC trajectory;
+        # rebuild that plan here (without storing it) so it is priced too.
+        trajectory = _compute_scheduled_soc_trajectory(
+            state.slot_prices_today, num_slots, minutes_per_slot,
+            current_kwh, current_slot, result.scheduled_slots, config, state,
+        )
+        tomorrow, _ = _compute_tomorrow_schedule(config, state, result, trajectory)
+    return dp.plan_cost(
+        config, state,
+        today_slots=result.scheduled_slots,
+        tomorrow_slots=tomorrow,
+        current_kwh=start_kwh,
+        num_slots=num_slots,
+        current_slot=current_slot,
+        minutes_per_slot=minutes_per_slot,
+        reserve_target=reserve_target,
+        pv_confidence=pv_confidence,
+        slot_power={"today": result.slot_power_kw,
+                    "tomorrow": result.tomorrow_slot_power_kw},
+    )
+
+
+# Scenario check defaults: forecast error spread used for hours without a
+# learned error model, and the correlation of the hourly errors within one
+# sampled day (a cloudy morning usually means a cloudy afternoon).
+_MC_PV_SIGMA = 0.30
+_MC_LOAD_SIGMA = 0.15
+_MC_DAY_CORRELATION = 0.8
+# Candidate plans: the engine's plan, plus up to this many cheapest extra
+# charges (cumulative), minus up to _MC_MAX_REMOVED priciest charges.
+_MC_MAX_ADDED = 6
+_MC_MAX_REMOVED = 3
+
+
+def _sample_scenarios(
+    rng,
+    samples: int,
+    hours: list[int],
+    pv_center: list[float],
+    pv_forecast: list[float],
+    consumption: list[float],
+    state: EMSState,
+):
+    """(samples × slots) PV and consumption draws around the forecast.
+
+    Each sample shares one day-level error draw across its hours (weight
+    _MC_DAY_CORRELATION) plus independent hourly noise.  Hours with a
+    learned PV error model scale the raw forecast by the sampled
+    actual/forecast ratio; the rest perturb the confidence-scaled forecast
+    the deterministic plan used.
+    """
+    rho = _MC_DAY_CORRELATION
+    spread = math.sqrt(1.0 - rho * rho)
+
+    def _z():
+        return rho * rng.standard_normal((samples, 1)) + spread * rng.standard_normal((samples, 24))
+
+    pv_z = _z()
+    load_z = _z()
+    pv_err = state.pv_error_hourly or {}
+    load_err = state.consumption_error_hourly or {}
+    pv_mean = _np.ones(24)
+    pv_std = _np.full(24, _MC_PV_SIGMA)
+    load_std = _np.full(24, _MC_LOAD_SIGMA)
+    learned = _np.zeros(24, dtype=bool)
+    for hour, (mean, std) in pv_err.items():
+        if 0 <= hour < 24:
+            pv_mean[hour], pv_std[hour], learned[hour] = mean, std, True
+    for hour, std in load_err.items():
+        if 0 <= hour < 24:
+            load_std[hour] = std
+
+    hour_idx = _np.asarray(hours)
+    ratio = _np.maximum(0.0, pv_mean + pv_std * pv_z)[:, hour_idx]
+    base = _np.where(learned[hour_idx], pv_forecast, pv_center)
+    pv = base * ratio
+    load = _np.asarray(consumption) * _np.maximum(0.0, 1.0 + load_std * load_z)[:, hour_idx]
+    return pv, load
+
+
+def _scenario_costs(
+    start_kwh: float,
+    pv,
+    load,
+    prices,
+    gain,
+    charge,
+    discharge,
+    discharge_kwh: float,
+    min_kwh: float,
+    cap: float,
+    efficiency: float,
+    reserve_kwh: float,
+    guard,
+    terminal_price: float,
+):
+    """Expected cost and reserve-shortfall probability of each candidate plan.
+
+    Walks every candidate (rows of ``charge`` / ``discharge``, each entry the
+    share of full power run in that slot) against every sample at once: the
+    SOC is a candidates × samples matrix stepped slot by slot with the same
+    clamped model as the SOC trajectories.  Cost per sample is grid charge
+    bought, plus house load the battery could not cover (imported at the
+    slot price), minus discharge revenue, minus the energy left at the end
+    valued at ``terminal_price``.  A shortfall is the SOC dropping below
+    ``reserve_kwh`` in a slot where ``guard`` says the deterministic plan
+    held it.
+    """
+    candidates = charge.shape[0]
+    samples = pv.shape[0]
+    soc = _np.full((candidates, samples), float(start_kwh))
+    cost = _np.zeros((candidates, samples))
+    short = _np.zeros((candidates, samples), dtype=bool)
+    tolerance = 0.01 * cap
+    for k in range(pv.shape[1]):
+        added = (gain[k] * charge[:, k])[:, None]
+        share = discharge[:, k][:, None]
+        taken = _np.where(
+            (share > 0) & (soc > min_kwh),
+            _np.minimum(discharge_kwh * share, soc - min_kwh), 0.0)
+        raw = soc + (pv[:, k] - load[:, k])[None, :] + added - taken
+        stored = _np.maximum(0.0, added - _np.maximum(raw - cap, 0.0))
+        unserved = _np.maximum(min_kwh - raw, 0.0)
+        cost += prices[k] * (stored / efficiency + unserved - taken * efficiency)
+        soc = _np.clip(raw, min_kwh, cap)
+        if guard[k]:
+            short |= soc < reserve_kwh - tolerance
+    cost -= terminal_price * (soc - start_kwh)
+    return cost.mean(axis=1), short.mean(axis=1)
+
+
+def _apply_scenario_check(
+    result: ScheduleResult,
+    config: EMSConfig,
+    state: EMSState,
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+) -> None:
+    """Re-pick today's charge slots against sampled PV / consumption days.
+
+    Candidates are the engine's plan, that plan plus the 1.._MC_MAX_ADDED
+    cheapest free slots under the plan's charge-price ceiling (each such
+    plan re-validated against overflow), and minus its 1.._MC_MAX_REMOVED
+    priciest charges (discharges are kept).  All are scored in one
+    vectorised pass (_scenario_costs); the cheapest candidate whose
+    shortfall probability is within config.pv_scenario_shortfall_pct wins,
+    or the least risky one when none is.  Sampling is seeded by the slot so
+    the choice is stable within a slot.  Updates ``result`` in place; stats
+    land in result.solver_stats["scenarios"].
+    """
+    if _np is None:
+        _LOGGER.debug("Scenario check skipped — numpy unavailable")
+        return
+    started = time.perf_counter()
+    prices_today = state.slot_prices_today or []
+    slot_hours = minutes_per_slot / 60.0
+    cap = config.battery_capacity_kwh
+    pv_confidence = _calculate_pv_confidence(
+        state.pv_hourly_kwh, state.pv_actual_today_kwh,
+        state.current_hour, state.current_minute,
+        previous_confidence=state.previous_pv_confidence,
+    )
+    slots = list(range(current_slot, num_slots))
+    hours = [int((i * minutes_per_slot) / 60) % 24 for i in slots]
+    pv_forecast = [(state.pv_hourly_kwh or {}).get(h, 0.0) * slot_hours for h in hours]
+    consumption = [
+        state.consumption_hourly_kwh[h] * slot_hours
+        if state.consumption_hourly_kwh and h in state.consumption_hourly_kwh
+        else config.consumption_est_kwh / num_slots
+        for h in hours
+    ]
+    grid_kws = [
+        min(config.safe_power_kw,
+            max(0.0, config.inverter_max_power_kw
+                - (state.pv_hourly_kwh or {}).get(h, 0.0) * pv_confidence))
+        for h in hours
+    ]
+    gain = [kw * slot_hours * config.efficiency for kw in grid_kws]
+    prices = [prices_today[i] if prices_today[i] is not None else 0.0 for i in slots]
+    buyable = [i for i in slots if prices_today[i] is not None]
+    if not buyable:
+        return
+
+    base = dict(result.scheduled_slots)
+    charges = sorted((i for i, a in base.items() if a == "charge" and i >= current_slot),
+                     key=lambda i: prices_today[i] or 0.0)
+    remaining = [(i, prices_today[i]) for i in buyable]
+    ceiling = _charge_price_ceiling(base, remaining)
+    free = sorted((i for i in buyable if i not in base and prices_today[i] <= ceiling),
+                  key=lambda i: prices_today[i])
+
+    def _validated_added(plan: dict[int, str]) -> dict[int, str]:
+        # The engine already validated its own slots; added charges still
+        # have to survive the overflow check before they can be committed.
+        valid_charges, _ = _validate_schedule_soc(
+            remaining,
+            {i for i, a in plan.items() if a == "charge" and i >= current_slot},
+            {i for i, a in plan.items() if a == "discharge" and i >= current_slot},
+            current_kwh, config.consumption_est_kwh / num_slots,
+            state.pv_hourly_kwh or {}, minutes_per_slot, pv_confidence,
+            cap, min_kwh, config.safe_power_kw * slot_hours, config.efficiency,
+            consumption_hourly_kwh=state.consumption_hourly_kwh,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            safe_power_kw=config.safe_power_kw,
+            keep_all_negative_charges=config.charge_to_full_on_negative_price,
+            keep_partial_charges=(config.grid_mode == "from_grid"
+                                  and not config.charge_to_full_on_negative_price),
+            slot_power_kw=result.slot_power_kw,
+        )
+        return {i: a for i, a in plan.items()
+                if a != "charge" or i in valid_charges or base.get(i) == "charge"}
+
+    min_kwh = (config.battery_discharge_min_pct / 100.0) * cap
+    plans = [base]
+    for k in range(1, min(_MC_MAX_ADDED, len(free)) + 1):
+        plan = _validated_added({**base, **{i: "charge" for i in free[:k]}})
+        if plan not in plans:
+            plans.append(plan)
+    for k in range(1, min(_MC_MAX_REMOVED, len(charges)) + 1):
+        dropped = set(charges[-k:])
+        plans.append({i: a for i, a in base.items() if i not in dropped})
+
+    # Slots of the engine's plan keep their planned power; added ones run full.
+    power = result.slot_power_kw
+    charge = _np.array([_action_mask(p, power, slots, "charge", grid_kws)
+                        for p in plans], dtype=float)
+    discharge = _np.array([_action_mask(p, power, slots, "discharge",
+                                        config.safe_power_kw)
+                           for p in plans], dtype=float)
+    reserve_kwh = max(min_kwh, (result.reserve_target_pct / 100.0) * cap)
+    # Where the deterministic plan already sits below the reserve (it is
+    # spending the battery on purpose), missing it is not a shortfall.
+    planned = _compute_scheduled_soc_trajectory(
+        prices_today, num_slots, minutes_per_slot, current_kwh, current_slot,
+        base, config, state, power,
+    )
+    guard = [planned[min(i + 1, num_slots - 1)] / 100.0 * cap >= reserve_kwh - 0.01 * cap
+             for i in slots]
+    # Energy left at the end of the day is worth what it would cost to buy
+    # back at the cheapest remaining price.
+    terminal_price = max(0.0, min(prices_today[i] for i in buyable))
+
+    rng = _np.random.default_rng(num_slots * 1000 + current_slot)
+    pv, load = _sample_scenarios(
+        rng, config.pv_scenario_samples, hours,
+        [x * pv_confidence for x in pv_forecast], pv_forecast, consumption, state,
+    )
+    expected, shortfall = _scenario_costs(
+        current_kwh, pv, load, _np.asarray(prices), _np.asarray(gain),
+        charge, discharge, config.safe_power_kw * slot_hours,
+        min_kwh, cap, config.efficiency, reserve_kwh, guard, terminal_price,
+    )
+
+    limit = config.pv_scenario_shortfall_pct / 100.0
+    feasible = [k for k in range(len(plans)) if shortfall[k] <= limit]
+    if feasible:
+        best = min(feasible, key=lambda k: (expected[k], k))
+    else:
+        best = min(range(len(plans)), key=lambda k: (shortfall[k], expected[k], k))
+    chosen = plans[best]
+    added = sum(1 for i, a in chosen.items() if a == "charge" and base.get(i) != "charge")
+    removed = sum(1 for i, a in base.items() if a == "charge" and chosen.get(i) != "charge")
+    result.solver_stats["scenarios"] = {
+        "samples": config.pv_scenario_samples,
+        "shortfall_prob": round(float(shortfall[best]), 3),
+        "base_shortfall_prob": round(float(shortfall[0]), 3),
+        "expected_cost_eur": round(float(expected[best]), 3),
+        "base_expected_cost_eur": round(float(expected[0]), 3),
+        "added": added,
+        "removed": removed,
+        "ms": round((time.perf_counter() - started) * 1000.0, 1),
+    }
+    if best == 0:
+        return
+    result.scheduled_slots = chosen
+    result.grid_energy_planned = round(_planned_charge_kwh(
+        config, {i: a for i, a in chosen.items() if i >= current_slot},
+        power, minutes_per_slot), 2)
+    # The flex-load buy gate reads price_threshold: a dropped priciest
+    # charge must lower it.
+    _refresh_plan_counters(result, config, chosen, remaining)
+    change = f"+{added}" if added else f"-{removed}"
+    result.schedule_reason = (
+        f"{result.schedule_reason} Scenario check: {change} charge slot(s) "
+        f"(reserve shortfall risk {shortfall[0]:.0%} → {shortfall[best]:.0%})."
+    ).strip()
+
+
+@contextmanager
+def _phase(name: str):
+    """Time the enclosed block as phase ``name`` of the running replan."""
+    stats = _PHASE_STATS.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_phase(name, time.perf_counter() - started, stats)
+
+
+def _record_phase(name: str, seconds: float, stats: dict[str, list] | None = None) -> None:
+    """Add one entry of ``seconds`` to phase ``name`` (no-op outside a replan)."""
+    if stats is None:
+        stats = _PHASE_STATS.get()
+        if stats is None:
+            return
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
 def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
     """Calculate optimal charge/discharge schedule.
 
     Pure function — all inputs via config and state, no HA dependencies.
+    The returned result carries the replan's phase timings (``phase_ms`` /
+    ``phase_calls``).
+    """
+    stats: dict[str, list] = {}
+    token = _PHASE_STATS.set(stats)
+    started = time.perf_counter()
+    try:
+        result = _calculate_schedule(config, state)
+    finally:
+        _PHASE_STATS.reset(token)
+    _record_phase("total", time.perf_counter() - started, stats)
+    result.phase_ms = {name: round(entry[0] * 1000.0, 3) for name, entry in stats.items()}
+    result.phase_calls = {name: entry[1] for name, entry in stats.items()}
+    return result
+
+
+def profile_schedule(config: EMSConfig, state: EMSState, path: str) -> ScheduleResult:
+    """calculate_schedule under cProfile, with the stats dumped to ``path``.
+
+    For a one-off look at a slow replan: open the dump with ``python -m
+    pstats`` or snakeviz.  When another profiler already owns this
+    interpreter the replan runs unprofiled and nothing is written.
     """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as err:
+        _LOGGER.warning("Replan not profiled — %s", err)
+        return calculate_schedule(config, state)
+    try:
+        result = calculate_schedule(config, state)
+    finally:
+        profiler.disable()
+    profiler.dump_stats(path)
+    return result
+
+
+def _calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
+    """calculate_schedule's body, run with the phase collector installed."""
+    started = time.perf_counter()
     result = ScheduleResult()
 
     if config.grid_mode == "off" or not state.slot_prices_today:
@@ -2007,6 +3265,12 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
         result.schedule_reason = "All price slots for today have passed"
         return result
 
+    # Extended horizon: every engine plans across midnight exactly as it
+    # does once tomorrow's prices are out.  The horizon is then the same
+    # 48 h the engines already solve every afternoon, so it stays inside the
+    # usual solve budget.
+    state, provisional = _with_estimated_tomorrow(config, state)
+
     # When per-hour PV data is unavailable, synthesize from daily forecast
     # so that _project_soc_trajectory can account for solar production.
     # Forecast service downtime fallback: if pv_forecast_today is missing
@@ -2060,6 +3324,8 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
             previous_pv_confidence=state.previous_pv_confidence,
             last_modbus_read_ts=state.last_modbus_read_ts,
             pv_fallback_today_kwh=state.pv_fallback_today_kwh,
+            pv_error_hourly=state.pv_error_hourly,
+            consumption_error_hourly=state.consumption_error_hourly,
             current_hour=state.current_hour,
             current_minute=state.current_minute,
         )
@@ -2106,6 +3372,7 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
         previous_pv_confidence=state.previous_pv_confidence,
     )
     energy_per_slot = config.safe_power_kw * slot_duration_hours
+    _record_phase("prepare", time.perf_counter() - started)
 
     def _run_greedy() -> ScheduleResult:
         if config.grid_mode == "from_grid":
@@ -2125,16 +3392,29 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
             )
         return ScheduleResult()
 
-    if config.scheduler_engine == "milp":
-        result = _run_milp_or_none(
-            config, state, remaining, current_kwh,
-            num_slots, current_slot, minutes_per_slot,
-        )
-        if result is None:
+    with _phase("engine"):
+        if config.scheduler_engine == "auto":
+            result = _race_engines(
+                config, state, remaining, current_kwh,
+                num_slots, current_slot, minutes_per_slot, _run_greedy,
+            )
+        elif config.scheduler_engine in _SOLVER_ENGINES:
+            result = _run_solver_or_none(
+                config.scheduler_engine, config, state, remaining, current_kwh,
+                num_slots, current_slot, minutes_per_slot,
+            )
+            if result is None:
+                result = _run_greedy()
+                result.scheduler_active = "greedy_fallback"
+        else:
             result = _run_greedy()
-            result.scheduler_active = "greedy_fallback"
-    else:
-        result = _run_greedy()
+
+    result.tomorrow_provisional = provisional
+    if provisional:
+        result.schedule_reason = (
+            f"{result.schedule_reason} Tomorrow planned on estimated prices "
+            f"(provisional)."
+        ).strip()
 
     # Urgent recovery: when battery is below discharge_min, force immediate
     # charge slots starting from the current slot.  The cheapest-slot optimizer
@@ -2154,6 +3434,8 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
             if result.scheduled_slots.get(i) != "charge":
                 result.scheduled_slots[i] = "charge"
                 added += 1
+            # Recovery charges run at full power.
+            result.slot_power_kw.pop(i, None)
         if added:
             _LOGGER.info(
                 "Urgent recovery: battery at %.1f kWh (min=%.1f), "
@@ -2161,6 +3443,21 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
                 current_kwh, min_kwh, added,
             )
 
+    if (config.pv_scenario_samples > 0
+            and config.grid_mode in ("from_grid", "both")
+            and battery_soc is not None):
+        with _phase("scenario_check"):
+            _apply_scenario_check(
+                result, config, state, current_kwh, num_slots, current_slot,
+                minutes_per_slot,
+            )
+
+    # Power levels only apply to slots still scheduled after the passes above.
+    if result.slot_power_kw:
+        result.slot_power_kw = {
+            i: kw for i, kw in result.slot_power_kw.items() if i in result.scheduled_slots
+        }
+
     # Update status
     if not result.scheduled_slots:
         if result.status not in ("off", "no_price_data", "day_complete"):
@@ -2171,42 +3468,30 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
         result.status = "waiting"
 
     # Compute authoritative SOC trajectory with the finalized schedule
-    result.soc_trajectory = _compute_scheduled_soc_trajectory(
-        prices, num_slots, minutes_per_slot,
-        current_kwh, current_slot,
-        result.scheduled_slots,
-        config, state,
-    )
+    with _phase("trajectory"):
+        result.soc_trajectory = _compute_scheduled_soc_trajectory(
+            prices, num_slots, minutes_per_slot,
+            current_kwh, current_slot,
+            result.scheduled_slots,
+            config, state, result.slot_power_kw,
+        )
 
     # Compute tomorrow's schedule and trajectory (if tomorrow prices exist).
     # When the MILP already provided tomorrow_scheduled_slots, skip the
     # greedy reconstruction and only compute the SOC trajectory.
     if state.slot_prices_tomorrow:
-        if result.tomorrow_scheduled_slots:
-            tmr_num = len(state.slot_prices_tomorrow)
-            tmr_mps = (24 * 60) / tmr_num
-            min_kwh_t = (config.battery_discharge_min_pct / 100.0) * config.battery_capacity_kwh
-            if result.soc_trajectory:
-                midnight_pct = result.soc_trajectory[-1]
-                midnight_kwh_t = max(min_kwh_t, (midnight_pct / 100.0) * config.battery_capacity_kwh)
+        with _phase("tomorrow"):
+            if result.tomorrow_scheduled_slots:
+                result.tomorrow_soc_trajectory = _tomorrow_trajectory_for_slots(
+                    config, state, result.soc_trajectory, result.tomorrow_scheduled_slots,
+                    result.tomorrow_slot_power_kw,
+                )
             else:
-                midnight_kwh_t = min_kwh_t
-            pv_tmr_hourly = state.pv_hourly_kwh_tomorrow or {}
-            if not pv_tmr_hourly:
-                pv_total = state.pv_forecast_tomorrow or 0.0
-                daylight = list(range(6, 18))
-                per_h = pv_total / len(daylight) if daylight else 0.0
-                pv_tmr_hourly = {h: per_h for h in daylight}
-            result.tomorrow_soc_trajectory = _compute_tomorrow_soc_trajectory(
-                config, state, result.tomorrow_scheduled_slots,
-                midnight_kwh_t, tmr_num, tmr_mps, pv_tmr_hourly,
-            )
-        else:
-            tmr_slots, tmr_traj = _compute_tomorrow_schedule(
-                config, state, result, result.soc_trajectory,
-            )
-            result.tomorrow_scheduled_slots = tmr_slots
-            result.tomorrow_soc_trajectory = tmr_traj
+                tmr_slots, tmr_traj = _compute_tomorrow_schedule(
+                    config, state, result, result.soc_trajectory,
+                )
+                result.tomorrow_scheduled_slots = tmr_slots
+                result.tomorrow_soc_trajectory = tmr_traj
 
     # Schedule flexible loads into cheap / PV-surplus slots
     active_loads = [ld for ld in config.flexible_loads if ld.enabled]
@@ -2226,14 +3511,15 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
         charge_prices = [p for i, p in remaining
                          if result.scheduled_slots.get(i) == "charge"]
         flex_buy_threshold = max(charge_prices) if charge_prices else None
-        result.load_slots = _schedule_flexible_loads(
-            config.flexible_loads,
-            remaining,
-            result.scheduled_slots,
-            flex_buy_threshold,
-            pv_surplus_set,
-            config.ev_charge_strategy,
-        )
+        with _phase("flex"):
+            result.load_slots = _schedule_flexible_loads(
+                config.flexible_loads,
+                remaining,
+                result.scheduled_slots,
+                flex_buy_threshold,
+                pv_surplus_set,
+                config.ev_charge_strategy,
+            )
 
         # Tomorrow's flex load schedule (same strategy, tomorrow's data)
         if state.slot_prices_tomorrow:
@@ -2251,18 +3537,337 @@ def calculate_schedule(config: EMSConfig, state: EMSState) -> ScheduleResult:
                 if result.tomorrow_scheduled_slots.get(i) == "charge"
             ]
             tmr_threshold = max(tmr_charge_prices) if tmr_charge_prices else flex_buy_threshold
-            result.tomorrow_load_slots = _schedule_flexible_loads(
-                config.flexible_loads,
-                tmr_remaining,
-                result.tomorrow_scheduled_slots,
-                tmr_threshold,
-                tmr_pv_surplus,
-                config.ev_charge_strategy,
-            )
+            with _phase("flex"):
+                result.tomorrow_load_slots = _schedule_flexible_loads(
+                    config.flexible_loads,
+                    tmr_remaining,
+                    result.tomorrow_scheduled_slots,
+                    tmr_threshold,
+                    tmr_pv_surplus,
+                    config.ev_charge_strategy,
+                )
 
     return result
 
 
+def _tomorrow_trajectory_for_slots(
+    config: EMSConfig,
+    state: EMSState,
+    today_trajectory: list[float],
+    tomorrow_slots: dict[int, str],
+    slot_power_kw: dict[int, float] | None = None,
+) -> list[float]:
+    """Tomorrow's SOC% trajectory for a given tomorrow plan, from today's midnight SOC."""
+    tmr_num = len(state.slot_prices_tomorrow)
+    tmr_mps = (24 * 60) / tmr_num
+    min_kwh_t = (config.battery_discharge_min_pct / 100.0) * config.battery_capacity_kwh
+    if today_trajectory:
+        midnight_pct = today_trajectory[-1]
+        midnight_kwh_t = max(min_kwh_t, (midnight_pct / 100.0) * config.battery_capacity_kwh)
+    else:
+        midnight_kwh_t = min_kwh_t
+    pv_tmr_hourly = state.pv_hourly_kwh_tomorrow or {}
+    if not pv_tmr_hourly:
+        pv_total = state.pv_forecast_tomorrow or 0.0
+        daylight = list(range(6, 18))
+        per_h = pv_total / len(daylight) if daylight else 0.0
+        pv_tmr_hourly = {h: per_h for h in daylight}
+    return _compute_tomorrow_soc_trajectory(
+        config, state, tomorrow_slots,
+        midnight_kwh_t, tmr_num, tmr_mps, pv_tmr_hourly, slot_power_kw,
+    )
+
+
+def _with_estimated_tomorrow(config: EMSConfig, state: EMSState) -> tuple[EMSState, bool]:
+    """Stand in the estimated curve for tomorrow's unknown prices.
+
+    With config.extended_horizon and no published tomorrow prices, returns
+    ``state`` with slot_prices_tomorrow set to the estimate (and the
+    stored-actuals PV total for a missing PV forecast), flagged provisional.
+    """
+    if not (config.extended_horizon and not state.slot_prices_tomorrow
+            and state.slot_prices_tomorrow_estimate):
+        return state, False
+    pv_tomorrow = state.pv_forecast_tomorrow or state.pv_tomorrow_estimate_kwh
+    return replace(
+        state,
+        slot_prices_tomorrow=list(state.slot_prices_tomorrow_estimate),
+        pv_forecast_tomorrow=pv_tomorrow,
+    ), True
+
+
+def repair_schedule(
+    previous: ScheduleResult,
+    config: EMSConfig,
+    state: EMSState,
+    max_added_slots: int = 4,
+) -> ScheduleResult | None:
+    """Shift ``previous`` to the current slot and repair it locally.
+
+    Cheap alternative to calculate_schedule when only the SOC has drifted:
+    past slots are dropped, the remaining plan is re-validated from the
+    actual battery level (overflowing charges and floor-breaching
+    discharges are pruned by _validate_schedule_soc), and when the repaired
+    trajectory now hits the hardware floor where the previous one did not,
+    the cheapest unscheduled slots up to that point are added as charges
+    (grid charging modes only).
+    Tomorrow's plan is kept; its trajectory is re-derived from the new
+    midnight SOC.
+
+    Returns None when the plan cannot be repaired locally — no prices, the
+    day is complete, tomorrow switched between estimated and published
+    prices, or the dip needs more than ``max_added_slots`` charges — so the
+    caller runs a full replan.  A provisional plan is repaired on the same
+    estimated tomorrow calculate_schedule used (extended horizon).
+    """
+    prices = state.slot_prices_today
+    if config.grid_mode == "off" or not prices or config.battery_capacity_kwh <= 0:
+        return None
+    num_slots = len(prices)
+    minutes_per_slot = (24 * 60) / num_slots
+    current_slot = min(
+        int((state.current_hour * 60 + state.current_minute) / minutes_per_slot),
+        num_slots - 1,
+    )
+    remaining = [(i, prices[i]) for i in range(current_slot, num_slots) if prices[i] is not None]
+    if not remaining or state.battery_soc_pct is None:
+        return None
+    # A provisional plan keeps planning tomorrow on the estimate; once the
+    # real prices are out only a full replan can use them.
+    state, provisional = _with_estimated_tomorrow(config, state)
+    if provisional != previous.tomorrow_provisional:
+        return None
+
+    # Same PV view calculate_schedule plans with: synthesize hourly PV from
+    # the daily total (or the coordinator's 7-day fallback) when missing.
+    forecast_total = state.pv_forecast_today or state.pv_fallback_today_kwh
+    if not state.pv_hourly_kwh and forecast_total and forecast_total > 0:
+        state = replace(state, pv_hourly_kwh=_synthesize_pv_hourly(forecast_total))
+
+    cap = config.battery_capacity_kwh
+    current_kwh = (state.battery_soc_pct / 100.0) * cap
+    min_kwh = (config.battery_discharge_min_pct / 100.0) * cap
+    # Greedy plans were validated against the reserve, so repair them the
+    # same way.  The solver engines price reserve shortfall instead of
+    # forbidding it, so their discharges are only held to the hardware floor.
+    solver_plan = previous.scheduler_active in _SOLVER_ENGINES
+    if config.discharge_to_make_room_for_negative_price or solver_plan:
+        floor = min_kwh
+    else:
+        floor = max(min_kwh, (previous.reserve_target_pct / 100.0) * cap)
+    pv_confidence = _calculate_pv_confidence(
+        state.pv_hourly_kwh, state.pv_actual_today_kwh,
+        state.current_hour, state.current_minute,
+        previous_confidence=state.previous_pv_confidence,
+    )
+    energy_per_slot = config.safe_power_kw * (minutes_per_slot / 60.0)
+    slot_power = previous.slot_power_kw
+
+    def _validated(scheduled: dict[int, str]) -> dict[int, str]:
+        charge, discharge = _validate_schedule_soc(
+            remaining,
+            {i for i, a in scheduled.items() if a == "charge"},
+            {i for i, a in scheduled.items() if a == "discharge"},
+            current_kwh, config.consumption_est_kwh / num_slots,
+            state.pv_hourly_kwh or {}, minutes_per_slot, pv_confidence,
+            cap, floor, energy_per_slot, config.efficiency,
+            consumption_hourly_kwh=state.consumption_hourly_kwh,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            safe_power_kw=config.safe_power_kw,
+            keep_all_negative_charges=config.charge_to_full_on_negative_price,
+            # Only greedy's from_grid validation keeps partial charges;
+            # to_grid/both keep their stricter overflow pruning.
+            keep_partial_charges=(config.grid_mode == "from_grid"
+                                  and not config.charge_to_full_on_negative_price),
+            slot_power_kw=slot_power,
+        )
+        if solver_plan:
+            # The solver sized its charges against its own PV/partial-power
+            # model; the greedy overflow rules would second-guess that, so
+            # only its discharges are re-checked.  A charge slot on a full
+            # battery simply does nothing at run time.
+            charge |= {i for i, a in scheduled.items() if a == "charge"}
+        return {i: ("charge" if i in charge else "discharge")
+                for i in sorted(charge | discharge)}
+
+    kept = {i: a for i, a in previous.scheduled_slots.items() if i >= current_slot}
+    ceiling = _charge_price_ceiling(kept, remaining)
+    scheduled = _validated(kept)
+    trajectory = _compute_scheduled_soc_trajectory(
+        prices, num_slots, minutes_per_slot, current_kwh, current_slot,
+        scheduled, config, state, slot_power,
+    )
+    # The trajectory clamps at the hardware floor, so a violation shows as
+    # the SOC pinned there at a slot where the previous plan stayed clear.
+    min_pct = config.battery_discharge_min_pct
+    planned = previous.soc_trajectory
+
+    def _new_floor_contact(traj: list[float]) -> int | None:
+        return next((i for i in range(current_slot, num_slots)
+                     if traj[i] <= min_pct + 0.05
+                     and (i >= len(planned) or planned[i] > min_pct + 0.5)), None)
+
+    added = 0
+    while True:
+        dip = _new_floor_contact(trajectory)
+        if dip is None:
+            break
+        if config.grid_mode not in ("from_grid", "both") or added >= max_added_slots:
+            return None
+        candidates = [(p, i) for i, p in remaining
+                      if i <= dip and i not in scheduled and p <= ceiling]
+        if not candidates:
+            return None
+        slot = min(candidates)[1]
+        scheduled = _validated({**scheduled, slot: "charge"})
+        if scheduled.get(slot) != "charge":
+            return None
+        added += 1
+        trajectory = _compute_scheduled_soc_trajectory(
+            prices, num_slots, minutes_per_slot, current_kwh, current_slot,
+            scheduled, config, state, slot_power,
+        )
+
+    result = replace(
+        previous,
+        scheduled_slots=scheduled,
+        slot_power_kw={i: kw for i, kw in slot_power.items() if i in scheduled},
+        soc_trajectory=trajectory,
+        load_slots={load: {i: on for i, on in slots.items() if i >= current_slot}
+                    for load, slots in previous.load_slots.items()},
+        solver_stats={**previous.solver_stats, "repaired": True},
+    )
+    if state.slot_prices_tomorrow and result.tomorrow_scheduled_slots:
+        result.tomorrow_soc_trajectory = _tomorrow_trajectory_for_slots(
+            config, state, trajectory, result.tomorrow_scheduled_slots,
+            result.tomorrow_slot_power_kw,
+        )
+    result.grid_energy_planned = round(_planned_charge_kwh(
+        config, scheduled, result.slot_power_kw, minutes_per_slot), 2)
+    n_charge, n_sell = _refresh_plan_counters(result, config, scheduled, remaining)
+    parts = []
+    if n_charge:
+        parts.append(f"buying {n_charge} slot(s)")
+    if n_sell:
+        parts.append(f"selling {n_sell} slot(s)")
+    result.schedule_reason = (
+        f"Repaired plan from {state.battery_soc_pct:.0f}% SOC: "
+        + (", ".join(parts) if parts else "no grid action needed")
+    )
+    if added:
+        result.schedule_reason += f" ({added} charge slot(s) added to hold the floor)"
+    if provisional:
+        result.schedule_reason += " Tomorrow planned on estimated prices (provisional)."
+    if not scheduled:
+        result.status = "no_action_needed"
+    elif current_slot in scheduled:
+        result.status = "active"
+    else:
+        result.status = "waiting"
+    return result
+
+
+def _share_batch_inputs(states: list[EMSState]) -> list[EMSState]:
+    """Make equal per-slot inputs the same objects across ``states``.
+
+    Sweeps vary one knob over the same day, so the price, PV and
+    consumption arrays are usually equal.  Sharing them means each is
+    pickled once per worker chunk (pickle memoises repeated objects) rather
+    than once per scenario.
+    """
+    arrays: dict[tuple, object] = {}
+
+    def _shared(value):
+        if not value:
+            return value
+        items = tuple(value.items()) if isinstance(value, dict) else tuple(value)
+        return arrays.setdefault((type(value), items), value)
+
+    return [
+        replace(
+            state,
+            slot_prices_today=_shared(state.slot_prices_today),
+            slot_prices_tomorrow=_shared(state.slot_prices_tomorrow),
+            pv_hourly_kwh=_shared(state.pv_hourly_kwh),
+            pv_hourly_kwh_tomorrow=_shared(state.pv_hourly_kwh_tomorrow),
+            consumption_hourly_kwh=_shared(state.consumption_hourly_kwh),
+        )
+        for state in states
+    ]
+
+
+def _solve_batch_chunk(
+    pairs: list[tuple[EMSConfig, EMSState]],
+) -> list[ScheduleResult]:
+    """Worker-side loop of calculate_schedule_batch."""
+    return [calculate_schedule(config, state) for config, state in pairs]
+
+
+def calculate_schedule_batch(
+    configs: list[EMSConfig] | EMSConfig,
+    states: list[EMSState] | EMSState,
+    workers: int | None = 1,
+) -> ScheduleBatch:
+    """Run calculate_schedule over many scenarios (sensitivity / what-if sweeps).
+
+    ``configs`` and ``states`` are paired by position; either may be a
+    single object that is broadcast to the other's length.  Identical
+    scenarios are solved once and equal input arrays are shared (see
+    _share_batch_inputs).  With ``workers`` > 1 (None = one per CPU) the
+    distinct scenarios are split into chunks over a spawned process pool;
+    results are identical to calling calculate_schedule one by one.  Loaded
+    flat by path (as the tools do) this module is "ems", so the caller must
+    put its directory on sys.path for the spawned children to import it.
+    """
+    if isinstance(configs, EMSConfig):
+        configs = [configs] * (1 if isinstance(states, EMSState) else len(states))
+    if isinstance(states, EMSState):
+        states = [states] * len(configs)
+    if len(configs) != len(states):
+        raise ValueError(
+            f"configs and states differ in length ({len(configs)} vs {len(states)})"
+        )
+    # Offline sweep machinery: imported here so the integration never loads it.
+    import multiprocessing
+    import os
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+
+    states = _share_batch_inputs(list(states))
+
+    # Deduplicate on the pickled inputs: dataclasses holding lists/dicts are
+    # not hashable, and pickle is what the pool would send anyway.
+    distinct: list[tuple[EMSConfig, EMSState]] = []
+    index_of: dict[bytes, int] = {}
+    rows: list[int] = []
+    for config, state in zip(configs, states):
+        key = pickle.dumps((config, state), pickle.HIGHEST_PROTOCOL)
+        if key not in index_of:
+            index_of[key] = len(distinct)
+            distinct.append((config, state))
+        rows.append(index_of[key])
+
+    workers = (os.cpu_count() or 1) if workers is None else max(1, workers)
+    if workers == 1 or len(distinct) < 2:
+        solved = _solve_batch_chunk(distinct)
+    else:
+        # A few chunks per worker balances uneven solve times (MILP vs a
+        # trivial "off" scenario) without paying per-scenario IPC.
+        size = max(1, math.ceil(len(distinct) / (workers * 4)))
+        chunks = [distinct[i:i + size] for i in range(0, len(distinct), size)]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(chunks)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            solved = [r for chunk in pool.map(_solve_batch_chunk, chunks) for r in chunk]
+
+    names = [f.name for f in fields(ScheduleResult)]
+    return ScheduleBatch(
+        columns={name: [getattr(solved[i], name) for i in rows] for name in names},
+        solved=len(distinct),
+    )
+
+
 def _schedule_from_grid(
     config: EMSConfig,
     state: EMSState,
@@ -2288,10 +3893,11 @@ def _schedule_from_grid(
     # at ~18 EUR/kWh evening peak.  Scoped to from_grid because both/to_grid
     # use the reserve to also gate SELLING, where shrinking it at night has
     # different (trade-off) implications.
-    reserve_kwh = calculate_self_consumption_reserve(
-        config.consumption_est_kwh, state.pv_hourly_kwh,
-        state.current_hour, state.current_minute,
-        consumption_hourly_kwh=state.consumption_hourly_kwh)
+    with _phase("greedy.reserve"):
+        reserve_kwh = calculate_self_consumption_reserve(
+            config.consumption_est_kwh, state.pv_hourly_kwh,
+            state.current_hour, state.current_minute,
+            consumption_hourly_kwh=state.consumption_hourly_kwh)
     result.self_consumption_reserve = round(reserve_kwh, 2)
 
     min_kwh = (config.battery_discharge_min_pct / 100.0) * config.battery_capacity_kwh
@@ -2299,7 +3905,8 @@ def _schedule_from_grid(
     # for self-use (daytime), but at night the battery should ride down to
     # survival and refill from tomorrow's PV — not be topped up at peak prices.
     night = _is_night(state.pv_hourly_kwh, state.current_hour, state.current_minute)
-    reserve_target = _compute_reserve_target(config, reserve_kwh, apply_boost=not night)
+    with _phase("greedy.reserve"):
+        reserve_target = _compute_reserve_target(config, reserve_kwh, apply_boost=not night)
     result.reserve_target_pct = round(
         (reserve_target / config.battery_capacity_kwh) * 100.0, 1,
     ) if config.battery_capacity_kwh > 0 else 0.0
@@ -2352,24 +3959,25 @@ def _schedule_from_grid(
     else:
         energy_deficit = base_deficit
 
-    selected, tomorrow_slots, tomorrow_charge_kwh = select_unified_charge_slots(
-        remaining, energy_deficit, effective_per_slot,
-        config.battery_capacity_kwh, config.battery_discharge_min_pct,
-        config.consumption_est_kwh, config.efficiency, energy_per_slot,
-        current_kwh=current_kwh, net_pv=net_pv,
-        charge_max_pct=config.battery_charge_max_pct,
-        slot_prices_tomorrow=state.slot_prices_tomorrow,
-        pv_forecast_tomorrow=state.pv_forecast_tomorrow,
-        pv_hourly_kwh=state.pv_hourly_kwh,
-        current_hour=state.current_hour,
-        reserve_target_pct=config.reserve_target_pct,
-        optimization_priority=config.optimization_priority,
-        safe_power_kw=config.safe_power_kw,
-        inverter_max_power_kw=config.inverter_max_power_kw,
-        pv_confidence=pv_confidence,
-        minutes_per_slot=minutes_per_slot,
-        pv_hourly_kwh_tomorrow=state.pv_hourly_kwh_tomorrow,
-    )
+    with _phase("greedy.selection"):
+        selected, tomorrow_slots, tomorrow_charge_kwh = select_unified_charge_slots(
+            remaining, energy_deficit, effective_per_slot,
+            config.battery_capacity_kwh, config.battery_discharge_min_pct,
+            config.consumption_est_kwh, config.efficiency, energy_per_slot,
+            current_kwh=current_kwh, net_pv=net_pv,
+            charge_max_pct=config.battery_charge_max_pct,
+            slot_prices_tomorrow=state.slot_prices_tomorrow,
+            pv_forecast_tomorrow=state.pv_forecast_tomorrow,
+            pv_hourly_kwh=state.pv_hourly_kwh,
+            current_hour=state.current_hour,
+            reserve_target_pct=config.reserve_target_pct,
+            optimization_priority=config.optimization_priority,
+            safe_power_kw=config.safe_power_kw,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            pv_confidence=pv_confidence,
+            minutes_per_slot=minutes_per_slot,
+            pv_hourly_kwh_tomorrow=state.pv_hourly_kwh_tomorrow,
+        )
 
     result.tomorrow_precharge = round(-tomorrow_charge_kwh, 2) if tomorrow_charge_kwh > 0 else 0.0
     result.tomorrow_planned_slots = len(tomorrow_slots)
@@ -2428,18 +4036,19 @@ def _schedule_from_grid(
 
     # Per-slot SOC validation: ensure charge doesn't push SOC above capacity
     charge_set = {s[0] for s in selected}
-    validated_charge, _ = _validate_schedule_soc(
-        remaining, charge_set, set(),
-        current_kwh, consumption_per_slot,
-        state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
-        config.battery_capacity_kwh, min_kwh,
-        energy_per_slot, config.efficiency,
-        consumption_hourly_kwh=state.consumption_hourly_kwh,
-        inverter_max_power_kw=config.inverter_max_power_kw,
-        safe_power_kw=config.safe_power_kw,
-        keep_all_negative_charges=config.charge_to_full_on_negative_price,
-        keep_partial_charges=not config.charge_to_full_on_negative_price,
-    )
+    with _phase("greedy.validation"):
+        validated_charge, _ = _validate_schedule_soc(
+            remaining, charge_set, set(),
+            current_kwh, consumption_per_slot,
+            state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
+            config.battery_capacity_kwh, min_kwh,
+            energy_per_slot, config.efficiency,
+            consumption_hourly_kwh=state.consumption_hourly_kwh,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            safe_power_kw=config.safe_power_kw,
+            keep_all_negative_charges=config.charge_to_full_on_negative_price,
+            keep_partial_charges=not config.charge_to_full_on_negative_price,
+        )
 
     # Re-shop any charge energy that validation dropped for overflow into
     # later slots where prior consumption has freed headroom, so the overnight
@@ -2461,15 +4070,16 @@ def _schedule_from_grid(
         # Marginal price the selector already committed to: never re-shop the
         # dropped energy into a pricier slot (see _fill_charge_to_deficit).
         fill_max_price = max((p for _, p in selected if p is not None), default=None)
-        validated_charge = _fill_charge_to_deficit(
-            remaining, validated_charge, fill_target,
-            current_kwh, consumption_per_slot, state.pv_hourly_kwh,
-            minutes_per_slot, pv_confidence, config.battery_capacity_kwh,
-            min_kwh, energy_per_slot, config.efficiency,
-            config.inverter_max_power_kw, config.safe_power_kw,
-            state.consumption_hourly_kwh,
-            max_price=fill_max_price,
-        )
+        with _phase("greedy.refill"):
+            validated_charge = _fill_charge_to_deficit(
+                remaining, validated_charge, fill_target,
+                current_kwh, consumption_per_slot, state.pv_hourly_kwh,
+                minutes_per_slot, pv_confidence, config.battery_capacity_kwh,
+                min_kwh, energy_per_slot, config.efficiency,
+                config.inverter_max_power_kw, config.safe_power_kw,
+                state.consumption_hourly_kwh,
+                max_price=fill_max_price,
+            )
 
     price_of_remaining = {idx: p for idx, p in remaining}
     selected = [
@@ -2537,10 +4147,12 @@ def _schedule_to_grid(
     result = ScheduleResult()
 
     # Reserve-aware: protect self-consumption reserve
-    reserve_kwh = calculate_self_consumption_reserve(
-        config.consumption_est_kwh, state.pv_hourly_kwh)
+    with _phase("greedy.reserve"):
+        reserve_kwh = calculate_self_consumption_reserve(
+            config.consumption_est_kwh, state.pv_hourly_kwh)
     result.self_consumption_reserve = round(reserve_kwh, 2)
-    reserve_target = _compute_reserve_target(config, reserve_kwh)
+    with _phase("greedy.reserve"):
+        reserve_target = _compute_reserve_target(config, reserve_kwh)
     result.reserve_target_pct = round(
         (reserve_target / config.battery_capacity_kwh) * 100.0, 1,
     ) if config.battery_capacity_kwh > 0 else 0.0
@@ -2604,16 +4216,17 @@ def _schedule_to_grid(
 
     # Per-slot SOC validation: ensure discharge doesn't drop SOC below min
     discharge_set = {s[0] for s in selected}
-    _, validated_discharge = _validate_schedule_soc(
-        remaining, set(), discharge_set,
-        current_kwh, consumption_per_slot,
-        state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
-        config.battery_capacity_kwh, reserve_target,
-        energy_per_slot, config.efficiency,
-        consumption_hourly_kwh=state.consumption_hourly_kwh,
-        inverter_max_power_kw=config.inverter_max_power_kw,
-        safe_power_kw=config.safe_power_kw,
-    )
+    with _phase("greedy.validation"):
+        _, validated_discharge = _validate_schedule_soc(
+            remaining, set(), discharge_set,
+            current_kwh, consumption_per_slot,
+            state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
+            config.battery_capacity_kwh, reserve_target,
+            energy_per_slot, config.efficiency,
+            consumption_hourly_kwh=state.consumption_hourly_kwh,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            safe_power_kw=config.safe_power_kw,
+        )
     selected = [(idx, p) for idx, p in selected if idx in validated_discharge]
 
     if not selected:
@@ -2655,11 +4268,13 @@ def _schedule_both(
     effective_per_slot = energy_per_slot * config.efficiency
     round_trip_eff = config.efficiency * config.efficiency
 
-    reserve_kwh = calculate_self_consumption_reserve(
-        config.consumption_est_kwh, state.pv_hourly_kwh)
+    with _phase("greedy.reserve"):
+        reserve_kwh = calculate_self_consumption_reserve(
+            config.consumption_est_kwh, state.pv_hourly_kwh)
     result.self_consumption_reserve = round(reserve_kwh, 2)
 
-    reserve_target = _compute_reserve_target(config, reserve_kwh)
+    with _phase("greedy.reserve"):
+        reserve_target = _compute_reserve_target(config, reserve_kwh)
     result.reserve_target_pct = round(
         (reserve_target / config.battery_capacity_kwh) * 100.0, 1,
     ) if config.battery_capacity_kwh > 0 else 0.0
@@ -2756,24 +4371,25 @@ def _schedule_both(
                 cheapest_buy, most_expensive, min_profitable_sell, energy_deficit,
             )
 
-    charge_slots, tomorrow_slots, tomorrow_charge_kwh = select_unified_charge_slots(
-        remaining, energy_deficit, effective_per_slot,
-        config.battery_capacity_kwh, config.battery_discharge_min_pct,
-        config.consumption_est_kwh, config.efficiency, energy_per_slot,
-        current_kwh=current_kwh, net_pv=net_pv,
-        charge_max_pct=config.battery_charge_max_pct,
-        slot_prices_tomorrow=state.slot_prices_tomorrow,
-        pv_forecast_tomorrow=state.pv_forecast_tomorrow,
-        pv_hourly_kwh=state.pv_hourly_kwh,
-        current_hour=state.current_hour,
-        reserve_target_pct=config.reserve_target_pct,
-        optimization_priority=config.optimization_priority,
-        safe_power_kw=config.safe_power_kw,
-        inverter_max_power_kw=config.inverter_max_power_kw,
-        pv_confidence=pv_confidence,
-        minutes_per_slot=minutes_per_slot,
-        pv_hourly_kwh_tomorrow=state.pv_hourly_kwh_tomorrow,
-    )
+    with _phase("greedy.selection"):
+        charge_slots, tomorrow_slots, tomorrow_charge_kwh = select_unified_charge_slots(
+            remaining, energy_deficit, effective_per_slot,
+            config.battery_capacity_kwh, config.battery_discharge_min_pct,
+            config.consumption_est_kwh, config.efficiency, energy_per_slot,
+            current_kwh=current_kwh, net_pv=net_pv,
+            charge_max_pct=config.battery_charge_max_pct,
+            slot_prices_tomorrow=state.slot_prices_tomorrow,
+            pv_forecast_tomorrow=state.pv_forecast_tomorrow,
+            pv_hourly_kwh=state.pv_hourly_kwh,
+            current_hour=state.current_hour,
+            reserve_target_pct=config.reserve_target_pct,
+            optimization_priority=config.optimization_priority,
+            safe_power_kw=config.safe_power_kw,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            pv_confidence=pv_confidence,
+            minutes_per_slot=minutes_per_slot,
+            pv_hourly_kwh_tomorrow=state.pv_hourly_kwh_tomorrow,
+        )
 
     result.tomorrow_precharge = round(-tomorrow_charge_kwh, 2) if tomorrow_charge_kwh > 0 else 0.0
     result.tomorrow_planned_slots = len(tomorrow_slots)
@@ -2906,17 +4522,18 @@ def _schedule_both(
     # Per-slot SOC validation: ensure combined schedule respects battery bounds
     charge_set = {s[0] for s in charge_slots}
     discharge_set = {s[0] for s in sell_selected}
-    validated_charge, validated_discharge = _validate_schedule_soc(
-        remaining, charge_set, discharge_set,
-        current_kwh, consumption_per_slot,
-        state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
-        config.battery_capacity_kwh, reserve_target,
-        energy_per_slot, config.efficiency,
-        consumption_hourly_kwh=state.consumption_hourly_kwh,
-        inverter_max_power_kw=config.inverter_max_power_kw,
-        safe_power_kw=config.safe_power_kw,
-        keep_all_negative_charges=config.charge_to_full_on_negative_price,
-    )
+    with _phase("greedy.validation"):
+        validated_charge, validated_discharge = _validate_schedule_soc(
+            remaining, charge_set, discharge_set,
+            current_kwh, consumption_per_slot,
+            state.pv_hourly_kwh, minutes_per_slot, pv_confidence,
+            config.battery_capacity_kwh, reserve_target,
+            energy_per_slot, config.efficiency,
+            consumption_hourly_kwh=state.consumption_hourly_kwh,
+            inverter_max_power_kw=config.inverter_max_power_kw,
+            safe_power_kw=config.safe_power_kw,
+            keep_all_negative_charges=config.charge_to_full_on_negative_price,
+        )
     charge_slots = [(idx, p) for idx, p in charge_slots if idx in validated_charge]
     sell_selected = [(idx, p) for idx, p in sell_selected if idx in validated_discharge]
 
@@ -2139,8 +2139,8 @@ class FelicityEMSCard extends LitElement {
             </div>
             <div class="status-bar">
               ${operationalMode ? html`<span class="status-chip mode">${operationalMode}</span>` : ''}
-              ${schedulerEngine === "milp" ? html`
-                <span class="status-chip engine ${schedulerActive === 'greedy_fallback' ? 'fallback' : ''}">${schedulerActive === 'milp' ? 'MILP' : schedulerActive === 'greedy_fallback' ? 'Greedy (fallback)' : 'Greedy'}</span>
+              ${schedulerEngine === "milp" || schedulerEngine === "dp" || schedulerEngine === "auto" ? html`
+                <span class="status-chip engine ${schedulerActive === 'greedy_fallback' ? 'fallback' : ''}">${schedulerEngine === 'auto' ? 'Auto: ' : ''}${schedulerActive === 'milp' ? 'MILP' : schedulerActive === 'dp' ? 'DP' : schedulerActive === 'greedy_fallback' ? 'Greedy (fallback)' : 'Greedy'}</span>
               ` : ''}
               ${safeMaxKw != null ? html`
                 <span class="status-chip power ${isThrottled ? 'throttled' : ''}">Active power ${this._fmt(safeMaxKw, 1)} kW</span>
@@ -2212,8 +2212,8 @@ class FelicityEMSCard extends LitElement {
 
   _renderSchedulerEngineControl() {
     const current = this._getState("scheduler_engine") || "greedy";
-    const labels = { greedy: "Greedy (default)", milp: "Optimizer (MILP)" };
-    const options = ["greedy", "milp"];
+    const labels = { greedy: "Greedy (default)", milp: "Optimizer (MILP)", dp: "Optimizer (DP)", auto: "Auto (cheapest)" };
+    const options = ["greedy", "milp", "dp", "auto"];
     return html`
       <div class="control-item">
         <span class="control-label">Scheduler</span>
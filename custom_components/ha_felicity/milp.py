@@ -21,15 +21,19 @@ Design
   precomputed values (reserve target, PV confidence) as arguments.  No
   import of ``ems.py`` — keeps the dependency graph clean and the
   fallback bullet-proof.
-* ``pulp`` is imported lazily inside :func:`solve_schedule`.  If it is
-  not installed, or the solver fails / times out / is infeasible, the
-  function returns ``None`` and the caller falls back to the greedy
-  scheduler.
+* The LP is assembled directly as a sparse column-wise matrix
+  (:func:`_build_lp`) and solved in-process by HiGHS — via ``highspy``, or
+  ``scipy.optimize.milp`` when only scipy is installed.  ``pulp`` (CBC as a
+  subprocess with temp files) is only the fallback when neither in-memory
+  backend exists.  All three are imported lazily; if none is usable, or the
+  solve fails / times out / is infeasible, the function returns ``None``
+  and the caller falls back to the greedy scheduler.
 * Charge and discharge are **binary per-slot** decisions at full safe
-  power — matching how the coordinator actually drives the inverter
-  (a slot is charge / discharge / idle, never a partial power level).
-  The SOC-bound constraints then prevent overflow and phantom charging
-  for free.
+  power — matching how the coordinator drives the inverter by default
+  (a slot is charge / discharge / idle).  The SOC-bound constraints then
+  prevent overflow and phantom charging for free.  With
+  ``config.variable_power`` the continuous per-slot energies are kept
+  instead and returned as per-slot kW levels (:func:`variable_power_slots`).
 
 The MILP produces both today's and tomorrow's ``scheduled_slots``
 from the unified 2-day horizon.  The SOC trajectory and flexible-load
@@ -39,6 +43,7 @@ overlays are still computed by the existing ``ems.py`` machinery.
 from __future__ import annotations
 
 import logging
+import time
 from typing import Any
 
 _LOGGER = logging.getLogger(__name__)
@@ -59,8 +64,46 @@ _SOLVE_TIME_LIMIT = 10
 _MILP_DISABLED = False
 _MILP_DISABLED_REASON = ""
 
+# In-memory LP backend, probed once per process: "highs" (highspy),
+# "scipy" (scipy.optimize.milp, which wraps the same HiGHS code) or None.
+# Either solves the sparse model directly from Python arrays — no .mps file
+# in /tmp, no CBC fork, no solution-file parse — which on Raspberry-Pi
+# class hosts is the difference between milliseconds and seconds.
+_INMEMORY_BACKEND: str | None = None
+_INMEMORY_PROBED = False
 
-def _pick_solver(pulp):
+# Column layout of the LP: _SLOT_COLS columns per horizon slot (offsets
+# below), then the end-of-horizon reserve shortfall, the midnight reserve
+# shortfall and the capped leftover-SOC reward.
+_SLOT_COLS = 5
+_COL_C, _COL_D, _COL_SPILL, _COL_SOC, _COL_IMP = range(_SLOT_COLS)
+_INF = float("inf")
+
+# Variable power: a slot is activated once its level reaches this share of
+# safe power (or one power step, whichever is larger).
+_VARIABLE_MIN_FRAC = 0.05
+
+
+def _inmemory_backend() -> str | None:
+    """Return the in-memory LP backend to use, probing imports only once."""
+    global _INMEMORY_BACKEND, _INMEMORY_PROBED
+    if not _INMEMORY_PROBED:
+        _INMEMORY_PROBED = True
+        try:
+            import highspy  # noqa: F401
+            _INMEMORY_BACKEND = "highs"
+        except (ImportError, OSError):
+            try:
+                from scipy.optimize import milp  # noqa: F401
+                _INMEMORY_BACKEND = "scipy"
+            except (ImportError, OSError):
+                _INMEMORY_BACKEND = None
+        _LOGGER.debug("MILP in-memory LP backend: %s",
+                      _INMEMORY_BACKEND or "none (pulp/CBC fallback)")
+    return _INMEMORY_BACKEND
+
+
+def _pick_solver(pulp, time_limit: float = _SOLVE_TIME_LIMIT):
     """Return an available CBC-class LP solver, or None.
 
     pulp ships a prebuilt CBC binary, but it is not published for every
@@ -97,7 +140,7 @@ def _pick_solver(pulp):
         return None
 
     for name in ("PULP_CBC_CMD", "COIN_CMD"):
-        solver = _try(name, timeLimit=_SOLVE_TIME_LIMIT)
+        solver = _try(name, timeLimit=time_limit)
         if solver is not None:
             return solver
 
@@ -126,35 +169,53 @@ def solve_schedule(
     minutes_per_slot: float,
     reserve_target: float,
     pv_confidence: float,
+    stats: dict[str, Any] | None = None,
+    slot_power: dict[str, dict[int, float]] | None = None,
+    time_limit: float | None = None,
 ) -> tuple[dict[int, str], dict[int, str]] | None:
     """Solve the EMS schedule as a MILP.
 
     Returns ``(today_slots, tomorrow_slots)`` where each is
     ``{slot_index: "charge"|"discharge"}``, or ``None`` if the solver
-    is unavailable or fails (caller falls back to greedy).
+    is unavailable or fails (caller falls back to greedy).  When ``stats``
+    is given it is filled with the solve diagnostics (backend, build_ms,
+    solve_ms, extract_ms, iterations, warm_start).  With
+    ``config.variable_power``, ``slot_power`` receives
+    ``{"today"|"tomorrow": {slot_index: kW}}`` for the slots planned below
+    safe power.  ``time_limit`` (seconds) tightens the solver's wall-clock
+    cap below _SOLVE_TIME_LIMIT; a solve that hits it returns None.
     """
     global _MILP_DISABLED, _MILP_DISABLED_REASON
 
-    # Short-circuit: a prior unrecoverable failure disabled MILP for the
-    # lifetime of this process.  No retry, no traceback spam — greedy runs.
-    if _MILP_DISABLED:
-        return None
+    # In-memory backends solve the same sparse model without a subprocess,
+    # so the pulp/CBC availability machinery below only applies when
+    # neither highspy nor scipy is installed.
+    backend = _inmemory_backend()
+    pulp = None
+    if backend is None:
+        # Short-circuit: a prior unrecoverable failure disabled MILP for the
+        # lifetime of this process.  No retry, no traceback spam — greedy runs.
+        if _MILP_DISABLED:
+            return None
 
-    try:
-        import pulp  # noqa: PLC0415 — lazy import so ems.py works without pulp
-    except Exception as err:  # pragma: no cover - import guard
-        _MILP_DISABLED = True
-        _MILP_DISABLED_REASON = f"pulp import failed: {err}"
-        _LOGGER.warning(
-            "pulp not installed or broken — MILP disabled for this session "
-            "(greedy fallback active; re-checked on next restart). "
-            "Install with: pip install pulp>=2.7.0  Error: %s", err,
-        )
-        return None
+        try:
+            import pulp  # noqa: PLC0415 — lazy import so ems.py works without pulp
+        except Exception as err:  # pragma: no cover - import guard
+            _MILP_DISABLED = True
+            _MILP_DISABLED_REASON = f"pulp import failed: {err}"
+            _LOGGER.warning(
+                "pulp not installed or broken — MILP disabled for this session "
+                "(greedy fallback active; re-checked on next restart). "
+                "Install with: pip install pulp>=2.7.0  Error: %s", err,
+            )
+            return None
+        backend = "pulp"
 
     try:
         return _solve(
-            pulp, config, state,
+            config, state,
+            backend=backend,
+            pulp=pulp,
             remaining=remaining,
             current_kwh=current_kwh,
             num_slots=num_slots,
@@ -162,6 +223,9 @@ def solve_schedule(
             minutes_per_slot=minutes_per_slot,
             reserve_target=reserve_target,
             pv_confidence=pv_confidence,
+            stats=stats,
+            slot_power=slot_power,
+            time_limit=time_limit,
         )
     except FileNotFoundError as err:
         # The CBC solver binary is missing / unrunnable on this platform
@@ -182,32 +246,24 @@ def solve_schedule(
         return None
 
 
-def _solve(
-    pulp,
+def build_horizon(
     config: Any,
     state: Any,
     *,
-    remaining: list[tuple[int, float]],
-    current_kwh: float,
     num_slots: int,
     current_slot: int,
     minutes_per_slot: float,
-    reserve_target: float,
     pv_confidence: float,
-) -> dict[int, str] | None:
+) -> list[dict[str, Any]]:
+    """Build the optimisation horizon shared by the solver engines.
+
+    Today's remaining slots, then all of tomorrow when those prices are
+    known.  Each entry carries the data needed to model one slot's energy
+    balance; ``dp.py`` reads the same horizon so both exact engines see an
+    identical energy model.
+    """
     slot_hours = minutes_per_slot / 60.0
-    cap = config.battery_capacity_kwh
-    eff = config.efficiency
-    soc_max = (config.battery_charge_max_pct / 100.0) * cap
-    soc_min = (config.battery_discharge_min_pct / 100.0) * cap
     safe_kwh = config.safe_power_kw * slot_hours  # full-power slot energy
-
-    if cap <= 0 or safe_kwh <= 0 or not remaining:
-        return None
-
-    # --- Build the optimisation horizon: today's remaining slots, then
-    # all of tomorrow when those prices are known.  Each entry carries
-    # the data needed to model one slot's energy balance. ---
     horizon: list[dict[str, Any]] = []
 
     def _add_day(prices: list[float | None], pv_hourly: dict[int, float],
@@ -240,7 +296,46 @@ def _solve(
     if state.slot_prices_tomorrow:
         _add_day(state.slot_prices_tomorrow, state.pv_hourly_kwh_tomorrow or {},
                  1.0, "tomorrow", 0)
+    return horizon
+
 
+def _solve(
+    config: Any,
+    state: Any,
+    *,
+    backend: str,
+    pulp=None,
+    remaining: list[tuple[int, float]],
+    current_kwh: float,
+    num_slots: int,
+    current_slot: int,
+    minutes_per_slot: float,
+    reserve_target: float,
+    pv_confidence: float,
+    stats: dict[str, Any] | None = None,
+    slot_power: dict[str, dict[int, float]] | None = None,
+    time_limit: float | None = None,
+) -> tuple[dict[int, str], dict[int, str]] | None:
+    if stats is None:
+        stats = {}
+    build_started = time.perf_counter()
+    slot_hours = minutes_per_slot / 60.0
+    cap = config.battery_capacity_kwh
+    eff = config.efficiency
+    soc_max = (config.battery_charge_max_pct / 100.0) * cap
+    soc_min = (config.battery_discharge_min_pct / 100.0) * cap
+    safe_kwh = config.safe_power_kw * slot_hours  # full-power slot energy
+
+    if cap <= 0 or safe_kwh <= 0 or not remaining:
+        return None
+
+    horizon = build_horizon(
+        config, state,
+        num_slots=num_slots,
+        current_slot=current_slot,
+        minutes_per_slot=minutes_per_slot,
+        pv_confidence=pv_confidence,
+    )
     if not horizon:
         return None
 
@@ -262,47 +357,26 @@ def _solve(
     cheapest = min(prices_h)
     most_exp = max(prices_h)
 
-    prob = pulp.LpProblem("ems_schedule", pulp.LpMinimize)
-
     # Charge / discharge energy per slot are continuous within the slot's
     # power cap.  The slot is *marked* charge/discharge for execution if the
     # planned energy is meaningful; the inverter then runs at safe power and
     # naturally stops at the SOC floor.  Round-trip efficiency loss makes
     # charging and discharging the same slot never optimal, so no binary
     # "exclusive" variable is needed — this stays a fast, robust LP.
-    c, d, spill, soc, imp = {}, {}, {}, {}, {}
-    for k, h in enumerate(horizon):
+    charge_ub: list[float] = []
+    discharge_ub: list[float] = []
+    for h in horizon:
         price = h["price"]
-        charge_ub = h["charge_cap"] if allow_charge else 0.0
+        c_ub = h["charge_cap"] if allow_charge else 0.0
         if delta > 0 and price > most_exp - delta:
-            charge_ub = 0.0  # too expensive to be a profitable buy
-        discharge_ub = h["discharge_cap"] if allow_discharge else 0.0
+            c_ub = 0.0  # too expensive to be a profitable buy
+        d_ub = h["discharge_cap"] if allow_discharge else 0.0
         if config.block_export_on_negative_price and price < 0:
-            discharge_ub = 0.0
+            d_ub = 0.0
         if delta > 0 and price < cheapest + delta:
-            discharge_ub = 0.0  # spread too small to sell
-
-        c[k] = pulp.LpVariable(f"c_{k}", lowBound=0, upBound=charge_ub)
-        d[k] = pulp.LpVariable(f"d_{k}", lowBound=0, upBound=discharge_ub)
-        spill[k] = pulp.LpVariable(f"spill_{k}", lowBound=0)
-        soc[k] = pulp.LpVariable(f"soc_{k}", lowBound=soc_min, upBound=soc_max)
-        # Emergency feasibility slack — physically, grid passthrough keeps the
-        # battery from dropping below soc_min (the house draws from grid when
-        # the battery is empty).  Without it the SOC dynamics can be
-        # INFEASIBLE: when consumption drains the battery faster than charging
-        # can offset (e.g. to_grid mode where charging is disallowed, or a very
-        # high-consumption slot), `soc[k] == prev + net + ... ` cannot satisfy
-        # `soc[k] >= soc_min`, and the whole MILP collapses to greedy.  imp[k]
-        # absorbs exactly that deficit.  It carries a high penalty so it's 0 in
-        # every normal case (no behavioural change / parity preserved) and only
-        # activates to keep the LP feasible.
-        imp[k] = pulp.LpVariable(f"imp_{k}", lowBound=0)
-
-    # SOC dynamics.  soc[k] is the level at the *end* of slot k.
-    prev = current_kwh
-    for k in range(K):
-        prob += soc[k] == prev + horizon[k]["net"] + eff * c[k] - d[k] - spill[k] + imp[k]
-        prev = soc[k]
+            d_ub = 0.0  # spread too small to sell
+        charge_ub.append(c_ub)
+        discharge_ub.append(d_ub)
 
     # Reserve constraints are SOFT (slack + penalty), never hard.  A hard
     # `soc >= reserve_target` can be INFEASIBLE — e.g. late evening with the
@@ -317,12 +391,6 @@ def _solve(
     # the slack only absorbs the genuinely-unreachable remainder.
     reserve_clamped = min(reserve_target, soc_max)
     reserve_penalty = max(1.0, most_exp) * 5.0
-    reserve_shortfalls = []
-
-    # End-of-horizon reserve (overnight coverage).
-    end_short = pulp.LpVariable("reserve_short_end", lowBound=0)
-    prob += soc[K - 1] + end_short >= reserve_clamped
-    reserve_shortfalls.append(end_short)
 
     # Midnight boundary: when the horizon spans today+tomorrow, push the
     # battery toward reserve_target by end of today.  Without this the solver
@@ -333,10 +401,8 @@ def _solve(
         if horizon[k]["day"] == "tomorrow":
             midnight_k = k
             break
-    if midnight_k is not None and midnight_k > 0:
-        mid_short = pulp.LpVariable("reserve_short_mid", lowBound=0)
-        prob += soc[midnight_k - 1] + mid_short >= reserve_clamped
-        reserve_shortfalls.append(mid_short)
+    if midnight_k == 0:
+        midnight_k = None
 
     # Value energy left in the battery at the horizon end so the solver
     # doesn't pointlessly dump it at the last positive price.  Reference:
@@ -349,27 +415,12 @@ def _solve(
     # higher (e.g. P90) would charge at uneconomic prices, which an EMS must
     # never do.  Self-consumption differentiates via the reserve floor
     # (1.25× in reserve_target), not by over-charging.
+    #
+    # The leftover SOC is rewarded only UP TO the reserve target (see
+    # reward_soc in _build_lp).
     avg_price = max(0.0, sum(prices_h) / len(prices_h))
     terminal_value = avg_price * eff
 
-    # Reward leftover SOC only UP TO the reserve target — the energy genuinely
-    # needed for overnight survival (and, in self_consumption, the boosted
-    # reserve).  Rewarding ALL leftover SOC (up to soc_max) made the solver
-    # buy any slot below avg·eff² to push the battery toward FULL, even in pure
-    # cost mode where that is over-buying: it spends money now to store energy
-    # the horizon has no modelled use for.  Real symptom: on a duck-curve cost
-    # day MILP charged an extra night slot and a 3rd midday slot to end at 81%
-    # where greedy ended at 52% — and cost MORE (0.895 vs 0.600).  Capping the
-    # reward at the reserve makes the solver fill to the reserve (driven by
-    # reward + soft penalty) but never beyond it for the sake of leftover
-    # value, so it stops over-buying.  Arbitrage (both mode) is unaffected:
-    # energy above the reserve is sold for the explicit sell REVENUE term, not
-    # the terminal reward, so the solver still cycles the battery when a peak
-    # pays for it.  Self-consumption still fills high because its reserve is
-    # the 1.25× boosted value.
-    reward_soc = pulp.LpVariable("reward_soc", lowBound=0, upBound=reserve_clamped)
-    prob += reward_soc <= soc[K - 1]
-
     # Earliness preference: when several slots share the SAME price, charge the
     # EARLIER one.  The cost objective is indifferent between equal-price slots,
     # so the solver would otherwise pick arbitrarily (often the latest, right
@@ -379,31 +430,60 @@ def _solve(
     # granularity, so it NEVER flips a genuine price difference — only breaks
     # ties) nudges charging earlier, giving the same-cost plan a safety buffer.
     early = (avg_price + 0.01) * 1e-4
-    prob += (
-        pulp.lpSum(horizon[k]["price"] * c[k] for k in range(K))           # buy cost
-        - pulp.lpSum(horizon[k]["price"] * eff * d[k] for k in range(K))   # sell revenue
-        + pulp.lpSum(cycle_cost * d[k] for k in range(K))                  # wear
-        - terminal_value * reward_soc                                      # leftover value (≤ reserve)
-        + pulp.lpSum(reserve_penalty * s for s in reserve_shortfalls)      # soft reserve
-        + pulp.lpSum(reserve_penalty * imp[k] for k in range(K))           # feasibility slack
-        + pulp.lpSum(early * k * c[k] for k in range(K))                   # charge earlier (tie-break)
+
+    lp = _build_lp(
+        prices=prices_h,
+        net=[h["net"] for h in horizon],
+        charge_ub=charge_ub,
+        discharge_ub=discharge_ub,
+        current_kwh=current_kwh,
+        eff=eff,
+        soc_min=soc_min,
+        soc_max=soc_max,
+        cycle_cost=cycle_cost,
+        reserve=reserve_clamped,
+        reserve_penalty=reserve_penalty,
+        terminal_value=terminal_value,
+        early=early,
+        midnight_k=midnight_k,
+    )
+    stats["build_ms"] = round((time.perf_counter() - build_started) * 1000.0, 3)
+    x = _run_lp(
+        lp, backend, pulp,
+        warm_key=(getattr(config, "plan_id", ""), grid_mode, cap),
+        slot_keys=[(h["day"], h["slot"]) for h in horizon],
+        stats=stats,
+        time_limit=time_limit,
     )
+    if x is None:
+        return None
+    extract_started = time.perf_counter()
+    c_vals = x[_COL_C:_SLOT_COLS * K:_SLOT_COLS]
+    d_vals = x[_COL_D:_SLOT_COLS * K:_SLOT_COLS]
 
-    solver = _pick_solver(pulp)
-    if solver is None:
-        # No usable LP solver on this platform — structural, so the caller
-        # disables MILP for the session (one warning, greedy runs).  Reuse the
-        # FileNotFoundError path in solve_schedule for the flag + message.
-        raise FileNotFoundError(
-            "no available LP solver — pulp's bundled CBC binary is missing and "
-            "no system CBC (COIN_CMD) was found"
+    if getattr(config, "variable_power", False):
+        # The inverter runs each slot at the planned level, so the LP's
+        # continuous plan is executable as solved — no full-power collapse.
+        if slot_power is None:
+            slot_power = {}
+        today_scheduled, tomorrow_scheduled = variable_power_slots(
+            horizon, c_vals, d_vals,
+            safe_power_kw=config.safe_power_kw,
+            power_step_kw=getattr(config, "power_step_kw", 0.0),
+            minutes_per_slot=minutes_per_slot,
+            slot_power=slot_power,
         )
-    prob.solve(solver)
-
-    status = pulp.LpStatus[prob.status]
-    if status != "Optimal":
-        _LOGGER.warning("MILP non-optimal (%s) — falling back to greedy", status)
-        return None
+        _force_negative_charges(config, horizon, today_scheduled,
+                                tomorrow_scheduled, slot_power)
+        stats["extract_ms"] = round((time.perf_counter() - extract_started) * 1000.0, 3)
+        _LOGGER.debug(
+            "MILP solved (%s, %.1f ms, variable power): today %d slots "
+            "(%d partial), tomorrow %d slots (%d partial), horizon=%d",
+            backend, stats.get("solve_ms", 0.0),
+            len(today_scheduled), len(slot_power.get("today", {})),
+            len(tomorrow_scheduled), len(slot_power.get("tomorrow", {})), K,
+        )
+        return today_scheduled, tomorrow_scheduled
 
     # --- Extract slot decisions ------------------------------------------------
     # The LP uses continuous variables, so it may spread energy thinly across
@@ -423,8 +503,8 @@ def _solve(
     discharge_candidates: list[tuple[int, dict, float]] = []
 
     for k, h in enumerate(horizon):
-        cv = pulp.value(c[k]) or 0.0
-        dv = pulp.value(d[k]) or 0.0
+        cv = c_vals[k]
+        dv = d_vals[k]
         slot_charge_cap = h["charge_cap"] or safe_kwh
         slot_discharge_cap = h["discharge_cap"] or safe_kwh
         if cv > slot_charge_cap * MIN_FRAC:
@@ -461,8 +541,8 @@ def _solve(
     # LP's final SOC to estimate the peak SOC the battery will reach.
     peak_soc = current_kwh
     for k, h in enumerate(horizon):
-        cv = pulp.value(c[k]) or 0.0
-        dv = pulp.value(d[k]) or 0.0
+        cv = c_vals[k]
+        dv = d_vals[k]
         peak_soc = min(soc_max, peak_soc + horizon[k]["net"] + eff * cv - dv)
     discharge_headroom_kwh = max(discharge_headroom_kwh,
                                   max(0.0, peak_soc - reserve_target))
@@ -508,19 +588,7 @@ def _solve(
             accum += (h["charge_cap"] or safe_kwh) * eff
             sched[h["slot"]] = "charge"
 
-    # charge_to_full_on_negative_price: the user has explicitly opted to grab
-    # EVERY negative-price slot for the revenue (you're paid to charge),
-    # accepting that some PV may be curtailed.  The LP only charges negatives
-    # up to the SOC-max bound (it can't model charging a battery past full), so
-    # on its own it stops once full and may take fewer than all of them.  Mirror
-    # greedy's explicit behaviour: force every remaining p<0 slot to charge.
-    if getattr(config, "charge_to_full_on_negative_price", False):
-        for k, h in enumerate(horizon):
-            if h["price"] < 0:
-                sched = (today_scheduled if h["day"] == "today"
-                         else tomorrow_scheduled)
-                if sched.get(h["slot"]) != "discharge":
-                    sched[h["slot"]] = "charge"
+    _force_negative_charges(config, horizon, today_scheduled, tomorrow_scheduled)
 
     accum = 0.0
     for k, h, kw in discharge_candidates:
@@ -531,11 +599,17 @@ def _solve(
             today_scheduled[h["slot"]] = "discharge"
         else:
             tomorrow_scheduled[h["slot"]] = "discharge"
+    stats["extract_ms"] = round((time.perf_counter() - extract_started) * 1000.0, 3)
 
     _LOGGER.debug(
-        "MILP solved: today %d slots (%d charge, %d discharge), "
+        "MILP solved (%s, %.1f ms, %s iterations, %s start): "
+        "today %d slots (%d charge, %d discharge), "
         "tomorrow %d slots (%d charge, %d discharge), horizon=%d, "
         "energy targets: charge=%.1f kWh, discharge=%.1f kWh",
+        backend,
+        stats.get("solve_ms", 0.0),
+        stats.get("iterations"),
+        stats.get("warm_start", "cold"),
         len(today_scheduled),
         sum(1 for v in today_scheduled.values() if v == "charge"),
         sum(1 for v in today_scheduled.values() if v == "discharge"),
@@ -547,3 +621,534 @@ def _solve(
         discharge_target_kwh,
     )
     return today_scheduled, tomorrow_scheduled
+
+
+def _force_negative_charges(
+    config: Any,
+    horizon: list[dict[str, Any]],
+    today_scheduled: dict[int, str],
+    tomorrow_scheduled: dict[int, str],
+    slot_power: dict[str, dict[int, float]] | None = None,
+) -> None:
+    """charge_to_full_on_negative_price: charge every p<0 slot at full power.
+
+    The user has explicitly opted to grab EVERY negative-price slot for the
+    revenue (you're paid to charge), accepting that some PV may be
+    curtailed.  The LP only charges negatives up to the SOC-max bound (it
+    can't model charging a battery past full), so on its own it stops once
+    full and may take fewer than all of them.  Mirror greedy's explicit
+    behaviour: force every remaining p<0 slot to charge.
+    """
+    if not getattr(config, "charge_to_full_on_negative_price", False):
+        return
+    for h in horizon:
+        if h["price"] < 0:
+            sched = (today_scheduled if h["day"] == "today"
+                     else tomorrow_scheduled)
+            if sched.get(h["slot"]) != "discharge":
+                sched[h["slot"]] = "charge"
+                if slot_power is not None:
+                    slot_power.get(h["day"], {}).pop(h["slot"], None)
+
+
+def variable_power_slots(
+    horizon: list[dict[str, Any]],
+    charge_kwh,
+    discharge_kwh,
+    *,
+    safe_power_kw: float,
+    power_step_kw: float,
+    minutes_per_slot: float,
+    slot_power: dict[str, dict[int, float]],
+) -> tuple[dict[int, str], dict[int, str]]:
+    """Turn per-slot energies into a variable-power plan.
+
+    ``charge_kwh[k]`` (grid-side) and ``discharge_kwh[k]`` (battery-side) are
+    the energies an engine planned for horizon slot k.  Each is expressed as
+    a power level, rounded to ``power_step_kw`` and capped at safe power; a
+    slot is scheduled once that level reaches the activation floor, the
+    larger of the two actions winning when both are set.  Levels below safe
+    power are written to ``slot_power[day][slot]`` in kW.  Shared by the
+    MILP and the DP so both report levels the same way.
+    """
+    slot_hours = minutes_per_slot / 60.0
+    step = power_step_kw if power_step_kw > 0 else 0.0
+    floor_kw = max(step, safe_power_kw * _VARIABLE_MIN_FRAC)
+    today_scheduled: dict[int, str] = {}
+    tomorrow_scheduled: dict[int, str] = {}
+    for k, h in enumerate(horizon):
+        cv = charge_kwh[k]
+        dv = discharge_kwh[k]
+        action, energy = ("charge", cv) if cv >= dv else ("discharge", dv)
+        kw = energy / slot_hours
+        if step:
+            kw = round(kw / step) * step
+        kw = min(kw, safe_power_kw)
+        if kw < floor_kw - 1e-9:
+            continue
+        sched = today_scheduled if h["day"] == "today" else tomorrow_scheduled
+        sched[h["slot"]] = action
+        if kw < safe_power_kw - 1e-6:
+            slot_power.setdefault(h["day"], {})[h["slot"]] = round(kw, 3)
+    return today_scheduled, tomorrow_scheduled
+
+
+class _SparseLP:
+    """LP in HiGHS' native form: column bounds/costs, row ranges, CSC matrix."""
+
+    __slots__ = ("a_index", "a_start", "a_value", "col_cost", "col_lower",
+                 "col_upper", "row_lower", "row_upper")
+
+    def __init__(self, col_cost, col_lower, col_upper, row_lower, row_upper,
+                 a_start, a_index, a_value) -> None:
+        self.col_cost = col_cost
+        self.col_lower = col_lower
+        self.col_upper = col_upper
+        self.row_lower = row_lower
+        self.row_upper = row_upper
+        self.a_start = a_start
+        self.a_index = a_index
+        self.a_value = a_value
+
+    @property
+    def num_col(self) -> int:
+        return len(self.col_cost)
+
+    @property
+    def num_row(self) -> int:
+        return len(self.row_lower)
+
+
+def _build_lp(
+    *,
+    prices: list[float],
+    net: list[float],
+    charge_ub: list[float],
+    discharge_ub: list[float],
+    current_kwh: float,
+    eff: float,
+    soc_min: float,
+    soc_max: float,
+    cycle_cost: float,
+    reserve: float,
+    reserve_penalty: float,
+    terminal_value: float,
+    early: float,
+    midnight_k: int | None,
+) -> _SparseLP:
+    """Assemble the scheduling LP directly in sparse column-wise form.
+
+    Per slot k (columns ``_SLOT_COLS * k + offset``):
+
+    * ``c``     grid kWh charged,        0 ≤ c ≤ charge_ub[k]
+    * ``d``     battery kWh discharged,  0 ≤ d ≤ discharge_ub[k]
+    * ``spill`` PV that doesn't fit,     0 ≤ spill
+    * ``soc``   level at END of slot k,  soc_min ≤ soc ≤ soc_max
+    * ``imp``   emergency feasibility slack (grid passthrough), 0 ≤ imp
+
+    Rows: one SOC-dynamics equality per slot
+    (``soc[k] - soc[k-1] - eff·c + d + spill - imp = net[k]``, with
+    ``current_kwh`` moved to the RHS for k = 0), the soft end-of-horizon
+    reserve, the soft midnight reserve when the horizon spans two days, and
+    ``reward_soc ≤ soc[K-1]``.
+
+    The matrix itself comes from a cached :class:`_LPTemplate`; a replan
+    only computes the cost, bound and RHS vectors (prices, PV net, caps,
+    current_kwh, reserve), so building the model is a few list copies.
+
+    Emergency feasibility slack — physically, grid passthrough keeps the
+    battery from dropping below soc_min (the house draws from grid when the
+    battery is empty).  Without it the SOC dynamics can be INFEASIBLE: when
+    consumption drains the battery faster than charging can offset (e.g.
+    to_grid mode where charging is disallowed, or a very high-consumption
+    slot), ``soc[k] == prev + net + ...`` cannot satisfy ``soc[k] >= soc_min``,
+    and the whole MILP collapses to greedy.  imp[k] absorbs exactly that
+    deficit.  It carries a high penalty so it's 0 in every normal case and
+    only activates to keep the LP feasible.
+
+    Reward leftover SOC only UP TO the reserve target — the energy genuinely
+    needed for overnight survival (and, in self_consumption, the boosted
+    reserve).  Rewarding ALL leftover SOC (up to soc_max) made the solver buy
+    any slot below avg·eff² to push the battery toward FULL, even in pure
+    cost mode where that is over-buying.  Real symptom: on a duck-curve cost
+    day MILP charged an extra night slot and a 3rd midday slot to end at 81%
+    where greedy ended at 52% — and cost MORE (0.895 vs 0.600).  Arbitrage
+    (both mode) is unaffected: energy above the reserve is sold for the
+    explicit sell REVENUE term, not the terminal reward.
+    """
+    K = len(prices)
+    template = _lp_template(K, midnight_k, eff)
+    ncol = template.num_col
+    last = _SLOT_COLS * K
+
+    col_cost = [0.0] * ncol
+    col_cost[_COL_C:last:_SLOT_COLS] = [p + early * k for k, p in enumerate(prices)]  # buy cost + tie-break
+    col_cost[_COL_D:last:_SLOT_COLS] = [cycle_cost - p * eff for p in prices]  # wear - sell revenue
+    col_cost[_COL_IMP:last:_SLOT_COLS] = [reserve_penalty] * K            # feasibility slack
+    col_cost[last:ncol - 1] = [reserve_penalty] * (ncol - 1 - last)       # reserve shortfalls
+    col_cost[ncol - 1] = -terminal_value                                  # leftover value (≤ reserve)
+
+    col_lower = list(template.col_lower)
+    col_lower[_COL_SOC:last:_SLOT_COLS] = [soc_min] * K
+    col_upper = list(template.col_upper)
+    col_upper[_COL_C:last:_SLOT_COLS] = charge_ub
+    col_upper[_COL_D:last:_SLOT_COLS] = discharge_ub
+    col_upper[_COL_SOC:last:_SLOT_COLS] = [soc_max] * K
+    col_upper[ncol - 1] = reserve
+
+    # Rows: K dynamics equalities (current_kwh folded into the first RHS),
+    # then soc[K-1] + end_short ≥ reserve, soc[midnight-1] + mid_short ≥
+    # reserve when present, and reward_soc - soc[K-1] ≤ 0.
+    n_reserve = template.num_row - K - 1
+    row_lower = list(net)
+    row_lower[0] += current_kwh
+    row_upper = list(row_lower)
+    row_lower += [reserve] * n_reserve + [-_INF]
+    row_upper += [_INF] * n_reserve + [0.0]
+
+    return _SparseLP(col_cost, col_lower, col_upper, row_lower, row_upper,
+                     template.a_start, template.a_index, template.a_value)
+
+
+class _LPTemplate:
+    """Fixed sparse structure of the LP for one horizon shape.
+
+    Structure depends only on the horizon length, the midnight position and
+    the efficiency (the charge coefficient in the dynamics rows), none of
+    which change between ticks within a slot.  Templates are immutable once
+    built, so concurrent solves (two inverters) can share one safely;
+    :func:`_build_lp` only fills fresh cost / bound / RHS vectors around it.
+    """
+
+    __slots__ = ("a_index", "a_start", "a_value", "col_lower", "col_upper",
+                 "num_col", "num_row")
+
+    def __init__(self, K: int, midnight_k: int | None, eff: float) -> None:
+        end_row = K
+        mid_row = K + 1 if midnight_k is not None else None
+        reward_row = K + (2 if midnight_k is not None else 1)
+
+        col_lower: list[float] = []
+        col_upper: list[float] = []
+        a_start: list[int] = [0]
+        a_index: list[int] = []
+        a_value: list[float] = []
+
+        def _col(upper: float, entries: list[tuple[int, float]]) -> None:
+            col_lower.append(0.0)
+            col_upper.append(upper)
+            for row, value in entries:
+                a_index.append(row)
+                a_value.append(value)
+            a_start.append(len(a_index))
+
+        for k in range(K):
+            _col(0.0, [(k, -eff)])      # c
+            _col(0.0, [(k, 1.0)])       # d
+            _col(_INF, [(k, 1.0)])      # spill
+            soc_entries = [(k, 1.0)]
+            if k + 1 < K:
+                soc_entries.append((k + 1, -1.0))
+            else:
+                soc_entries += [(end_row, 1.0), (reward_row, -1.0)]
+            if mid_row is not None and k == midnight_k - 1:
+                soc_entries.append((mid_row, 1.0))
+            soc_entries.sort()
+            _col(0.0, soc_entries)      # soc
+            _col(_INF, [(k, -1.0)])     # imp
+        _col(_INF, [(end_row, 1.0)])    # end reserve shortfall
+        if mid_row is not None:
+            _col(_INF, [(mid_row, 1.0)])  # midnight shortfall
+        _col(0.0, [(reward_row, 1.0)])  # reward_soc
+
+        self.num_col = len(col_lower)
+        self.num_row = reward_row + 1
+        self.col_lower = tuple(col_lower)
+        self.col_upper = tuple(col_upper)
+        self.a_start = tuple(a_start)
+        self.a_index = tuple(a_index)
+        self.a_value = tuple(a_value)
+
+
+# Templates by (K, midnight_k, eff).  Within a slot every replan reuses one;
+# the horizon shrinks by a slot each period, so only a handful are live.
+_TEMPLATES: dict[tuple[int, int | None, float], _LPTemplate] = {}
+_TEMPLATE_CACHE_SIZE = 8
+
+
+def _lp_template(K: int, midnight_k: int | None, eff: float) -> _LPTemplate:
+    key = (K, midnight_k, eff)
+    template = _TEMPLATES.get(key)
+    if template is None:
+        if len(_TEMPLATES) >= _TEMPLATE_CACHE_SIZE:
+            _TEMPLATES.clear()
+        template = _TEMPLATES[key] = _LPTemplate(K, midnight_k, eff)
+    return template
+
+
+def _run_lp(
+    lp: _SparseLP,
+    backend: str,
+    pulp=None,
+    *,
+    warm_key: tuple | None = None,
+    slot_keys: list[tuple[str, int]] | None = None,
+    stats: dict[str, Any] | None = None,
+    time_limit: float | None = None,
+) -> list[float] | None:
+    """Solve ``lp`` on ``backend``; return the column values or None.
+
+    ``stats`` (when given) receives backend, solve_ms, iterations and
+    warm_start.  Only HiGHS exposes a basis, so only it warm-starts;
+    ``iterations`` is None for backends that do not report a count.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(backend=backend, iterations=None, warm_start="cold")
+    limit = float(_SOLVE_TIME_LIMIT)
+    if time_limit is not None:
+        limit = min(limit, max(time_limit, 0.01))
+    started = time.perf_counter()
+    try:
+        if backend == "highs":
+            return _solve_highs(lp, warm_key, slot_keys or [], stats, limit)
+        if backend == "scipy":
+            return _solve_scipy(lp, limit)
+        return _solve_pulp(pulp, lp, limit)
+    finally:
+        stats["solve_ms"] = round((time.perf_counter() - started) * 1000.0, 3)
+
+
+class _WarmStart:
+    """Optimal HiGHS basis and primal values of one solve, by horizon slot."""
+
+    __slots__ = ("col_status", "col_value", "row_status", "slot_keys")
+
+    def __init__(self, slot_keys, col_status, row_status, col_value) -> None:
+        self.slot_keys = slot_keys
+        self.col_status = col_status
+        self.row_status = row_status
+        self.col_value = col_value
+
+
+# Last optimal basis per (plan_id, grid_mode, capacity): plan_id keeps each
+# inverter's entry apart.  A config change that alters the model's shape
+# starts a new entry; the tick-to-tick replan of one inverter always hits
+# the same one.
+_WARM_STARTS: dict[tuple, _WarmStart] = {}
+_WARM_CACHE_SIZE = 4
+
+
+def _shift_warm_start(
+    prev: _WarmStart, slot_keys: list[tuple[str, int]], lp: _SparseLP, highspy,
+) -> tuple[list, list, list[float]] | None:
+    """Map ``prev`` onto the new horizon by (day, slot); None if nothing overlaps.
+
+    The horizon starts later every period, so most slots shift left by the
+    elapsed count.  After midnight yesterday's "tomorrow" slots are today's.
+    Slots that are new (tomorrow's prices just arrived) start at their lower
+    bound with a basic balance row — HiGHS repairs the rest in a few pivots.
+    The tail columns/rows (end shortfall, [midnight shortfall], reward) map
+    by role.
+    """
+    status = highspy.HighsBasisStatus
+    old_k = len(prev.slot_keys)
+    new_k = len(slot_keys)
+    if not old_k or not new_k:
+        return None
+    old_pos = {key: i for i, key in enumerate(prev.slot_keys)}
+    rolled = (slot_keys[0][0] == prev.slot_keys[0][0] == "today"
+              and slot_keys[0][1] < prev.slot_keys[0][1])
+
+    col_status: list = []
+    col_value: list[float] = []
+    row_status: list = []
+    mapped = 0
+    for day, slot in slot_keys:
+        if rolled:
+            src = old_pos.get(("tomorrow", slot)) if day == "today" else None
+        else:
+            src = old_pos.get((day, slot))
+        if src is None:
+            col_status += [status.kLower] * _SLOT_COLS
+            col_value += [0.0] * _SLOT_COLS
+            row_status.append(status.kBasic)
+            continue
+        mapped += 1
+        base = src * _SLOT_COLS
+        col_status += prev.col_status[base:base + _SLOT_COLS]
+        col_value += prev.col_value[base:base + _SLOT_COLS]
+        row_status.append(prev.row_status[src])
+    if not mapped:
+        return None
+
+    # Tail roles: offset 0 = end shortfall, last = reward, and the midnight
+    # shortfall in between only when both horizons have one.
+    old_tail = len(prev.col_status) - old_k * _SLOT_COLS
+    new_tail = lp.num_col - new_k * _SLOT_COLS
+    for t in range(new_tail):
+        if t == new_tail - 1:
+            src = old_tail - 1
+        elif t == 0 or old_tail == new_tail:
+            src = t
+        else:
+            src = None
+        if src is None:
+            col_status.append(status.kLower)
+            col_value.append(0.0)
+            row_status.append(status.kBasic)
+        else:
+            col_status.append(prev.col_status[old_k * _SLOT_COLS + src])
+            col_value.append(prev.col_value[old_k * _SLOT_COLS + src])
+            row_status.append(prev.row_status[old_k + src])
+
+    # A bound that moved can invalidate a nonbasic status (e.g. "at upper"
+    # on a column whose ceiling is now infinite); park those at the lower.
+    for j, st in enumerate(col_status):
+        if st == status.kUpper and lp.col_upper[j] == _INF:
+            col_status[j] = status.kLower
+        elif st == status.kLower and lp.col_lower[j] == -_INF:
+            col_status[j] = status.kZero
+    return col_status, row_status, col_value
+
+
+def _apply_warm_start(h, highspy, lp: _SparseLP, prev: _WarmStart,
+                      slot_keys: list[tuple[str, int]]) -> str:
+    """Seed ``h`` from ``prev``; return "basis", "solution" or "cold".
+
+    A shifted basis is only usable when it still has exactly one basic
+    variable per row; otherwise the shifted primal values are handed over
+    and HiGHS crashes a basis from them.
+    """
+    shifted = _shift_warm_start(prev, slot_keys, lp, highspy)
+    if shifted is None:
+        return "cold"
+    col_status, row_status, col_value = shifted
+    ok = highspy.HighsStatus.kOk
+    basic = highspy.HighsBasisStatus.kBasic
+    n_basic = (sum(1 for st in col_status if st == basic)
+               + sum(1 for st in row_status if st == basic))
+    if n_basic == lp.num_row:
+        basis = highspy.HighsBasis()
+        basis.col_status = col_status
+        basis.row_status = row_status
+        basis.valid = True
+        if h.setBasis(basis) == ok:
+            return "basis"
+    solution = highspy.HighsSolution()
+    solution.col_value = col_value
+    solution.value_valid = True
+    if h.setSolution(solution) == ok:
+        return "solution"
+    return "cold"
+
+
+def _solve_highs(lp: _SparseLP, warm_key: tuple | None,
+                 slot_keys: list[tuple[str, int]],
+                 stats: dict[str, Any],
+                 time_limit: float = _SOLVE_TIME_LIMIT) -> list[float] | None:
+    import highspy
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", False)
+    h.setOptionValue("time_limit", float(time_limit))
+    model = highspy.HighsLp()
+    model.num_col_ = lp.num_col
+    model.num_row_ = lp.num_row
+    model.col_cost_ = lp.col_cost
+    model.col_lower_ = lp.col_lower
+    model.col_upper_ = lp.col_upper
+    model.row_lower_ = lp.row_lower
+    model.row_upper_ = lp.row_upper
+    model.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    model.a_matrix_.start_ = lp.a_start
+    model.a_matrix_.index_ = lp.a_index
+    model.a_matrix_.value_ = lp.a_value
+    h.passModel(model)
+    prev = _WARM_STARTS.get(warm_key) if warm_key is not None else None
+    if prev is not None:
+        stats["warm_start"] = _apply_warm_start(h, highspy, lp, prev, slot_keys)
+    h.run()
+    stats["iterations"] = max(0, h.getInfo().simplex_iteration_count)
+    status = h.getModelStatus()
+    if status != highspy.HighsModelStatus.kOptimal:
+        _WARM_STARTS.pop(warm_key, None)
+        _LOGGER.warning("MILP non-optimal (%s) — falling back to greedy",
+                        h.modelStatusToString(status))
+        return None
+    col_value = list(h.getSolution().col_value)
+    basis = h.getBasis()
+    if warm_key is not None and basis.valid:
+        if warm_key not in _WARM_STARTS and len(_WARM_STARTS) >= _WARM_CACHE_SIZE:
+            _WARM_STARTS.clear()
+        _WARM_STARTS[warm_key] = _WarmStart(
+            list(slot_keys), list(basis.col_status), list(basis.row_status),
+            col_value)
+    return col_value
+
+
+def _solve_scipy(lp: _SparseLP,
+                 time_limit: float = _SOLVE_TIME_LIMIT) -> list[float] | None:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import csc_matrix
+
+    matrix = csc_matrix((lp.a_value, lp.a_index, lp.a_start),
+                        shape=(lp.num_row, lp.num_col))
+    res = milp(
+        lp.col_cost,
+        constraints=LinearConstraint(matrix, lp.row_lower, lp.row_upper),
+        bounds=Bounds(lp.col_lower, lp.col_upper),
+        options={"time_limit": time_limit},
+    )
+    if res.status != 0 or res.x is None:
+        _LOGGER.warning("MILP non-optimal (%s) — falling back to greedy",
+                        res.message)
+        return None
+    return res.x.tolist()
+
+
+def _solve_pulp(pulp, lp: _SparseLP,
+                time_limit: float = _SOLVE_TIME_LIMIT) -> list[float] | None:
+    """Fallback: rebuild the same sparse model in pulp and solve via CBC."""
+    prob = pulp.LpProblem("ems_schedule", pulp.LpMinimize)
+    cols = [
+        pulp.LpVariable(
+            f"x_{j}",
+            lowBound=None if lp.col_lower[j] == -_INF else lp.col_lower[j],
+            upBound=None if lp.col_upper[j] == _INF else lp.col_upper[j],
+        )
+        for j in range(lp.num_col)
+    ]
+    prob += pulp.LpAffineExpression(
+        [(cols[j], cost) for j, cost in enumerate(lp.col_cost) if cost])
+    rows: list[list] = [[] for _ in range(lp.num_row)]
+    for j in range(lp.num_col):
+        for pos in range(lp.a_start[j], lp.a_start[j + 1]):
+            rows[lp.a_index[pos]].append((cols[j], lp.a_value[pos]))
+    for r, terms in enumerate(rows):
+        expr = pulp.LpAffineExpression(terms)
+        lower, upper = lp.row_lower[r], lp.row_upper[r]
+        if lower == upper:
+            prob += expr == lower
+            continue
+        if lower != -_INF:
+            prob += expr >= lower
+        if upper != _INF:
+            prob += expr <= upper
+
+    solver = _pick_solver(pulp, time_limit)
+    if solver is None:
+        # No usable LP solver on this platform — structural, so the caller
+        # disables MILP for the session (one warning, greedy runs).  Reuse the
+        # FileNotFoundError path in solve_schedule for the flag + message.
+        raise FileNotFoundError(
+            "no available LP solver — pulp's bundled CBC binary is missing and "
+            "no system CBC (COIN_CMD) was found"
+        )
+    prob.solve(solver)
+
+    status = pulp.LpStatus[prob.status]
+    if status != "Optimal":
+        _LOGGER.warning("MILP non-optimal (%s) — falling back to greedy", status)
+        return None
+    return [col.value() or 0.0 for col in cols]
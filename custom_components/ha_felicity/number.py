@@ -201,6 +201,42 @@ async def async_setup_entry(
             icon="mdi:battery-clock",
             default_value=0.0,
         ),
+        HA_FelicityInternalNumber(
+            coordinator,
+            entry,
+            option_key="auto_engine_budget_s",
+            name="Auto Scheduler Time Budget",
+            min_val=1,
+            max_val=30,
+            step=1,
+            unit="s",
+            icon="mdi:timer-sand",
+            default_value=5.0,
+        ),
+        HA_FelicityInternalNumber(
+            coordinator,
+            entry,
+            option_key="pv_scenario_samples",
+            name="PV Scenario Samples",
+            min_val=0,
+            max_val=1000,
+            step=50,
+            unit=None,
+            icon="mdi:chart-bell-curve",
+            default_value=0,
+        ),
+        HA_FelicityInternalNumber(
+            coordinator,
+            entry,
+            option_key="pv_scenario_shortfall_pct",
+            name="PV Scenario Shortfall Limit",
+            min_val=1,
+            max_val=50,
+            step=1,
+            unit="%",
+            icon="mdi:shield-alert-outline",
+            default_value=10.0,
+        ),
     ])
 
     # Flexible load number entities. Gated on a switch entity being assigned
@@ -120,13 +120,61 @@ async def async_setup_entry(
             coordinator=coordinator,
             entry=entry,
             option_key="scheduler_engine",
-            select_options=["greedy", "milp"],
+            select_options=["greedy", "milp", "dp", "auto"],
             name="Scheduler Engine",
             icon="mdi:function-variant",
             entity_category=EntityCategory.CONFIG,
         )
     )
 
+    entities.append(
+        HA_FelicitySpecialModeSelect(
+            coordinator=coordinator,
+            entry=entry,
+            option_key="scheduler_worker",
+            select_options=["thread", "process"],
+            name="Scheduler Worker",
+            icon="mdi:cpu-64-bit",
+            entity_category=EntityCategory.CONFIG,
+        )
+    )
+
+    entities.append(
+        HA_FelicitySpecialModeSelect(
+            coordinator=coordinator,
+            entry=entry,
+            option_key="profile_next_replan",
+            select_options=["off", "on"],
+            name="Profile Next Replan",
+            icon="mdi:timer-search-outline",
+            entity_category=EntityCategory.CONFIG,
+        )
+    )
+
+    entities.append(
+        HA_FelicitySpecialModeSelect(
+            coordinator=coordinator,
+            entry=entry,
+            option_key="extended_horizon",
+            select_options=["off", "on"],
+            name="Extended Planning Horizon",
+            icon="mdi:calendar-arrow-right",
+            entity_category=EntityCategory.CONFIG,
+        )
+    )
+
+    entities.append(
+        HA_FelicitySpecialModeSelect(
+            coordinator=coordinator,
+            entry=entry,
+            option_key="variable_power",
+            select_options=["off", "on"],
+            name="Variable Slot Power",
+            icon="mdi:tune-variant",
+            entity_category=EntityCategory.CONFIG,
+        )
+    )
+
     entities.append(
         HA_FelicitySpecialModeSelect(
             coordinator=coordinator,
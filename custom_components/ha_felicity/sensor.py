@@ -128,16 +128,21 @@ class HA_FelicityScheduleStatusSensor(CoordinatorEntity, SensorEntity):
         scheduled = self.coordinator.scheduled_slots
         opts = self.coordinator.config_entry.options
 
-        # Build per-slot data array for the EMS card
+        # Build per-slot data array for the EMS card.  Variable-power slots
+        # planned below safe power also carry their level ("power_kw").
+        slot_power = self.coordinator.slot_power_kw
         slot_data = []
         if slot_prices:
             for i, price in enumerate(slot_prices):
                 action = scheduled.get(i)  # "charge", "discharge", or None
-                slot_data.append({
+                entry = {
                     "slot": i,
                     "price": round(price, 4) if price is not None else None,
                     "action": action,
-                })
+                }
+                if action and i in slot_power:
+                    entry["power_kw"] = slot_power[i]
+                slot_data.append(entry)
 
         # Flex load schedule keyed by SLOT (the card draws a strip per bar):
         # {slot_index: [load indices active in that slot]}.  The coordinator
@@ -162,17 +167,40 @@ class HA_FelicityScheduleStatusSensor(CoordinatorEntity, SensorEntity):
         tomorrow_slot_data = []
         tomorrow_prices = self.coordinator.slot_prices_tomorrow
         tomorrow_scheduled = self.coordinator._tomorrow_scheduled_slots or {}
+        tomorrow_power = self.coordinator._tomorrow_slot_power_kw or {}
         if tomorrow_prices:
             for i, price in enumerate(tomorrow_prices):
-                tomorrow_slot_data.append({
+                entry = {
                     "slot": i,
                     "price": round(price, 4) if price is not None else None,
                     "action": tomorrow_scheduled.get(i),
-                })
+                }
+                if entry["action"] and i in tomorrow_power:
+                    entry["power_kw"] = tomorrow_power[i]
+                tomorrow_slot_data.append(entry)
+        # Extended horizon: a plan made on ESTIMATED prices is kept apart
+        # from slot_schedule_tomorrow so the card never shows estimates as
+        # published prices.
+        provisional_slot_data = []
+        estimate = self.coordinator.tomorrow_estimated_prices
+        if self.coordinator.tomorrow_provisional and not tomorrow_prices and estimate:
+            provisional_slot_data = [
+                {"slot": i, "price": round(price, 4), "action": tomorrow_scheduled.get(i)}
+                for i, price in enumerate(estimate)
+            ]
 
         return {
             "schedule_reason": self.coordinator.schedule_reason,
             "scheduler_active": self.coordinator.scheduler_active,
+            "solver_stats": self.coordinator.solver_stats,
+            "phase_ms": self.coordinator.schedule_phase_ms,
+            "phase_calls": self.coordinator.schedule_phase_calls,
+            "phase_stats": self.coordinator.schedule_phase_stats,
+            "plan_age_s": self.coordinator.schedule_plan_age_s,
+            "plan_solves_superseded": self.coordinator.schedule_solves_superseded,
+            "plan_repairs": self.coordinator.schedule_repairs,
+            "plan_replans": self.coordinator.schedule_replans,
+            "plan_replan_reason": self.coordinator.schedule_replan_reason,
             "cheap_slots_remaining": self.coordinator.cheap_slots_remaining,
             "grid_energy_planned_kwh": self.coordinator.grid_energy_planned,
             "scheduled_slot_count": len(scheduled),
@@ -193,6 +221,8 @@ class HA_FelicityScheduleStatusSensor(CoordinatorEntity, SensorEntity):
             "self_consumption_reserve": self.coordinator.self_consumption_reserve,
             "slot_schedule": slot_data,
             "slot_schedule_tomorrow": tomorrow_slot_data,
+            "tomorrow_provisional": self.coordinator.tomorrow_provisional,
+            "slot_schedule_tomorrow_provisional": provisional_slot_data,
             # Simulation parameters for client-side schedule preview
             "sim_params": {
                 "battery_capacity_kwh": effective_capacity,
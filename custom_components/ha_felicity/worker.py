@@ -0,0 +1,105 @@
+"""Optional out-of-process schedule solving.
+
+``ems.calculate_schedule`` is pure, CPU-bound Python.  Run in Home
+Assistant's default thread executor it still holds the GIL, so a heavy
+replan (MILP model build, "auto" race, DP sweep) competes with the event
+loop and every other integration for the interpreter.  With the
+``scheduler_worker`` option set to ``process`` the coordinator hands the
+solve to one persistent worker process instead:
+
+* The process is **spawned**, never forked — HA runs many threads and a
+  forked child would inherit their locks mid-flight.
+* It is started once and kept.  The initializer imports the engine modules
+  (and probes the LP backend) up front, so a replan pays only the pickling
+  of ``EMSConfig`` / ``EMSState`` in and ``ScheduleResult`` out — plain
+  dataclasses, a few kB.  Per-process caches (MILP templates and warm-start
+  bases) survive between solves as they would in-process.
+* Any failure to start or a crashed worker disables the process path for
+  the rest of the session (one warning) and the caller falls back to the
+  thread executor — same "re-check on next restart" policy as the MILP.
+
+``submit`` may spawn the process, so call it from an executor thread, not
+the event loop.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+_EXECUTOR: ProcessPoolExecutor | None = None
+_DISABLED = False
+_DISABLED_REASON = ""
+
+
+def _preload(modules: tuple[str, ...]) -> None:
+    """Worker initializer: import the engines before the first solve."""
+    for name in modules:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        probe = getattr(module, "_inmemory_backend", None)
+        if probe is not None:
+            probe()
+
+
+def _sibling_modules(fn: Callable[..., Any]) -> tuple[str, ...]:
+    """``fn``'s module plus the solver engines next to it."""
+    module = fn.__module__
+    package, _, _ = module.rpartition(".")
+    prefix = f"{package}." if package else ""
+    return (module, f"{prefix}milp", f"{prefix}dp")
+
+
+def available() -> bool:
+    """False once the process path has been disabled for this session."""
+    return not _DISABLED
+
+
+def submit(fn: Callable[..., Any], *args: Any) -> Future:
+    """Run ``fn(*args)`` in the worker process; return its future.
+
+    Raises RuntimeError when the process path is disabled.  Any other
+    failure — OSError or BrokenProcessPool from a failed start, a pickling
+    error, an exception raised in the child — reaches the caller (here or
+    through the future), which should then call ``disable``.
+    """
+    global _EXECUTOR
+    if _DISABLED:
+        raise RuntimeError(f"schedule worker disabled: {_DISABLED_REASON}")
+    if _EXECUTOR is None:
+        _EXECUTOR = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_preload,
+            initargs=(_sibling_modules(fn),),
+        )
+    return _EXECUTOR.submit(fn, *args)
+
+
+def disable(reason: str) -> None:
+    """Stop using the worker process for this session (greedy-style fallback)."""
+    global _DISABLED, _DISABLED_REASON
+    if not _DISABLED:
+        _LOGGER.warning(
+            "Schedule worker process unavailable — solving in a thread for this "
+            "session (re-checked on next restart): %s", reason,
+        )
+    _DISABLED = True
+    _DISABLED_REASON = reason
+    shutdown()
+
+
+def shutdown() -> None:
+    """Stop the worker process (entry unload); the next ``submit`` restarts it."""
+    global _EXECUTOR
+    executor, _EXECUTOR = _EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,7 +1,9 @@
 """Tests for coordinator resilience fixes."""
 
 import asyncio
+import json
 import sys
+import pickle
 import os
 import types
 from unittest.mock import AsyncMock, MagicMock
@@ -44,7 +46,18 @@ _pkg.__package__ = "custom_components.ha_felicity"
 # Mock sub-modules that coordinator imports relatively
 _const_mod = types.ModuleType("custom_components.ha_felicity.const")
 _const_mod.DOMAIN = "ha_felicity"
+_const_mod.CONF_INVERTER_MODEL = "inverter_model"
+_const_mod.INVERTER_MODEL_TREX_FIVE = "TREX-5"
 _const_mod.INVERTER_MODEL_TREX_TEN = "TREX-10"
+_const_mod.INVERTER_MODEL_TREX_TWENTY_FIVE = "TREX-25"
+_const_mod.INVERTER_MODEL_TREX_FIFTY = "TREX-50"
+_const_mod.DEFAULT_INVERTER_MODEL = _const_mod.INVERTER_MODEL_TREX_TEN
+_const_mod.INVERTER_MAX_POWER_KW = {
+    _const_mod.INVERTER_MODEL_TREX_FIVE: 5,
+    _const_mod.INVERTER_MODEL_TREX_TEN: 10,
+    _const_mod.INVERTER_MODEL_TREX_TWENTY_FIVE: 25,
+    _const_mod.INVERTER_MODEL_TREX_FIFTY: 50,
+}
 
 _type_specific_mod = MagicMock()
 _type_specific_mod.__name__ = "custom_components.ha_felicity.type_specific"
@@ -107,6 +120,7 @@ def _make_coordinator(**overrides):
     coord.config_entry.options = {}
     coord.model_combined = {}
     coord.inverter_model = "TREX-10"
+    coord._inverter_max_power_kw = 10
     coord.TypeSpecificHandler = MagicMock()
     coord.data = {}
     coord.connected = False
@@ -381,3 +395,582 @@ class TestSlotOverridesPersistence:
 
         assert coord.scheduled_slots[0] == "discharge"    # discharge allowed
         assert 1 not in coord.scheduled_slots              # charge blocked
+
+
+# ---------------------------------------------------------------------------
+# Background schedule solve (keep-last-plan)
+# ---------------------------------------------------------------------------
+
+def _make_solver_coordinator(release: asyncio.Event):
+    """Coordinator whose executor solve blocks until ``release`` is set."""
+    coord = _make_coordinator()
+    coord._schedule_task = None
+    coord._pending_schedule = None
+    coord._schedule_generation = 0
+    coord._committed_generation = 0
+    coord.schedule_committed_ts = None
+    coord.schedule_solves_superseded = 0
+    coord._committed_result = None
+    coord._committed_replan_key = None
+    coord._last_full_replan_ts = None
+    coord.schedule_repairs = 0
+    coord.schedule_replans = 0
+    coord.schedule_replan_reason = None
+    coord.async_update_listeners = MagicMock()
+    coord._apply_schedule_result = MagicMock()
+    coord._record_schedule_phases = MagicMock()
+    solved = []
+
+    async def _executor(func, config, state):
+        solved.append(config)
+        await release.wait()
+        return f"plan-{config}"
+
+    coord.hass.async_add_executor_job = _executor
+    coord.config_entry.async_create_background_task = (
+        lambda hass, coro, name: asyncio.get_running_loop().create_task(coro)
+    )
+    return coord, solved
+
+
+def _request(tag):
+    return coordinator_mod._ScheduleRequest(
+        config=tag, state=None, battery_soc=50.0,
+        now=coordinator_mod.datetime.now(), effective_capacity=10.0,
+    )
+
+
+async def _drain(coord):
+    while coord._schedule_task is not None and not coord._schedule_task.done():
+        await coord._schedule_task
+
+
+class TestBackgroundScheduleSolve:
+    """The control path keeps the committed plan while a solve runs."""
+
+    @pytest.mark.asyncio
+    async def test_plan_committed_when_solve_finishes(self):
+        release = asyncio.Event()
+        coord, _ = _make_solver_coordinator(release)
+        coord._submit_schedule_solve(_request("a"))
+        await asyncio.sleep(0)
+        assert coord.schedule_plan_age_s is None
+        coord._apply_schedule_result.assert_not_called()
+
+        release.set()
+        await _drain(coord)
+        coord._apply_schedule_result.assert_called_once()
+        assert coord._apply_schedule_result.call_args.args[0] == "plan-a"
+        assert coord.schedule_plan_age_s >= 0
+        coord.async_update_listeners.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_queued_request_superseded_by_newer(self):
+        release = asyncio.Event()
+        coord, solved = _make_solver_coordinator(release)
+        coord._submit_schedule_solve(_request("a"))
+        await asyncio.sleep(0)
+        coord._submit_schedule_solve(_request("b"))
+        coord._submit_schedule_solve(_request("c"))
+        assert coord.schedule_solves_superseded == 1
+
+        release.set()
+        await _drain(coord)
+        assert solved == ["a", "c"]
+        applied = [c.args[0] for c in coord._apply_schedule_result.call_args_list]
+        assert applied == ["plan-a", "plan-c"]
+
+    @pytest.mark.asyncio
+    async def test_cancel_drops_in_flight_result(self):
+        release = asyncio.Event()
+        coord, _ = _make_solver_coordinator(release)
+        coord._submit_schedule_solve(_request("a"))
+        await asyncio.sleep(0)
+        task = coord._schedule_task
+        coord._cancel_schedule_solve("grid mode changed")
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        coord._apply_schedule_result.assert_not_called()
+
+        # The next request starts immediately and commits normally.
+        coord._submit_schedule_solve(_request("b"))
+        await _drain(coord)
+        applied = [c.args[0] for c in coord._apply_schedule_result.call_args_list]
+        assert applied == ["plan-b"]
+
+
+class TestScheduleWorkerFallback:
+    """A failing worker process is disabled and the solve reruns in a thread."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("error", [
+        pickle.PicklingError("cannot pickle 'lock' object"),
+        ValueError("raised in the child"),
+    ])
+    async def test_worker_error_falls_back_to_thread(self, monkeypatch, error):
+        coord = _make_coordinator()
+        coord.config_entry.options = {"scheduler_worker": "process"}
+        fake_worker = MagicMock()
+        fake_worker.available.return_value = True
+        fake_worker.submit.side_effect = error
+        monkeypatch.setattr(coordinator_mod, "worker", fake_worker)
+
+        async def _executor(func, *args):
+            return func(*args)
+
+        coord.hass.async_add_executor_job = _executor
+        monkeypatch.setattr(coordinator_mod.ems_module, "calculate_schedule",
+                            lambda config, state: "thread-plan")
+        result = await coord._execute_calculate_schedule("config", "state")
+        assert result == "thread-plan"
+        fake_worker.disable.assert_called_once_with(repr(error))
+
+
+class TestPlanRepairGate:
+    """A committed plan is repaired in place unless a full replan is due."""
+
+    def _coord(self, trajectory):
+        coord, _ = _make_solver_coordinator(asyncio.Event())
+        coord._committed_result = types.SimpleNamespace(soc_trajectory=trajectory)
+        coord._committed_replan_key = 1
+        coord._last_full_replan_ts = coordinator_mod.time.time()
+        return coord
+
+    def _request(self, soc, key=1, predicted=None):
+        return coordinator_mod._ScheduleRequest(
+            config=None,
+            state=types.SimpleNamespace(slot_prices_today=[0.1] * 24, predicted_soc_pct=predicted),
+            battery_soc=soc,
+            now=coordinator_mod.datetime(2026, 1, 1, 10, 0),
+            effective_capacity=10.0,
+            replan_key=key,
+        )
+
+    def test_repair_when_on_plan(self):
+        coord = self._coord([50.0] * 24)
+        assert coord._full_replan_reason(self._request(51.0)) is None
+
+    def test_replan_on_changed_inputs(self):
+        coord = self._coord([50.0] * 24)
+        assert coord._full_replan_reason(self._request(50.0, key=2)) == "inputs changed"
+
+    def test_replan_on_soc_drift(self):
+        coord = self._coord([50.0] * 24)
+        assert "drifted" in coord._full_replan_reason(self._request(45.0))
+
+    def test_replan_when_plan_expired_or_missing(self):
+        coord = self._coord([50.0] * 24)
+        coord._last_full_replan_ts -= coordinator_mod._REPAIR_MAX_AGE_S + 1
+        assert coord._full_replan_reason(self._request(50.0)) == "plan expired"
+        coord._committed_result = None
+        assert coord._full_replan_reason(self._request(50.0)) == "no committed plan"
+
+    def test_replan_on_consumption_deviation(self):
+        coord = self._coord([50.0] * 24)
+        reason = coord._full_replan_reason(self._request(50.0, predicted=60.0))
+        assert reason == "consumption deviation"
+
+
+class TestForecastErrorModel:
+    """Per-hour PV / consumption error history feeding the scenario check."""
+
+    def _coord(self):
+        coord = _make_coordinator()
+        coord._pv_forecast_ratios = {}
+        coord._pv_error_hour = None
+        coord._pv_error_hour_start_kwh = None
+        coord._pv_hourly_ring = coordinator_mod._DayRing(coordinator_mod._PV_HISTORY_DAYS, 24)
+        coord._hourly_ring = coordinator_mod._DayRing(coordinator_mod._HOURLY_RING_DAYS, 24)
+        coord.pv_hourly_kwh = {10: 2.0, 11: 2.0}
+        return coord
+
+    def _tick(self, coord, monkeypatch, hour, pv_kwh):
+        real = coordinator_mod.datetime
+
+        class _Now(real):
+            @classmethod
+            def now(cls, tz=None):
+                return real(2026, 6, 1, hour, 30)
+
+        monkeypatch.setattr(coordinator_mod, "datetime", _Now)
+        coord.data = {"pv_generated_energy_day": pv_kwh * 1000.0}
+        coord._record_pv_forecast_error()
+
+    def test_hour_ratio_recorded(self, monkeypatch):
+        coord = self._coord()
+        self._tick(coord, monkeypatch, 10, 1.0)
+        self._tick(coord, monkeypatch, 10, 1.8)
+        self._tick(coord, monkeypatch, 11, 2.6)
+        assert coord._pv_forecast_ratios == {"10": [0.8]}
+
+    def test_skipped_hour_not_recorded(self, monkeypatch):
+        coord = self._coord()
+        self._tick(coord, monkeypatch, 9, 0.5)
+        self._tick(coord, monkeypatch, 11, 3.0)
+        assert coord._pv_forecast_ratios == {}
+
+    def test_models_need_history(self):
+        coord = self._coord()
+        coord._pv_forecast_ratios = {"10": [0.8, 1.0, 1.2], "11": [1.0]}
+        model = coord._pv_error_model()
+        assert set(model) == {10}
+        assert model[10][0] == 1.0
+        assert model[10][1] > 0.1
+        today = coordinator_mod.datetime.now()
+        for days_ago, kwh in ((1, 1.0), (2, 2.0), (3, 3.0)):
+            day = (today - coordinator_mod.timedelta(days=days_ago)).strftime("%Y-%m-%d")
+            coord._store_hourly_day(day, {"18": kwh, "3": 0.2})
+        load = coord._consumption_error_model()
+        assert load[18] > 0.3
+        assert load[3] == coordinator_mod._ERROR_MIN_SIGMA
+
+
+class TestExtendedHorizonHistory:
+    """Price / PV history behind the extended-horizon estimates."""
+
+    def _coord(self):
+        coord = _make_coordinator()
+        coord._price_history = []
+        coord._pv_daily_ring = coordinator_mod._DayRing(coordinator_mod._PV_DAILY_RING_DAYS, 1)
+        coord._pv_hourly_ring = coordinator_mod._DayRing(coordinator_mod._PV_HISTORY_DAYS, 24)
+        coord._pv_baseline_kwh = None
+        coord._pv_remaining_share = None
+        coord.slot_prices_today = None
+        coord._pv_today_peak_kwh = 0.0
+        coord._tomorrow_estimate = None
+        coord.tomorrow_estimated_prices = None
+        return coord
+
+    def test_day_recorded_and_estimated(self):
+        coord = self._coord()
+        monday = coordinator_mod.datetime(2026, 6, 1)
+        for week in range(2):
+            coord.slot_prices_today = [0.1 + 0.1 * week] * 24
+            coord._pv_today_peak_kwh = 10.0 + week
+            coord._record_day_history(monday + coordinator_mod.timedelta(days=7 * week))
+        assert [e["weekday"] for e in coord._price_history] == [0, 0]
+        sunday = coordinator_mod.datetime(2026, 6, 14, 9, 0)
+        estimate = coord._estimate_tomorrow_prices(sunday)
+        assert estimate == pytest.approx([0.15] * 24)
+        assert coord._tomorrow_estimate[0] == "2026-06-15"
+        assert coord.tomorrow_estimated_prices == estimate
+
+    def _close_days(self, coord, first, kwhs):
+        for i, kwh in enumerate(kwhs):
+            coord._pv_today_peak_kwh = kwh
+            coord._record_day_history(first + coordinator_mod.timedelta(days=i))
+
+    def test_pv_estimate_needs_three_days(self):
+        coord = self._coord()
+        self._close_days(coord, coordinator_mod.datetime(2026, 6, 1), (8.0, 12.0))
+        assert coord._estimate_daily_pv() is None
+        assert coord._compute_pv_fallback() is None
+        self._close_days(coord, coordinator_mod.datetime(2026, 6, 3), (30.0,))
+        assert coord._estimate_daily_pv() == 12.0
+
+    def test_pv_baseline_falls_back_to_last_year(self):
+        coord = self._coord()
+        self._close_days(coord, coordinator_mod.datetime(2025, 6, 1), (20.0, 22.0, 24.0))
+        coord._update_pv_baseline(coordinator_mod.datetime(2026, 6, 2).toordinal())
+        assert coord._pv_baseline_kwh == 22.0
+
+    def test_pv_fallback_follows_hourly_shape(self, monkeypatch):
+        coord = self._coord()
+        june_1 = coordinator_mod.datetime(2026, 6, 1)
+        for d in range(3):
+            ordinal = june_1.toordinal() + d
+            for hour in range(8, 16):
+                coord._pv_hourly_ring.set(ordinal, hour, 1.0)
+        self._close_days(coord, june_1, (8.0, 8.0, 8.0))
+        real = coordinator_mod.datetime
+
+        class _Now(real):
+            @classmethod
+            def now(cls, tz=None):
+                return real(2026, 6, 4, 12, 0)
+
+        monkeypatch.setattr(coordinator_mod, "datetime", _Now)
+        coord.data = {"pv_generated_energy_day": 2000.0}   # dull morning: 2 of the usual 4 kWh
+        assert coord._compute_pv_fallback() == 6.0
+
+
+class TestVariablePowerExecutor:
+    """Rule-1 power follows the plan's per-slot level (variable power)."""
+
+    def _coord(self, variable_power="on"):
+        coord = _make_coordinator()
+        coord.config_entry.options = {"variable_power": variable_power}
+        coord.safe_max_power = 5
+        coord.scheduled_slots = {3: "charge", 4: "charge", 5: "discharge"}
+        coord.slot_power_kw = {4: 2.3}
+        coord._current_energy_state = "charging"
+        coord._rule_power_written_w = 5000
+        coord.TypeSpecificHandler.write_type_specific_register = AsyncMock(return_value=True)
+        return coord
+
+    def test_slot_level_capped_at_safe_power(self):
+        coord = self._coord()
+        coord._current_slot_index = lambda: 4
+        assert coord._slot_rule_power_w("charging") == 2300
+        assert coord._slot_rule_power_w("discharging") == 5000
+        coord._current_slot_index = lambda: 3
+        assert coord._slot_rule_power_w("charging") == 5000
+        coord.slot_power_kw = {3: 7.5}
+        assert coord._slot_rule_power_w("charging") == 5000
+
+    @pytest.mark.asyncio
+    async def test_sync_writes_only_on_level_change(self):
+        coord = self._coord()
+        coord._current_slot_index = lambda: 4
+        await coord._sync_slot_rule_power()
+        await coord._sync_slot_rule_power()
+        write = coord.TypeSpecificHandler.write_type_specific_register
+        write.assert_awaited_once_with("econ_rule_1_power", 2300)
+        assert coord._rule_power_written_w == 2300
+
+    @pytest.mark.asyncio
+    async def test_sync_off_without_option(self):
+        coord = self._coord(variable_power="off")
+        coord._current_slot_index = lambda: 4
+        await coord._sync_slot_rule_power()
+        coord.TypeSpecificHandler.write_type_specific_register.assert_not_awaited()
+
+
+class TestPhaseDiagnostics:
+    """Replan phase timings: last solve, rolling window, one-shot cProfile."""
+
+    def _coord(self, **options):
+        coord = _make_coordinator()
+        coord.config_entry.options = dict(options)
+        coord.schedule_phase_ms = {}
+        coord.schedule_phase_calls = {}
+        coord._schedule_phase_history = coordinator_mod.deque(
+            maxlen=coordinator_mod._PHASE_HISTORY_REPLANS)
+        coord.hass.config.path = lambda name: f"/config/{name}"
+        return coord
+
+    def test_rolling_stats_over_recorded_replans(self):
+        coord = self._coord()
+        for engine_ms in (2.0, 4.0):
+            coord._record_schedule_phases(types.SimpleNamespace(
+                phase_ms={"engine": engine_ms, "total": engine_ms + 1.0},
+                phase_calls={"engine": 1, "total": 1},
+            ))
+        assert coord.schedule_phase_ms == {"engine": 4.0, "total": 5.0}
+        stats = coord.schedule_phase_stats
+        assert stats["engine"] == {"mean_ms": 3.0, "max_ms": 4.0, "replans": 2}
+
+    def test_profile_request_is_one_shot(self):
+        coord = self._coord(profile_next_replan="on", grid_mode="from_grid")
+        path = coord._take_profile_request()
+        assert path.startswith("/config/") and path.endswith(".prof")
+        update = coord.hass.config_entries.async_update_entry
+        update.assert_called_once()
+        assert update.call_args.kwargs["options"] == {
+            "profile_next_replan": "off", "grid_mode": "from_grid"}
+
+    def test_no_profile_without_option(self):
+        coord = self._coord()
+        assert coord._take_profile_request() is None
+        coord.hass.config_entries.async_update_entry.assert_not_called()
+
+
+class TestLiveHourlyConsumption:
+    """Hourly profile accumulated from the load-energy counter every tick."""
+
+    def _coord(self):
+        coord = _make_coordinator(register_map={
+            "load_consumption_energy_day": {"unit": "Wh"}})
+        coord.consumption_override_entity = None
+        coord._hourly_consumption_profile = {}
+        coord._hourly_ring = coordinator_mod._DayRing(coordinator_mod._HOURLY_RING_DAYS, 24)
+        coord._load_counter_kwh = None
+        coord._load_counter_ts = None
+        coord._load_hour_marker = None
+        coord._load_hour_kwh = 0.0
+        coord._load_hour_complete = False
+        return coord
+
+    def _tick(self, coord, monkeypatch, day, hour, minute, wh):
+        real = coordinator_mod.datetime
+        stamp = real(2026, 6, day, hour, minute)
+
+        class _Now(real):
+            @classmethod
+            def now(cls, tz=None):
+                return stamp
+
+        monkeypatch.setattr(coordinator_mod, "datetime", _Now)
+        monkeypatch.setattr(coordinator_mod.time, "time", stamp.timestamp)
+        coord.data = {"load_consumption_energy_day": wh}
+        coord._accumulate_hourly_consumption()
+
+    def _run_hour(self, coord, monkeypatch, day, hour, start_wh, wh_per_min):
+        for minute in range(60):
+            self._tick(coord, monkeypatch, day, hour, minute, start_wh + minute * wh_per_min)
+        return start_wh + 60 * wh_per_min
+
+    def test_full_hour_recorded_and_profiled(self, monkeypatch):
+        coord = self._coord()
+        wh = self._run_hour(coord, monkeypatch, 1, 9, 0, 10)       # partial: first tick
+        wh = self._run_hour(coord, monkeypatch, 1, 10, wh, 20)
+        self._tick(coord, monkeypatch, 1, 11, 0, wh)
+        assert coord._hourly_consumption_profile == {10: 1.2}
+        june_1 = coordinator_mod.datetime(2026, 6, 1).toordinal()
+        assert coord._hourly_ring.get(june_1, 10) == pytest.approx(1.2)
+        assert coord._hourly_ring.get(june_1, 9) is None
+
+    def test_gap_leaves_hour_unknown(self, monkeypatch):
+        coord = self._coord()
+        self._run_hour(coord, monkeypatch, 1, 9, 0, 10)
+        self._tick(coord, monkeypatch, 1, 10, 0, 600)
+        self._tick(coord, monkeypatch, 1, 10, 30, 900)              # 30 min gap
+        self._tick(coord, monkeypatch, 1, 11, 0, 1200)
+        assert 10 not in coord._hourly_consumption_profile
+
+    @pytest.mark.parametrize("glitch_wh", [50_000, 2000])  # spike / drop that is no reset
+    def test_implausible_counter_step_leaves_hour_unknown(self, monkeypatch, glitch_wh):
+        coord = self._coord()
+        wh = self._run_hour(coord, monkeypatch, 1, 9, 5000, 10)
+        for minute in range(60):
+            value = glitch_wh if minute == 30 else wh + minute * 10
+            self._tick(coord, monkeypatch, 1, 10, minute, value)
+        self._tick(coord, monkeypatch, 1, 11, 0, wh + 600)
+        assert 10 not in coord._hourly_consumption_profile
+
+    def test_midnight_reset_and_daily_average(self, monkeypatch):
+        coord = self._coord()
+        wh = self._run_hour(coord, monkeypatch, 1, 22, 9000, 10)
+        self._run_hour(coord, monkeypatch, 1, 23, wh, 10)
+        self._tick(coord, monkeypatch, 2, 0, 0, 10)                 # counter reset
+        assert coord._hourly_consumption_profile[23] == pytest.approx(0.6)
+        wh = self._run_hour(coord, monkeypatch, 2, 0, 10, 10)
+        wh = self._run_hour(coord, monkeypatch, 2, 1, wh, 10)
+        self._tick(coord, monkeypatch, 2, 21, 59, 9000)             # after a gap
+        wh = self._run_hour(coord, monkeypatch, 2, 22, 9000, 30)
+        self._run_hour(coord, monkeypatch, 2, 23, wh, 30)
+        self._tick(coord, monkeypatch, 3, 0, 0, 30)
+        assert coord._hourly_consumption_profile[22] == pytest.approx(1.8)
+        assert coord._hourly_consumption_profile[23] == pytest.approx(1.2)
+
+    def test_old_ring_rows_drop_out(self, monkeypatch):
+        coord = self._coord()
+        coord._store_hourly_day("2026-05-01", {"8": 5.0})
+        coord._store_hourly_day("2026-05-31", {"8": 1.0})
+        wh = self._run_hour(coord, monkeypatch, 1, 7, 0, 10)
+        wh = self._run_hour(coord, monkeypatch, 1, 8, wh, 50)
+        self._tick(coord, monkeypatch, 1, 9, 0, wh)
+        assert coord._hourly_consumption_profile[8] == pytest.approx(2.0)
+
+    def test_same_weekday_median(self):
+        coord = self._coord()
+        monday = coordinator_mod.datetime(2026, 6, 1).toordinal()
+        for weeks, kwh in ((1, 1.0), (2, 5.0), (3, 2.0)):
+            day = coordinator_mod.datetime.fromordinal(monday - 7 * weeks)
+            coord._store_hourly_day(day.strftime("%Y-%m-%d"), {"18": kwh})
+        coord._store_hourly_day("2026-05-31", {"18": 0.4})          # Sunday
+        assert coord._hour_of_week_estimate(18, monday) == 2.0
+        # No Tuesday history yet: the last days' average stands in
+        assert coord._hour_of_week_estimate(18, monday + 1) == pytest.approx(0.4)
+
+    def test_ring_round_trips_packed(self):
+        coord = self._coord()
+        coord._store_hourly_day("2026-06-01", {"7": 0.5})
+        packed = json.loads(json.dumps(coord._hourly_ring.pack()))
+        assert len(packed["values"]) < 10_000
+        other = self._coord()
+        other._hourly_ring.load(packed)
+        june_1 = coordinator_mod.datetime(2026, 6, 1).toordinal()
+        assert other._hourly_ring.get(june_1, 7) == 0.5
+        assert other._hourly_ring.get(june_1, 8) is None
+        assert other._hourly_ring.get(june_1 - 7, 7) is None
+
+
+class TestCoalescedStorePersistence:
+    """Runtime state rides on one delayed, coalesced consumption-store write."""
+
+    def _coord(self):
+        coord = _make_coordinator()
+        coord._consumption_store = MagicMock()
+        coord._consumption_store.async_save = AsyncMock()
+        coord._store_save_pending = False
+        coord._hourly_ring = coordinator_mod._DayRing(coordinator_mod._HOURLY_RING_DAYS, 24)
+        coord._pv_daily_ring = coordinator_mod._DayRing(coordinator_mod._PV_DAILY_RING_DAYS, 1)
+        coord._pv_hourly_ring = coordinator_mod._DayRing(coordinator_mod._PV_HISTORY_DAYS, 24)
+        coord._pv_forecast_ratios = {}
+        coord._price_history = []
+        coord._cycle_charged_kwh = 12.5
+        coord._cycle_discharged_kwh = 10.0
+        coord._battery_soh_factor = 0.99
+        coord._soc_history = {3: 55.0}
+        coord._pv_integrated_today_kwh = 1.25
+        coord._pv_today_peak_kwh = 2.0
+        coord._deviation_since_ts = None
+        coord._load_counter_kwh, coord._load_counter_ts = 4.2, 1000.0
+        coord._load_hour_marker = None
+        coord._load_hour_kwh = 0.0
+        coord._load_hour_complete = False
+        coord._current_day = None
+        return coord
+
+    def test_changes_coalesce_into_one_delayed_write(self):
+        coord = self._coord()
+        for _ in range(5):
+            coord._mark_store_dirty()
+        coord._consumption_store.async_delay_save.assert_called_once()
+        data_func, delay = coord._consumption_store.async_delay_save.call_args.args
+        assert delay == coordinator_mod._STORE_SAVE_DELAY_S
+        data = data_func()
+        assert data["cycle_charged_kwh"] == 12.5
+        assert data["runtime"]["soc_history"] == {"3": 55.0}
+        # The write went out: the next change arms a new one
+        coord._mark_store_dirty()
+        assert coord._consumption_store.async_delay_save.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_only_when_pending(self):
+        coord = self._coord()
+        await coord.async_flush_store()
+        coord._consumption_store.async_save.assert_not_called()
+        coord._mark_store_dirty()
+        await coord.async_flush_store()
+        coord._consumption_store.async_save.assert_awaited_once()
+        assert coord._store_save_pending is False
+
+    def test_runtime_restored_only_for_today(self):
+        saved = self._coord()
+        saved._load_hour_marker = ("2026-06-01", 9)
+        runtime = json.loads(json.dumps(saved._runtime_state()))
+        restored = self._coord()
+        restored._soc_history = {}
+        restored._pv_integrated_today_kwh = 0.0
+        restored._restore_runtime_state(runtime)
+        assert restored._soc_history == {3: 55.0}
+        assert restored._pv_integrated_today_kwh == 1.25
+        assert restored._load_hour_marker == ("2026-06-01", 9)
+        stale = self._coord()
+        stale._soc_history = {}
+        stale._restore_runtime_state({**runtime, "date": "2000-01-01"})
+        assert stale._soc_history == {}
+
+    def test_runtime_before_rollover_stamped_with_its_day(self, monkeypatch):
+        real = coordinator_mod.datetime
+        stamp = real(2026, 6, 2, 0, 0, 5)
+
+        class _Now(real):
+            @classmethod
+            def now(cls, tz=None):
+                return stamp
+
+        monkeypatch.setattr(coordinator_mod, "datetime", _Now)
+        saved = self._coord()
+        saved._current_day = 1              # rollover tick has not run yet
+        runtime = saved._runtime_state()
+        assert runtime["date"] == "2026-06-01"
+        restored = self._coord()
+        restored._soc_history = {}
+        restored._restore_runtime_state(runtime)
+        assert restored._soc_history == {}
+        saved._current_day = 2
+        assert saved._runtime_state()["date"] == "2026-06-02"
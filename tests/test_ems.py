@@ -22,6 +22,7 @@ import math
 import sys
 import os
 import importlib.util
+from dataclasses import replace
 
 import pytest
 
@@ -44,11 +45,22 @@ milp = importlib.util.module_from_spec(_milp_spec)
 sys.modules["milp"] = milp
 _milp_spec.loader.exec_module(milp)
 
+# dp.py (exact SOC dynamic program) is pure Python; register it the same way.
+_dp_path = os.path.join(
+    os.path.dirname(__file__), "..", "custom_components", "ha_felicity", "dp.py"
+)
+_dp_spec = importlib.util.spec_from_file_location("dp", _dp_path)
+dp = importlib.util.module_from_spec(_dp_spec)
+sys.modules["dp"] = dp
+_dp_spec.loader.exec_module(dp)
+
 try:
     import pulp as _pulp  # noqa: F401
     _HAS_PULP = True
 except Exception:
     _HAS_PULP = False
+# MILP runs on highspy / scipy in-process, or on pulp (CBC) as a fallback.
+_HAS_LP = _HAS_PULP or milp._inmemory_backend() is not None
 
 EMSConfig = ems.EMSConfig
 EMSState = ems.EMSState
@@ -5076,7 +5088,7 @@ class TestSellCoverage:
         )
 
 
-@pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+@pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
 class TestMILPScheduler:
     """Tests for the optional MILP scheduler (milp.py)."""
 
@@ -5310,7 +5322,7 @@ class TestMILPScheduler:
         result = calculate_schedule(config, state)
         assert result.scheduler_active == "greedy"
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_no_peak_charge_to_hit_reserve(self):
         """MILP must NOT charge an expensive evening peak just to satisfy a
         high self_consumption reserve.
@@ -5356,7 +5368,7 @@ class TestMILPScheduler:
             f"MILP charged an expensive peak to hit the reserve: {charge_prices}"
         )
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_sells_evening_peak_not_cheap_early_slot(self):
         """MILP to_grid must sell into the EVENING PEAK, not a cheap early slot.
 
@@ -5400,7 +5412,7 @@ class TestMILPScheduler:
             f"MILP sold a cheap early slot instead of the peak: {sell_prices}"
         )
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_synthesizes_daily_only_tomorrow_pv(self):
         """MILP must see tomorrow's PV even when the forecast gives only a
         DAILY total (no hourly).  Otherwise it plans the next day with NO sun
@@ -5462,7 +5474,7 @@ class TestMILPScheduler:
             f"MILP over-bought tomorrow despite 42.9 kWh PV: {sorted(tmr_charge)}"
         )
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_charge_to_full_grabs_all_negative_slots(self):
         """With charge_to_full_on_negative_price, MILP must force EVERY p<0
         slot to charge (mirrors greedy), not stop at SOC-max like the LP alone.
@@ -5581,7 +5593,7 @@ def _grid_cost_of_schedule(config, state, today_sched, tomorrow_sched):
     return cost
 
 
-@pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+@pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
 class TestMILPvsGreedy:
     """Cross-check the MILP and greedy engines on identical scenarios.
 
@@ -5881,7 +5893,7 @@ class TestSelfSufficiencyTodayFirst:
             f"charge at least as much today"
         )
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_midnight_constraint_charges_today(self):
         """MILP midnight SOC constraint forces today charging for overnight."""
         base, state = self._make_scenario("self_consumption", "milp")
@@ -5895,7 +5907,7 @@ class TestSelfSufficiencyTodayFirst:
         )
         assert result.scheduler_active == "milp"
 
-    @pytest.mark.skipif(not _HAS_PULP, reason="pulp not installed")
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
     def test_milp_midnight_constraint_cost_mode(self):
         """MILP midnight constraint also applies in cost mode (prevents
         overnight drain below reserve target)."""
@@ -6406,3 +6418,1041 @@ class TestGreedyPartialChargeNoSun:
         r = calculate_schedule(cfg, st)
         charge = [i for i, a in r.scheduled_slots.items() if a == "charge"]
         assert charge == [], f"near-full battery should not charge, got {charge}"
+
+
+# ── Incremental SOC validator equivalence ─────────────────────────────────
+
+
+def _load_legacy_bench():
+    """Reference (pre-optimisation) implementations kept in tools/ for A/B runs."""
+    path = os.path.join(
+        os.path.dirname(__file__), "..", "tools", "bench_soc_validator.py"
+    )
+    spec = importlib.util.spec_from_file_location("bench_soc_validator", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _load_legacy_validator():
+    return _load_legacy_bench().legacy_validate_schedule_soc
+
+
+class TestIncrementalSocValidator:
+    """`_validate_schedule_soc` resumes from the earliest affected slot after
+    a drop instead of re-simulating from current_kwh.  The pruned sets must
+    match the legacy full re-simulation exactly, including tie-breaks."""
+
+    def _random_case(self, rng, num_slots):
+        minutes = 1440 / num_slots
+        prices = [round(rng.uniform(-0.10, 0.45), 3) for _ in range(num_slots)]
+        start = rng.randrange(0, num_slots // 2)
+        remaining = [(i, prices[i]) for i in range(start, num_slots)]
+        peak = rng.choice([0.0, 2.0, 6.0, 12.0])
+        pv = {h: peak * max(0.0, math.sin(math.pi * (h - 6) / 14))
+              for h in range(24)}
+        idxs = [i for i, _ in remaining]
+        charge = {i for i in idxs if rng.random() < 0.35}
+        discharge = {i for i in idxs if i not in charge and rng.random() < 0.25}
+        cap = rng.choice([5.0, 10.0, 20.0])
+        hourly = ({h: rng.uniform(0.2, 2.5) for h in range(24)}
+                  if rng.random() < 0.5 else None)
+        args = (
+            remaining, charge, discharge,
+            rng.uniform(0.0, cap), rng.uniform(0.05, 0.6), pv, minutes,
+            rng.uniform(0.3, 1.0), cap, cap * 0.1,
+            rng.uniform(0.5, 5.0) * minutes / 60.0, 0.92,
+        )
+        kwargs = {
+            "inverter_max_power_kw": rng.choice([0.0, 8.0]),
+            "safe_power_kw": rng.choice([0.0, 5.0]),
+            "consumption_hourly_kwh": hourly,
+            "keep_all_negative_charges": rng.random() < 0.3,
+            "keep_partial_charges": rng.random() < 0.5,
+        }
+        return args, kwargs
+
+    @pytest.mark.parametrize("num_slots", [24, 96, 192])
+    def test_matches_legacy_full_resimulation(self, num_slots):
+        import random
+        legacy = _load_legacy_validator()
+        rng = random.Random(20260 + num_slots)
+        for _ in range(150):
+            args, kwargs = self._random_case(rng, num_slots)
+            assert (ems._validate_schedule_soc(*args, **kwargs)
+                    == legacy(*args, **kwargs))
+
+
+class TestChargeFeasibilityRefill:
+    """`_fill_charge_to_deficit` answers "does this slot fit?" from a
+    segment-tree oracle instead of re-validating every candidate.  The
+    refilled set must equal the per-candidate re-validation exactly."""
+
+    def _random_case(self, rng, num_slots):
+        minutes = 1440 / num_slots
+        prices = [round(rng.uniform(-0.05, 0.40), 2) for _ in range(num_slots)]
+        start = rng.randrange(0, num_slots // 2)
+        remaining = [(i, prices[i]) for i in range(start, num_slots)]
+        peak = rng.choice([0.0, 2.0, 6.0, 12.0])
+        pv = {h: peak * max(0.0, math.sin(math.pi * (h - 6) / 14))
+              for h in range(24)}
+        cap = rng.choice([5.0, 10.0, 20.0])
+        kept = {i for i, _ in remaining if rng.random() < 0.1}
+        hourly = ({h: rng.uniform(0.2, 2.5) for h in range(24)}
+                  if rng.random() < 0.5 else None)
+        args = (
+            remaining, kept, rng.uniform(0.0, cap * 1.5), rng.uniform(0.0, cap),
+            rng.uniform(0.05, 0.6) * minutes / 15.0, pv, minutes,
+            rng.uniform(0.3, 1.0), cap, cap * 0.1,
+            rng.uniform(0.5, 5.0) * minutes / 60.0, 0.92,
+            rng.choice([0.0, 8.0]), rng.choice([0.0, 5.0]), hourly,
+        )
+        return args, {"max_price": rng.choice([None, 0.1, 0.2])}
+
+    @pytest.mark.parametrize("num_slots", [24, 96, 192])
+    def test_matches_per_candidate_revalidation(self, num_slots):
+        import random
+        bench = _load_legacy_bench()
+        rng = random.Random(40 + num_slots)
+        for _ in range(120):
+            args, kwargs = self._random_case(rng, num_slots)
+            expected = bench.legacy_fill_charge_to_deficit(
+                *args, slot_gain=ems._slot_grid_charge_kwh, **kwargs)
+            assert ems._fill_charge_to_deficit(*args, **kwargs) == expected
+
+    def test_oracle_agrees_with_strict_validation(self):
+        """query() True/False must match whether the strict validator keeps
+        the candidate set unchanged, also after incremental add()s."""
+        import random
+        rng = random.Random(7)
+        for _ in range(60):
+            args, _ = self._random_case(rng, 96)
+            remaining, _kept, _deficit, soc = args[:4]
+            rest = args[4:]
+            oracle = ems._ChargeFeasibility(remaining, soc, *rest)
+            kept: set[int] = set()
+            oracle.rebuild(kept)
+            for idx, _price in rng.sample(remaining, len(remaining)):
+                if idx in kept:
+                    continue
+                fits = oracle.query(idx)
+                trial, _ = ems._validate_schedule_soc(
+                    remaining, kept | {idx}, set(), soc, rest[0], rest[1],
+                    rest[2], rest[3], rest[4], rest[5], rest[6], rest[7],
+                    inverter_max_power_kw=rest[8], safe_power_kw=rest[9],
+                    consumption_hourly_kwh=rest[10],
+                )
+                if fits is None:
+                    continue
+                price_of = dict(remaining)
+                if all(price_of[s] < 0 for s in kept | {idx}):
+                    # Negative-price-only sets may keep a PV-caused
+                    # overflow (pv_fills_battery); the oracle stays strict.
+                    continue
+                assert fits == (trial == kept | {idx})
+                if fits:
+                    kept.add(idx)
+                    oracle.add(idx)
+
+    def test_undersized_battery_refill_on_15_minute_market(self):
+        """A 5 kWh battery against a 12 kWh/day load on 15-minute slots:
+        the refill packs cheap night slots after prior drain, capped by
+        the deficit, without touching the expensive day."""
+        num_slots = 96
+        prices = [0.05 if i < 24 else 0.30 for i in range(num_slots)]
+        remaining = [(i, p) for i, p in enumerate(prices)]
+        got = ems._fill_charge_to_deficit(
+            remaining, set(), 12.0, 1.0, 12.0 / num_slots, {}, 15.0, 1.0,
+            5.0, 0.5, 0.75, 0.92, 8.0, 3.0, None, max_price=0.05,
+        )
+        assert got and all(prices[i] == 0.05 for i in got)
+        trial, _ = ems._validate_schedule_soc(
+            remaining, got, set(), 1.0, 12.0 / num_slots, {}, 15.0, 1.0,
+            5.0, 0.5, 0.75, 0.92, inverter_max_power_kw=8.0,
+            safe_power_kw=3.0,
+        )
+        assert trial == got
+
+
+class TestSocWalkBatch:
+    """`_soc_walk_batch` — the shared clamped-SOC engine behind the SOC
+    trajectories and the make-room discharge search."""
+
+    def _random_batch(self, rng, rows, num):
+        net = [rng.uniform(-1.5, 1.5) for _ in range(num)]
+        gain = [rng.uniform(0.0, 2.0) for _ in range(num)]
+        charge = [[rng.random() < 0.2 for _ in range(num)] for _ in range(rows)]
+        discharge = [[rng.random() < 0.2 for _ in range(num)] for _ in range(rows)]
+        return net, gain, charge, discharge
+
+    @pytest.mark.parametrize("floor", [None, 1.0])
+    def test_numpy_and_python_backends_identical(self, floor):
+        np = pytest.importorskip("numpy")
+        import random
+        rng = random.Random(11)
+        for rows, num in [(1, 24), (5, 96), (40, 192)]:
+            net, gain, charge, discharge = self._random_batch(rng, rows, num)
+            args = (4.0, net, gain, charge, discharge, 1.2, 0.5, 10.0)
+            py_rows, py_min = ems._soc_walk_batch(
+                *args, discharge_floor=floor, backend="python")
+            np_rows, np_min = ems._soc_walk_batch(
+                *args, discharge_floor=floor, backend="numpy")
+            assert np.asarray(np_rows).shape == (rows, num + 1)
+            assert [list(r) for r in py_rows] == np.asarray(np_rows).tolist()
+            assert list(py_min) == np.asarray(np_min).tolist()
+
+    def test_floor_limited_discharge_stops_at_floor(self):
+        entering, raw_min = ems._soc_walk_batch(
+            3.0, [0.0] * 4, [0.0] * 4, None, [[True] * 4], 1.5, 2.0, 10.0,
+            discharge_floor=2.0,
+        )
+        assert list(entering[0]) == [3.0, 2.0, 2.0, 2.0, 2.0]
+        assert raw_min[0] == 2.0
+
+    def test_fixed_discharge_reports_unclamped_dip(self):
+        entering, raw_min = ems._soc_walk_batch(
+            1.0, [0.0, 0.0], [], None, [[True, True]], 0.8, 0.0, 10.0,
+        )
+        assert list(entering[0]) == [1.0, pytest.approx(0.2), 0.0]
+        assert raw_min[0] == pytest.approx(-0.6)
+
+    def test_batch_trajectories_match_single_schedule(self):
+        cfg = default_config()
+        st = default_state(pv_hourly_kwh=make_pv_hourly(20.0))
+        schedules = [{}, {2: "charge", 3: "charge"}, {18: "discharge"},
+                     {i: "discharge" for i in range(17, 22)}] * 5
+        many = ems._compute_scheduled_soc_trajectories(
+            [0.1] * 24, 24, 60.0, 6.0, 4, schedules, cfg, st)
+        assert len(many) == len(schedules)
+        for sched, trajectory in zip(schedules, many):
+            assert trajectory == ems._compute_scheduled_soc_trajectory(
+                [0.1] * 24, 24, 60.0, 6.0, 4, sched, cfg, st)
+
+
+class TestDPScheduler:
+    """Tests for the exact dynamic-programming engine (dp.py)."""
+
+    @staticmethod
+    def _config(**overrides):
+        kwargs = {
+            "grid_mode": "from_grid",
+            "scheduler_engine": "dp",
+            "battery_capacity_kwh": 10,
+            "battery_discharge_min_pct": 20,
+            "battery_charge_max_pct": 100,
+            "safe_power_kw": 5,
+            "inverter_max_power_kw": 10,
+            "consumption_est_kwh": 5,
+            "efficiency": 0.90,
+            "reserve_target_pct": 50,
+        }
+        kwargs.update(overrides)
+        return EMSConfig(**kwargs)
+
+    @staticmethod
+    def _solve_kwargs(prices, current_kwh, reserve_target=5.0):
+        return {
+            "remaining": list(enumerate(prices)),
+            "current_kwh": current_kwh,
+            "num_slots": len(prices),
+            "current_slot": 0,
+            "minutes_per_slot": 1440 / len(prices),
+            "reserve_target": reserve_target,
+            "pv_confidence": 1.0,
+        }
+
+    def test_dp_charges_cheap_slots_from_grid(self):
+        """Runs without pulp and buys the cheap half to reach the reserve."""
+        prices = [0.05] * 6 + [0.30] * 6
+        state = EMSState(
+            slot_prices_today=prices, battery_soc_pct=10.0, pv_hourly_kwh={},
+            pv_actual_today_kwh=0, current_hour=0, current_minute=0,
+        )
+        result = calculate_schedule(self._config(), state)
+        assert result.scheduler_active == "dp"
+        assert "DP plan" in result.schedule_reason
+        charges = [i for i, a in result.scheduled_slots.items() if a == "charge"]
+        assert charges and all(i < 6 for i in charges), charges
+
+    def test_dp_sells_peak_not_trough(self):
+        """both mode: buy the troughs, sell the peak, never the reverse."""
+        prices = [0.02] * 4 + [0.40] * 4 + [0.02] * 4
+        state = EMSState(
+            slot_prices_today=prices, battery_soc_pct=50.0, pv_hourly_kwh={},
+            pv_actual_today_kwh=0, current_hour=0, current_minute=0,
+        )
+        result = calculate_schedule(self._config(grid_mode="both"), state)
+        charges = {i for i, a in result.scheduled_slots.items() if a == "charge"}
+        sells = {i for i, a in result.scheduled_slots.items() if a == "discharge"}
+        assert sells and charges
+        assert all(prices[i] == 0.40 for i in sells)
+        assert all(prices[i] == 0.02 for i in charges)
+
+    def test_dp_respects_grid_mode_and_negative_export_block(self):
+        prices = [0.30, -0.10, 0.05, 0.40] * 3
+        state = EMSState(
+            slot_prices_today=prices, battery_soc_pct=90.0, pv_hourly_kwh={},
+            pv_actual_today_kwh=0, current_hour=0, current_minute=0,
+        )
+        result = calculate_schedule(self._config(
+            grid_mode="to_grid", block_export_on_negative_price=True), state)
+        assert "charge" not in result.scheduled_slots.values()
+        assert all(prices[i] >= 0 for i, a in result.scheduled_slots.items()
+                   if a == "discharge")
+
+    def test_dp_meets_midnight_reserve_before_cheaper_tomorrow(self):
+        """Soft midnight reserve: today is charged even though tomorrow is cheaper."""
+        state = EMSState(
+            slot_prices_today=[0.20] * 24, slot_prices_tomorrow=[0.05] * 24,
+            battery_soc_pct=20.0, pv_hourly_kwh={}, pv_actual_today_kwh=0,
+            current_hour=18, current_minute=0,
+        )
+        result = calculate_schedule(self._config(), state)
+        assert "charge" in result.scheduled_slots.values()
+        assert result.soc_trajectory[-1] >= 45.0
+
+    def test_dp_matches_brute_force_optimum(self):
+        """The DP plan's exact model cost equals the best of all 3^K plans."""
+        import itertools
+        import random
+
+        rng = random.Random(29)
+        for _ in range(20):
+            prices = [round(rng.uniform(-0.05, 0.40), 3) for _ in range(6)]
+            config = self._config(
+                grid_mode=rng.choice(["from_grid", "to_grid", "both"]),
+                battery_capacity_kwh=4.0, safe_power_kw=1.0,
+                consumption_est_kwh=rng.uniform(0.5, 6.0))
+            state = EMSState(
+                slot_prices_today=prices, battery_soc_pct=50.0,
+                pv_hourly_kwh={h: rng.uniform(0.0, 2.0) for h in range(24)},
+                current_hour=0, current_minute=0,
+            )
+            kwargs = self._solve_kwargs(prices, rng.uniform(0.8, 4.0), 2.0)
+            model = dp._build_model(
+                config, state,
+                **{k: v for k, v in kwargs.items() if k != "remaining"})
+            values = model.backward_python()
+            chosen = [a for a, _ in model.forward(kwargs["current_kwh"], values)]
+            best = min(
+                model.plan_cost(kwargs["current_kwh"], list(plan))
+                for plan in itertools.product(dp._ACTIONS, repeat=len(prices))
+            )
+            dp_cost = model.plan_cost(kwargs["current_kwh"], chosen)
+            # Exact up to SOC-grid interpolation, which is negligible here.
+            assert dp_cost <= best + 1e-3, (prices, chosen, dp_cost, best)
+
+    def test_numpy_and_python_backends_agree(self):
+        pytest.importorskip("numpy")
+        import random
+
+        rng = random.Random(7)
+        for _ in range(10):
+            prices = [rng.uniform(0.0, 0.4) for _ in range(48)]
+            tomorrow = [rng.uniform(0.0, 0.4) for _ in range(48)]
+            state = EMSState(
+                slot_prices_today=prices, slot_prices_tomorrow=tomorrow,
+                battery_soc_pct=50.0,
+                pv_hourly_kwh={h: max(0.0, 3 - abs(h - 13) * 0.6) for h in range(24)},
+                current_hour=0, current_minute=0,
+            )
+            config = self._config(grid_mode=rng.choice(["from_grid", "both"]))
+            kwargs = self._solve_kwargs(prices, rng.uniform(2.0, 9.0))
+            assert (dp._solve(config, state, backend="numpy", **kwargs)
+                    == dp._solve(config, state, backend="python", **kwargs))
+
+
+class TestMILPBackends:
+    """The sparse LP gives the same optimum on every available backend."""
+
+    _BACKENDS = (
+        pytest.param("highs", marks=pytest.mark.skipif(
+            importlib.util.find_spec("highspy") is None, reason="highspy not installed")),
+        pytest.param("scipy", marks=pytest.mark.skipif(
+            importlib.util.find_spec("scipy") is None, reason="scipy not installed")),
+        pytest.param("pulp", marks=pytest.mark.skipif(
+            not _HAS_PULP, reason="pulp not installed")),
+    )
+
+    @staticmethod
+    def _lp(midnight_k=None, K=12):
+        import random
+
+        rng = random.Random(K)
+        return milp._build_lp(
+            prices=[rng.uniform(-0.05, 0.40) for _ in range(K)],
+            net=[rng.uniform(-1.0, 1.5) for _ in range(K)],
+            charge_ub=[2.5] * K,
+            discharge_ub=[2.5] * K,
+            current_kwh=4.0,
+            eff=0.9,
+            soc_min=2.0,
+            soc_max=10.0,
+            cycle_cost=0.02,
+            reserve=5.0,
+            reserve_penalty=2.0,
+            terminal_value=0.15,
+            early=1e-5,
+            midnight_k=midnight_k,
+        )
+
+    def test_sparse_layout(self):
+        lp = self._lp(K=12)
+        assert lp.num_col == 12 * milp._SLOT_COLS + 2
+        assert lp.num_row == 12 + 2
+        lp_mid = self._lp(midnight_k=5, K=12)
+        assert lp_mid.num_col == lp.num_col + 1
+        assert lp_mid.num_row == lp.num_row + 1
+        # CSC: one start per column plus the end sentinel.
+        assert len(lp.a_start) == lp.num_col + 1
+        assert lp.a_start[-1] == len(lp.a_index) == len(lp.a_value)
+
+    def test_template_reused_and_patched(self):
+        """Same horizon shape → same cached structure; only vectors change."""
+        first = self._lp(midnight_k=5, K=12)
+        second = milp._build_lp(
+            prices=[0.10] * 12, net=[0.5] * 12,
+            charge_ub=[1.0] * 12, discharge_ub=[0.0] * 12,
+            current_kwh=7.0, eff=0.9, soc_min=1.0, soc_max=9.0,
+            cycle_cost=0.0, reserve=4.0, reserve_penalty=3.0,
+            terminal_value=0.1, early=0.0, midnight_k=5,
+        )
+        assert second.a_index is first.a_index
+        assert second.a_value is first.a_value
+        step = milp._SLOT_COLS
+        assert second.col_upper[milp._COL_C:12 * step:step] == [1.0] * 12
+        assert second.col_upper[milp._COL_D:12 * step:step] == [0.0] * 12
+        assert second.col_lower[milp._COL_SOC:12 * step:step] == [1.0] * 12
+        assert second.row_lower[0] == pytest.approx(7.5)
+        assert second.row_lower[1] == pytest.approx(0.5)
+        # The first model's vectors are untouched by the second build.
+        assert first.row_lower[0] != second.row_lower[0]
+
+    @pytest.mark.parametrize("backend", _BACKENDS)
+    @pytest.mark.parametrize("midnight_k", [None, 5])
+    def test_backends_reach_same_optimum(self, backend, midnight_k):
+        lp = self._lp(midnight_k=midnight_k)
+        pulp = None
+        if backend == "pulp":
+            import pulp
+        x = milp._run_lp(lp, backend, pulp)
+        assert x is not None
+        objective = sum(c * v for c, v in zip(lp.col_cost, x))
+        # Reference: the first available backend's objective.
+        ref_backend = milp._inmemory_backend() or "pulp"
+        ref = milp._run_lp(lp, ref_backend, pulp if ref_backend == "pulp" else None)
+        assert objective == pytest.approx(
+            sum(c * v for c, v in zip(lp.col_cost, ref)), abs=1e-6)
+
+    def test_inmemory_backend_never_touches_cbc(self, monkeypatch):
+        if milp._inmemory_backend() is None:
+            pytest.skip("no in-memory LP backend installed")
+
+        def _no_cbc(_pulp):
+            raise AssertionError("CBC must not be used with an in-memory backend")
+
+        monkeypatch.setattr(milp, "_pick_solver", _no_cbc)
+        config = EMSConfig(grid_mode="from_grid", scheduler_engine="milp",
+                           battery_capacity_kwh=10)
+        state = EMSState(
+            slot_prices_today=[0.05] * 6 + [0.30] * 6, battery_soc_pct=10.0,
+            pv_hourly_kwh={}, pv_actual_today_kwh=0,
+            current_hour=0, current_minute=0,
+        )
+        result = calculate_schedule(config, state)
+        assert result.scheduler_active == "milp"
+
+
+class TestMILPWarmStart:
+    """Re-solves seed HiGHS with the previous basis, shifted by elapsed slots."""
+
+    @staticmethod
+    def _prices(seed):
+        import random
+
+        rng = random.Random(seed)
+        return [rng.uniform(0.0, 0.40) for _ in range(96)]
+
+    def _run(self, hour, minute, soc, today, tomorrow=None, plan_id=""):
+        config = EMSConfig(grid_mode="both", scheduler_engine="milp",
+                           battery_capacity_kwh=10, plan_id=plan_id)
+        state = EMSState(
+            slot_prices_today=today, slot_prices_tomorrow=tomorrow,
+            battery_soc_pct=soc,
+            pv_hourly_kwh={10: 2.0, 11: 3.0, 12: 3.0, 13: 2.0},
+            pv_actual_today_kwh=0, current_hour=hour, current_minute=minute,
+        )
+        return calculate_schedule(config, state)
+
+    @pytest.fixture(autouse=True)
+    def _highs_only(self, monkeypatch):
+        if milp._inmemory_backend() != "highs":
+            pytest.skip("warm start needs highspy")
+        monkeypatch.setattr(milp, "_WARM_STARTS", {})
+
+    def test_shifted_resolve_matches_cold_with_fewer_iterations(self):
+        today, tomorrow = self._prices(3), self._prices(4)
+        first = self._run(8, 0, 40, today, tomorrow)
+        assert first.solver_stats["warm_start"] == "cold"
+        warm = self._run(8, 30, 42, today, tomorrow)
+        assert warm.solver_stats["warm_start"] in ("basis", "solution")
+
+        milp._WARM_STARTS.clear()
+        cold = self._run(8, 30, 42, today, tomorrow)
+        assert cold.solver_stats["warm_start"] == "cold"
+        assert warm.solver_stats["iterations"] < cold.solver_stats["iterations"]
+        assert warm.scheduled_slots == cold.scheduled_slots
+        assert warm.tomorrow_scheduled_slots == cold.tomorrow_scheduled_slots
+
+    def test_midnight_rollover_maps_tomorrow_onto_today(self):
+        today, tomorrow = self._prices(5), self._prices(6)
+        self._run(23, 45, 50, today, tomorrow)
+        warm = self._run(0, 0, 50, tomorrow)
+        assert warm.solver_stats["warm_start"] == "basis"
+        milp._WARM_STARTS.clear()
+        cold = self._run(0, 0, 50, tomorrow)
+        assert warm.scheduled_slots == cold.scheduled_slots
+
+    def test_new_tomorrow_prices_still_warm(self):
+        today, tomorrow = self._prices(7), self._prices(8)
+        self._run(13, 0, 50, today)
+        warm = self._run(13, 5, 50, today, tomorrow)
+        assert warm.solver_stats["warm_start"] in ("basis", "solution")
+        milp._WARM_STARTS.clear()
+        cold = self._run(13, 5, 50, today, tomorrow)
+        assert warm.scheduled_slots == cold.scheduled_slots
+        assert warm.tomorrow_scheduled_slots == cold.tomorrow_scheduled_slots
+
+    def test_inverters_keep_separate_bases(self):
+        self._run(8, 0, 40, self._prices(10), plan_id="entry_a")
+        self._run(8, 0, 60, self._prices(11), plan_id="entry_b")
+        assert set(milp._WARM_STARTS) == {("entry_a", "both", 10), ("entry_b", "both", 10)}
+        other = self._run(8, 0, 40, self._prices(12), plan_id="entry_c")
+        assert other.solver_stats["warm_start"] == "cold"
+
+    def test_stats_reported(self):
+        result = self._run(8, 0, 40, self._prices(9))
+        stats = result.solver_stats
+        assert stats["backend"] == "highs"
+        assert stats["solve_ms"] >= 0
+        assert isinstance(stats["iterations"], int)
+
+    def test_dp_reports_stats_without_warm_start(self):
+        config = EMSConfig(grid_mode="both", scheduler_engine="dp",
+                           battery_capacity_kwh=10)
+        state = EMSState(
+            slot_prices_today=self._prices(10), battery_soc_pct=40,
+            pv_hourly_kwh={}, pv_actual_today_kwh=0,
+            current_hour=8, current_minute=0,
+        )
+        result = calculate_schedule(config, state)
+        assert result.scheduler_active == "dp"
+        assert result.solver_stats["backend"] in ("numpy", "python")
+        assert result.solver_stats["warm_start"] == "cold"
+        assert result.solver_stats["iterations"] is None
+
+
+@pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")
+class TestAutoEngine:
+    """"auto" races greedy and MILP and keeps the plan the shared model prices lower."""
+
+    @staticmethod
+    def _inputs(engine, budget=5.0):
+        import random
+
+        rng = random.Random(11)
+        config = EMSConfig(grid_mode="both", scheduler_engine=engine,
+                           battery_capacity_kwh=10, auto_engine_budget_s=budget)
+        state = EMSState(
+            slot_prices_today=[rng.uniform(0.0, 0.40) for _ in range(24)],
+            slot_prices_tomorrow=[rng.uniform(0.0, 0.40) for _ in range(24)],
+            battery_soc_pct=50.0,
+            pv_hourly_kwh={10: 2.0, 11: 3.0, 12: 3.0, 13: 2.0},
+            pv_actual_today_kwh=0, current_hour=6, current_minute=0,
+        )
+        return config, state
+
+    def test_commits_cheaper_plan(self):
+        config, state = self._inputs("auto")
+        result = calculate_schedule(config, state)
+        stats = result.solver_stats
+        costs = stats["auto_costs"]
+        assert set(costs) == {"greedy", "milp"}
+        winner = stats["auto_winner"]
+        assert costs[winner] == min(costs.values())
+        assert stats["auto_margin_eur"] == pytest.approx(
+            abs(costs["greedy"] - costs["milp"]), abs=1e-4)
+
+        alone = calculate_schedule(*self._inputs(winner))
+        assert result.scheduled_slots == alone.scheduled_slots
+        assert result.schedule_reason.startswith("Auto (")
+
+    def test_milp_over_budget_keeps_greedy(self, monkeypatch):
+        import time as _time
+
+        real = milp.solve_schedule
+
+        def _slow(*args, **kwargs):
+            _time.sleep(0.5)
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(milp, "solve_schedule", _slow)
+        config, state = self._inputs("auto", budget=0.05)
+        result = calculate_schedule(config, state)
+        assert result.solver_stats["auto_winner"] == "greedy"
+        assert set(result.solver_stats["auto_costs"]) == {"greedy"}
+        assert result.scheduler_active == "greedy"
+
+    def test_budget_is_milp_time_limit(self, monkeypatch):
+        seen = []
+        real = milp.solve_schedule
+
+        def _spy(*args, **kwargs):
+            seen.append(kwargs.get("time_limit"))
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(milp, "solve_schedule", _spy)
+        calculate_schedule(*self._inputs("auto", budget=3.0))
+        assert seen == [3.0]
+
+    def test_dp_plan_cost_prices_idle_plan(self):
+        config, state = self._inputs("auto")
+        common = {
+            "current_kwh": 5.0, "num_slots": 24, "current_slot": 6,
+            "minutes_per_slot": 60.0, "reserve_target": 2.0, "pv_confidence": 1.0,
+        }
+        idle = dp.plan_cost(config, state, today_slots={}, tomorrow_slots={}, **common)
+        optimal = dp.solve_schedule(config, state, remaining=[(6, 0.1)], **common)
+        planned = dp.plan_cost(config, state, today_slots=optimal[0],
+                               tomorrow_slots=optimal[1], **common)
+        assert planned <= idle + 1e-6
+
+
+class TestScheduleWorker:
+    """The optional worker process returns the same plan as an in-process solve."""
+
+    @pytest.fixture
+    def worker(self, monkeypatch):
+        package_dir = os.path.join(
+            os.path.dirname(__file__), "..", "custom_components", "ha_felicity")
+        # The spawned child resolves the pickled ems.* classes by importing
+        # the flat modules this file loaded, so put their directory on the
+        # path it inherits.
+        monkeypatch.syspath_prepend(package_dir)
+        spec = importlib.util.spec_from_file_location(
+            "worker", os.path.join(package_dir, "worker.py"))
+        module = importlib.util.module_from_spec(spec)
+        monkeypatch.setitem(sys.modules, "worker", module)
+        spec.loader.exec_module(module)
+        yield module
+        module.shutdown()
+
+    def test_process_plan_matches_in_process(self, worker):
+        config = EMSConfig(grid_mode="both", battery_capacity_kwh=10)
+        state = EMSState(
+            slot_prices_today=[0.05] * 8 + [0.30] * 8 + [0.10] * 8,
+            battery_soc_pct=40.0, pv_hourly_kwh={11: 2.0, 12: 2.0},
+            pv_actual_today_kwh=0, current_hour=2, current_minute=0,
+        )
+        remote = worker.submit(ems.calculate_schedule, config, state).result(timeout=120)
+        local = calculate_schedule(config, state)
+        assert isinstance(remote, ScheduleResult)
+        assert remote.scheduled_slots == local.scheduled_slots
+        assert remote.soc_trajectory == local.soc_trajectory
+        assert remote.schedule_reason == local.schedule_reason
+
+    def test_disable_stops_submissions(self, worker):
+        worker.disable("test")
+        assert not worker.available()
+        with pytest.raises(RuntimeError):
+            worker.submit(ems.calculate_schedule, EMSConfig(), EMSState())
+
+
+class TestPlanRepair:
+    """repair_schedule shifts the committed plan instead of re-solving it."""
+
+    PRICES = tuple(0.05 + 0.30 * ((i * 37) % 96) / 96 for i in range(96))
+
+    def _state(self, hour, minute, soc, pv=True):
+        return EMSState(
+            slot_prices_today=list(self.PRICES), battery_soc_pct=soc,
+            pv_hourly_kwh={10: 2.0, 11: 3.0, 12: 3.0, 13: 2.0} if pv else {},
+            pv_actual_today_kwh=0, current_hour=hour, current_minute=minute,
+        )
+
+    @pytest.mark.parametrize("mode", ["from_grid", "to_grid", "both"])
+    def test_greedy_repair_matches_full_replan(self, mode):
+        config = EMSConfig(grid_mode=mode, battery_capacity_kwh=10)
+        base = calculate_schedule(config, self._state(8, 0, 40.0))
+        later = self._state(8, 20, 39.0)
+        repaired = ems.repair_schedule(base, config, later)
+        assert repaired is not None
+        assert repaired.scheduled_slots == calculate_schedule(config, later).scheduled_slots
+        assert repaired.solver_stats["repaired"] is True
+
+    def test_past_slots_dropped(self):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=15)
+        base = calculate_schedule(config, self._state(0, 0, 40.0, pv=False))
+        assert min(base.scheduled_slots) < 8
+        repaired = ems.repair_schedule(base, config, self._state(2, 0, 60.0, pv=False))
+        assert repaired is not None
+        assert all(i >= 8 for i in repaired.scheduled_slots)
+        assert repaired.soc_trajectory[8] == pytest.approx(60.0, abs=0.5)
+
+    def test_soc_drop_adds_charge_or_declines(self):
+        config = EMSConfig(grid_mode="both", battery_capacity_kwh=10)
+        base = calculate_schedule(config, self._state(8, 0, 60.0))
+        repaired = ems.repair_schedule(base, config, self._state(8, 20, 30.0))
+        if repaired is None:
+            return
+        floor = config.battery_discharge_min_pct
+        for i in range(33, 96):
+            if repaired.soc_trajectory[i] <= floor + 0.05:
+                assert base.soc_trajectory[i] <= floor + 0.5
+
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend")
+    def test_solver_plan_keeps_its_charges(self):
+        config = EMSConfig(grid_mode="both", scheduler_engine="milp",
+                           battery_capacity_kwh=10)
+        base = calculate_schedule(config, self._state(8, 0, 40.0))
+        repaired = ems.repair_schedule(base, config, self._state(8, 20, 39.0))
+        assert repaired is not None
+        kept = {i: a for i, a in base.scheduled_slots.items() if i >= 33}
+        assert repaired.scheduled_slots == kept
+
+    @pytest.mark.parametrize("early, expected", [
+        (0.50, None),  # only slots above the charge ceiling precede the dip
+        (0.02, {2: "charge"}),
+    ])
+    def test_dip_charges_capped_by_price_ceiling(self, early, expected):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=6)
+        previous = ScheduleResult(soc_trajectory=[60.0] * 24, scheduled_slots={})
+        state = EMSState(
+            slot_prices_today=[early] * 12 + [0.05] * 12, battery_soc_pct=30.0,
+            pv_hourly_kwh={}, pv_actual_today_kwh=0, current_hour=2, current_minute=0,
+        )
+        repaired = ems.repair_schedule(previous, config, state)
+        if expected is None:
+            assert repaired is None
+            return
+        assert repaired.scheduled_slots == expected
+        assert repaired.cheap_slots_remaining == 1
+        assert repaired.price_threshold == early
+        assert "1 charge slot(s) added" in repaired.schedule_reason
+
+    def test_reason_and_counters_refreshed(self):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=15)
+        base = calculate_schedule(config, self._state(0, 0, 40.0, pv=False))
+        repaired = ems.repair_schedule(base, config, self._state(2, 0, 60.0, pv=False))
+        assert repaired is not None
+        charges = [i for i, a in repaired.scheduled_slots.items() if a == "charge"]
+        assert repaired.cheap_slots_remaining == len(charges)
+        assert repaired.schedule_reason.startswith("Repaired plan from 60% SOC")
+        if charges:
+            assert repaired.price_threshold == max(self.PRICES[i] for i in charges)
+
+    def test_off_mode_not_repairable(self):
+        config = EMSConfig(grid_mode="off", battery_capacity_kwh=10)
+        base = calculate_schedule(config, self._state(8, 0, 40.0))
+        assert ems.repair_schedule(base, config, self._state(8, 20, 40.0)) is None
+
+
+class TestScheduleBatch:
+    """calculate_schedule_batch matches one-by-one calls, column-wise."""
+
+    def _sweep(self):
+        prices = [0.05] * 8 + [0.30] * 8 + [0.10] * 8
+        configs = [EMSConfig(grid_mode="both", battery_capacity_kwh=10,
+                             consumption_est_kwh=kwh) for kwh in (8.0, 12.0, 16.0)]
+        states = [EMSState(slot_prices_today=list(prices), battery_soc_pct=soc,
+                           pv_hourly_kwh={11: 2.0, 12: 2.0}, pv_actual_today_kwh=0,
+                           current_hour=2, current_minute=0) for soc in (30.0, 50.0, 30.0)]
+        return configs, states
+
+    def test_matches_serial(self):
+        configs, states = self._sweep()
+        batch = ems.calculate_schedule_batch(configs, states)
+        assert len(batch) == 3
+        for i, (config, state) in enumerate(zip(configs, states)):
+            single = calculate_schedule(config, state)
+            assert batch["scheduled_slots"][i] == single.scheduled_slots
+            assert batch["soc_trajectory"][i] == single.soc_trajectory
+            assert batch.result(i).schedule_reason == single.schedule_reason
+
+    def test_broadcast_and_duplicates_solved_once(self):
+        configs, states = self._sweep()
+        batch = ems.calculate_schedule_batch(configs[0], [states[0], states[2], states[1]])
+        assert len(batch) == 3
+        assert batch.solved == 2
+        assert batch["scheduled_slots"][0] == batch["scheduled_slots"][1]
+
+    def test_length_mismatch_rejected(self):
+        configs, states = self._sweep()
+        with pytest.raises(ValueError):
+            ems.calculate_schedule_batch(configs, states[:2])
+
+    def test_process_pool_matches_serial(self, monkeypatch):
+        # Spawned children import the flat "ems" module this file loaded.
+        monkeypatch.syspath_prepend(os.path.join(
+            os.path.dirname(__file__), "..", "custom_components", "ha_felicity"))
+        configs, states = self._sweep()
+        serial = ems.calculate_schedule_batch(configs, states)
+        pooled = ems.calculate_schedule_batch(configs, states, workers=2)
+        # Phase timings are wall clock; everything else must match exactly.
+        del pooled.columns["phase_ms"], serial.columns["phase_ms"]
+        assert pooled.columns == serial.columns
+
+
+@pytest.mark.skipif(ems._np is None, reason="scenario check needs numpy")
+class TestScenarioCheck:
+    """Monte Carlo PV / consumption check on today's charge plan."""
+
+    PRICES = tuple(0.10 + 0.20 * (17 <= h < 21) + 0.01 * (i % 4)
+                   for h in range(24) for i in range(4))
+
+    def _run(self, samples, soc=30.0, **state_kwargs):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=12, pv_scenario_samples=samples)
+        state = EMSState(
+            slot_prices_today=list(self.PRICES), battery_soc_pct=soc,
+            pv_hourly_kwh={9: 1.0, 10: 2.0, 11: 3.0, 12: 3.0, 13: 2.0, 14: 1.0},
+            pv_actual_today_kwh=0, current_hour=6, current_minute=0,
+            **state_kwargs,
+        )
+        return calculate_schedule(config, state)
+
+    def test_disabled_by_default(self):
+        result = self._run(0)
+        assert "scenarios" not in result.solver_stats
+
+    def test_risky_plan_gets_extra_charges(self):
+        base = self._run(0)
+        checked = self._run(200)
+        stats = checked.solver_stats["scenarios"]
+        assert stats["base_shortfall_prob"] > 0.10
+        assert stats["shortfall_prob"] <= 0.10
+        assert stats["added"] > 0
+        added = set(checked.scheduled_slots) - set(base.scheduled_slots)
+        assert all(checked.scheduled_slots[i] == "charge" for i in added)
+        assert "Scenario check" in checked.schedule_reason
+
+    def test_same_slot_same_choice(self):
+        assert self._run(200).scheduled_slots == self._run(200).scheduled_slots
+
+    def test_dropped_charge_lowers_threshold(self):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=4, pv_scenario_samples=100)
+        state = EMSState(
+            slot_prices_today=[0.05] * 2 + [0.10] + [0.20] * 2 + [0.30] + [0.20] * 18,
+            battery_soc_pct=30.0, pv_hourly_kwh={}, pv_actual_today_kwh=0,
+            current_hour=1, current_minute=0,
+        )
+        result = ScheduleResult(scheduled_slots={2: "charge", 5: "charge"},
+                                price_threshold=0.30, cheap_slots_remaining=2,
+                                reserve_target_pct=20.0)
+        ems._apply_scenario_check(result, config, state, 3.0, 24, 1, 60.0)
+        assert result.solver_stats["scenarios"]["removed"] == 1
+        assert result.scheduled_slots == {2: "charge"}
+        assert result.price_threshold == 0.10
+        assert result.cheap_slots_remaining == 1
+
+    def test_added_charges_under_plan_ceiling(self):
+        base = self._run(0)
+        checked = self._run(200)
+        remaining = [(i, p) for i, p in enumerate(self.PRICES) if i >= 24]
+        ceiling = ems._charge_price_ceiling(base.scheduled_slots, remaining)
+        added = set(checked.scheduled_slots) - set(base.scheduled_slots)
+        assert added
+        assert all(self.PRICES[i] <= ceiling for i in added)
+
+    def test_learned_error_model_narrows_risk(self):
+        wide = self._run(200, pv_error_hourly={h: (1.0, 0.6) for h in range(24)})
+        tight = self._run(200, pv_error_hourly={h: (1.0, 0.05) for h in range(24)},
+                          consumption_error_hourly={h: 0.05 for h in range(24)})
+        assert (tight.solver_stats["scenarios"]["base_shortfall_prob"]
+                < wide.solver_stats["scenarios"]["base_shortfall_prob"])
+
+    def test_without_numpy_plan_unchanged(self, monkeypatch):
+        base = self._run(0)
+        monkeypatch.setattr(ems, "_np", None)
+        result = self._run(200)
+        assert result.scheduled_slots == base.scheduled_slots
+        assert "scenarios" not in result.solver_stats
+
+
+class TestExtendedHorizon:
+    """Estimated tomorrow prices extend the plan past midnight."""
+
+    TODAY = tuple([0.30] * 2 + [0.10] * 3 + [0.30] * 13 + [0.45] * 3 + [0.30] * 3)
+
+    def test_estimate_prefers_same_weekday(self):
+        history = [
+            {"weekday": 5, "prices": [0.05] * 24},
+            {"weekday": 5, "prices": [0.07] * 24},
+            {"weekday": 1, "prices": [0.30] * 24},
+        ]
+        assert ems.estimate_day_prices(history, 5, 24) == [0.06] * 24
+        # Too few same-weekday days: fall back to the median of all days.
+        assert ems.estimate_day_prices(history, 2, 24) == [0.07] * 24
+
+    def test_estimate_resamples_granularity(self):
+        quarter = [0.1, 0.2, 0.3, 0.4] * 24
+        history = [{"weekday": 0, "prices": quarter}, {"weekday": 0, "prices": quarter}]
+        assert ems.estimate_day_prices(history, 0, 24) == [0.25] * 24
+        assert ems.estimate_day_prices(history[:1], 0, 24) is None
+
+    def _state(self, **kwargs):
+        return EMSState(
+            slot_prices_today=list(self.TODAY), battery_soc_pct=50.0,
+            pv_forecast_today=5.0, pv_actual_today_kwh=0,
+            current_hour=8, current_minute=0,
+            slot_prices_tomorrow_estimate=[0.05] * 6 + [0.30] * 18,
+            pv_tomorrow_estimate_kwh=5.0, **kwargs,
+        )
+
+    def test_plans_tomorrow_provisionally(self):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           extended_horizon=True)
+        result = calculate_schedule(config, self._state())
+        assert result.tomorrow_provisional
+        assert result.tomorrow_scheduled_slots
+        assert all(i < 6 for i in result.tomorrow_scheduled_slots)
+        assert "provisional" in result.schedule_reason
+
+    def test_repair_keeps_provisional_tomorrow(self):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           extended_horizon=True)
+        base = calculate_schedule(config, self._state())
+        drifted = replace(self._state(), current_minute=20, battery_soc_pct=55.0)
+        repaired = ems.repair_schedule(base, config, drifted)
+        assert repaired is not None
+        assert repaired.tomorrow_provisional
+        assert "provisional" in repaired.schedule_reason
+        # Tomorrow's trajectory is re-derived from the drifted midnight SOC.
+        assert repaired.tomorrow_soc_trajectory
+        assert repaired.tomorrow_soc_trajectory != base.tomorrow_soc_trajectory
+        published = replace(drifted, slot_prices_tomorrow=[0.30] * 24)
+        assert ems.repair_schedule(base, config, published) is None
+
+    def test_off_or_known_prices_ignore_estimate(self):
+        off = calculate_schedule(
+            EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10), self._state())
+        assert not off.tomorrow_provisional
+        assert not off.tomorrow_scheduled_slots
+        known = calculate_schedule(
+            EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10, extended_horizon=True),
+            self._state(slot_prices_tomorrow=[0.30] * 24),
+        )
+        assert not known.tomorrow_provisional
+
+
+class TestVariablePower:
+    """Variable per-slot power: solver plans carry kW levels per slot."""
+
+    PRICES = tuple([0.30] * 2 + [0.10] * 4 + [0.30] * 12 + [0.45] * 3 + [0.30] * 3)
+
+    def _run(self, engine, variable_power=True, **config):
+        cfg = EMSConfig(
+            grid_mode="from_grid", battery_capacity_kwh=10, safe_power_kw=5,
+            inverter_max_power_kw=10, consumption_est_kwh=9,
+            scheduler_engine=engine, variable_power=variable_power, **config,
+        )
+        state = EMSState(
+            slot_prices_today=list(self.PRICES), battery_soc_pct=30,
+            pv_hourly_kwh={}, pv_actual_today_kwh=0, current_hour=0,
+        )
+        return calculate_schedule(cfg, state)
+
+    def test_fractional_walk_scales_actions(self):
+        np = pytest.importorskip("numpy")
+        args = (4.0, [0.0] * 3, [2.0] * 3, [[0.5, 1.0, 0.0]], [[0.0, 0.0, 0.25]],
+                2.0, 0.0, 10.0)
+        for floor in (None, 1.0):
+            py_rows, _ = ems._soc_walk_batch(*args, discharge_floor=floor, backend="python")
+            np_rows, _ = ems._soc_walk_batch(*args, discharge_floor=floor, backend="numpy")
+            assert list(py_rows[0]) == [4.0, 5.0, 7.0, 6.5]
+            assert np.asarray(np_rows).tolist() == [list(py_rows[0])]
+
+    def test_validation_keeps_charge_that_fits_at_reduced_power(self):
+        args = ([(0, 0.1), (1, 0.2)], {0, 1}, set(), 4.0, 0.0, {}, 60.0, 1.0,
+                10.0, 2.0, 5.0, 1.0)
+        full, _ = _validate_schedule_soc(*args)
+        reduced, _ = _validate_schedule_soc(*args, slot_power_kw={1: 1.0})
+        assert full == {0}
+        assert reduced == {0, 1}
+
+    @pytest.mark.parametrize("engine", [
+        pytest.param("milp", marks=pytest.mark.skipif(not _HAS_LP, reason="no LP backend installed")),
+        "dp",
+    ])
+    def test_solver_plans_partial_slots(self, engine):
+        binary = self._run(engine, variable_power=False)
+        result = self._run(engine)
+        assert result.scheduler_active == engine
+        assert not binary.slot_power_kw
+        assert result.slot_power_kw
+        for slot, kw in result.slot_power_kw.items():
+            assert result.scheduled_slots[slot] == "charge"
+            assert 0 < kw < 5
+            assert kw == pytest.approx(round(kw, 1))
+        # The trajectory follows the partial charges instead of a full slot.
+        assert max(result.soc_trajectory) <= 100.0
+        assert "reduced power" in result.schedule_reason
+
+    def test_power_step_rounds_levels(self):
+        result = self._run("dp", power_step_kw=1.0)
+        assert all(kw == int(kw) for kw in result.slot_power_kw.values())
+
+    def test_greedy_stays_full_power(self):
+        assert not self._run("greedy").slot_power_kw
+
+
+class TestPhaseProfiler:
+    """calculate_schedule records per-phase wall time and entry counts."""
+
+    PRICES = tuple(0.05 if h < 6 else 0.30 for h in range(24))
+
+    def _inputs(self, engine="greedy"):
+        config = EMSConfig(grid_mode="from_grid", battery_capacity_kwh=10,
+                           consumption_est_kwh=12, scheduler_engine=engine)
+        state = EMSState(slot_prices_today=list(self.PRICES),
+                         slot_prices_tomorrow=list(self.PRICES),
+                         battery_soc_pct=30.0, current_hour=0, current_minute=0)
+        return config, state
+
+    def test_greedy_phases_recorded(self):
+        result = calculate_schedule(*self._inputs())
+        assert result.scheduled_slots
+        for phase in ("prepare", "engine", "greedy.reserve", "greedy.selection",
+                      "greedy.validation", "trajectory", "tomorrow", "total"):
+            assert phase in result.phase_ms
+            assert result.phase_calls[phase] >= 1
+        assert result.phase_calls["greedy.reserve"] == 2
+        assert result.phase_ms["total"] >= result.phase_ms["engine"]
+        assert result.phase_ms["engine"] >= result.phase_ms["greedy.selection"]
+
+    @pytest.mark.skipif(not _HAS_LP, reason="no LP backend")
+    def test_milp_build_solve_extract(self):
+        result = calculate_schedule(*self._inputs("milp"))
+        assert result.scheduler_active == "milp"
+        for part in ("build", "solve", "extract"):
+            assert result.phase_calls[f"milp.{part}"] == 1
+            assert result.solver_stats[f"{part}_ms"] == result.phase_ms[f"milp.{part}"]
+
+    def test_phase_is_noop_outside_a_replan(self):
+        with ems._phase("greedy.selection"):
+            pass
+        ems._record_phase("engine", 1.0)
+        assert ems._PHASE_STATS.get() is None
+
+    def test_profile_schedule_dumps_stats(self, tmp_path):
+        import pstats
+
+        path = tmp_path / "replan.prof"
+        result = ems.profile_schedule(*self._inputs(), str(path))
+        assert result.scheduled_slots == calculate_schedule(*self._inputs()).scheduled_slots
+        names = {func[2] for func in pstats.Stats(str(path)).stats}
+        assert "_calculate_schedule" in names
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Historical backtest  (a year of real days through the scheduler)
+================================================================
+
+Replays stored day-ahead prices, PV actuals and house load slot by slot and
+acts on each strategy's decision with a simple battery model:
+
+  none     no EMS: the battery only self-consumes (PV surplus in, deficit out)
+  manual   the coordinator's manual threshold rule (price_threshold_level,
+           5 % hysteresis band) evaluated live every slot
+  greedy   ems.calculate_schedule with the greedy engine, replanned every
+           ``--replan-every`` slots (default: every slot); the battery runs
+           the current slot's action at its planned power
+  milp     the same with the MILP engine (``dp`` / ``auto`` work too)
+
+The plans see what the coordinator would: today's prices, tomorrow's from
+``--publish-hour`` on, the day's PV as the forecast (actuals, i.e. a perfect
+forecast), the PV produced so far and a 7-day hourly consumption profile
+built from the preceding days.  In auto mode the coordinator uses the plan's
+reserve target as the discharge floor; the battery model does the same.
+
+Per strategy it reports the total cost (import and export at the slot
+price), the cost with no battery at all, grid import / export, battery
+cycles (discharged kWh / capacity) and reserve breaches: slots in which the
+battery sat at its floor while the house imported above the day's average
+price, i.e. the reserve ran out before the expensive hours did.
+
+Days are cut into chunks of ``--chunk-days`` and the (strategy, chunk)
+pairs run in ``--workers`` processes.  Every chunk starts at ``--soc``; a
+chunk's first day loses at most one battery's worth of carry-over, which
+at the default 28-day chunks is noise on a year's total.
+
+Input
+-----
+A CSV (or Parquet, with pandas installed) with one row per slot:
+
+    timestamp,price,pv_kwh,load_kwh
+    2025-01-01T00:00,0.1123,0.0,0.21
+    2025-01-01T00:15,0.1098,0.0,0.19
+    ...
+
+``timestamp`` is local time, ``price`` EUR/kWh, ``pv_kwh`` / ``load_kwh``
+the energy in that slot.  Any whole number of slots per day works (24, 48,
+96...); incomplete days are dropped.  Without ``--data`` a synthetic year
+(``ems_scaling.synthetic_day`` with seasonal PV and load) is used.
+
+Run
+---
+    python tools/backtest.py                                     :: synthetic year
+    python tools/backtest.py --data history.csv --strategy greedy milp
+    python tools/backtest.py --data history.parquet --option battery_capacity_kwh=15
+    python tools/backtest.py --days 60 --replan-every 4 --json bt.json
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import importlib.util
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_REPO = os.path.dirname(_HERE)
+_PKG = os.path.join(_REPO, "custom_components", "ha_felicity")
+
+STRATEGIES = ("none", "manual", "greedy", "milp")
+PROFILE_DAYS = 7
+
+# Coordinator options the backtest understands (the same names and defaults
+# as the integration's options).
+DEFAULT_OPTIONS = {
+    "grid_mode": "both",
+    "battery_capacity_kwh": 10.0,
+    "battery_charge_max_level": 100,
+    "battery_discharge_min_level": 20,
+    "efficiency_factor": 0.90,
+    "power_level": 5,
+    "inverter_max_power_kw": 10,
+    "price_threshold_level": 5,
+    "reserve_target_pct": 0,
+    "arbitrage_price_delta": 0.0,
+    "battery_cycle_cost_eur_kwh": 0.0,
+    "variable_power": "off",
+}
+
+_EMS = None
+
+
+def _load(modname: str, filename: str):
+    spec = importlib.util.spec_from_file_location(modname, os.path.join(_PKG, filename))
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[modname] = mod          # so ems.py's lazy `import milp` resolves
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _ems():
+    """The ems module, loaded once per process (workers load their own)."""
+    global _EMS
+    if _EMS is None:
+        _EMS = _load("ems", "ems.py")
+        _load("milp", "milp.py")
+        _load("dp", "dp.py")
+    return _EMS
+
+
+# ---------------------------------------------------------------------------
+# Input
+# ---------------------------------------------------------------------------
+
+def _rows_from_file(path: str) -> list[tuple[datetime, float, float, float]]:
+    if path.endswith((".parquet", ".pq")):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("Reading Parquet needs pandas (and pyarrow); "
+                             "convert to CSV or pip install pandas pyarrow") from None
+        frame = pd.read_parquet(path, columns=["timestamp", "price", "pv_kwh", "load_kwh"])
+        records = frame.itertuples(index=False)
+    else:
+        with open(path, newline="", encoding="utf-8") as fh:
+            records = list(csv.DictReader(fh))
+        records = [(r["timestamp"], r["price"], r["pv_kwh"], r["load_kwh"]) for r in records]
+    rows = []
+    for ts, price, pv, load in records:
+        stamp = ts.to_pydatetime() if hasattr(ts, "to_pydatetime") else datetime.fromisoformat(str(ts))
+        rows.append((stamp.replace(tzinfo=None), float(price), float(pv), float(load)))
+    return rows
+
+
+def days_from_rows(rows) -> list[dict]:
+    """Group slot rows into whole days: {date, prices, pv, load} (per-slot lists)."""
+    by_day: dict[date, list] = {}
+    for stamp, price, pv, load in sorted(rows):
+        by_day.setdefault(stamp.date(), []).append((price, pv, load))
+    sizes = [len(v) for v in by_day.values()]
+    slots = max(set(sizes), key=sizes.count) if sizes else 0
+    days = []
+    for day, values in sorted(by_day.items()):
+        if len(values) != slots or 1440 % slots:
+            continue
+        prices, pv, load = (list(col) for col in zip(*values, strict=True))
+        days.append({"date": day.isoformat(), "prices": prices, "pv": pv, "load": load})
+    return days
+
+
+def synthetic_year(start: date, n_days: int, slots: int, seed: int) -> list[dict]:
+    """Seasonal synthetic days: 4-30 kWh PV (peak in June), 9-15 kWh load."""
+    sys.path.insert(0, _HERE)
+    from ems_scaling import synthetic_day
+
+    days = []
+    for i in range(n_days):
+        day = start + timedelta(days=i)
+        season = math.cos((day.timetuple().tm_yday - 172) / 365.0 * 2 * math.pi)
+        synth = synthetic_day(slots, seed=seed * 1000 + i, pv_kwh=17.0 + 13.0 * season,
+                              load_kwh=12.0 - 3.0 * season, negative=i % 7 == 5)
+        per_hour = slots // 24 or 1
+        pv = [synth["pv_hourly_kwh"].get(s * 24 // slots, 0.0) / per_hour for s in range(slots)]
+        load = [synth["consumption_hourly_kwh"].get(s * 24 // slots, 0.0) / per_hour
+                for s in range(slots)]
+        days.append({"date": day.isoformat(), "prices": synth["slot_prices_today"],
+                     "pv": pv, "load": load})
+    return days
+
+
+# ---------------------------------------------------------------------------
+# Strategies
+# ---------------------------------------------------------------------------
+
+def manual_threshold(prices: list[float], level: float) -> float:
+    """The coordinator's manual threshold (price_threshold_level 1-10)."""
+    pmin, pmax = min(prices), max(prices)
+    pavg = sum(prices) / len(prices)
+    if level <= 5:
+        return pmin + (pavg - pmin) * ((level - 1) / 4.0)
+    return pavg + (pmax - pavg) * ((level - 5) / 5.0)
+
+
+def _hourly(values: list[float]) -> dict[int, float]:
+    hourly: dict[int, float] = {}
+    n = len(values)
+    for slot, kwh in enumerate(values):
+        hour = slot * 24 // n
+        hourly[hour] = hourly.get(hour, 0.0) + kwh
+    return hourly
+
+
+def _profile(history: list[dict]) -> dict[int, float] | None:
+    """7-day average hourly consumption, as the coordinator's profile."""
+    if not history:
+        return None
+    hours = [_hourly(day["load"]) for day in history[-PROFILE_DAYS:]]
+    return {h: round(sum(d.get(h, 0.0) for d in hours) / len(hours), 3) for h in range(24)}
+
+
+class _Planner:
+    """Runs ems.calculate_schedule for one day the way the coordinator would."""
+
+    def __init__(self, engine: str, opts: dict):
+        self.ems = _ems()
+        self.engine = engine
+        self.opts = opts
+        self.result = None
+        self.solves = 0
+        self.solve_s = 0.0
+
+    def plan(self, day: dict, tomorrow: dict | None, history: list[dict], slot: int,
+             soc_pct: float, pv_so_far: float, slot_min: float):
+        ems, opts = self.ems, self.opts
+        minute = int(slot * slot_min)
+        profile = _profile(history)
+        pv_hourly = _hourly(day["pv"])
+        config = ems.EMSConfig(
+            grid_mode=opts["grid_mode"],
+            battery_capacity_kwh=opts["battery_capacity_kwh"],
+            battery_charge_max_pct=opts["battery_charge_max_level"],
+            battery_discharge_min_pct=opts["battery_discharge_min_level"],
+            efficiency=opts["efficiency_factor"],
+            safe_power_kw=opts["power_level"],
+            inverter_max_power_kw=opts["inverter_max_power_kw"],
+            consumption_est_kwh=sum(profile.values()) if profile else sum(day["load"]),
+            reserve_target_pct=opts["reserve_target_pct"],
+            arbitrage_price_delta=opts["arbitrage_price_delta"],
+            battery_cycle_cost_eur_kwh=opts["battery_cycle_cost_eur_kwh"],
+            scheduler_engine=self.engine,
+            variable_power=str(opts["variable_power"]).lower() in ("on", "true", "1"),
+        )
+        state = ems.EMSState(
+            battery_soc_pct=soc_pct,
+            slot_prices_today=day["prices"],
+            slot_prices_tomorrow=tomorrow["prices"] if tomorrow else None,
+            pv_hourly_kwh=pv_hourly,
+            pv_forecast_today=round(sum(day["pv"]), 2),
+            pv_forecast_remaining=round(sum(day["pv"][slot:]), 2),
+            pv_forecast_tomorrow=round(sum(tomorrow["pv"]), 2) if tomorrow else None,
+            pv_hourly_kwh_tomorrow=_hourly(tomorrow["pv"]) if tomorrow else None,
+            pv_actual_today_kwh=round(pv_so_far, 2),
+            consumption_hourly_kwh=profile,
+            current_hour=minute // 60,
+            current_minute=minute % 60,
+        )
+        t0 = time.perf_counter()
+        self.result = ems.calculate_schedule(config, state)
+        self.solve_s += time.perf_counter() - t0
+        self.solves += 1
+
+    def action(self, slot: int) -> tuple[str | None, float | None, float]:
+        """(action, power kW or None for full power, discharge floor %) for ``slot``."""
+        res = self.result
+        action = res.scheduled_slots.get(slot)
+        floor = max(self.opts["battery_discharge_min_level"], res.reserve_target_pct)
+        return action, res.slot_power_kw.get(slot), floor
+
+
+# ---------------------------------------------------------------------------
+# Battery model and one chunk
+# ---------------------------------------------------------------------------
+
+def run_chunk(job: dict) -> dict:
+    """Simulate ``job['days']`` (after ``job['warmup']`` profile-only days)."""
+    strategy, opts = job["strategy"], job["options"]
+    days, warmup = job["days"], job["warmup"]
+    cap = opts["battery_capacity_kwh"]
+    eff = opts["efficiency_factor"]
+    max_pct = opts["battery_charge_max_level"]
+    min_pct = opts["battery_discharge_min_level"]
+    allow_charge = opts["grid_mode"] in ("from_grid", "both")
+    allow_sell = opts["grid_mode"] in ("to_grid", "both")
+    planner = _Planner(strategy, opts) if strategy not in ("none", "manual") else None
+    soc = job["soc"]
+    totals = dict.fromkeys(("cost", "baseline", "import_kwh", "export_kwh", "charged_kwh",
+                            "discharged_kwh", "breaches"), 0.0)
+    months: dict[str, float] = {}
+    manual_state = "idle"
+
+    for d in range(warmup, len(days) - 1 if job["has_next"] else len(days)):
+        day = days[d]
+        tomorrow = days[d + 1] if d + 1 < len(days) else None
+        history = days[max(0, d - PROFILE_DAYS):d]
+        n = len(day["prices"])
+        slot_min = 1440 / n
+        slot_h = slot_min / 60.0
+        avg_price = sum(day["prices"]) / n
+        threshold = manual_threshold(day["prices"], opts["price_threshold_level"])
+        spread = max(day["prices"]) - min(day["prices"])
+        margin = spread * 0.05
+        pv_so_far = 0.0
+        month = day["date"][:7]
+        for slot in range(n):
+            price, pv, load = day["prices"][slot], day["pv"][slot], day["load"][slot]
+            action, power_kw, floor = None, None, min_pct
+            if strategy == "manual":
+                # coordinator._determine_energy_state, manual branch.
+                if manual_state == "charging" and allow_charge and price < threshold and soc < max_pct:
+                    action = "charge"
+                elif manual_state == "discharging" and allow_sell and price > threshold and soc > min_pct:
+                    action = "discharge"
+                elif allow_charge and price < threshold - margin and soc < max_pct:
+                    action = "charge"
+                elif allow_sell and price > threshold + margin and soc > min_pct:
+                    action = "discharge"
+                manual_state = {"charge": "charging", "discharge": "discharging"}.get(action, "idle")
+            elif planner is not None:
+                if planner.result is None or slot % job["replan_every"] == 0:
+                    published = tomorrow if slot * slot_min >= job["publish_hour"] * 60 else None
+                    planner.plan(day, published, history, slot, soc, pv_so_far, slot_min)
+                action, power_kw, floor = planner.action(slot)
+
+            limit = min(opts["power_level"] if power_kw is None else power_kw,
+                        opts["inverter_max_power_kw"]) * slot_h
+            if action == "charge" and soc < max_pct:
+                batt = limit                                    # kWh into the inverter
+            elif action == "discharge" and soc > floor:
+                batt = -limit
+            else:
+                floor = min_pct
+                batt = max(-opts["inverter_max_power_kw"] * slot_h,
+                           min(opts["inverter_max_power_kw"] * slot_h, pv - load))
+            if batt > 0:
+                room = max(0.0, (max_pct - soc) / 100.0 * cap)
+                batt = min(batt, room / eff)
+                soc += batt * eff / cap * 100.0
+            elif batt < 0:
+                avail = max(0.0, (soc - floor) / 100.0 * cap)
+                batt = max(batt, -avail)
+                soc += batt / cap * 100.0
+            grid = load - pv + batt
+            cost = grid * price
+            totals["cost"] += cost
+            totals["baseline"] += (load - pv) * price
+            totals["import_kwh"] += max(0.0, grid)
+            totals["export_kwh"] += max(0.0, -grid)
+            totals["charged_kwh"] += max(0.0, batt)
+            totals["discharged_kwh"] += max(0.0, -batt)
+            if soc <= min_pct + 0.5 and grid > 0.01 and price > avg_price:
+                totals["breaches"] += 1
+            months[month] = months.get(month, 0.0) + cost
+            pv_so_far += pv
+        if planner is not None:
+            planner.result = None   # a new day starts with a fresh plan
+
+    return {
+        "strategy": strategy,
+        "totals": totals,
+        "months": months,
+        "solves": planner.solves if planner else 0,
+        "solve_s": planner.solve_s if planner else 0.0,
+        "soc_end": soc,
+    }
+
+
+def _chunks(days: list[dict], chunk_days: int) -> list[tuple[list[dict], int, bool]]:
+    """(days with profile warm-up and one look-ahead day, warm-up count, has_next)."""
+    out = []
+    for start in range(0, len(days), chunk_days):
+        end = min(len(days), start + chunk_days)
+        lo = max(0, start - PROFILE_DAYS)
+        has_next = end < len(days)
+        out.append((days[lo:end + (1 if has_next else 0)], start - lo, has_next))
+    return out
+
+
+def _parse_option(text: str) -> tuple[str, object]:
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"--option needs KEY=VALUE, got {text!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Historical EMS backtest")
+    ap.add_argument("--data", help="CSV / Parquet with timestamp,price,pv_kwh,load_kwh")
+    ap.add_argument("--days", type=int, default=365,
+                    help="synthetic days (without --data) or the first N days of --data")
+    ap.add_argument("--start", default="2025-01-01", help="first synthetic day")
+    ap.add_argument("--slots", type=int, default=96, help="synthetic slots per day")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--strategy", nargs="+", default=list(STRATEGIES),
+                    help="none, manual and any ems engine (greedy, milp, dp, auto)")
+    ap.add_argument("--replan-every", type=int, default=1, help="slots between replans")
+    ap.add_argument("--publish-hour", type=int, default=13,
+                    help="hour from which tomorrow's prices are known")
+    ap.add_argument("--soc", type=float, default=50.0, help="SOC at the start of each chunk")
+    ap.add_argument("--chunk-days", type=int, default=28)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--option", type=_parse_option, action="append", default=[],
+                    metavar="KEY=VALUE", help="override an option (see DEFAULT_OPTIONS)")
+    ap.add_argument("--json", metavar="FILE", help="write totals and monthly costs as JSON")
+    args = ap.parse_args()
+
+    options = dict(DEFAULT_OPTIONS)
+    for key, value in args.option:
+        if key not in options:
+            print(f"Unknown option {key!r}; known: {', '.join(options)}")
+            return 2
+        options[key] = value
+
+    if args.data:
+        days = days_from_rows(_rows_from_file(args.data))[:args.days]
+    else:
+        days = synthetic_year(date.fromisoformat(args.start), args.days, args.slots, args.seed)
+    if not days:
+        print("No complete days in the input.")
+        return 2
+
+    jobs = [
+        {"strategy": strategy, "options": options, "days": chunk, "warmup": warmup,
+         "has_next": has_next, "soc": args.soc, "replan_every": max(1, args.replan_every),
+         "publish_hour": args.publish_hour}
+        for strategy in args.strategy
+        for chunk, warmup, has_next in _chunks(days, args.chunk_days)
+    ]
+    print(f"{len(days)} days ({days[0]['date']} .. {days[-1]['date']}, "
+          f"{len(days[0]['prices'])} slots/day), {len(jobs)} chunk(s) on "
+          f"{min(args.workers, len(jobs))} worker(s)")
+
+    t0 = time.perf_counter()
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            parts = list(pool.map(run_chunk, jobs))
+    else:
+        parts = [run_chunk(job) for job in jobs]
+    wall = time.perf_counter() - t0
+
+    summary: dict[str, dict] = {}
+    for part in parts:
+        entry = summary.setdefault(part["strategy"], {
+            **dict.fromkeys(part["totals"], 0.0), "months": {}, "solves": 0, "solve_s": 0.0})
+        for key, value in part["totals"].items():
+            entry[key] += value
+        for month, cost in part["months"].items():
+            entry["months"][month] = entry["months"].get(month, 0.0) + cost
+        entry["solves"] += part["solves"]
+        entry["solve_s"] += part["solve_s"]
+
+    cap = options["battery_capacity_kwh"]
+    print(f"{'strategy':<10} {'cost':>9} {'no-batt':>9} {'saving':>8} {'import':>8} "
+          f"{'export':>8} {'cycles':>7} {'breaches':>8} {'solves':>7} {'ms/solve':>8}")
+    for strategy, entry in summary.items():
+        entry["cycles"] = entry["discharged_kwh"] / cap if cap else 0.0
+        ms = entry["solve_s"] / entry["solves"] * 1000 if entry["solves"] else 0.0
+        print(f"{strategy:<10} {entry['cost']:>9.2f} {entry['baseline']:>9.2f} "
+              f"{entry['baseline'] - entry['cost']:>8.2f} {entry['import_kwh']:>8.0f} "
+              f"{entry['export_kwh']:>8.0f} {entry['cycles']:>7.1f} {entry['breaches']:>8.0f} "
+              f"{entry['solves']:>7} {ms:>8.2f}")
+    print(f"wall {wall:.1f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"days": len(days), "first": days[0]["date"], "last": days[-1]["date"],
+                       "options": options, "results": summary}, fh, indent=2, sort_keys=True)
+        print(f"Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
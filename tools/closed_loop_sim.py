@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Closed-loop day simulator  (real coordinator, emulated inverter, virtual clock)
+===============================================================================
+
+``ems_simulator.py`` calls ``ems.calculate_schedule`` once per scenario, so
+nothing the coordinator does between plans gets exercised: the tick's state
+decision, anti-conflict hysteresis, charge commitment, slot overrides, safe
+power, flexible loads and midnight rollover.  This simulator closes the loop:
+
+  * the real ``HA_FelicityCoordinator`` (built with the fakes from
+    ``coordinator_bench.py``) ticks every ``--tick-s`` virtual seconds,
+  * an emulated inverter reads back the rule-1 registers the coordinator
+    writes (Economic mode, charge / discharge enable, power, SOC limit),
+    moves the battery with a simple PV / load / battery model and publishes
+    SOC, grid power, phase currents and PV / load day counters into the
+    register image the next tick reads,
+  * ``datetime.now()`` and ``time.time()`` in ``coordinator.py`` follow a
+    virtual clock, so a day runs in seconds; ``--speed 1000`` paces it at
+    1000x real time instead of as fast as possible,
+  * Nordpool publishes tomorrow's prices at ``--publish-hour`` and rolls
+    them over at midnight; the forecast entity carries hourly ``wh_hours``
+    while the actual PV deviates from it by ``--pv-error``,
+  * flexible-load switches the coordinator turns on add their power to the
+    house load.
+
+Days come from ``ems_scaling.synthetic_day`` (seeded duck-curve prices,
+cloudy PV, spiky load).  ``--days`` runs are spread over worker processes;
+``--span`` keeps one coordinator across several consecutive days, so the
+midnight rollover runs under load.
+
+Per day it prints the energy cost against a no-battery baseline, SOC start /
+end / minimum, grid import / export, battery throughput and the number of
+register writes and state transitions.  ``--outdir`` also writes each run's
+full write log and per-slot trace as JSON.
+
+The emulated inverter is deliberately simple: rule 1 is always inside its
+time / weekday window, charging and discharging run at the written rule
+power, otherwise the battery self-consumes, and import and export use the
+same slot price.
+
+Run
+---
+    python tools/closed_loop_sim.py                              :: 8 days, auto / greedy
+    python tools/closed_loop_sim.py --days 28 --span 7 --engine milp
+    python tools/closed_loop_sim.py --price-mode manual --option price_threshold_level=3
+    python tools/closed_loop_sim.py --option flexible_load_1_enabled=on \\
+        --option flexible_load_1_switch_entity=switch.boiler --outdir sim_output
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _HERE)
+
+from coordinator_bench import (  # noqa: I001
+    FORECAST_ENTITY, NORDPOOL_ENTITY, FakeModbusClient, _ConfigEntry, _Hass,
+    _load_package,
+)
+from ems_scaling import synthetic_day
+
+SLOTS_PER_DAY = 96
+
+# Measurement / control register keys per model family.
+_SMALL = {
+    "soc": ("battery_capacity",),
+    "voltage": ("battery_voltage",),
+    "grid_w": "total_ac_input_power",
+    "currents": ("ac_input_current", "ac_input_current_l2", "ac_input_current_l3"),
+    "pv_w": "pv_power_conversion",
+    "pv_day_wh": "pv_generated_energy_day",
+    "load_day_wh": "load_consumption_energy_day",
+}
+_LARGE = {
+    "soc": ("bat1_soc",),
+    "voltage": ("bat1_voltage",),
+    "grid_kw": "total_grid_power",
+    "currents": ("phase_a_ct_current", "phase_b_ct_current", "phase_c_ct_current"),
+    "pv_kw": "pv1_power",
+    "pv_day_kwh": "pv1_day_energy",
+    "load_day_kwh": "homeload_day_cost_energy",
+}
+
+
+# ---------------------------------------------------------------------------
+# Virtual clock
+# ---------------------------------------------------------------------------
+
+class VirtualClock:
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def advance(self, seconds: float) -> None:
+        self.now += timedelta(seconds=seconds)
+
+    def install(self, coordinator_mod) -> None:
+        """Point the coordinator module's ``datetime`` and ``time`` at this clock."""
+        clock = self
+        real_time = coordinator_mod.time
+
+        class _VirtualDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now if tz is None else clock.now.astimezone(tz)
+
+        class _VirtualTime:
+            def __getattr__(self, name):
+                return getattr(real_time, name)
+
+            def time(self) -> float:
+                return clock.now.timestamp()
+
+        coordinator_mod.datetime = _VirtualDatetime
+        coordinator_mod.time = _VirtualTime()
+
+
+# ---------------------------------------------------------------------------
+# Register codec (the inverse of the coordinator's read path)
+# ---------------------------------------------------------------------------
+
+_SCALE = {1: 10, 8: 10, 2: 100, 9: 100, 4: 1000, 10: 1000}
+
+
+def encode(info: dict, value: float) -> list[int]:
+    size = info.get("size", 1)
+    raw = round(value * _SCALE.get(info.get("index", 0), 1))
+    if raw < 0:
+        raw += 1 << (16 * size)
+    words = [(raw >> (16 * i)) & 0xFFFF for i in range(size - 1, -1, -1)]
+    return words if info.get("endian", "big") == "big" else words[::-1]
+
+
+def decode(info: dict, words: list[int]) -> float:
+    size = info.get("size", 1)
+    index = info.get("index", 0)
+    if info.get("endian", "big") != "big":
+        words = words[::-1]
+    raw = 0
+    for word in words:
+        raw = (raw << 16) | word
+    if index in (3, 8, 9, 10) and raw >= 1 << (16 * size - 1):
+        raw -= 1 << (16 * size)
+    return raw / _SCALE.get(index, 1)
+
+
+class LoggingModbusClient(FakeModbusClient):
+    """FakeModbusClient that keeps a time-stamped, decoded write log."""
+
+    def __init__(self, image, registers: dict, clock: VirtualClock):
+        super().__init__(image)
+        self._by_address = {}
+        for key, info in registers.items():
+            self._by_address.setdefault(info["address"], (key, info))
+        self._clock = clock
+        self.log: list[tuple[str, str, float]] = []
+
+    async def write_registers(self, address, values, device_id=1):
+        key, info = self._by_address.get(address, (f"@{address}", {}))
+        value = decode(info, list(values)) if info else values[0]
+        self.log.append((self._clock.now.isoformat(timespec="seconds"), key, value))
+        return await super().write_registers(address, values, device_id)
+
+
+class _SwitchServices:
+    """hass.services that tracks switch entities and logs every call."""
+
+    def __init__(self, clock: VirtualClock, log: list):
+        self.on: set[str] = set()
+        self._clock = clock
+        self._log = log
+
+    async def async_call(self, domain, service, data=None, **_) -> None:
+        entity_id = (data or {}).get("entity_id")
+        if service == "turn_on":
+            self.on.add(entity_id)
+        elif service == "turn_off":
+            self.on.discard(entity_id)
+        self._log.append((self._clock.now.isoformat(timespec="seconds"),
+                          f"{domain}.{service}", entity_id))
+
+
+# ---------------------------------------------------------------------------
+# Emulated inverter
+# ---------------------------------------------------------------------------
+
+class EmulatedInverter:
+    """Battery / PV / load physics behind the register image."""
+
+    def __init__(self, const, model: str, registers: dict, image: dict, *,
+                 capacity_kwh: float, soc_pct: float, floor_pct: float,
+                 efficiency: float):
+        self.registers = registers
+        self.image = image
+        self.small = model in (const.INVERTER_MODEL_TREX_FIVE, const.INVERTER_MODEL_TREX_TEN)
+        self.keys = _SMALL if self.small else _LARGE
+        self.max_kw = const.INVERTER_MAX_POWER_KW.get(model, 10)
+        self.phases = sum(1 for k in self.keys["currents"] if k in registers) or 1
+        self.capacity_kwh = capacity_kwh
+        self.soc = soc_pct
+        self.floor_pct = floor_pct
+        self.efficiency = efficiency
+        self.pv_day_kwh = 0.0
+        self.load_day_kwh = 0.0
+
+    def _get(self, key: str) -> float:
+        info = self.registers.get(key)
+        if info is None:
+            return 0.0
+        size = info.get("size", 1)
+        return decode(info, [self.image.get(info["address"] + i, 0) for i in range(size)])
+
+    def _put(self, key: str, value: float) -> None:
+        info = self.registers.get(key)
+        if info is not None:
+            for i, word in enumerate(encode(info, value)):
+                self.image[info["address"] + i] = word
+
+    def controls(self) -> tuple[str, float, float]:
+        """(action, rule power kW, SOC limit %) as the written registers say."""
+        if self.small:
+            economic = self._get("operating_mode") == 2
+            enable = self._get("econ_rule_1_enable")
+            charge, discharge = economic and enable == 1, economic and enable == 2
+            power_kw = self._get("econ_rule_1_power") / 1000.0
+        else:
+            economic = self._get("eco_timeofuse") == 1
+            charge = economic and self._get("econ_rule_1_grid_charge_enable") == 1
+            discharge = (economic and not charge
+                         and self._get("econ_rule_1_sell_enable") == 1)
+            power_kw = self._get("econ_rule_1_power")
+        action = "charge" if charge else "discharge" if discharge else "self_use"
+        return action, power_kw, self._get("econ_rule_1_soc")
+
+    def step(self, dt_h: float, pv_kw: float, load_kw: float) -> dict:
+        """Advance the battery by ``dt_h`` hours; returns the flows in kW."""
+        action, rule_kw, soc_limit = self.controls()
+        limit_kw = min(self.max_kw, max(0.0, rule_kw))
+        if action == "charge" and self.soc < soc_limit:
+            batt_kw = limit_kw
+        elif action == "discharge" and self.soc > soc_limit:
+            batt_kw = -limit_kw
+        else:
+            batt_kw = max(-self.max_kw, min(self.max_kw, pv_kw - load_kw))
+        floor = soc_limit if action == "discharge" else self.floor_pct
+        top = soc_limit if action == "charge" else 100.0
+        if batt_kw > 0:
+            room_kwh = max(0.0, (top - self.soc) / 100.0 * self.capacity_kwh)
+            batt_kw = min(batt_kw, room_kwh / (dt_h * self.efficiency))
+            self.soc += batt_kw * dt_h * self.efficiency / self.capacity_kwh * 100.0
+        elif batt_kw < 0:
+            avail_kwh = max(0.0, (self.soc - floor) / 100.0 * self.capacity_kwh)
+            batt_kw = max(batt_kw, -avail_kwh / dt_h)
+            self.soc += batt_kw * dt_h / self.capacity_kwh * 100.0
+        grid_kw = load_kw - pv_kw + batt_kw
+        self.pv_day_kwh += pv_kw * dt_h
+        self.load_day_kwh += load_kw * dt_h
+        return {"action": action, "batt_kw": batt_kw, "grid_kw": grid_kw}
+
+    def new_day(self) -> None:
+        self.pv_day_kwh = 0.0
+        self.load_day_kwh = 0.0
+
+    def publish(self, pv_kw: float, grid_kw: float) -> None:
+        """Write the measurements the coordinator reads into the image."""
+        keys = self.keys
+        for key in keys["soc"]:
+            self._put(key, self.soc)
+        for key in keys["voltage"]:
+            self._put(key, 52.0)
+        amps = abs(grid_kw) * 1000.0 / 230.0 / self.phases
+        for key in keys["currents"]:
+            self._put(key, amps)
+        if self.small:
+            self._put(keys["grid_w"], grid_kw * 1000.0)
+            self._put(keys["pv_w"], pv_kw * 1000.0)
+            self._put(keys["pv_day_wh"], self.pv_day_kwh * 1000.0)
+            self._put(keys["load_day_wh"], self.load_day_kwh * 1000.0)
+        else:
+            self._put(keys["grid_kw"], grid_kw)
+            self._put(keys["pv_kw"], pv_kw)
+            self._put(keys["pv_day_kwh"], self.pv_day_kwh)
+            self._put(keys["load_day_kwh"], self.load_day_kwh)
+
+
+# ---------------------------------------------------------------------------
+# Inputs
+# ---------------------------------------------------------------------------
+
+def make_day(index: int, seed: int, pv_kwh: float, load_kwh: float, pv_error: float) -> dict:
+    """Synthetic day ``index``: prices, forecast and the PV that actually comes."""
+    day = synthetic_day(SLOTS_PER_DAY, seed=seed * 1000 + index, pv_kwh=pv_kwh,
+                        load_kwh=load_kwh, negative=index % 5 == 3)
+    rng = random.Random(seed * 7919 + index)
+    actual = {h: kwh * max(0.0, rng.gauss(1.0, pv_error))
+              for h, kwh in day["pv_hourly_kwh"].items()}
+    day["pv_actual_hourly_kwh"] = actual
+    return day
+
+
+def _forecast_state(hass, today: date, day: dict, tomorrow: dict) -> None:
+    wh_hours = {}
+    for when, src in ((today, day), (today + timedelta(days=1), tomorrow)):
+        for hour, kwh in src["pv_hourly_kwh"].items():
+            stamp = datetime(when.year, when.month, when.day, hour).isoformat()
+            wh_hours[stamp] = round(kwh * 1000)
+    hass.states.set(FORECAST_ENTITY, str(day["pv_forecast_today"]), {"wh_hours": wh_hours})
+
+
+def _nordpool_state(hass, day: dict, tomorrow: dict | None, slot: int) -> None:
+    today = day["slot_prices_today"]
+    hass.states.set(NORDPOOL_ENTITY, str(today[slot]), {
+        "today": today,
+        "tomorrow": tomorrow["slot_prices_today"] if tomorrow else [],
+        "min": min(today),
+        "max": max(today),
+        "average": round(sum(today) / len(today), 4),
+    })
+
+
+# ---------------------------------------------------------------------------
+# One run
+# ---------------------------------------------------------------------------
+
+def _options(args: dict, const, registers: dict) -> dict:
+    options = {
+        "price_mode": args["price_mode"],
+        "grid_mode": args["grid_mode"],
+        "scheduler_engine": args["engine"],
+        "battery_capacity_kwh": args["capacity"],
+        "battery_discharge_min_level": args["floor"],
+        "power_level": 5,
+        "max_amperage_per_phase": 16,
+        "efficiency_factor": 0.90,
+        # Let the coordinator open the rule-1 window where the model has one.
+        "rule1_time_window": "auto" if "econ_rule_1_stop_time" in registers else "manual",
+        "rule1_weekday": "auto" if "econ_rule_1_effective_week" in registers else "manual",
+        const.CONF_REGISTER_SET: "full",
+    }
+    options.update(args["options"])
+    return options
+
+
+def _flex_loads(options: dict) -> dict[str, float]:
+    loads = {}
+    for n in (1, 2, 3):
+        entity = options.get(f"flexible_load_{n}_switch_entity")
+        if str(options.get(f"flexible_load_{n}_enabled", "off")).lower() == "on" and entity:
+            loads[entity] = float(options.get(f"flexible_load_{n}_power_kw", 2.0))
+    return loads
+
+
+async def _run(pkg, job: dict) -> dict:
+    const, coordinator_mod = pkg["const"], pkg["coordinator"]
+    args = job["args"]
+    start = datetime.combine(date.fromisoformat(job["start"]), datetime.min.time())
+    clock = VirtualClock(start)
+    clock.install(coordinator_mod)
+
+    model = args["model"]
+    model_config = const.MODEL_REGISTRY[model]
+    registers = model_config["registers"]
+    image: dict[int, int] = {}
+    client = LoggingModbusClient(image, registers, clock)
+    hass = _Hass()
+    hass.services = _SwitchServices(clock, client.log)
+    options = _options(args, const, registers)
+    flex = _flex_loads(options)
+    coord = coordinator_mod.HA_FelicityCoordinator(
+        hass=hass, client=client, slave_id=1, register_map=dict(registers),
+        groups=model_config["register_groups"], model_combined=model_config["combined"],
+        inverter_model=model, config_entry=_ConfigEntry(model, options),
+        nordpool_entity=NORDPOOL_ENTITY, forecast_entity=FORECAST_ENTITY,
+    )
+    inverter = EmulatedInverter(
+        const, model, registers, image, capacity_kwh=args["capacity"],
+        soc_pct=args["soc"], floor_pct=min(10.0, args["floor"]), efficiency=0.90)
+
+    days = [make_day(job["first_day"] + i, args["seed"], args["pv_kwh"], args["load_kwh"],
+                     args["pv_error"]) for i in range(job["span"] + 1)]
+    tick_s = args["tick_s"]
+    dt_h = tick_s / 3600.0
+    ticks_per_day = int(86400 / tick_s)
+    summaries, trace, failures = [], [], []
+    t_real0 = time.perf_counter()
+
+    for d in range(job["span"]):
+        day, tomorrow = days[d], days[d + 1]
+        today = (start + timedelta(days=d)).date()
+        inverter.new_day()
+        _forecast_state(hass, today, day, tomorrow)
+        writes_before, failures_before = len(client.log), len(failures)
+        replans_before, repairs_before = coord.schedule_replans, coord.schedule_repairs
+        stats = dict.fromkeys(("cost", "baseline", "import_kwh", "export_kwh",
+                               "charged_kwh", "discharged_kwh"), 0.0)
+        soc_start, soc_min = inverter.soc, inverter.soc
+        transitions, last_state = 0, coord._current_energy_state
+        slot_acc: dict | None = None
+
+        for t in range(ticks_per_day):
+            now = clock.now
+            slot = (now.hour * 60 + now.minute) * SLOTS_PER_DAY // 1440
+            price = day["slot_prices_today"][slot]
+            published = tomorrow if now.hour >= args["publish_hour"] else None
+            _nordpool_state(hass, day, published, slot)
+
+            pv_kw = day["pv_actual_hourly_kwh"].get(now.hour, 0.0)
+            load_kw = day["consumption_hourly_kwh"].get(now.hour, 0.0)
+            load_kw += sum(kw for entity, kw in flex.items() if entity in hass.services.on)
+            flow = inverter.step(dt_h, pv_kw, load_kw)
+            inverter.publish(pv_kw, flow["grid_kw"])
+
+            grid_kwh = flow["grid_kw"] * dt_h
+            stats["cost"] += grid_kwh * price
+            stats["baseline"] += (load_kw - pv_kw) * dt_h * price
+            stats["import_kwh"] += max(0.0, grid_kwh)
+            stats["export_kwh"] += max(0.0, -grid_kwh)
+            stats["charged_kwh"] += max(0.0, flow["batt_kw"]) * dt_h
+            stats["discharged_kwh"] += max(0.0, -flow["batt_kw"]) * dt_h
+            soc_min = min(soc_min, inverter.soc)
+
+            try:
+                coord.data = await coord._async_update_data()
+            except coordinator_mod.UpdateFailed as err:  # HA logs it and retries
+                failures.append((now.isoformat(timespec="seconds"), str(err)))
+            if coord._current_energy_state != last_state:
+                transitions += 1
+                last_state = coord._current_energy_state
+
+            if slot_acc is None or slot_acc["slot"] != slot:
+                if slot_acc is not None:
+                    trace.append(slot_acc)
+                slot_acc = {"date": today.isoformat(), "slot": slot, "price": price,
+                            "soc": 0.0, "grid_kwh": 0.0, "pv_kwh": 0.0, "load_kwh": 0.0,
+                            "state": coord._current_energy_state}
+            slot_acc["soc"] = round(inverter.soc, 2)
+            slot_acc["grid_kwh"] = round(slot_acc["grid_kwh"] + grid_kwh, 4)
+            slot_acc["pv_kwh"] = round(slot_acc["pv_kwh"] + pv_kw * dt_h, 4)
+            slot_acc["load_kwh"] = round(slot_acc["load_kwh"] + load_kw * dt_h, 4)
+
+            clock.advance(tick_s)
+            if args["speed"] > 0:
+                ahead = (clock.now - start).total_seconds() / args["speed"] - (
+                    time.perf_counter() - t_real0)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        if slot_acc is not None:
+            trace.append(slot_acc)
+
+        summaries.append({
+            "date": today.isoformat(),
+            **{k: round(v, 3) for k, v in stats.items()},
+            "saving": round(stats["baseline"] - stats["cost"], 3),
+            "cycles": round(stats["discharged_kwh"] / args["capacity"], 2),
+            "soc_start": round(soc_start, 1),
+            "soc_end": round(inverter.soc, 1),
+            "soc_min": round(soc_min, 1),
+            "writes": len(client.log) - writes_before,
+            "transitions": transitions,
+            "failed_ticks": len(failures) - failures_before,
+            "replans": coord.schedule_replans - replans_before,
+            "repairs": coord.schedule_repairs - repairs_before,
+        })
+
+    task = coord._schedule_task
+    if task is not None and not task.done():
+        task.cancel()
+    real_s = time.perf_counter() - t_real0
+    return {
+        "start": job["start"],
+        "days": summaries,
+        "real_s": round(real_s, 2),
+        "speedup": round(job["span"] * 86400 / real_s) if real_s else None,
+        "writes": client.log,
+        "failures": failures,
+        "trace": trace,
+    }
+
+
+def simulate(job: dict) -> dict:
+    """Worker entry point: one run of ``job['span']`` consecutive days."""
+    logging.basicConfig(level=job["args"]["log_level"])
+    return asyncio.run(_run(_load_package(), job))
+
+
+def _parse_option(text: str) -> tuple[str, object]:
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"--option needs KEY=VALUE, got {text!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Closed-loop coordinator day simulator")
+    ap.add_argument("--days", type=int, default=8, help="days to simulate in total")
+    ap.add_argument("--span", type=int, default=1,
+                    help="consecutive days per run (one coordinator, midnight rollovers)")
+    ap.add_argument("--start", default="2026-06-01", help="first day (YYYY-MM-DD)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--model", default="T-REX-10K-P3G01")
+    ap.add_argument("--price-mode", choices=["manual", "auto"], default="auto")
+    ap.add_argument("--grid-mode", choices=["off", "from_grid", "to_grid", "both"],
+                    default="both")
+    ap.add_argument("--engine", default="greedy", help="scheduler_engine in auto mode")
+    ap.add_argument("--capacity", type=float, default=10.0, help="battery kWh")
+    ap.add_argument("--soc", type=float, default=50.0, help="SOC at the start of a run")
+    ap.add_argument("--floor", type=float, default=20.0, help="battery_discharge_min_level")
+    ap.add_argument("--pv-kwh", type=float, default=20.0)
+    ap.add_argument("--load-kwh", type=float, default=12.0)
+    ap.add_argument("--pv-error", type=float, default=0.2,
+                    help="sigma of the hourly actual / forecast PV ratio")
+    ap.add_argument("--publish-hour", type=int, default=13,
+                    help="hour at which tomorrow's prices appear")
+    ap.add_argument("--tick-s", type=float, default=10.0, help="virtual seconds per tick")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="pace at this many x real time (0 = as fast as possible)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--option", type=_parse_option, action="append", default=[],
+                    metavar="KEY=VALUE", help="extra coordinator option (JSON value)")
+    ap.add_argument("--log-level", default="ERROR",
+                    help="coordinator log level (INFO shows every decision)")
+    ap.add_argument("--outdir", help="write each run's write log and slot trace here")
+    args = ap.parse_args()
+
+    shared = {
+        "model": args.model, "price_mode": args.price_mode, "grid_mode": args.grid_mode,
+        "engine": args.engine, "capacity": args.capacity, "soc": args.soc,
+        "floor": args.floor, "pv_kwh": args.pv_kwh, "load_kwh": args.load_kwh,
+        "pv_error": args.pv_error, "publish_hour": args.publish_hour,
+        "tick_s": args.tick_s, "speed": args.speed, "seed": args.seed,
+        "log_level": args.log_level.upper(),
+        "options": dict(args.option),
+    }
+    first = date.fromisoformat(args.start)
+    span = max(1, args.span)
+    jobs = [
+        {"args": shared, "start": (first + timedelta(days=d)).isoformat(),
+         "first_day": d, "span": min(span, args.days - d)}
+        for d in range(0, args.days, span)
+    ]
+
+    t0 = time.perf_counter()
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            runs = list(pool.map(simulate, jobs))
+    else:
+        runs = [simulate(job) for job in jobs]
+    wall = time.perf_counter() - t0
+
+    print(f"{'date':<11} {'cost':>7} {'no-batt':>8} {'saving':>7} {'import':>7} "
+          f"{'export':>7} {'cycles':>6} {'soc s/e/min':>15} {'writes':>6} {'trans':>5} "
+          f"{'replan':>6} {'repair':>6} {'failed':>6}")
+    total = {"cost": 0.0, "baseline": 0.0}
+    for run in runs:
+        for day in run["days"]:
+            total["cost"] += day["cost"]
+            total["baseline"] += day["baseline"]
+            socs = f"{day['soc_start']:.0f}/{day['soc_end']:.0f}/{day['soc_min']:.0f}"
+            print(f"{day['date']:<11} {day['cost']:>7.2f} {day['baseline']:>8.2f} "
+                  f"{day['saving']:>7.2f} {day['import_kwh']:>7.1f} {day['export_kwh']:>7.1f} "
+                  f"{day['cycles']:>6.2f} {socs:>15} {day['writes']:>6} "
+                  f"{day['transitions']:>5} {day['replans']:>6} {day['repairs']:>6} "
+                  f"{day['failed_ticks']:>6}")
+    n_days = sum(len(run["days"]) for run in runs)
+    print(f"{n_days} day(s): cost {total['cost']:.2f} vs {total['baseline']:.2f} without "
+          f"battery (saving {total['baseline'] - total['cost']:.2f}); wall {wall:.1f}s, "
+          f"{n_days * 86400 / wall:.0f}x real time over {len(jobs)} run(s)")
+
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+        for run in runs:
+            path = os.path.join(args.outdir, f"closed_loop_{run['start']}.json")
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(run, fh, indent=1)
+        print(f"Write logs and slot traces in {args.outdir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
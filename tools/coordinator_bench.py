@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Coordinator tick benchmark  (ticks/s, allocations and event-loop blocking)
+==========================================================================
+
+``ems_bench.py`` times the scheduler on its own.  This runner times what Home
+Assistant actually runs every ``update_interval`` (10 s by default): one
+``HA_FelicityCoordinator._async_update_data`` call.  It uses the same trick as
+``tests/test_coordinator.py`` (Home Assistant and pymodbus replaced by small
+fakes in ``sys.modules``), but loads the real ``const``, ``type_specific``,
+``trex_*``, ``ems`` and ``coordinator`` modules and builds the coordinator
+through its real ``__init__``, the way ``async_setup_entry`` does:
+
+  * a fake Modbus client answers every register group of the model's full
+    map from a register image (SOC and battery voltage set, the rest zero),
+    yielding to the loop once per read like a real transport would,
+  * a fake Nordpool state carries today's and tomorrow's 15-minute prices,
+  * a fake Forecast.Solar state carries hourly ``wh_hours`` for both days.
+
+For each (model, register set, price mode) it reports:
+
+  * the **cold tick**: the first tick (store load, first schedule solve),
+  * **ticks/s** over ``--ticks`` warm ticks,
+  * **KiB allocated per tick** (median ``tracemalloc`` peak above the
+    starting level) and **KiB retained per tick** (net growth over the run,
+    a leak shows up here),
+  * **event-loop blocking**: the longest single callback the tick ran on the
+    loop, and the median loop time per tick.  Work handed to the executor
+    (the schedule solve) does not block the loop and is not counted.
+
+``--soc-step`` moves the SOC every tick (default 0.1 %), so auto mode goes
+through the replan-or-repair decision on every tick instead of the
+"inputs unchanged" early return.  Use ``--soc-step 0`` for the idle case.
+
+Run
+---
+    python tools/coordinator_bench.py
+    python tools/coordinator_bench.py --model T-REX-50KHP3G01 --price-mode auto
+    python tools/coordinator_bench.py --engine milp --ticks 500 --json ticks.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import asyncio.events
+import gc
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_REPO = os.path.dirname(_HERE)
+_PKG = os.path.join(_REPO, "custom_components", "ha_felicity")
+_PKG_NAME = "custom_components.ha_felicity"
+
+NORDPOOL_ENTITY = "sensor.nordpool_kwh_bench"
+FORECAST_ENTITY = "sensor.energy_production_today_bench"
+
+# Raw register values for the keys the tick reads back (scaled /10).
+_REGISTER_IMAGE = {
+    "battery_voltage": 520,
+    "bat1_voltage": 520,
+    "bat2_voltage": 520,
+}
+_SOC_KEYS = ("battery_capacity", "bat1_soc", "bat2_soc")
+
+
+# ---------------------------------------------------------------------------
+# Home Assistant / pymodbus fakes (as in tests/test_coordinator.py)
+# ---------------------------------------------------------------------------
+
+class _DataUpdateCoordinator:
+    def __init__(self, hass, logger, *, name=None, update_interval=None, **_):
+        self.hass = hass
+        self.logger = logger
+        self.name = name
+        self.update_interval = update_interval
+        self.data = None
+
+    def async_update_listeners(self) -> None:
+        pass
+
+
+class _Store:
+    def __init__(self, hass, version, key, **_):
+        self.key = key
+        self.saves = 0
+
+    async def async_load(self):
+        return None
+
+    async def async_save(self, data) -> None:
+        self.saves += 1
+
+    def async_delay_save(self, data_func, delay=0) -> None:
+        self.saves += 1
+
+
+class _ModbusException(Exception):
+    pass
+
+
+class _ConnectionException(_ModbusException):
+    pass
+
+
+def _install_fakes() -> None:
+    for name in ("homeassistant", "homeassistant.core", "homeassistant.config_entries",
+                 "homeassistant.helpers", "homeassistant.helpers.entity"):
+        sys.modules.setdefault(name, MagicMock())
+    duc = types.ModuleType("homeassistant.helpers.update_coordinator")
+    duc.DataUpdateCoordinator = _DataUpdateCoordinator
+    duc.UpdateFailed = Exception
+    sys.modules["homeassistant.helpers.update_coordinator"] = duc
+    storage = types.ModuleType("homeassistant.helpers.storage")
+    storage.Store = _Store
+    sys.modules["homeassistant.helpers.storage"] = storage
+    pymodbus = types.ModuleType("pymodbus")
+    exceptions = types.ModuleType("pymodbus.exceptions")
+    exceptions.ModbusException = _ModbusException
+    exceptions.ConnectionException = _ConnectionException
+    pymodbus.exceptions = exceptions
+    sys.modules.setdefault("pymodbus", pymodbus)
+    sys.modules.setdefault("pymodbus.exceptions", exceptions)
+
+    # The package namespace without running __init__.py (it needs real HA);
+    # submodules then import for real through __path__.
+    sys.modules.setdefault("custom_components", types.ModuleType("custom_components"))
+    pkg = types.ModuleType(_PKG_NAME)
+    pkg.__path__ = [_PKG]
+    pkg.__package__ = _PKG_NAME
+    sys.modules[_PKG_NAME] = pkg
+
+
+class _State:
+    def __init__(self, state, attributes):
+        self.state = state
+        self.attributes = attributes
+
+
+class _States:
+    def __init__(self):
+        self._states: dict[str, _State] = {}
+
+    def set(self, entity_id: str, state: str, attributes: dict) -> None:
+        self._states[entity_id] = _State(state, attributes)
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+
+class _ConfigEntries:
+    def async_update_entry(self, entry, options=None, **_) -> None:
+        if options is not None:
+            entry.options = options
+
+
+class _Services:
+    def __init__(self):
+        self.calls = 0
+
+    async def async_call(self, *args, **kwargs) -> None:
+        self.calls += 1
+
+
+class _Hass:
+    def __init__(self):
+        self.states = _States()
+        self.config_entries = _ConfigEntries()
+        self.services = _Services()
+        self.config = types.SimpleNamespace(path=lambda *parts: os.path.join(_HERE, *parts))
+
+    async def async_add_executor_job(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+class _ConfigEntry:
+    def __init__(self, model: str, options: dict):
+        self.entry_id = "bench"
+        self.title = "Felicity"
+        self.data = {"inverter_model": model}
+        self.options = options
+
+    def async_create_background_task(self, hass, coro, name):
+        return asyncio.get_running_loop().create_task(coro, name=name)
+
+
+class _Response:
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self) -> bool:
+        return False
+
+
+class FakeModbusClient:
+    """Answers reads from a register image; writes land in it."""
+
+    def __init__(self, image: dict[int, int]):
+        self.image = image
+        self.connected = False
+        self.reads = 0
+        self.writes = 0
+
+    async def connect(self) -> bool:
+        self.connected = True
+        return True
+
+    async def close(self) -> None:
+        self.connected = False
+
+    async def read_holding_registers(self, address, count, device_id=1):
+        self.reads += 1
+        await asyncio.sleep(0)
+        image = self.image
+        return _Response([image.get(address + i, 0) for i in range(count)])
+
+    async def write_registers(self, address, values, device_id=1):
+        self.writes += 1
+        await asyncio.sleep(0)
+        for i, value in enumerate(values):
+            self.image[address + i] = value
+        return _Response(list(values))
+
+
+# ---------------------------------------------------------------------------
+# Inputs
+# ---------------------------------------------------------------------------
+
+def _day_prices(slots: int, offset: float) -> list[float]:
+    """A duck curve: cheap night and midday, evening peak."""
+    prices = []
+    for slot in range(slots):
+        hour = slot * 24 / slots
+        if 17 <= hour < 21:
+            price = 0.34
+        elif 10 <= hour < 15:
+            price = 0.06
+        elif hour < 6:
+            price = 0.12
+        else:
+            price = 0.20
+        prices.append(round(price + offset + 0.01 * (slot % 3), 4))
+    return prices
+
+
+def _nordpool_attributes(slots: int) -> dict:
+    today = _day_prices(slots, 0.0)
+    tomorrow = _day_prices(slots, 0.02)
+    return {
+        "today": today,
+        "tomorrow": tomorrow,
+        "min": min(today),
+        "max": max(today),
+        "average": round(sum(today) / len(today), 4),
+    }
+
+
+def _forecast_attributes(now: datetime) -> tuple[float, dict]:
+    wh_hours = {}
+    total = 0.0
+    for day in (0, 1):
+        date = (now + timedelta(days=day)).date()
+        for hour in range(7, 20):
+            wh = round(2400 * max(0.0, 1 - abs(hour - 13) / 6.5))
+            wh_hours[datetime(date.year, date.month, date.day, hour).isoformat()] = wh
+            if day == 0:
+                total += wh
+    return round(total / 1000, 2), {"wh_hours": wh_hours}
+
+
+def _set_soc(client: FakeModbusClient, registers: dict, soc_pct: float) -> None:
+    for key in _SOC_KEYS:
+        if key in registers:
+            client.image[registers[key]["address"]] = round(soc_pct * 10)
+
+
+def build_coordinator(pkg, model: str, register_set: str, price_mode: str, engine: str,
+                      slots: int):
+    """A real coordinator for ``model``, wired the way async_setup_entry does it."""
+    const = pkg["const"]
+    model_config = const.MODEL_REGISTRY[model]
+    registers = model_config["registers"]
+    groups = model_config["register_groups"]
+    selected = registers
+    if register_set in model_config.get("register_sets", {}):
+        selected = {k: registers[k] for k in model_config["register_sets"][register_set]
+                    if k in registers}
+    for group in groups:                      # the setup's safety net
+        for key in group["keys"]:
+            if key not in selected and key in registers:
+                selected[key] = registers[key]
+
+    image = {registers[k]["address"]: v for k, v in _REGISTER_IMAGE.items() if k in registers}
+    client = FakeModbusClient(image)
+    hass = _Hass()
+    hass.states.set(NORDPOOL_ENTITY, str(_day_prices(slots, 0.0)[0]),
+                    _nordpool_attributes(slots))
+    pv_today, attrs = _forecast_attributes(datetime.now())
+    hass.states.set(FORECAST_ENTITY, str(pv_today), attrs)
+    options = {
+        "price_mode": price_mode,
+        "scheduler_engine": engine,
+        "grid_mode": "both",
+        "price_threshold_level": 5,
+        "battery_capacity_kwh": 10,
+        "power_level": 5,
+        const.CONF_REGISTER_SET: register_set,
+    }
+    coord = pkg["coordinator"].HA_FelicityCoordinator(
+        hass=hass,
+        client=client,
+        slave_id=1,
+        register_map=selected,
+        groups=groups,
+        model_combined=model_config["combined"],
+        inverter_model=model,
+        config_entry=_ConfigEntry(model, options),
+        nordpool_entity=NORDPOOL_ENTITY,
+        forecast_entity=FORECAST_ENTITY,
+    )
+    return coord, client, registers, len(selected)
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+class LoopBlockProbe:
+    """Time every callback the event loop runs (asyncio.events.Handle._run).
+
+    A callback is the synchronous stretch between two awaits; its duration is
+    how long the loop could not serve anything else.
+    """
+
+    def __init__(self):
+        self.durations: list[float] = []
+        self._original = None
+
+    def __enter__(self):
+        self._original = original = asyncio.events.Handle._run
+        durations = self.durations
+
+        def timed_run(handle):
+            t0 = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                durations.append(time.perf_counter() - t0)
+
+        asyncio.events.Handle._run = timed_run
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.events.Handle._run = self._original
+
+    def take(self) -> list[float]:
+        taken = list(self.durations)
+        self.durations.clear()
+        return taken
+
+
+async def _drain(coord) -> None:
+    """Let a background schedule solve finish before the next measurement."""
+    task = coord._schedule_task
+    while task is not None and not task.done():
+        await asyncio.wait({task})
+        task = coord._schedule_task
+
+
+async def bench_one(pkg, model: str, register_set: str, price_mode: str, engine: str,
+                    ticks: int, soc_step: float, slots: int) -> dict:
+    coord, client, registers, n_registers = build_coordinator(
+        pkg, model, register_set, price_mode, engine, slots)
+    soc = [50.0]
+
+    async def tick():
+        soc[0] = 20.0 + (soc[0] - 20.0 + soc_step) % 70.0
+        _set_soc(client, registers, soc[0])
+        coord.data = await coord._async_update_data()
+
+    t0 = time.perf_counter()
+    await tick()
+    await _drain(coord)
+    cold_ms = (time.perf_counter() - t0) * 1000
+
+    gc.collect()
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        await tick()
+    elapsed = time.perf_counter() - t0
+    await _drain(coord)
+
+    block_max, block_sum = [], []
+    with LoopBlockProbe() as probe:
+        for _ in range(ticks):
+            probe.take()
+            await tick()
+            durations = probe.take()
+            block_max.append(max(durations, default=0.0))
+            block_sum.append(sum(durations))
+    await _drain(coord)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        per_tick = []
+        for _ in range(ticks):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await tick()
+            _, peak = tracemalloc.get_traced_memory()
+            per_tick.append(peak - before)
+        await _drain(coord)
+        gc.collect()
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "registers": n_registers,
+        "groups": len(coord._address_groups),
+        "cold_ms": round(cold_ms, 2),
+        "ticks_per_s": round(ticks / elapsed, 1),
+        "tick_ms": round(elapsed / ticks * 1000, 3),
+        "alloc_kib_per_tick": round(statistics.median(per_tick) / 1024, 1),
+        "retained_kib_per_tick": round((end - start) / ticks / 1024, 2),
+        "block_max_ms": round(max(block_max) * 1000, 3),
+        "loop_ms_per_tick": round(statistics.median(block_sum) * 1000, 3),
+        "replans": coord.schedule_replans,
+        "repairs": coord.schedule_repairs,
+        "reads_per_tick": round(client.reads / (3 * ticks + 1), 1),
+    }
+
+
+def _load_package() -> dict:
+    _install_fakes()
+    return {name: importlib.import_module(f"{_PKG_NAME}.{name}")
+            for name in ("const", "ems", "coordinator")}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Coordinator tick benchmark")
+    ap.add_argument("--model", nargs="+", help="inverter models (default: all)")
+    ap.add_argument("--register-set", nargs="+",
+                    help="register sets (default: every set the model defines)")
+    ap.add_argument("--price-mode", choices=["manual", "auto", "both"], default="both")
+    ap.add_argument("--engine", default="greedy", help="scheduler_engine in auto mode")
+    ap.add_argument("--ticks", type=int, default=200)
+    ap.add_argument("--soc-step", type=float, default=0.1,
+                    help="SOC change per tick, percent (0 = idle inputs)")
+    ap.add_argument("--slots", type=int, default=96, help="price slots per day")
+    ap.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    pkg = _load_package()
+    registry = pkg["const"].MODEL_REGISTRY
+    models = args.model or list(registry)
+    unknown = [m for m in models if m not in registry]
+    if unknown:
+        print(f"Unknown model(s): {', '.join(unknown)}; known: {', '.join(registry)}")
+        return 2
+    modes = ["manual", "auto"] if args.price_mode == "both" else [args.price_mode]
+
+    print(f"{'model / set / mode':<40} {'regs':>5} {'grps':>5} {'cold ms':>8} "
+          f"{'ticks/s':>8} {'KiB/tick':>9} {'kept KiB':>9} {'block ms':>9} {'loop ms':>8}")
+    results = {}
+    for model in models:
+        sets = args.register_set or list(registry[model].get("register_sets", {})) or ["full"]
+        for register_set in sets:
+            for mode in modes:
+                key = f"{model}/{register_set}/{mode}"
+                res = asyncio.run(bench_one(pkg, model, register_set, mode, args.engine,
+                                            args.ticks, args.soc_step, args.slots))
+                results[key] = res
+                print(f"{key:<40} {res['registers']:>5} {res['groups']:>5} "
+                      f"{res['cold_ms']:>8.1f} {res['ticks_per_s']:>8.0f} "
+                      f"{res['alloc_kib_per_tick']:>9.1f} {res['retained_kib_per_tick']:>9.2f} "
+                      f"{res['block_max_ms']:>9.2f} {res['loop_ms_per_tick']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"ticks": args.ticks, "soc_step": args.soc_step,
+                       "engine": args.engine, "results": results},
+                      fh, indent=2, sort_keys=True)
+        print(f"Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
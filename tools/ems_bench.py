@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Scheduler benchmark  (wall time, memory and phase split per scenario)
+=====================================================================
+
+``ems_simulator.py`` checks that every scenario in ``tools/scenarios.py``
+meets its expectations; it records no timings.  This runner takes the same
+library and, for each (scenario, engine) pair:
+
+  * runs ``ems.calculate_schedule`` ``--repeat`` times after ``--warmup``
+    untimed runs and reports the p50 / p95 wall time,
+  * re-runs it once under ``tracemalloc`` for the peak allocation,
+  * re-runs it ``--repeat`` times with the phase functions wrapped and
+    reports the median exclusive time of each phase:
+
+      reserve     calculate_self_consumption_reserve, _compute_reserve_target
+      selection   select_unified_charge_slots
+      validation  _validate_schedule_soc
+      refill      _fill_charge_to_deficit
+      tomorrow    _compute_tomorrow_schedule, _tomorrow_trajectory_for_slots,
+                  _compute_tomorrow_soc_trajectory
+      flex        _schedule_flexible_loads
+      solver      _run_solver_or_none (MILP / DP model build and solve)
+      other       everything else in calculate_schedule
+
+    Exclusive means a nested call is charged to its own phase: the
+    validation a tomorrow plan runs counts as validation, not tomorrow.
+
+The timed runs and the phase runs are separate passes, so the wrappers'
+overhead never shows up in p50 / p95.
+
+``--save FILE`` writes the results as a baseline JSON; ``--compare FILE``
+checks the current run against one and exits 1 when a p50 grows by more
+than ``--threshold`` percent (and by at least ``--min-ms``, so sub-ms noise
+on tiny scenarios does not trip it) or a peak allocation by more than
+``--mem-threshold`` percent.
+
+Run
+---
+    python tools/ems_bench.py
+    python tools/ems_bench.py --engine milp --repeat 50 --save bench.json
+    python tools/ems_bench.py --compare bench.json --threshold 15
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import importlib.util
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import UTC, datetime
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_REPO = os.path.dirname(_HERE)
+_PKG = os.path.join(_REPO, "custom_components", "ha_felicity")
+
+# Phase name -> the ems functions whose (exclusive) time it collects.
+PHASES: tuple[tuple[str, tuple[str, ...]], ...] = (
+    ("reserve", ("calculate_self_consumption_reserve", "_compute_reserve_target")),
+    ("selection", ("select_unified_charge_slots",)),
+    ("validation", ("_validate_schedule_soc",)),
+    ("refill", ("_fill_charge_to_deficit",)),
+    ("tomorrow", ("_compute_tomorrow_schedule", "_tomorrow_trajectory_for_slots",
+                  "_compute_tomorrow_soc_trajectory")),
+    ("flex", ("_schedule_flexible_loads",)),
+    ("solver", ("_run_solver_or_none",)),
+)
+PHASE_NAMES = tuple(name for name, _ in PHASES) + ("other",)
+
+
+def _load(modname: str, filename: str):
+    spec = importlib.util.spec_from_file_location(modname, os.path.join(_PKG, filename))
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[modname] = mod          # so ems.py's lazy `import milp` resolves
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile (no interpolation: p95 of 20 runs is the 19th)."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class PhaseTimer:
+    """Wrap the ems phase functions and accumulate their exclusive time.
+
+    Every wrapper pushes a child-time slot on entry; on exit it charges its
+    own elapsed time minus its children's to its phase, and adds its full
+    elapsed time to the caller's child slot.
+    """
+
+    def __init__(self, ems):
+        self._ems = ems
+        self._originals: dict[str, object] = {}
+        self._stack: list[float] = []
+        self.totals = dict.fromkeys(PHASE_NAMES, 0.0)
+
+    def _wrap(self, phase: str, fn):
+        stack = self._stack
+        totals = self.totals
+
+        def wrapped(*args, **kwargs):
+            stack.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                totals[phase] += elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+
+        return wrapped
+
+    def __enter__(self):
+        for phase, names in PHASES:
+            for name in names:
+                live = getattr(self._ems, name)
+                self._originals[name] = live
+                setattr(self._ems, name, self._wrap(phase, live))
+        return self
+
+    def __exit__(self, *exc):
+        for name, live in self._originals.items():
+            setattr(self._ems, name, live)
+        self._originals.clear()
+
+    def run(self, config, state) -> dict[str, float]:
+        """One ``calculate_schedule`` call; returns seconds per phase."""
+        self.totals.update(dict.fromkeys(PHASE_NAMES, 0.0))
+        t0 = time.perf_counter()
+        self._ems.calculate_schedule(config, state)
+        total = time.perf_counter() - t0
+        self.totals["other"] = max(0.0, total - sum(self.totals.values()))
+        return dict(self.totals)
+
+
+def bench_one(ems, scenario: dict, engine: str, repeat: int, warmup: int) -> dict:
+    """Timings, peak memory and phase split for one scenario on one engine."""
+    cfg_kwargs = dict(scenario["config"])
+    cfg_kwargs["scheduler_engine"] = engine
+    config = ems.EMSConfig(**cfg_kwargs)
+    state = ems.EMSState(**scenario["state"])
+
+    for _ in range(warmup):
+        ems.calculate_schedule(config, state)
+
+    gc.collect()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ems.calculate_schedule(config, state)
+        samples.append(time.perf_counter() - t0)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        ems.calculate_schedule(config, state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    phase_runs = []
+    with PhaseTimer(ems) as timer:
+        for _ in range(repeat):
+            phase_runs.append(timer.run(config, state))
+
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "phases_ms": {
+            name: round(statistics.median(run[name] for run in phase_runs) * 1000, 3)
+            for name in PHASE_NAMES
+        },
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_ms: float,
+            mem_threshold: float) -> list[str]:
+    """Regression messages for every run slower / bigger than the baseline allows."""
+    regressions = []
+    for key, now in current.items():
+        then = baseline.get(key)
+        if then is None:
+            continue
+        limit = then["p50_ms"] * (1 + threshold / 100.0)
+        if now["p50_ms"] > limit and now["p50_ms"] - then["p50_ms"] >= min_ms:
+            regressions.append(
+                f"{key}: p50 {then['p50_ms']:.2f} -> {now['p50_ms']:.2f} ms "
+                f"(+{(now['p50_ms'] / then['p50_ms'] - 1) * 100:.0f}%)")
+        mem_limit = then["peak_kib"] * (1 + mem_threshold / 100.0)
+        if then["peak_kib"] and now["peak_kib"] > mem_limit:
+            regressions.append(
+                f"{key}: peak {then['peak_kib']:.0f} -> {now['peak_kib']:.0f} KiB "
+                f"(+{(now['peak_kib'] / then['peak_kib'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print_row(key: str, res: dict) -> None:
+    phases = " ".join(f"{res['phases_ms'][name]:>8.2f}" for name in PHASE_NAMES)
+    print(f"{key:<46} {res['p50_ms']:>8.2f} {res['p95_ms']:>8.2f} "
+          f"{res['peak_kib']:>8.0f} {phases}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="EMS scheduler benchmark")
+    ap.add_argument("--name", help="only the scenario with this name")
+    ap.add_argument("--engine", choices=["greedy", "milp", "dp", "auto", "both"],
+                    default="both")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--warmup", type=int, default=2,
+                    help="untimed runs first (imports, MILP template cache)")
+    ap.add_argument("--save", metavar="FILE", help="write the results as a baseline JSON")
+    ap.add_argument("--compare", metavar="FILE", help="check against a baseline JSON")
+    ap.add_argument("--threshold", type=float, default=20.0,
+                    help="allowed p50 growth over the baseline, percent")
+    ap.add_argument("--min-ms", type=float, default=0.5,
+                    help="ignore p50 growth smaller than this many ms")
+    ap.add_argument("--mem-threshold", type=float, default=25.0,
+                    help="allowed peak-memory growth over the baseline, percent")
+    args = ap.parse_args()
+
+    ems = _load("ems", "ems.py")
+    engines = ["greedy", "milp"] if args.engine == "both" else [args.engine]
+    try:
+        _load("milp", "milp.py")
+    except Exception as err:  # noqa: BLE001
+        print(f"[warn] MILP engine unavailable ({err}); skipping it.")
+        engines = [e for e in engines if e != "milp"] or ["greedy"]
+    _load("dp", "dp.py")
+    sys.path.insert(0, _HERE)
+    from scenarios import SCENARIOS
+
+    # Manual mode is a threshold rule, not calculate_schedule — nothing to time.
+    scenarios = [s for s in SCENARIOS
+                 if (not args.name or s["name"] == args.name)
+                 and s["config"].get("price_mode") != "manual"]
+    if not scenarios:
+        print(f"No optimizer scenario named {args.name!r}.")
+        return 2
+
+    print(f"{'scenario / engine':<46} {'p50 ms':>8} {'p95 ms':>8} {'peak KiB':>8} "
+          + " ".join(f"{name:>8}" for name in PHASE_NAMES))
+    results = {}
+    for sc in scenarios:
+        for engine in engines:
+            key = f"{sc['name']}/{engine}"
+            results[key] = bench_one(ems, sc, engine, args.repeat, args.warmup)
+            _print_row(key, results[key])
+
+    if args.save:
+        payload = {
+            "meta": {
+                "created": datetime.now(UTC).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline.get("results", {}), args.threshold,
+                              args.min_ms, args.mem_threshold)
+        missing = sorted(set(baseline.get("results", {})) - set(results))
+        if missing:
+            print(f"[info] {len(missing)} baseline run(s) not in this run (filtered?)")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print("RESULT:", "WITHIN BASELINE" if not regressions else "REGRESSED")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
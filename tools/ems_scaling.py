@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Horizon-scaling benchmark  (24 / 48 / 96 / 288 slots per day)
+=============================================================
+
+The scenario library is hourly.  Day-ahead markets are moving to 15-minute
+slots, and a 5-minute market gives 288 slots a day, i.e. a 576-slot
+two-day horizon.  This tool generates synthetic price / PV / consumption
+days at any resolution and times every engine on each case as the slot
+count grows:
+
+  * ``synthetic_day`` builds a seeded day: a duck-curve price with slot
+    noise (and an optional negative midday dip), a cloudy PV bell and a
+    household load with random spikes.  PV and load are generated per slot
+    and summed into the hourly dicts the scheduler takes,
+  * ``CASES`` pair a day with a configuration: a household battery, a
+    trader at full load over the whole two-day horizon, and a very large
+    battery that needs dozens of charge slots,
+  * every (case, engine, slots/day) run reports the median wall time and
+    the exclusive time per phase (``ems_bench.PhaseTimer``),
+  * the growth exponent across the resolutions is fitted on a log-log
+    scale, for the total and for each phase.  Anything
+    above ``--flag-exponent`` that costs at least ``--flag-ms`` at the
+    largest size is printed as a super-linear HOT SPOT,
+  * with ``matplotlib`` installed it writes a log-log scaling chart.
+
+Engines default to greedy plus every solver engine ``ems`` knows about, so a
+new engine is benchmarked as soon as it is registered.
+
+Run
+---
+    python tools/ems_scaling.py
+    python tools/ems_scaling.py --slots 96 288 --engine greedy --repeat 3
+    python tools/ems_scaling.py --case big_battery --json scaling.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _HERE)
+from ems_bench import PHASE_NAMES, PhaseTimer, _load
+
+# Case name -> (EMSConfig kwargs, EMSState kwargs, synthetic_day kwargs).
+CASES: dict[str, tuple[dict, dict, dict]] = {
+    "household": (
+        {"grid_mode": "from_grid", "optimization_priority": "cost",
+         "battery_capacity_kwh": 10.0, "battery_discharge_min_pct": 20,
+         "efficiency": 0.90, "safe_power_kw": 3.0, "inverter_max_power_kw": 5.0,
+         "consumption_est_kwh": 12.0},
+        {"battery_soc_pct": 45.0, "current_hour": 14, "current_minute": 0},
+        {"pv_kwh": 18.0, "load_kwh": 12.0},
+    ),
+    "trader_full_load": (
+        {"grid_mode": "both", "optimization_priority": "cost",
+         "battery_capacity_kwh": 20.0, "battery_discharge_min_pct": 20,
+         "efficiency": 0.90, "safe_power_kw": 5.0, "inverter_max_power_kw": 10.0,
+         "consumption_est_kwh": 30.0},
+        {"battery_soc_pct": 50.0, "current_hour": 0, "current_minute": 0},
+        {"pv_kwh": 25.0, "load_kwh": 30.0, "negative": True},
+    ),
+    "big_battery": (
+        {"grid_mode": "from_grid", "optimization_priority": "cost",
+         "battery_capacity_kwh": 200.0, "battery_discharge_min_pct": 10,
+         "efficiency": 0.92, "safe_power_kw": 5.0, "inverter_max_power_kw": 10.0,
+         "consumption_est_kwh": 40.0},
+        {"battery_soc_pct": 15.0, "current_hour": 0, "current_minute": 0},
+        {"pv_kwh": 10.0, "load_kwh": 40.0},
+    ),
+}
+DEFAULT_SLOTS = (24, 48, 96, 288)
+
+
+def _duck_price(hour: float, low: float, mid: float, peak: float) -> float:
+    """scenarios.inverse_solar_prices at a fractional hour."""
+    solar = max(0.0, math.cos((hour - 13.0) / 7.0 * math.pi / 2) ** 2) if 6 <= hour <= 20 else 0.0
+    eve = math.exp(-((hour - 19.0) ** 2) / (2 * 1.8 ** 2))
+    morn = math.exp(-((hour - 7.5) ** 2) / (2 * 1.1 ** 2))
+    night = math.exp(-((hour - 3.0) ** 2) / (2 * 2.5 ** 2))
+    return (mid - (mid - low) * solar + (peak - mid) * eve
+            + (peak - mid) * 0.45 * morn - (mid - low) * 0.35 * night)
+
+
+def synthetic_day(slots_per_day: int, *, seed: int = 0, pv_kwh: float = 20.0,
+                  load_kwh: float = 12.0, negative: bool = False) -> dict:
+    """One synthetic day at ``slots_per_day`` resolution, as EMSState kwargs.
+
+    Returns ``slot_prices_today`` plus the hourly ``pv_hourly_kwh`` /
+    ``consumption_hourly_kwh`` and the matching daily PV total.  The same
+    seed gives the same day at every resolution up to the slot noise, so
+    growth across resolutions is the horizon, not a different day.
+    """
+    rng = random.Random(seed * 1000 + slots_per_day)
+    hours = 24.0 / slots_per_day
+    prices, pv_raw, load_raw = [], [], []
+    cloud = 1.0
+    for i in range(slots_per_day):
+        hour = (i + 0.5) * hours
+        price = _duck_price(hour, 0.03, 0.16, 0.38) + rng.gauss(0.0, 0.012)
+        if negative and 11.5 <= hour < 14.5:
+            price -= 0.08
+        prices.append(round(price, 4))
+        # AR(1) cloud cover so neighbouring slots dim together.
+        cloud = min(1.0, max(0.2, 0.8 * cloud + 0.2 * rng.uniform(0.3, 1.2)))
+        sun = max(0.0, math.cos((hour - 13.0) / 6.5 * math.pi / 2)) if 6.5 <= hour <= 19.5 else 0.0
+        pv_raw.append(sun * sun * cloud)
+        spike = rng.uniform(1.5, 3.0) if rng.random() < 0.05 else 1.0
+        shape = (1.0 + 1.5 * math.exp(-((hour - 7.5) ** 2) / 2.0)
+                 + 2.0 * math.exp(-((hour - 19.5) ** 2) / 4.0))
+        load_raw.append(shape * spike)
+
+    pv_scale = pv_kwh / (sum(pv_raw) or 1.0)
+    load_scale = load_kwh / sum(load_raw)
+    pv_hourly: dict[int, float] = {}
+    load_hourly: dict[int, float] = {}
+    for i in range(slots_per_day):
+        h = int(i * hours)
+        pv_hourly[h] = pv_hourly.get(h, 0.0) + pv_raw[i] * pv_scale
+        load_hourly[h] = load_hourly.get(h, 0.0) + load_raw[i] * load_scale
+    return {
+        "slot_prices_today": prices,
+        "pv_hourly_kwh": {h: round(v, 3) for h, v in pv_hourly.items() if v > 0.0005},
+        "pv_forecast_today": round(pv_kwh, 2),
+        "consumption_hourly_kwh": {h: round(v, 3) for h, v in load_hourly.items()},
+    }
+
+
+def build_inputs(ems, case: str, engine: str, slots_per_day: int, seed: int):
+    """EMSConfig / EMSState for ``case`` on a two-day synthetic horizon."""
+    cfg_kwargs, state_kwargs, day_kwargs = CASES[case]
+    today = synthetic_day(slots_per_day, seed=seed, **day_kwargs)
+    tomorrow = synthetic_day(slots_per_day, seed=seed + 1, **day_kwargs)
+    state = dict(state_kwargs, **today)
+    state["slot_prices_tomorrow"] = tomorrow["slot_prices_today"]
+    state["pv_hourly_kwh_tomorrow"] = tomorrow["pv_hourly_kwh"]
+    state["pv_forecast_tomorrow"] = tomorrow["pv_forecast_today"]
+    state["pv_forecast_remaining"] = round(sum(
+        kwh for h, kwh in today["pv_hourly_kwh"].items() if h >= state["current_hour"]), 2)
+    return (ems.EMSConfig(**dict(cfg_kwargs, scheduler_engine=engine)),
+            ems.EMSState(**state))
+
+
+def measure(ems, config, state, repeat: int) -> dict:
+    """Median wall time and median exclusive phase times, in ms."""
+    ems.calculate_schedule(config, state)       # warm-up: imports, MILP template
+    walls = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ems.calculate_schedule(config, state)
+        walls.append(time.perf_counter() - t0)
+    with PhaseTimer(ems) as timer:
+        phase_runs = [timer.run(config, state) for _ in range(repeat)]
+    return {
+        "wall_ms": statistics.median(walls) * 1000,
+        "phases_ms": {name: statistics.median(run[name] for run in phase_runs) * 1000
+                      for name in PHASE_NAMES},
+    }
+
+
+def growth_exponent(sizes: list[int], times_ms: list[float]) -> float | None:
+    """Least-squares slope of log(time) over log(size): 1 = linear, 2 = quadratic."""
+    points = [(math.log(n), math.log(t)) for n, t in zip(sizes, times_ms, strict=True)
+              if t > 1e-3]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def plot_scaling(results: dict, sizes: list[int], path: str) -> str | None:
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+    cases = sorted({case for case, _ in results})
+    fig, axes = plt.subplots(1, len(cases), figsize=(5 * len(cases), 4.2), squeeze=False)
+    for ax, case in zip(axes[0], cases, strict=True):
+        for (run_case, engine), runs in sorted(results.items()):
+            if run_case != case:
+                continue
+            ax.plot(sizes, [runs[n]["wall_ms"] for n in sizes], marker="o", label=engine)
+            if engine == "greedy":
+                for phase in ("validation", "refill", "selection", "tomorrow"):
+                    ax.plot(sizes, [max(runs[n]["phases_ms"][phase], 1e-3) for n in sizes],
+                            linestyle=":", linewidth=1, label=f"greedy {phase}")
+        ref = results.get((case, "greedy")) or next(
+            runs for (c, _), runs in results.items() if c == case)
+        base = ref[sizes[0]]["wall_ms"]
+        ax.plot(sizes, [base * n / sizes[0] for n in sizes], color="grey",
+                linewidth=0.8, linestyle="--", label="linear")
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xticks(sizes)
+        ax.set_xticklabels([str(n) for n in sizes])
+        ax.set_xlabel("slots per day")
+        ax.set_ylabel("ms per replan")
+        ax.set_title(case)
+        ax.legend(fontsize=7)
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fig.savefig(path, dpi=90)
+    plt.close(fig)
+    return path
+
+
+def main():
+    ems = _load("ems", "ems.py")
+    engines_known = ["greedy", *ems._SOLVER_ENGINES]
+    ap = argparse.ArgumentParser(description="EMS horizon-scaling benchmark")
+    ap.add_argument("--slots", type=int, nargs="+", default=list(DEFAULT_SLOTS),
+                    help="slots per day to run (default 24 48 96 288)")
+    ap.add_argument("--engine", choices=engines_known, nargs="+", default=engines_known)
+    ap.add_argument("--case", choices=sorted(CASES), nargs="+", default=sorted(CASES))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--flag-exponent", type=float, default=1.3,
+                    help="growth exponent above which a phase is a hot spot")
+    ap.add_argument("--flag-ms", type=float, default=1.0,
+                    help="ignore phases cheaper than this at the largest size")
+    ap.add_argument("--json", metavar="FILE", help="also write the raw results")
+    ap.add_argument("--no-plot", action="store_true")
+    ap.add_argument("--outdir", default=os.path.join(_HERE, "sim_output"))
+    args = ap.parse_args()
+
+    engines = list(args.engine)
+    try:
+        _load("milp", "milp.py")
+    except Exception as err:  # noqa: BLE001
+        print(f"[warn] MILP engine unavailable ({err}); skipping it.")
+        engines = [e for e in engines if e != "milp"]
+    _load("dp", "dp.py")
+    sizes = sorted(set(args.slots))
+
+    print(f"{'case / engine':<28} " + " ".join(f"{n:>9}" for n in sizes) + f" {'exp':>6}")
+    results: dict[tuple[str, str], dict[int, dict]] = {}
+    hot_spots = []
+    for case in args.case:
+        for engine in engines:
+            runs = {}
+            for n in sizes:
+                config, state = build_inputs(ems, case, engine, n, args.seed)
+                runs[n] = measure(ems, config, state, args.repeat)
+            results[(case, engine)] = runs
+            walls = [runs[n]["wall_ms"] for n in sizes]
+            exp = growth_exponent(sizes, walls)
+            print(f"{case + ' / ' + engine:<28} "
+                  + " ".join(f"{t:>7.1f}ms" for t in walls)
+                  + (f" {exp:>6.2f}" if exp is not None else f" {'-':>6}"))
+            for phase in PHASE_NAMES:
+                times = [runs[n]["phases_ms"][phase] for n in sizes]
+                phase_exp = growth_exponent(sizes, times)
+                if (phase_exp is not None and phase_exp > args.flag_exponent
+                        and times[-1] >= args.flag_ms):
+                    hot_spots.append((case, engine, phase, phase_exp, times))
+
+    print()
+    if hot_spots:
+        for case, engine, phase, exp, times in hot_spots:
+            print(f"HOT SPOT {case} / {engine} / {phase}: exponent {exp:.2f}  "
+                  + " -> ".join(f"{t:.1f}" for t in times) + " ms")
+    else:
+        print(f"No phase grows faster than n^{args.flag_exponent:g}.")
+
+    if args.json:
+        payload = {
+            f"{case}/{engine}": {str(n): runs[n] for n in sizes}
+            for (case, engine), runs in results.items()
+        }
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, indent=2, sort_keys=True)
+        print(f"Raw results written to {args.json}")
+    if not args.no_plot and results:
+        path = plot_scaling(results, sizes, os.path.join(args.outdir, "scaling.png"))
+        if path:
+            print(f"Chart written to: {path}")
+        else:
+            print("(matplotlib not installed — no chart.  `pip install matplotlib` for visuals.)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,6 +27,9 @@ Run (Windows / Mac / Linux)
     python tools/ems_simulator.py --name self_suff_daytime_ev   # one scenario
     python tools/ems_simulator.py --no-plot                     # text only
     python tools/ems_simulator.py --engine greedy               # one engine
+    python tools/ems_simulator.py --engine dp                   # exact DP engine
+    python tools/ems_simulator.py --engine auto                 # greedy vs MILP race
+    python tools/ems_simulator.py --workers 4                   # solve scenarios in 4 processes
 
 Exit code is 0 when all expectations pass, 1 otherwise.
 
@@ -54,12 +57,18 @@ def _load(modname: str, filename: str):
 
 
 ems = _load("ems", "ems.py")
+# calculate_schedule_batch's spawned workers re-import the flat "ems" module.
+# Appended, not prepended: the package's select.py would shadow the stdlib.
+if _PKG not in sys.path:
+    sys.path.append(_PKG)
 try:
     _load("milp", "milp.py")
     _HAS_MILP = True
 except Exception as err:  # noqa: BLE001
     print(f"[warn] MILP engine unavailable ({err}); only greedy will run.")
     _HAS_MILP = False
+# The DP engine is pure Python (numpy optional) — always available.
+_load("dp", "dp.py")
 
 # Scenario library lives next to this runner.
 sys.path.insert(0, _HERE)
@@ -95,14 +104,14 @@ def _result_dict(engine, prices, sched, traj, cur_slot, *,
     }
 
 
-def run_one(scenario: dict, engine: str) -> dict:
-    """Run one scenario through one optimizer engine; return a flat result dict."""
+def _scenario_inputs(scenario: dict, engine: str):
+    """EMSConfig / EMSState for one scenario run through one engine."""
     cfg_kwargs = dict(scenario["config"])
     cfg_kwargs["scheduler_engine"] = engine
-    config = ems.EMSConfig(**cfg_kwargs)
-    state = ems.EMSState(**scenario["state"])
-    result = ems.calculate_schedule(config, state)
+    return ems.EMSConfig(**cfg_kwargs), ems.EMSState(**scenario["state"])
+
 
+def _summarize(result, state, engine: str) -> dict:
     prices = state.slot_prices_today or []
     num = len(prices)
     cur_slot = int((state.current_hour * 60 + state.current_minute) / ((24 * 60) / num)) if num else 0
@@ -117,6 +126,28 @@ def run_one(scenario: dict, engine: str) -> dict:
     )
 
 
+def run_one(scenario: dict, engine: str) -> dict:
+    """Run one scenario through one optimizer engine; return a flat result dict."""
+    config, state = _scenario_inputs(scenario, engine)
+    return _summarize(ems.calculate_schedule(config, state), state, engine)
+
+
+def run_batch(scenarios: list[dict], engines: list[str], workers: int | None) -> dict:
+    """All (scenario, engine) runs through ems.calculate_schedule_batch.
+
+    Returns {scenario name: {engine: result dict}}, same shape run_one builds.
+    """
+    runs = [(sc, e) for sc in scenarios for e in engines
+            if sc["config"].get("price_mode") != "manual"]
+    inputs = [_scenario_inputs(sc, e) for sc, e in runs]
+    batch = ems.calculate_schedule_batch(
+        [c for c, _ in inputs], [s for _, s in inputs], workers=workers)
+    out: dict = {}
+    for i, ((sc, engine), (_, state)) in enumerate(zip(runs, inputs)):
+        out.setdefault(sc["name"], {})[engine] = _summarize(batch.result(i), state, engine)
+    return out
+
+
 def _manual_threshold(prices, level):
     """Mirror of coordinator's manual threshold formula (price_threshold_level 1-10)."""
     vals = [p for p in prices if p is not None]
@@ -422,9 +453,11 @@ def plot_scenario(scenario: dict, results: dict, outdir: str):
 def main():
     ap = argparse.ArgumentParser(description="EMS scenario simulator")
     ap.add_argument("--name", help="run only the scenario with this name")
-    ap.add_argument("--engine", choices=["greedy", "milp", "both"], default="both")
+    ap.add_argument("--engine", choices=["greedy", "milp", "dp", "auto", "both"], default="both")
     ap.add_argument("--no-plot", action="store_true")
     ap.add_argument("--outdir", default=os.path.join(_HERE, "sim_output"))
+    ap.add_argument("--workers", type=int, default=1,
+                    help="solve all scenarios up front across N processes (0 = one per CPU)")
     args = ap.parse_args()
 
     engines = ["greedy", "milp"] if args.engine == "both" else [args.engine]
@@ -438,12 +471,18 @@ def main():
             print(f"  {s['name']}")
         return 2
 
+    batched = {}
+    if args.workers != 1:
+        batched = run_batch(scenarios, engines, args.workers or None)
+
     all_ok = True
     plotted = []
     for sc in scenarios:
         if sc["config"].get("price_mode") == "manual":
             # Manual mode is engine-agnostic (a threshold rule, not the optimizer).
             results = {"manual": run_manual(sc)}
+        elif sc["name"] in batched:
+            results = batched[sc["name"]]
         else:
             results = {e: run_one(sc, e) for e in engines}
         ok = report_one(sc, results)